@@ -16,12 +16,13 @@ MainControls.py.
 """
 import copy
 import os
-import shutil
 import datetime
 import json
 import math
+import threading
 
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 from statistics import mean
 from time import sleep, time
 from dateutil.relativedelta import relativedelta
@@ -32,7 +33,13 @@ import constants
 import utils
 import utils_afss
 
-from image_io import imwrite, imread
+from image_io import imwrite, imread, remove_image, copy_image
+from ImageWriter import ImageWriter, remove_temp_files
+from MirrorQueue import MirrorQueue
+from Tracer import Tracer
+import acq_estimate
+import codec_calibration
+import tile_route
 
 
 class Acquisition:
@@ -64,12 +71,15 @@ class Acquisition:
         self.main_log_file = None
         self.imagelist_file = None
         self.imagelist_ov_file = None
-        self.mirror_imagelist_file = None
-        self.mirror_imagelist_ov_file = None
         self.incident_log_file = None
         self.metadata_file = None
         # Filename of current Viewport screenshot
         self.vp_screenshot_filename = None
+        # Durations of the acquisition phases (saved in meta/stats)
+        self.tracer = Tracer()
+        # Images written in the background (see flush_image_writer())
+        self.image_writer = ImageWriter()
+        self.img_inspector.image_writer = self.image_writer
 
         # Remove trailing slashes and whitespace from base directory string
         self.cfg['acq']['base_dir'] = self.cfg['acq']['base_dir'].rstrip(r'\\\/ ')
@@ -80,6 +90,11 @@ class Acquisition:
         self.acq_paused = (self.cfg['acq']['paused'].lower() == 'true')
         self.stack_completed = False
         self.report_requested = False
+        # Thread sending the current status report (if any)
+        self.status_report_thread = None
+        # Last error reported by the background metadata client
+        self.metadata_client_error = None
+        self.metadata_rejected_count = 0
         self.slice_counter = int(self.cfg['acq']['slice_counter'])
         if microtome is None:
             self.number_slices = 0
@@ -125,6 +140,19 @@ class Acquisition:
         # enabled/disabled during a run.
         self.use_mirror_drive = (
             self.cfg['sys']['use_mirror_drive'].lower() == 'true')
+        # Number of threads copying files to the mirror drive
+        self.mirror_workers = int(self.cfg['sys'].get('mirror_workers', '2'))
+        # The acquisition is paused if more files than mirror_backlog_limit
+        # are waiting to be copied to the mirror drive
+        self.mirror_backlog_limit = int(
+            self.cfg['sys'].get('mirror_backlog_limit', '1000'))
+        # Queue for copying files to the mirror drive in the background
+        # (running during acquisitions, see start_mirror_queue())
+        self.mirror_queue = None
+        self.mirror_status_time = 0
+        # True if copies on the mirror drive to be read back and verified
+        self.mirror_verify = (
+            self.cfg['sys'].get('mirror_verify', 'True').lower() == 'true')
         self.take_overviews = (
             self.cfg['acq']['take_overviews'].lower() == 'true')
         # The following options can be changed while acq is running
@@ -138,6 +166,40 @@ class Acquisition:
             self.cfg['acq']['use_tcp'].lower() == 'true')
         self.monitor_images = (
             self.cfg['acq']['monitor_images'].lower() == 'true')
+        # If pipelined_tile_acq is True, tiles are inspected and registered
+        # in a worker thread while the next tile is being acquired
+        self.pipelined_tile_acq = (
+            self.cfg['acq'].get('pipelined_tile_acq', 'False').lower()
+            == 'true')
+        # If optimise_tile_route is True, the order in which the tiles are
+        # acquired is optimised to minimise the duration of the stage moves
+        # (otherwise: snake pattern in each grid, grids in index order)
+        self.optimise_tile_route = (
+            self.cfg['acq'].get('optimise_tile_route', 'True').lower()
+            == 'true')
+        # Maximum duration (in s) of the tile route optimisation per slice
+        self.tile_route_time_budget = float(
+            self.cfg['acq'].get('tile_route_time_budget', '0.5'))
+        # Compression codecs of the saved tiles, overviews and stub
+        # overviews (see image_io.COMPRESSION_CODECS)
+        self.tile_compression = self.checked_codec('tile_compression')
+        self.ov_compression = self.checked_codec('ov_compression')
+        self.stub_ov_compression = self.checked_codec('stub_ov_compression')
+        # True if the codecs are to be measured on the first tile acquired
+        # in this session (in a background thread, see
+        # start_compression_calibration())
+        self.calibrate_codecs = (
+            self.cfg['acq'].get('calibrate_compression', 'False').lower()
+            == 'true')
+        # Encode throughput and compression ratio of the codecs (see
+        # calibrate_compression())
+        self.compression_calibration = None
+        self.compression_calibration_thread = None
+        # Acquisition order of the tiles in the current slice:
+        # {grid_index: tile indices in acquisition order}
+        self.tile_route = {}
+        # Previously planned routes (see plan_tile_route())
+        self.tile_route_cache = {}
         self.use_autofocus = (
             self.cfg['acq']['use_autofocus'].lower() == 'true')
         self.status_report_interval = int(
@@ -214,11 +276,10 @@ class Acquisition:
         # to False.
         self.first_ov = [True] * self.ovm.number_ov
 
-        # Track the durations for grabbing, mirroring and inspecting tiles.
+        # Track the durations for grabbing and inspecting tiles.
         # If the durations deviate too much from expected values,
         # warnings are shown in the log.
         self.tile_grab_durations = []
-        self.tile_mirror_durations = []
         self.tile_inspect_durations = []
 
     @property
@@ -249,6 +310,10 @@ class Acquisition:
 
         self.cfg['sys']['mirror_drive'] = self.mirror_drive
         self.cfg['sys']['use_mirror_drive'] = str(self.use_mirror_drive)
+        self.cfg['sys']['mirror_workers'] = str(self.mirror_workers)
+        self.cfg['sys']['mirror_backlog_limit'] = str(
+            self.mirror_backlog_limit)
+        self.cfg['sys']['mirror_verify'] = str(self.mirror_verify)
         self.cfg['sys']['send_metadata'] = str(self.send_metadata)
         self.cfg['sys']['metadata_project_name'] = self.metadata_project_name
         self.cfg['acq']['take_overviews'] = str(self.take_overviews)
@@ -259,6 +324,14 @@ class Acquisition:
         self.cfg['acq']['ask_user'] = str(self.ask_user_mode)
         self.cfg['acq']['use_tcp'] = str(self.use_tcp)
         self.cfg['acq']['monitor_images'] = str(self.monitor_images)
+        self.cfg['acq']['pipelined_tile_acq'] = str(self.pipelined_tile_acq)
+        self.cfg['acq']['optimise_tile_route'] = str(self.optimise_tile_route)
+        self.cfg['acq']['tile_route_time_budget'] = str(
+            self.tile_route_time_budget)
+        self.cfg['acq']['tile_compression'] = self.tile_compression
+        self.cfg['acq']['ov_compression'] = self.ov_compression
+        self.cfg['acq']['stub_ov_compression'] = self.stub_ov_compression
+        self.cfg['acq']['calibrate_compression'] = str(self.calibrate_codecs)
         self.cfg['acq']['use_autofocus'] = str(self.use_autofocus)
         self.cfg['acq']['eht_off_after_stack'] = str(self.eht_off_after_stack)
         self.cfg['monitoring']['report_interval'] = str(
@@ -274,6 +347,12 @@ class Acquisition:
         the stack, the estimated duration of the stack acquisition, the storage
         requirements, and the estimated date and time of completion.
 
+        The duration is calculated for each distinct pattern of grids and
+        overviews acquired in a slice (see acq_estimate.slice_patterns()).
+        The per-frame overhead, the cut duration and the stage move speed
+        are calibrated with the durations measured in the most recent
+        slices (see Tracer).
+
         Returns:
             min_dose (float): Minimum electron dose of current stack setup
                               (usually occurs during OV acquisition)
@@ -286,26 +365,30 @@ class Acquisition:
             total_stage_move_time (float): Total duration of stage moves
             total_cut_time (float): Total time for cuts with the knife
             date_estimate (str): Date and time of expected completion
+            remaining_time (int): Remaining time in seconds
+            remaining_time_range (tuple): 95% confidence bounds (in seconds)
+                                          of the remaining time, None if
+                                          no durations have been measured
+            stage_move_time_saved (float): Duration of stage moves saved by
+                                           the optimised tile routes planned
+                                           so far compared with the snake
+                                           pattern
         """
         if self.use_target_z_diff:
             # calculate number of slices based on total Z difference, rounding down to nearest whole slice
             number_slices = math.floor((self.target_z_diff*1000)/self.slice_thickness)
+            slices_completed = round(
+                self.total_z_diff * 1000 / self.slice_thickness)
         else:
             number_slices = self.number_slices
+            slices_completed = self.slice_counter
         N = number_slices
         if N == 0:  # 0 slices is a valid setting. It means: image the current
             N = 1  # surface, but do not cut afterwards.
         current = self.sem.target_beam_current
         min_dose = max_dose = None
-        if self.microtome is not None:
-            total_cut_time = (
-                number_slices * self.microtome.full_cut_duration)
-        else:
-            total_cut_time = 0
+        use_cut = self.microtome is not None and number_slices > 0
         total_grid_area = 0
-        total_data = 0
-        total_stage_move_time = 0
-        total_imaging_time = 0
 
         # Default estimate: overhead per acquired frame for saving the frame on
         # primary drive and for inspection
@@ -313,96 +396,113 @@ class Acquisition:
         # Add 0.5 s per frame when mirroring files
         if self.use_mirror_drive:
             overhead_per_frame += 0.5
-
-        max_offset_slice_number = max(
-            self.gm.max_acq_interval_offset(),
-            self.ovm.max_acq_interval_offset())
-        max_interval_slice_number = max(
-            self.gm.max_acq_interval(),
-            self.ovm.max_acq_interval())
-
-        # Calculate estimates until max_offset_slice_number, then starting from
-        # max_offset_slice_number for max_interval_slice_number, then
-        # extrapolate until target slice number N.
-
-        def calculate_for_slice_range(from_slice, to_slice):
-            """Run through stack (from_slice..to_slice) to calculate exact
-            raw imaging time, stage move durations, and amount of image data.
-            """
-            imaging_time = 0
-            stage_move_time = 0
-            amount_of_data = 0
-            # Start at stage position of OV 0
-            x0, y0 = self.ovm[0].centre_sx_sy
-            for slice_counter in range(from_slice, to_slice):
+        model = acq_estimate.TimingModel(
+            overhead_per_frame,
+            self.microtome.full_cut_duration if use_cut else 0)
+
+        # Overviews (if acquired) and grids with their number of frames,
+        # scan time and amount of data per slice in which they are acquired
+        overviews = ([self.ovm[ov_index]
+                      for ov_index in range(self.ovm.number_ov)]
+                     if self.take_overviews else [])
+        grids = list(self.gm)
+        items = overviews + grids
+        intervals = [item.acq_interval for item in items]
+        offsets = [item.acq_interval_offset for item in items]
+        active = [item.active for item in items]
+        frames = np.array(
+            [1] * len(overviews)
+            + [grid.number_active_tiles() for grid in grids])
+        scan_times = frames * np.array(
+            [item.tile_cycle_time() for item in items])
+        data = frames * np.array(
+            [ov.width_p() * ov.height_p() for ov in overviews]
+            + [grid.tile_width_p() * grid.tile_height_p() for grid in grids])
+
+        start_sx_sy = self.ovm[0].centre_sx_sy
+        stage_moves = {}
+
+        def stage_move_time(pattern, slice_counter):
+            """Return the duration of the stage moves (stage model) in a
+            slice with the overviews and grids in pattern, and the duration
+            saved by the optimised tile route. The slice starts and (if
+            overviews are acquired) ends at the position of OV 0."""
+            key = pattern.tobytes()
+            if key not in stage_moves:
+                positions = [start_sx_sy] + [
+                    ov.centre_sx_sy for ov, acquired
+                    in zip(overviews, pattern) if acquired]
+                move_time = 0
+                if len(positions) > 1:
+                    move_time += float(self.stage.stage_move_durations(
+                        positions[:-1], positions[1:]).diagonal().sum())
+                # Routes are only planned in the acquisition thread. Slices
+                # for which no route has been planned yet are estimated with
+                # the snake order.
+                route, route_duration, snake_duration = (
+                    self.plan_tile_route(slice_counter, positions[-1],
+                                         plan=False))
+                move_time += route_duration
+                end_sx_sy = positions[-1]
+                if route:
+                    last_grid_index, last_tiles = route[-1]
+                    end_sx_sy = self.gm[last_grid_index][last_tiles[-1]].sx_sy
                 if self.take_overviews:
-                    # Run through all overviews
-                    for ov_index in range(self.ovm.number_ov):
-                        if (self.ovm[ov_index].slice_active(slice_counter)
-                                and self.ovm[ov_index].active):
-                            x1, y1 = self.ovm[ov_index].centre_sx_sy
-                            stage_move_time += (
-                                self.stage.stage_move_duration(x0, y0, x1, y1))
-                            x0, y0 = x1, y1
-                            imaging_time += self.ovm[ov_index].tile_cycle_time()
-                            imaging_time += overhead_per_frame
-                            frame_size = (self.ovm[ov_index].width_p()
-                                          * self.ovm[ov_index].height_p())
-                            amount_of_data += frame_size
-                # Run through all grids
-                for grid_index, grid in enumerate(self.gm):
-                    if (grid.slice_active(slice_counter)
-                            and grid.active):
-                        for tile_index in grid.active_tiles:
-                            x1, y1 = grid[tile_index].sx_sy
-                            stage_move_time += (
-                                self.stage.stage_move_duration(x0, y0, x1, y1))
-                            x0, y0 = x1, y1
-                        number_active_tiles = (
-                            grid.number_active_tiles())
-                        imaging_time += (
-                            (grid.tile_cycle_time()
-                            + overhead_per_frame)
-                            * number_active_tiles)
-                        frame_size = (grid.tile_width_p()
-                                      * grid.tile_height_p())
-                        amount_of_data += frame_size * number_active_tiles
-                # Add time to move back to starting position
-                if self.take_overviews:
-                    x1, y1 = self.ovm[0].centre_sx_sy
-                    stage_move_time += (
-                        self.stage.stage_move_duration(x0, y0, x1, y1))
-                    x0, y0 = x1, y1
-
-            return imaging_time, stage_move_time, amount_of_data
-        # ========= End of inner function calculate_for_slice_range() ==========
-
-        if N <= max_offset_slice_number + max_interval_slice_number:
-            # Calculate for all slices
-            imaging_time_0, stage_move_time_0, amount_of_data_0 = (
-                calculate_for_slice_range(0, N))
-            imaging_time_1, stage_move_time_1, amount_of_data_1 = 0, 0, 0
-        else:
-            # First part (up to max_offset_slice_number)
-            imaging_time_0, stage_move_time_0, amount_of_data_0 = (
-                calculate_for_slice_range(0, max_offset_slice_number))
-            # Fraction of remaining slices that are acquired in
-            # regular intervals
-            imaging_time_1, stage_move_time_1, amount_of_data_1 = (
-                calculate_for_slice_range(
-                    max_offset_slice_number,
-                    max_offset_slice_number + max_interval_slice_number))
-            # Extrapolate for the remaining number of slices
-            if N > max_offset_slice_number + max_interval_slice_number:
-                factor = ((N - max_offset_slice_number)
-                          / max_interval_slice_number)
-                imaging_time_1 *= factor
-                stage_move_time_1 *= factor
-                amount_of_data_1 *= factor
-
-        total_imaging_time = imaging_time_0 + imaging_time_1
-        total_stage_move_time = stage_move_time_0 + stage_move_time_1
-        total_data = amount_of_data_0 + amount_of_data_1
+                    # Move back to starting position
+                    move_time += self.stage.stage_move_duration(
+                        *end_sx_sy, *start_sx_sy)
+                stage_moves[key] = (move_time,
+                                    snake_duration - route_duration)
+            return stage_moves[key]
+
+        def slice_range_estimates(from_slice, to_slice):
+            """Return the patterns in the slice range from_slice..to_slice-1
+            with their numbers of slices, scan times, stage move times,
+            numbers of frames, stage move times saved and amounts of data."""
+            patterns, counts, first_slices = acq_estimate.slice_patterns(
+                intervals, offsets, active, from_slice, to_slice)
+            moves = np.array([
+                stage_move_time(pattern, slice_counter)
+                for pattern, slice_counter in zip(patterns, first_slices)])
+            moves = moves.reshape(-1, 2)
+            return (counts, patterns @ scan_times, moves[:, 0],
+                    patterns @ frames, moves[:, 1], patterns @ data)
+
+        # Calibrate the model with the durations measured in recent slices
+        measured = self.tracer.slice_totals()
+        if measured:
+            slice_estimates = [slice_range_estimates(slice_counter,
+                                                     slice_counter + 1)
+                               for slice_counter, _, _ in measured]
+            model.calibrate(
+                ([duration for _, duration, _ in measured],
+                 [totals.get('stage_move', 0) for _, _, totals in measured],
+                 [totals.get('cut', 0) for _, _, totals in measured]),
+                [scan.sum() for _, scan, _, _, _, _ in slice_estimates],
+                [moves.sum() for _, _, moves, _, _, _ in slice_estimates],
+                [n.sum() for _, _, _, n, _, _ in slice_estimates],
+                cut=use_cut)
+
+        (counts, scan, moves, number_frames, time_saved,
+         amount_of_data) = slice_range_estimates(0, N)
+        total_imaging_time = float(counts @ (
+            scan + model.overhead_per_frame * number_frames))
+        total_stage_move_time = model.move_scale * float(counts @ moves)
+        stage_move_time_saved = model.move_scale * float(counts @ time_saved)
+        total_data = float(counts @ amount_of_data)
+        total_cut_time = number_slices * model.cut_time if use_cut else 0
+
+        # Remaining slices, starting with the current slice
+        remaining_slices = max(N - slices_completed, 0)
+        (counts, scan, moves, number_frames, _, _) = slice_range_estimates(
+            self.slice_counter, self.slice_counter + remaining_slices)
+        durations = model.slice_durations(scan, moves, number_frames,
+                                          cut=use_cut)
+        remaining_time = int(counts @ durations) if len(counts) else 0
+        remaining_time_range = model.bounds(durations, counts)
+        if remaining_time_range is not None:
+            # Whole seconds, like remaining_time
+            remaining_time_range = tuple(int(t) for t in remaining_time_range)
 
         # Calculate grid area and electron dose range
         for grid_index, grid in enumerate(self.gm):
@@ -432,23 +532,17 @@ class Acquisition:
 
         total_z = (number_slices * self.slice_thickness) / 1000
         total_data_in_GB = total_data / (10**9)
-        total_duration = (
-            total_imaging_time + total_stage_move_time + total_cut_time)
 
         # Calculate date and time of completion
         now = datetime.datetime.now()
-        if self.use_target_z_diff:
-            fraction_completed = self.total_z_diff / total_z
-        else:
-            fraction_completed = self.slice_counter / N
-        remaining_time = int(total_duration * (1 - fraction_completed))
         completion_date = now + relativedelta(seconds=remaining_time)
         date_estimate = str(completion_date)[:19].replace(' ', ' at ')
 
         # Return all estimates, to be displayed in main window GUI
         return (min_dose, max_dose, total_grid_area, total_z, total_data_in_GB,
                 total_imaging_time, total_stage_move_time, total_cut_time,
-                date_estimate, remaining_time)
+                date_estimate, remaining_time, remaining_time_range,
+                stage_move_time_saved)
 
     def set_up_acq_subdirectories(self):
         """Set up and mirror all subdirectories for the stack acquisition."""
@@ -477,7 +571,10 @@ class Acquisition:
                 'CTRL: Error while creating subdirectories: ' + exception_str))
             self.pause_acquisition(1)
             self.error_state = Error.primary_drive
-        elif self.use_mirror_drive:
+        else:
+            # Temporary files of images whose writing was interrupted
+            remove_temp_files(os.path.join(self.base_dir, 'workspace'))
+        if success and self.use_mirror_drive:
             success, exception_str = utils.create_subdirectories(
                 self.mirror_drive_dir, subdirectory_list)
             if not success:
@@ -548,6 +645,9 @@ class Acquisition:
             self.metadata_filename = os.path.join(
                 self.base_dir, 'meta', 'logs', 'metadata_' + timestamp + '.txt')
             self.metadata_file = open(self.metadata_filename, 'w', buffer_size)
+            # Durations of the acquisition phases, written after each slice
+            self.tracer.open(os.path.join(
+                self.base_dir, 'meta', 'stats', 'trace_' + timestamp + '.csv'))
         except Exception as e:
             self.log('CTRL', f'Error while setting up log files: {e}', 'error')
             self.pause_acquisition(1)
@@ -563,24 +663,9 @@ class Acquisition:
                     self.imagelist_ov_filename,
                     self.incident_log_filename,
                     self.metadata_filename])
-                # Create file handle for imagelist files on mirror drive.
-                # The imagelist files on the mirror drive are updated continously.
-                # The other logfiles are copied at the end of each run.
-                try:
-                    self.mirror_imagelist_file = open(os.path.join(
-                        self.mirror_drive, self.imagelist_filename[2:]),
-                        'w', buffer_size)
-                    self.mirror_imagelist_ov_file = open(os.path.join(
-                        self.mirror_drive, self.imagelist_ov_filename[2:]),
-                        'w', buffer_size)
-                except Exception as e:
-                    self.log(
-                        'CTRL',
-                        'Error while creating imagelist files on mirror '
-                        f'drive: {e}',
-                        'error')
-                    self.pause_acquisition(1)
-                    self.error_state = Error.mirror_drive
+                # The imagelist files are copied again after each tile or
+                # overview (see register_accepted_tile()). The other logfiles
+                # are copied at the end of each run.
 
     def set_up_afss_masks(self):
         # Create and store binary circular masks for AFSS
@@ -604,13 +689,100 @@ class Acquisition:
                     self.error_state = Error.autofocus_afss
             self.img_masks[mask_id] = mask
 
+    def start_mirror_queue(self):
+        """Start copying files to the mirror drive in the background. Files
+        not copied during the previous run are copied first."""
+        if self.mirror_queue is None:
+            self.mirror_queue = MirrorQueue(
+                self.base_dir, self.mirror_drive_dir,
+                os.path.join(self.base_dir, 'meta', 'mirror_queue.txt'),
+                number_workers=self.mirror_workers,
+                verify=self.mirror_verify)
+
+    def stop_mirror_queue(self, timeout=30):
+        """Wait for the files in the mirror queue to be copied (up to timeout
+        seconds) and stop the queue."""
+        if self.mirror_queue is not None:
+            backlog = self.mirror_queue.backlog
+            if backlog:
+                utils.log_info('CTRL', f'Copying {backlog} file(s) to '
+                                       f'mirror drive.')
+            if not self.mirror_queue.close(timeout):
+                utils.log_warning(
+                    'CTRL', f'{self.mirror_queue.backlog} file(s) not copied '
+                            f'to mirror drive. They will be copied when the '
+                            f'acquisition is resumed.')
+            self.mirror_queue = None
+            self.main_controls_trigger.transmit('MIRROR STATUS', None)
+
+    def flush_image_writer(self, timeout=60):
+        """Wait for the images written in the background to be saved (up
+        to timeout seconds)."""
+        backlog = self.image_writer.backlog
+        if backlog:
+            utils.log_info('CTRL', f'Saving {backlog} image(s).')
+        try:
+            saved = self.image_writer.flush(timeout)
+        except Exception as e:
+            saved = True
+            self.log('CTRL',
+                     f'Warning: Image could not be saved: {e}',
+                     'warning')
+        if not saved:
+            self.log('CTRL',
+                     f'Warning: {self.image_writer.backlog} image(s) not '
+                     f'saved after {timeout} s.',
+                     'warning')
+
+    def check_mirror_queue(self):
+        """Show the mirror queue metrics in the GUI (at most once per second).
+        Return Error.mirror_drive if the backlog exceeds the limit, otherwise
+        Error.none."""
+        if time() - self.mirror_status_time >= 1:
+            self.mirror_status_time = time()
+            self.main_controls_trigger.transmit(
+                'MIRROR STATUS', self.mirror_queue.metrics())
+        backlog = self.mirror_queue.backlog
+        if backlog > self.mirror_backlog_limit and self.pause_state != 1:
+            error = self.mirror_queue.last_error
+            self.log(
+                'CTRL',
+                f'Mirror drive backlog too large ({backlog} files).'
+                + (f' Last error: {error}' if error else ''),
+                'error')
+            return Error.mirror_drive
+        return Error.none
+
     def mirror_files(self, file_list):
-        """Copy files in file_list to mirror drive, keep relative path."""
+        """Copy files in file_list to mirror drive, keep relative path.
+        During acquisitions, the files are copied in the background. Pause
+        the acquisition if the files cannot be copied."""
+        self.pause_on_error(self.copy_to_mirror_drive(file_list))
+
+    def copy_to_mirror_drive(self, file_list):
+        """Copy files in file_list to mirror drive (see mirror_files()).
+        Return Error.mirror_drive if copying failed or the mirror queue
+        backlog is too large, otherwise Error.none. The acquisition state is
+        not changed, so this can run in the worker thread (pipelined mode).
+        """
+        if self.mirror_queue is not None:
+            # Files still being written in the background are queued when
+            # they are complete
+            try:
+                self.image_writer.when_written(file_list,
+                                               self.mirror_queue.add)
+            except Exception as e:
+                self.log('CTRL',
+                         f'Warning: Image could not be saved and is not '
+                         f'copied to the mirror drive: {e}',
+                         'warning')
+            return self.check_mirror_queue()
+        self.image_writer.wait(file_list)
         try:
             for file_name in file_list:
                 dst_file_name = os.path.join(self.mirror_drive, file_name[2:])
                 utils.validate_output_path(dst_file_name, is_file=True)
-                shutil.copy(file_name, dst_file_name)
+                copy_image(file_name, dst_file_name)
         except Exception as e:
             utils.log_warning('CTRL', 'WARNING (Could not mirror file(s))')
             self.add_to_incident_log('WARNING (Could not mirror file(s))')
@@ -620,14 +792,30 @@ class Acquisition:
                 for file_name in file_list:
                     dst_file_name = os.path.join(
                         self.mirror_drive, file_name[2:])
-                    shutil.copy(file_name, dst_file_name)
+                    copy_image(file_name, dst_file_name)
             except Exception as e:
                 self.log(
                     'CTRL',
                     f'Copying file(s) to mirror drive failed: {e}',
                     'error')
-                self.pause_acquisition(1)
-                self.error_state = Error.mirror_drive
+                return Error.mirror_drive
+        return Error.none
+
+    def mirror_imagelist(self, file_name):
+        """Copy the imagelist file file_name to the mirror drive after an
+        entry was added. During acquisitions, the file is copied by the
+        mirror queue (the backlog is checked when the images are queued)."""
+        if self.mirror_queue is not None:
+            self.mirror_queue.add([file_name])
+        else:
+            self.mirror_files([file_name])
+
+    def pause_on_error(self, error_state):
+        """Set error_state and pause the acquisition, unless error_state is
+        Error.none. Applies errors returned from the worker thread."""
+        if error_state != Error.none:
+            self.pause_acquisition(1)
+            self.error_state = error_state
 
     def load_acq_notes(self):
         """Read the contents of the notes text file and return them. Return
@@ -703,6 +891,7 @@ class Acquisition:
                     'CTRL',
                     'Mirror drive active: '
                     + self.mirror_drive_dir)
+                self.start_mirror_queue()
 
             # Save current configuration to disk:
             # Send signal to call save_settings() in MainControls.py
@@ -710,6 +899,12 @@ class Acquisition:
             # Update progress bar and slice counter in Main Controls GUI
             self.main_controls_trigger.transmit('UPDATE PROGRESS')
 
+            if self.send_metadata:
+                # Metadata is sent to the server in the background. Records
+                # not sent during the previous run are sent first.
+                self.notifications.start_metadata_client(
+                    os.path.join(self.base_dir, 'meta', 'outbox'))
+
             # Create metadata summary for this run, write it to disk and send it
             # to remote (VIME) server (if feature enabled).
             timestamp = int(time())
@@ -880,6 +1075,10 @@ class Acquisition:
         # ========================= ACQUISITION LOOP ===========================
 
         while not (self.acq_paused or self.stack_completed):
+            # The durations of the phases are saved for the slice that is
+            # acquired now (slice_counter is increased by the cut)
+            acquired_slice = self.slice_counter
+            self.tracer.start_slice()
             # Add line with stars in log file as a visual clue when a new
             # slice begins and show current slice counter and Z position.
             
@@ -936,25 +1135,15 @@ class Acquisition:
                     and self.notifications.remote_commands_enabled
                     and self.slice_counter % self.remote_check_interval == 0):
                 self.log('CTRL', 'Checking for remote commands.')
-                self.process_remote_commands()
+                with self.tracer.span('notification'):
+                    self.process_remote_commands()
 
             # Send status report if scheduled or requested by remote command
             if (self.use_email_monitoring
                     and (self.slice_counter > 0)
                     and (report_scheduled or self.report_requested)):
-                send_success, send_error, cleanup_success, cleanup_error = (
-                    self.notifications.send_status_report(
-                        self.base_dir, self.stack_name, self.slice_counter,
-                        self.recent_log_filename, self.incident_log_filename,
-                        self.vp_screenshot_filename))
-                if send_success:
-                    utils.log_info('CTRL', 'Status report e-mail sent.')
-                else:
-                    utils.log_error('CTRL', 'ERROR sending status report e-mail: '
-                                    + send_error)
-                if not cleanup_success:
-                    utils.log_warning('CTRL', 'ERROR while trying to remove '
-                                              'temporary file: ' + cleanup_error)
+                with self.tracer.span('notification'):
+                    self.start_status_report()
                 self.report_requested = False
 
             if self.send_metadata:
@@ -984,12 +1173,22 @@ class Acquisition:
                     self.tiles_acquired = []
                     self.grids_acquired = []
                     # Confirm slice completion
-                    self.confirm_slice_complete()
+                    with self.tracer.span('notification'):
+                        self.confirm_slice_complete()
             # Imaging and cutting for the current slice have finished.
             # Save current configuration to disk, update progress in GUI,
             # and check if stack has been completed.
+            # Save the durations of the phases of this slice (also used to
+            # calibrate the estimates shown with 'UPDATE PROGRESS')
+            success, error_msg = self.tracer.flush(acquired_slice)
+            if not success:
+                self.log(
+                    'CTRL',
+                    f'Warning: Could not save acquisition timing: {error_msg}',
+                    'warning')
             self.main_controls_trigger.transmit('SAVE CFG')
             self.main_controls_trigger.transmit('UPDATE PROGRESS')
+            self.main_controls_trigger.transmit('ACQ STATS')
 
             if self.use_target_z_diff:
                 # stop when cutting another slice at the current thickness would exceed the target z depth
@@ -1067,6 +1266,10 @@ class Acquisition:
             # For delayed AFSS activation
             self.autofocus.afss_next_activation = self.slice_counter + self.autofocus.afss_offset
 
+        # Write the images still waiting in the image writer (the
+        # acquisition has been paused or stopped)
+        self.flush_image_writer()
+
         # Update acquisition status in Main Controls GUI
         self.main_controls_trigger.transmit('ACQ NOT IN PROGRESS')
 
@@ -1086,15 +1289,20 @@ class Acquisition:
                          'Error sending "session stopped" '
                          f'signal to VIME server. {exc_str}',
                          'error')
+        if self.notifications.metadata_client is not None:
+            pending_count = self.notifications.metadata_client.pending_count
+            if pending_count:
+                self.log('CTRL', f'Sending {pending_count} metadata '
+                                 f'record(s) to server.')
+            if not self.notifications.stop_metadata_client():
+                self.log('CTRL',
+                         'Warning: Metadata could not be sent to server. '
+                         'It will be sent when the acquisition is resumed.',
+                         'warning')
 
         # Add last entry to main log
         self.main_log_file.write('*** END OF LOG ***\n')
 
-        # Copy log files to mirror drive. Error handling in self.mirror_files()
-        if self.use_mirror_drive:
-            self.mirror_files([self.main_log_filename,
-                               self.incident_log_filename,
-                               self.metadata_filename])
         # Close all log files
         if self.main_log_file is not None:
             self.main_log_file.close()
@@ -1102,16 +1310,52 @@ class Acquisition:
             self.imagelist_file.close()
         if self.imagelist_ov_file is not None:
             self.imagelist_ov_file.close()
-        if self.use_mirror_drive and self.mirror_imagelist_file is not None:
-            self.mirror_imagelist_file.close()
-            self.mirror_imagelist_ov_file.close()
         if self.incident_log_file is not None:
             self.incident_log_file.close()
         if self.metadata_file is not None:
             self.metadata_file.close()
+        self.tracer.close()
+
+        # Copy log files to mirror drive. Error handling in self.mirror_files()
+        if self.use_mirror_drive:
+            log_files = [self.main_log_filename,
+                         self.incident_log_filename,
+                         self.metadata_filename]
+            if self.tracer.file_name is not None:
+                log_files.append(self.tracer.file_name)
+            self.mirror_files(log_files)
+            self.stop_mirror_queue()
 
     # ================ END OF STACK ACQUISITION THREAD run() ===================
 
+    def start_status_report(self):
+        """Compile and send the status report e-mail in a background thread,
+        so that a slow mail server does not delay the acquisition."""
+        if (self.status_report_thread is not None
+                and self.status_report_thread.is_alive()):
+            utils.log_warning('CTRL', 'Previous status report is still being '
+                                      'sent. Status report skipped.')
+            return
+        self.status_report_thread = threading.Thread(
+            target=self.send_status_report, args=(self.slice_counter,),
+            daemon=True)
+        self.status_report_thread.start()
+
+    def send_status_report(self, slice_counter):
+        send_success, send_error, cleanup_success, cleanup_error = (
+            self.notifications.send_status_report(
+                self.base_dir, self.stack_name, slice_counter,
+                self.recent_log_filename, self.incident_log_filename,
+                self.vp_screenshot_filename))
+        if send_success:
+            utils.log_info('CTRL', 'Status report e-mail sent.')
+        else:
+            utils.log_error('CTRL', 'ERROR sending status report e-mail: '
+                            + send_error)
+        if not cleanup_success:
+            utils.log_warning('CTRL', 'ERROR while trying to remove '
+                                      'temporary file: ' + cleanup_error)
+
     def process_remote_commands(self):
         """Check if user has sent an e-mail with a command to the e-mail
         account associated with this setup (see system configuration).
@@ -1260,7 +1504,8 @@ class Acquisition:
         self.log(
             'STAGE',
             f'Move to new Z: {self.stage_z_position:.3f}')
-        self.microtome.move_stage_to_z(self.stage_z_position)
+        with self.tracer.span('stage_move_z'):
+            self.microtome.move_stage_to_z(self.stage_z_position)
         # Show new Z position in Main Controls GUI
         self.main_controls_trigger.transmit('UPDATE Z')
         # Check if there were microtome errors
@@ -1277,7 +1522,8 @@ class Acquisition:
             self.microtome.reset_error_state()
             # Try again after three-second delay
             sleep(3)
-            self.microtome.move_stage_to_z(self.stage_z_position)
+            with self.tracer.span('stage_move_z'):
+                self.microtome.move_stage_to_z(self.stage_z_position)
             self.main_controls_trigger.transmit('UPDATE Z')
             # Read new error_state
             self.error_state = self.microtome.error_state
@@ -1289,17 +1535,20 @@ class Acquisition:
                 f'Cutting in progress ({self.slice_thickness})'
                 ' nm cutting thickness).')
             # Do the full cut cycle (near, cut, retract, clear)
-            self.microtome.do_full_cut()
+            with self.tracer.span('cut'):
+                self.microtome.do_full_cut()
             # Process tiles for AFSS autofocus
-            self.process_afss_autofocus()
+            with self.tracer.span('autofocus'):
+                self.process_afss_autofocus()
             # Process tiles for heuristic autofocus during cut
             if self.heuristic_af_queue:
-                self.process_heuristic_af_queue()
-                # Apply all corrections to tiles
-                self.log(
-                    'CTRL',
-                    'Applying corrections to WD/STIG.')
-                self.autofocus.apply_heuristic_tile_corrections()
+                with self.tracer.span('autofocus'):
+                    self.process_heuristic_af_queue()
+                    # Apply all corrections to tiles
+                    self.log(
+                        'CTRL',
+                        'Applying corrections to WD/STIG.')
+                    self.autofocus.apply_heuristic_tile_corrections()
                 # If there were jumps in WD/STIG above the allowed thresholds
                 # (error 507), add message to the log.
                 if self.error_state == Error.wd_stig_difference:
@@ -1310,7 +1559,8 @@ class Acquisition:
             else:
                 # TODO: why is that? all microtomes already wait for completion during do_full_cut.
                 if not self.microtome.device_name == 'GCIB':
-                    sleep(self.microtome.full_cut_duration)
+                    with self.tracer.span('cut'):
+                        sleep(self.microtome.full_cut_duration)
                 else:
                     self.log('GCIB', 'Omitting post-cut sleep.')
             cut_cycle_delay = self.microtome.check_cut_cycle_status()
@@ -1409,12 +1659,46 @@ class Acquisition:
                          'signal to server. ' + exc_str,
                          'error')
 
+    def check_metadata_client(self):
+        """Log when the background metadata client starts or stops failing
+        to reach the server, and when the server has rejected records. The
+        acquisition is not paused because unsent metadata is kept in the
+        outbox and sent later."""
+        client = self.notifications.metadata_client
+        if client is None:
+            return
+        rejected_count = client.rejected_count
+        if rejected_count > self.metadata_rejected_count:
+            self.log('CTRL',
+                     f'Warning: Metadata server rejected '
+                     f'{rejected_count - self.metadata_rejected_count} '
+                     f'record(s). Rejected records are kept in '
+                     f'{client.outbox_dir} (*.rejected).',
+                     'warning')
+            self.metadata_rejected_count = rejected_count
+        error = client.last_error
+        if error != self.metadata_client_error:
+            if error is not None:
+                self.log('CTRL',
+                         f'Warning: Metadata server not reachable '
+                         f'({client.pending_count} record(s) queued). '
+                         f'{error}',
+                         'warning')
+            else:
+                self.log('CTRL', 'Metadata server reachable again.')
+            self.metadata_client_error = error
+
     def receive_msg_from_metadata_server(self):
         """Get commands or messages from the metadata server."""
+        self.check_metadata_client()
         status, command, msg, exc_str = (
             self.notifications.read_server_message(
                 self.metadata_project_name, self.stack_name))
-        if status == 100:
+        if status == 100 and self.notifications.metadata_client is not None:
+            self.log('CTRL',
+                     'Warning: Error during get request to server. ' + exc_str,
+                     'warning')
+        elif status == 100:
             self.error_state = Error.metadata_server
             self.pause_acquisition(1)
             self.log('CTRL: Error during get request '
@@ -1470,9 +1754,10 @@ class Acquisition:
 
     def process_heuristic_af_queue(self):
         """Process tiles in self.heuristic_af_queue for the heuristic autofocus.
-        This method is called while the cut cycle is carried out. If processing
-        takes less time than the cutting cycle, this method will wait for the
-        extra time.
+        This method is called while the cut cycle is carried out. The
+        estimators have usually already been computed in the background
+        (see Autofocus.submit_heuristic_af_batch()). If processing takes less
+        time than the cutting cycle, this method will wait for the extra time.
         """
         start_time = time()
         for tile_key in self.heuristic_af_queue:
@@ -1582,22 +1867,26 @@ class Acquisition:
 
                 if ov_accepted:
                     # Write overview's name and position into imagelist_ov
-                    self.register_accepted_ov(relative_ov_save_path, ov_index)
+                    with self.tracer.span('register'):
+                        self.register_accepted_ov(relative_ov_save_path,
+                                                  ov_index)
                     # Write stats and reslice to disk. If this does not work,
                     # show a warning in the log, but don't pause the acquisition
-                    success, error_msg = (
-                        self.img_inspector.save_ov_stats(
-                            self.base_dir, ov_index,
-                            self.slice_counter))
+                    with self.tracer.span('save'):
+                        success, error_msg = (
+                            self.img_inspector.save_ov_stats(
+                                self.base_dir, ov_index,
+                                self.slice_counter))
                     if not success:
                         self.log(
                             'CTRL',
                             'Warning: Could not save OV mean/SD to disk: '
                             + error_msg,
                             'error')
-                    success, error_msg = (
-                        self.img_inspector.save_ov_reslice(
-                            self.base_dir, ov_index))
+                    with self.tracer.span('save'):
+                        success, error_msg = (
+                            self.img_inspector.save_ov_reslice(
+                                self.base_dir, ov_index))
                     if not success:
                         self.log(
                             'CTRL',
@@ -1606,7 +1895,8 @@ class Acquisition:
                             'error')
                     # Mirror the acquired overview
                     if self.use_mirror_drive:
-                        self.mirror_files([ov_save_path])
+                        with self.tracer.span('mirror'):
+                            self.mirror_files([ov_save_path])
                 if sweep_counter > 0:
                     self.add_to_incident_log(
                         'Debris, ' + str(sweep_counter) + ' sweep(s)')
@@ -1630,7 +1920,8 @@ class Acquisition:
             self.log(
                 'STAGE',
                 f'Moving to OV {ov_index} position.')
-            self.stage.move_to_xy(ov_stage_position)
+            with self.tracer.span('stage_move'):
+                self.stage.move_to_xy(ov_stage_position)
             if self.stage.error_state != Error.none:
                 self.log(
                     'STAGE',
@@ -1644,7 +1935,8 @@ class Acquisition:
                 # Try again
                 self.stage.reset_error_state()
                 sleep(2)
-                self.stage.move_to_xy(ov_stage_position)
+                with self.tracer.span('stage_move'):
+                    self.stage.move_to_xy(ov_stage_position)
                 self.error_state = self.stage.error_state
                 if self.error_state != Error.none:
                     self.log(
@@ -1659,13 +1951,15 @@ class Acquisition:
                     self.main_controls_trigger.transmit('UPDATE XY')
         if move_success:
             # Set specified OV frame settings
-            self.sem.apply_frame_settings(
-                self.ovm[ov_index].frame_size_selector,
-                self.ovm[ov_index].pixel_size,
-                self.ovm[ov_index].dwell_time)
-            
-            # Set image bit depth for current overview
-            self.sem.set_bit_depth(self.ovm[ov_index].bit_depth_selector)
+            with self.tracer.span('frame_settings'):
+                self.sem.apply_frame_settings(
+                    self.ovm[ov_index].frame_size_selector,
+                    self.ovm[ov_index].pixel_size,
+                    self.ovm[ov_index].dwell_time)
+
+                # Set image bit depth for current overview
+                self.sem.set_bit_depth(self.ovm[ov_index].bit_depth_selector)
+                self.sem.set_compression(self.ov_compression)
             
             # Use individual OV focus parameters if available
             # (if wd == 0, use current)
@@ -1691,21 +1985,25 @@ class Acquisition:
 
             # Indicate the overview being acquired in the viewport
             self.main_controls_trigger.transmit('ACQ IND OV', ov_index)
-            # Acquire the image
-            self.sem.acquire_frame(ov_save_path, self.stage)
+            # Acquire the image (kept in memory for inspection if available)
+            with self.tracer.span('grab'):
+                _, ov_frame = self.sem.acquire_frame(
+                    ov_save_path, self.stage, return_image=True)
             # Remove indicator colour
             self.main_controls_trigger.transmit('ACQ IND OV', ov_index)
 
             # Check if OV image file exists and show image in Viewport
-            if os.path.isfile(ov_save_path):
+            if os.path.exists(ov_save_path):
 
                 # Inspect the acquired image
-                (ov_img, mean, stddev, sharpness,
-                 range_test_passed,
-                 load_error, load_exception, grab_incomplete) = (
-                    self.img_inspector.process_ov(ov_save_path,
-                                                  ov_index,
-                                                  self.slice_counter))
+                with self.tracer.span('inspect'):
+                    (ov_img, mean, stddev, sharpness,
+                     range_test_passed,
+                     load_error, load_exception, grab_incomplete) = (
+                        self.img_inspector.process_ov(ov_save_path,
+                                                      ov_index,
+                                                      self.slice_counter,
+                                                      ov_frame))
                 # Show OV in viewport and display mean and stddev
                 # if no load error
                 if not load_error:
@@ -1713,16 +2011,18 @@ class Acquisition:
                         'CTRL',
                         f'OV: M:{mean:.2f}, '
                         f'SD:{stddev:.2f}')
-                    # Save the acquired image in the workspace folder
+                    # Save the acquired image in the workspace folder (in
+                    # the background)
                     workspace_save_path = os.path.join(self.base_dir, 'workspace',
                                                        utils.get_ov_filename('', ov_index))
-                    imwrite(workspace_save_path, ov_img, npyramid_add=DEFAULT_PYRAMID_LEVELS)
-                    # Update the vp_file_path in the overview manager,
-                    # thereby loading the overview as a QPixmap for display
-                    # in the Viewport.
-                    self.ovm[ov_index].vp_file_path = workspace_save_path
-                    # Signal to update viewport
-                    self.main_controls_trigger.transmit('DRAW VP')
+                    with self.tracer.span('save'):
+                        future = self.image_writer.write(
+                            workspace_save_path, ov_img,
+                            npyramid_add=DEFAULT_PYRAMID_LEVELS,
+                            compression=self.ov_compression)
+                    future.add_done_callback(
+                        lambda future, ov_index=ov_index:
+                            self.show_workspace_ov(future, ov_index))
                 if load_error:
                     self.error_state = Error.image_load
                     ov_accepted = False
@@ -1837,13 +2137,23 @@ class Acquisition:
                     'Error during second sweep attempt.',
                     'error')
 
+    def show_workspace_ov(self, future, ov_index):
+        """Called when the workspace copy of an OV has been written."""
+        if future.exception() is None:
+            # Update the vp_file_path in the overview manager,
+            # thereby loading the overview as a QPixmap for display
+            # in the Viewport.
+            self.ovm[ov_index].vp_file_path = future.result()
+            # Signal to update viewport
+            self.main_controls_trigger.transmit('DRAW VP')
+
     def save_debris_image(self, ov_file_name, ov_index, sweep_counter):
         debris_save_path = utils.ov_debris_save_path(
             self.base_dir, self.stack_name, ov_index, self.slice_counter,
             sweep_counter)
         # Copy current ov_file to folder 'debris'
         try:
-            shutil.copy(ov_file_name, debris_save_path)
+            copy_image(ov_file_name, debris_save_path)
         except Exception as e:
             self.log(
                 'CTRL',
@@ -1854,6 +2164,75 @@ class Acquisition:
         if self.use_mirror_drive:
             self.mirror_files([debris_save_path])
 
+    def plan_tile_route(self, slice_counter, start_sx_sy, plan=True):
+        """Plan the order in which the active tiles of all grids are acquired
+        in slice slice_counter, starting at stage position start_sx_sy.
+        Return (route, route_duration, snake_duration) with route as a list
+        of (grid_index, tile indices in acquisition order). See
+        tile_route.plan_route(). If plan is False, the route is not planned
+        (which can take up to tile_route_time_budget): the route planned
+        earlier for the same tiles and start position is returned, or the
+        snake order if there is none.
+        """
+        # Active autofocus reference tiles (SEM autofocus/MAPFoSt) are
+        # acquired first in each grid, so that the corrections found on
+        # these tiles can be applied to the other tiles of the grid.
+        ref_tiles_first = (
+            self.optimise_tile_route
+            and self.use_autofocus
+            and self.autofocus.method in [0, 3]
+            and not self.gm.array_mode)
+        grids = []
+        for grid_index, grid in enumerate(self.gm):
+            if not (grid.active and grid.slice_active(slice_counter)):
+                continue
+            tiles = list(grid.active_tiles)
+            if not tiles:
+                continue
+            first_tiles = []
+            if ref_tiles_first:
+                first_tiles = [tile_index
+                               for tile_index in grid.autofocus_ref_tiles()
+                               if grid[tile_index].tile_active]
+            tile_sx_sy = np.array([grid[tile_index].sx_sy
+                                   for tile_index in tiles], dtype=float)
+            grids.append((grid_index, tiles, tile_sx_sy, first_tiles))
+
+        def snake_route():
+            route = [(grid_index, tiles) for grid_index, tiles, _, _ in grids]
+            duration = tile_route.route_duration(
+                start_sx_sy,
+                [(grid_index, tile_sx_sy)
+                 for grid_index, _, tile_sx_sy, _ in grids],
+                self.stage.stage_move_durations)
+            return route, duration, duration
+
+        if not self.optimise_tile_route:
+            return snake_route()
+
+        # The route is only planned again if the tiles, the start position
+        # or the stage parameters have changed.
+        key = (tuple(np.round(start_sx_sy, 3)),
+               self.stage.motor_speed_x, self.stage.motor_speed_y,
+               self.stage.stage_move_wait_interval,
+               tuple((grid_index, tuple(tiles), tile_sx_sy.tobytes(),
+                      tuple(first_tiles))
+                     for grid_index, tiles, tile_sx_sy, first_tiles in grids))
+        # The cache is read in the GUI thread (estimates) and updated in the
+        # acquisition thread
+        planned = self.tile_route_cache.get(key)
+        if planned is None:
+            if not plan:
+                return snake_route()
+            planned = tile_route.plan_route(
+                grids, start_sx_sy, self.stage.stage_move_durations,
+                self.tile_route_time_budget,
+                keep_grid_order=self.gm.array_mode)
+            if len(self.tile_route_cache) >= 64:
+                self.tile_route_cache.clear()
+            self.tile_route_cache[key] = planned
+        return planned
+
     def acquire_all_grids(self):
         """Acquire all grids that are active, with error handling."""
 
@@ -1890,7 +2269,28 @@ class Acquisition:
             self.gm.fit_apply_aberration_gradient()
         # For Automated Focus/Stigmator series (method 4), apply the WD/Stig deltas
         self.afss_handle_series()
-        for grid_index, grid in enumerate(self.gm):
+        # Plan the order in which the grids and tiles are acquired, starting
+        # at the current stage position
+        start_sx_sy = self.stage.last_known_xy
+        if None in start_sx_sy and self.ovm.number_ov > 0:
+            start_sx_sy = self.ovm[0].centre_sx_sy
+        elif None in start_sx_sy:
+            start_sx_sy = (0, 0)
+        route, route_duration, snake_duration = self.plan_tile_route(
+            self.slice_counter, start_sx_sy)
+        self.tile_route = dict(route)
+        if snake_duration - route_duration > 1:
+            self.log(
+                'CTRL',
+                f'Optimised tile route: stage moves {route_duration:.0f} s '
+                f'(snake pattern: {snake_duration:.0f} s)')
+        # Grids that are not acquired in this slice are visited last
+        # (to log that they are skipped)
+        grid_order = [grid_index for grid_index, _ in route]
+        grid_order += [grid_index for grid_index in range(self.gm.number_grids)
+                       if grid_index not in self.tile_route]
+        for grid_index in grid_order:
+            grid = self.gm[grid_index]
             grid_label = grid.get_label(grid_index)
             self.grid_current_index = grid_index
             self.grid_current_label = grid_label
@@ -1985,6 +2385,12 @@ class Acquisition:
         grid = self.gm[grid_index]
         grid_label = grid.get_label(grid_index)
         active_tiles = list(grid.active_tiles)
+        # Use the planned tile order (see plan_tile_route()) unless the
+        # active tiles have changed since the route was planned
+        route_tiles = self.tile_route.get(grid_index)
+        if (route_tiles is not None
+                and sorted(route_tiles) == sorted(active_tiles)):
+            active_tiles = list(route_tiles)
 
         # Focus parameters must be adjusted for each tile individually if focus
         # gradient is active or if autofocus/tracked focus is used with
@@ -2050,133 +2456,36 @@ class Acquisition:
         self.set_scan_rotation(grid_index)
 
         # ============= Acquisition loop of all active tiles ===============
-        for tile_index in active_tiles:
-            fail_counter = 0
-            tile_accepted = False
-            tile_skipped = False
-            tile_id = str(grid_index) + '.' + str(tile_index)
-
-            # Acquire the current tile
-            while (
-                not tile_accepted
-                and not tile_skipped
-                and fail_counter < 2
-            ):
-
+        if self.pipelined_tile_acq:
+            self.acquire_active_tiles_pipelined(
+                grid_index, active_tiles, adjust_wd_stig, adjust_acq_settings,
+                overwrite)
+        else:
+            for tile_index in active_tiles:
                 (tile_img, relative_save_path, save_path,
                     tile_accepted, tile_skipped, tile_selected,
-                    rejected_by_user) = (
-                    self.acquire_tile(grid_index, tile_index,
-                                      adjust_wd_stig, adjust_acq_settings,
-                                      overwrite=overwrite))
-                if not tile_skipped:
-                    adjust_acq_settings = False
-
-                if (
-                    self.error_state in [
-                        Error.grab_image,
-                        Error.grab_incomplete,
-                        Error.frame_frozen,
-                        Error.image_load,
-                        ]
-                    and not rejected_by_user
-                ):
-
-                    self.save_rejected_tile(save_path, fail_counter)
-                    # Try again
-                    fail_counter += 1
-                    if fail_counter == 2:
-                        # Pause after second failed attempt
-                        self.pause_acquisition(1)
-                    else:
-                        # Remove the file to avoid overwrite error
-                        try:
-                            os.remove(save_path)
-                        except Exception as e:
-                            self.log(
-                                'CTRL',
-                                'Tile image file could not be '
-                                f'removed: {e}',
-                                'error')
-                        # TODO: Try to solve frozen frame problem:
-                        # if self.error_state == Error.frame_frozen:
-                        #    self.handle_frozen_frame(grid_index)
-                        self.log(
-                            'SEM',
-                            'Trying again to image tile.',
-                            'warning')
-                        # Reset error state
-                        self.error_state = Error.none
-                elif self.error_state != Error.none:
-                    self.pause_acquisition(1)
+                    adjust_acq_settings) = (
+                    self.acquire_tile_with_retries(
+                        grid_index, tile_index, adjust_wd_stig,
+                        adjust_acq_settings, overwrite))
+                self.complete_tile(grid_index, tile_index, tile_img,
+                                   relative_save_path, save_path,
+                                   tile_accepted, tile_skipped, tile_selected)
+                del tile_img
+                # Save current position if acquisition was paused by user
+                # or interrupted by an error.
+                if self.pause_state == 1:
+                    self.set_interruption_point(grid_index, tile_index)
                     break
-            # End of tile aquisition while loop
-
-            if (
-                tile_accepted
-                and tile_selected
-                and not tile_skipped
-            ):
-                # Write tile's name and position into imagelist
-                self.register_accepted_tile(relative_save_path,
-                                            grid_index, tile_index)
-                # Save stats and reslice
-                success, error_msg = self.img_inspector.save_tile_stats(
-                    self.base_dir, grid_index, tile_index,
-                    self.slice_counter)
-                if not success:
-                    self.log(
-                        'CTRL',
-                        'Warning: Could not save tile mean and SD '
-                        f'to disk: {error_msg}',
-                        'error')
-                success, error_msg = self.img_inspector.save_tile_reslice(
-                    self.base_dir, grid_index, grid.array_index, grid.roi_index, tile_index)
-                if not success:
-                    self.log(
-                        'CTRL',
-                        'Warning: Could not save tile reslice to '
-                        f'disk: {error_msg}',
-                        'error')
-
-                # If heuristic autofocus is enabled and tile is selected as
-                # a reference tile, prepare tile for processing:
-                if (
-                    self.use_autofocus
-                    and self.autofocus.method==1
-                    and grid[tile_index].autofocus_active
-                ):
-
-                    tile_key = str(grid_index) + '.' + str(tile_index)
-                    self.autofocus.prepare_tile_for_heuristic_af(
-                        tile_img, tile_key)
-                    self.heuristic_af_queue.append(tile_key)
-                    del tile_img
-
-            elif (
-                not tile_selected
-                and not tile_skipped
-                and self.error_state == Error.none
-            ):
-                self.log(
-                    'CTRL',
-                    f'Tile {tile_id} was discarded by image '
-                    f'inspector.')
-                # Delete file
-                try:
-                    os.remove(save_path)
-                except Exception as e:
-                    self.log(
-                        'CTRL',
-                        f'Tile image file could not be deleted: {e}',
-                        'error')
-            # Save current position if acquisition was paused by user
-            # or interrupted by an error.
-            if self.pause_state == 1:
-                self.set_interruption_point(grid_index, tile_index)
-                break
         # ================= End of tile acquisition loop ===================
 
+        # Start processing the reference tiles of this grid for the
+        # heuristic autofocus in the background (results are used during
+        # the cut cycle)
+        self.autofocus.submit_heuristic_af_batch(
+            [tile_key for tile_key in self.heuristic_af_queue
+             if tile_key.split('.')[0] == str(grid_index)])
+
         cycle_time_diff = (self.sem.additional_cycle_time
                             - self.sem.DEFAULT_DELAY)
         if cycle_time_diff > 0.15:
@@ -2198,15 +2507,16 @@ class Acquisition:
                 'CTRL',
                 f'{grid_label}: avg. tile inspect '
                 f'duration: {mean(self.tile_inspect_durations):.1f} s')
-        if self.use_mirror_drive and self.tile_mirror_durations:
+        if self.mirror_queue is not None:
+            metrics = self.mirror_queue.metrics()
             self.log(
                 'CTRL',
-                f'{grid_label}: avg. time to copy tile to '
-                f'mirror drive: {mean(self.tile_mirror_durations):.1f} s')
+                f'{grid_label}: mirror drive backlog: '
+                f'{metrics["backlog"]} file(s), copy rate: '
+                f'{metrics["bandwidth"] / 1e6:.1f} MB/s')
         # Clear duration lists for the next grid
         self.tile_grab_durations = []
         self.tile_inspect_durations = []
-        self.tile_mirror_durations = []
 
         # Disable scan rotation
         self.set_scan_rotation(None)
@@ -2236,6 +2546,277 @@ class Acquisition:
                 self.gm[gr_ind][tile_index].stig_xy = self.autofocus.afss_wd_stig_orig[key][1]
                     
                     
+    def acquire_active_tiles_pipelined(self, grid_index, active_tiles,
+                                       adjust_wd_stig, adjust_acq_settings,
+                                       overwrite):
+        """Acquire the active tiles of the specified grid in a pipeline:
+        While the stage moves to tile N+1 and its frame is acquired, tile N
+        is mirrored and inspected in a worker thread. The worker does not
+        change the acquisition state; its errors are returned with the
+        result and applied here. The result for tile N is evaluated and
+        tile N is registered (image list, metadata, stats, reslice) before
+        tile N+1 is inspected and tile N+2 is acquired. If tile N fails or
+        cannot be registered, the frame already acquired for tile N+1 is
+        discarded and the acquisition is interrupted at tile N, as in
+        serial mode.
+        """
+        pending = None           # Tile acquired, but not yet evaluated
+        last_tile_index = None   # Last tile that was evaluated
+        with ThreadPoolExecutor(max_workers=1) as worker:
+            for tile_index in active_tiles:
+                if pending is not None and pending[2] is None:
+                    # Nothing to overlap with (previous tile was skipped or
+                    # not acquired): evaluate it before moving on
+                    adjust_acq_settings = self.finish_pipelined_tile(
+                        grid_index, pending, adjust_wd_stig,
+                        adjust_acq_settings, overwrite)
+                    last_tile_index = pending[0]
+                    pending = None
+                    if self.pause_state == 1:
+                        break
+
+                grab_result = self.grab_tile(grid_index, tile_index,
+                                             adjust_wd_stig,
+                                             adjust_acq_settings,
+                                             overwrite)
+                save_path, frame_acquired = grab_result[1], grab_result[3]
+                adjust_acq_settings = grab_result[4]
+                grab_error = self.error_state
+                self.error_state = Error.none
+
+                if pending is not None:
+                    adjust_acq_settings = self.finish_pipelined_tile(
+                        grid_index, pending, adjust_wd_stig,
+                        adjust_acq_settings, overwrite)
+                    last_tile_index = pending[0]
+                    pending = None
+                    if (
+                        self.pause_state == 1
+                        and self.error_state != Error.none
+                    ):
+                        # Previous tile failed. Discard the frame of the
+                        # current tile, it will be acquired again when
+                        # the acquisition is resumed.
+                        if frame_acquired:
+                            self.log(
+                                'CTRL',
+                                f'Tile {grid_index}.{tile_index} discarded '
+                                f'(previous tile failed).')
+                            try:
+                                remove_image(save_path)
+                            except Exception as e:
+                                self.log(
+                                    'CTRL',
+                                    'Tile image file could not be '
+                                    f'deleted: {e}',
+                                    'error')
+                        break
+
+                # Start mirroring and inspecting the current tile
+                future = None
+                if frame_acquired:
+                    future = worker.submit(self.inspect_tile,
+                                           grid_index, tile_index,
+                                           save_path, grab_error,
+                                           grab_result[5])
+                pending = (tile_index, grab_result, future, grab_error)
+                if self.pause_state == 1:
+                    # Paused by user: Finish the current tile, but do not
+                    # acquire any further tiles.
+                    break
+
+            if pending is not None:
+                adjust_acq_settings = self.finish_pipelined_tile(
+                    grid_index, pending, adjust_wd_stig,
+                    adjust_acq_settings, overwrite)
+                last_tile_index = pending[0]
+
+        # Save current position if acquisition was paused by user
+        # or interrupted by an error.
+        if self.pause_state == 1 and last_tile_index is not None:
+            self.set_interruption_point(grid_index, last_tile_index)
+
+    def finish_pipelined_tile(self, grid_index, pending, adjust_wd_stig,
+                              adjust_acq_settings, overwrite):
+        """Wait for the inspection of a tile acquired in pipelined mode,
+        apply its errors (with retries and 'Ask User' override as in serial
+        mode) and register it. Return the updated adjust_acq_settings flag.
+        """
+        tile_index, grab_result, future, grab_error = pending
+        relative_save_path, save_path, tile_skipped = grab_result[:3]
+        if future is not None:
+            (tile_img, tile_accepted, tile_selected, tile_error,
+                mirror_error) = future.result()
+            self.pause_on_error(mirror_error)
+        else:
+            tile_img, tile_accepted, tile_selected, tile_error = (
+                None, False, False, grab_error)
+        tile_accepted, rejected_by_user = self.check_tile_error_override(
+            tile_error, tile_accepted)
+        first_result = (tile_img, relative_save_path, save_path,
+                        tile_accepted, tile_skipped, tile_selected,
+                        rejected_by_user)
+        (tile_img, relative_save_path, save_path,
+            tile_accepted, tile_skipped, tile_selected,
+            adjust_acq_settings) = (
+            self.acquire_tile_with_retries(
+                grid_index, tile_index, adjust_wd_stig,
+                adjust_acq_settings, overwrite, first_result))
+        self.complete_tile(grid_index, tile_index, tile_img,
+                           relative_save_path, save_path,
+                           tile_accepted, tile_skipped, tile_selected)
+        return adjust_acq_settings
+
+    def acquire_tile_with_retries(self, grid_index, tile_index,
+                                  adjust_wd_stig, adjust_acq_settings,
+                                  overwrite, first_result=None):
+        """Acquire the specified tile and try again once if the frame could
+        not be grabbed or loaded, or if it was frozen or incomplete. Pause
+        after the second failed attempt or after any other error.
+        first_result, if specified, is used as the result of the first
+        attempt (pipelined mode). Return the result of the last attempt and
+        the updated adjust_acq_settings flag.
+        """
+        fail_counter = 0
+        tile_accepted = False
+        tile_skipped = False
+
+        # Acquire the current tile
+        while (
+            not tile_accepted
+            and not tile_skipped
+            and fail_counter < 2
+        ):
+            if first_result is not None:
+                (tile_img, relative_save_path, save_path,
+                    tile_accepted, tile_skipped, tile_selected,
+                    rejected_by_user) = first_result
+                first_result = None
+            else:
+                (tile_img, relative_save_path, save_path,
+                    tile_accepted, tile_skipped, tile_selected,
+                    rejected_by_user) = (
+                    self.acquire_tile(grid_index, tile_index,
+                                      adjust_wd_stig, adjust_acq_settings,
+                                      overwrite=overwrite))
+            if not tile_skipped:
+                adjust_acq_settings = False
+
+            if (
+                self.error_state in [
+                    Error.grab_image,
+                    Error.grab_incomplete,
+                    Error.frame_frozen,
+                    Error.image_load,
+                    ]
+                and not rejected_by_user
+            ):
+
+                self.save_rejected_tile(save_path, fail_counter)
+                # Try again
+                fail_counter += 1
+                if fail_counter == 2:
+                    # Pause after second failed attempt
+                    self.pause_acquisition(1)
+                else:
+                    # Remove the file to avoid overwrite error
+                    try:
+                        remove_image(save_path)
+                    except Exception as e:
+                        self.log(
+                            'CTRL',
+                            'Tile image file could not be '
+                            f'removed: {e}',
+                            'error')
+                    # TODO: Try to solve frozen frame problem:
+                    # if self.error_state == Error.frame_frozen:
+                    #    self.handle_frozen_frame(grid_index)
+                    self.log(
+                        'SEM',
+                        'Trying again to image tile.',
+                        'warning')
+                    # Reset error state
+                    self.error_state = Error.none
+            elif self.error_state != Error.none:
+                self.pause_acquisition(1)
+                break
+        # End of tile aquisition while loop
+
+        return (tile_img, relative_save_path, save_path,
+                tile_accepted, tile_skipped, tile_selected,
+                adjust_acq_settings)
+
+    def complete_tile(self, grid_index, tile_index, tile_img,
+                      relative_save_path, save_path,
+                      tile_accepted, tile_skipped, tile_selected):
+        """Register an accepted and selected tile and save its stats and
+        reslice, or delete the image file if the tile was discarded by the
+        image inspector.
+        """
+        grid = self.gm[grid_index]
+        tile_id = str(grid_index) + '.' + str(tile_index)
+        if (
+            tile_accepted
+            and tile_selected
+            and not tile_skipped
+        ):
+            # Write tile's name and position into imagelist
+            with self.tracer.span('register'):
+                self.register_accepted_tile(relative_save_path,
+                                            grid_index, tile_index)
+            # Save stats and reslice
+            with self.tracer.span('save'):
+                success, error_msg = self.img_inspector.save_tile_stats(
+                    self.base_dir, grid_index, tile_index,
+                    self.slice_counter)
+            if not success:
+                self.log(
+                    'CTRL',
+                    'Warning: Could not save tile mean and SD '
+                    f'to disk: {error_msg}',
+                    'error')
+            with self.tracer.span('save'):
+                success, error_msg = self.img_inspector.save_tile_reslice(
+                    self.base_dir, grid_index, grid.array_index,
+                    grid.roi_index, tile_index)
+            if not success:
+                self.log(
+                    'CTRL',
+                    'Warning: Could not save tile reslice to '
+                    f'disk: {error_msg}',
+                    'error')
+
+            # If heuristic autofocus is enabled and tile is selected as
+            # a reference tile, prepare tile for processing:
+            if (
+                self.use_autofocus
+                and self.autofocus.method==1
+                and grid[tile_index].autofocus_active
+            ):
+
+                tile_key = str(grid_index) + '.' + str(tile_index)
+                self.autofocus.prepare_tile_for_heuristic_af(
+                    tile_img, tile_key, save_path)
+                self.heuristic_af_queue.append(tile_key)
+
+        elif (
+            not tile_selected
+            and not tile_skipped
+            and tile_accepted
+        ):
+            self.log(
+                'CTRL',
+                f'Tile {tile_id} was discarded by image '
+                f'inspector.')
+            # Delete file
+            try:
+                remove_image(save_path)
+            except Exception as e:
+                self.log(
+                    'CTRL',
+                    f'Tile image file could not be deleted: {e}',
+                    'error')
+
     def acquire_tile(self, grid_index, tile_index,
                      adjust_wd_stig=False, adjust_acq_settings=False,
                      overwrite=False):
@@ -2245,14 +2826,40 @@ class Acquisition:
         is True, the pixel size, dwell time and frame size will be adjusted
         according to the settings of the grid at grid_index.
         """
-        grid = self.gm[grid_index]
-        tile_label = f'{grid.get_label(grid_index)}.{tile_index}'
         tile_img = None  # NumPy array of acquired image (from img_inspector)
         tile_accepted = False  # if True: tile passed img_inspector checks
         tile_selected = False  # if True: tile selected to be saved to disk
+
+        (relative_save_path, save_path, tile_skipped, frame_acquired, _,
+            frame) = self.grab_tile(grid_index, tile_index, adjust_wd_stig,
+                                    adjust_acq_settings, overwrite)
+        tile_error = self.error_state
+        if frame_acquired:
+            (tile_img, tile_accepted, tile_selected, tile_error,
+                mirror_error) = self.inspect_tile(
+                    grid_index, tile_index, save_path, tile_error, frame)
+            self.pause_on_error(mirror_error)
+        tile_accepted, rejected_by_user = self.check_tile_error_override(
+            tile_error, tile_accepted)
+
+        return (tile_img, relative_save_path, save_path,
+                tile_accepted, tile_skipped, tile_selected, rejected_by_user)
+
+    def grab_tile(self, grid_index, tile_index,
+                  adjust_wd_stig=False, adjust_acq_settings=False,
+                  overwrite=False):
+        """Move to the specified tile and acquire the frame (first stage of
+        acquire_tile()). Errors are stored in self.error_state. Return the
+        save paths, whether the tile was skipped, whether a frame was
+        acquired, the updated adjust_acq_settings flag and the frame as a
+        NumPy array (None if not provided by the SEM).
+        """
+        grid = self.gm[grid_index]
+        tile_label = f'{grid.get_label(grid_index)}.{tile_index}'
         tile_skipped = False   # if True: tile skipped because it was already
                                # acquired or marked as acquired
-        rejected_by_user = False   # if True: rejected by user (Ask user mode)
+        frame_acquired = False  # if True: sem.acquire_frame() was called
+        frame = None   # Acquired image if kept in memory by sem.acquire_frame()
 
         slice_index = self.slice_counter if not self.gm.array_mode else None
         relative_save_path = utils.tile_relative_save_path(
@@ -2277,7 +2884,7 @@ class Acquisition:
                 f'Tile {tile_label} already acquired. Skipping.')
 
         if not tile_skipped:
-            if not os.path.isfile(save_path) or retake_img:
+            if not os.path.exists(save_path) or retake_img:
                 # If current tile has different focus settings from previous
                 # tile, adjust working distance and stigmation for this tile
                 if adjust_wd_stig:
@@ -2310,7 +2917,8 @@ class Acquisition:
                 self.log(
                     'STAGE',
                     f'Moving to position of Tile {tile_label}')
-                self.stage.move_to_xy((stage_x, stage_y))
+                with self.tracer.span('stage_move'):
+                    self.stage.move_to_xy((stage_x, stage_y))
                 # The move function waits for the motor move duration and the
                 # specified stage move wait interval.
                 # Check if there were microtome problems:
@@ -2330,7 +2938,8 @@ class Acquisition:
                     self.log(
                         'STAGE',
                         f'Moving to position of Tile {tile_label}')
-                    self.stage.move_to_xy((stage_x, stage_y))
+                    with self.tracer.span('stage_move'):
+                        self.stage.move_to_xy((stage_x, stage_y))
                     # Check again if there is an error
                     self.error_state = self.stage.error_state
                     self.stage.reset_error_state()
@@ -2384,8 +2993,9 @@ class Acquisition:
                 and not self.gm.array_mode
             ):
                 do_move = False  # already at tile stage position
-                self.do_autofocus(*self.autofocus_stig_current_slice,
-                                  do_move, grid_index, tile_index)
+                with self.tracer.span('autofocus'):
+                    self.do_autofocus(*self.autofocus_stig_current_slice,
+                                      do_move, grid_index, tile_index)
                 # The autofocus routine changes the acquisition settings.
                 # They must be restored to the settings for the current grid.
                 adjust_acq_settings = True
@@ -2399,16 +3009,18 @@ class Acquisition:
 
             if adjust_acq_settings:
                 # Switch to specified acquisition settings of the current grid
-                self.sem.apply_frame_settings(
-                    grid.frame_size_selector,
-                    grid.pixel_size,
-                    grid.dwell_time)
-
-                # Set image bit depth for current grid
-                self.sem.set_bit_depth(grid.bit_depth_selector)
-
-                # Delay necessary for Gemini? (change of mag)
-                sleep(0.2)
+                with self.tracer.span('frame_settings'):
+                    self.sem.apply_frame_settings(
+                        grid.frame_size_selector,
+                        grid.pixel_size,
+                        grid.dwell_time)
+
+                    # Set image bit depth for current grid
+                    self.sem.set_bit_depth(grid.bit_depth_selector)
+                    self.sem.set_compression(self.tile_compression)
+
+                    # Delay necessary for Gemini? (change of mag)
+                    sleep(0.2)
                 # Lock magnification: If user accidentally changes the mag
                 # during the grid acquisition, SBEMimage will detect and
                 # undo the change.
@@ -2437,13 +3049,18 @@ class Acquisition:
             # Indicate current tile in Viewport
             self.main_controls_trigger.transmit(
                 'ACQ IND TILE', grid_index, tile_index)
-            start_time = time()
             # Acquire the frame
-            self.sem.acquire_frame(save_path, self.stage)
+            with self.tracer.span('grab') as span:
+                _, frame = self.sem.acquire_frame(save_path, self.stage,
+                                                  return_image=True)
+            frame_acquired = True
+            if (self.calibrate_codecs and frame is not None
+                    and self.compression_calibration_thread is None):
+                self.start_compression_calibration(
+                    frame, grid.tile_cycle_time())
             # Time how long it takes to acquire the frame. Display a warning in
             # the log if the overhead is larger than 1.5 seconds.
-            end_time = time()
-            grab_duration = end_time - start_time
+            grab_duration = span.duration
             self.tile_grab_durations.append(grab_duration)
             grab_overhead = grab_duration - self.sem.current_cycle_time
             if grab_overhead > 1.5:
@@ -2456,148 +3073,221 @@ class Acquisition:
             self.main_controls_trigger.transmit(
                 'ACQ IND TILE', grid_index, tile_index)
 
-            # Copy image file to the mirror drive
-            if self.use_mirror_drive:
-                start_time = time()
-                self.mirror_files([save_path])
-                # Time how long it takes to copy the file. Add a warning if
-                # it took longer than 1.5 seconds.
-                end_time = time()
-                mirror_duration = end_time - start_time
-                self.tile_mirror_durations.append(mirror_duration)
-                if mirror_duration > 1.5:
-                    self.log(
-                        'CTRL',
-                        'Warning: Copying tile to mirror drive took too '
-                        f'long ({mirror_duration:.1f} s).',
-                        'warning')
-
-            # Check if image was saved and process it
-            if os.path.isfile(save_path):
+        if not tile_skipped:
+            adjust_acq_settings = False
+
+        return (relative_save_path, save_path, tile_skipped, frame_acquired,
+                adjust_acq_settings, frame)
+
+    def checked_codec(self, setting):
+        """Return the codec of the configuration entry setting in [acq], or
+        DEFAULT_COMPRESSION with a warning if it is unknown or unavailable."""
+        codec, warning = codec_calibration.checked_codec(
+            self.cfg['acq'].get(setting, 'none'), setting)
+        if warning is not None:
+            utils.log_warning('CTRL', warning)
+        return codec
+
+    def start_compression_calibration(self, frame, tile_cycle_time):
+        """Start calibrate_compression() on a copy of frame in a background
+        thread, so that the measurement does not delay the acquisition."""
+        self.compression_calibration_thread = threading.Thread(
+            target=self.calibrate_compression,
+            args=(frame.copy(), tile_cycle_time),
+            daemon=True)
+        self.compression_calibration_thread.start()
+
+    def calibrate_compression(self, frame, tile_cycle_time):
+        """Measure the encode throughput and compression ratio of the
+        available codecs on frame (the first tile of the session), log the
+        results and the codec recommended for tile_cycle_time, and warn if
+        the configured tile codec is too slow. Runs in a background thread,
+        so the results are not written to the main log."""
+        results = codec_calibration.calibrate(frame)
+        for codec, result in results.items():
+            utils.log_info(
+                'CTRL',
+                f'Codec {codec}: {result["mb_per_s"]:.0f} MB/s, '
+                f'ratio {result["ratio"]:.2f}, '
+                f'{result["encode_time"] * 1000:.0f} ms per tile')
+        recommended = codec_calibration.recommend(results, tile_cycle_time)
+        max_encode_time = constants.CODEC_TIME_FRACTION * tile_cycle_time
+        utils.log_info(
+            'CTRL',
+            f'Recommended tile compression: {recommended} (encode '
+            f'time < {max_encode_time:.2f} s)')
+        result = results.get(self.tile_compression)
+        if result is not None and result['encode_time'] > max_encode_time:
+            utils.log_warning(
+                'CTRL',
+                f'Tile compression {self.tile_compression} takes '
+                f'{result["encode_time"]:.2f} s per tile.')
+        self.compression_calibration = results
+
+    def inspect_tile(self, grid_index, tile_index, save_path, error_state,
+                     frame=None):
+        """Mirror and inspect the frame acquired for the specified tile
+        (second stage of acquire_tile()). This method does not move the
+        stage or talk to the SEM, so it can run in a worker thread while the
+        next tile is being acquired. It does not change the acquisition
+        state. error_state is the error state after grab_tile(), frame the
+        image returned by grab_tile() (loaded from save_path if None).
+        Return the image, whether it was accepted and selected, the updated
+        error state and the error state of the mirror drive copy (the tile
+        is accepted regardless, but the acquisition is paused).
+        """
+        grid = self.gm[grid_index]
+        tile_label = f'{grid.get_label(grid_index)}.{tile_index}'
+        tile_img = None  # NumPy array of acquired image (from img_inspector)
+        tile_accepted = False  # if True: tile passed img_inspector checks
+        tile_selected = False  # if True: tile selected to be saved to disk
+        mirror_error = Error.none
 
-                # Identify appropriate image mask for quality monitor
-                mask = None
-                masking = False
-                for mask_key, mask_size in self.gm.tile_sizes.items():
-                    if mask_size == self.gm[grid_index].frame_size:
-                        mask = self.img_masks[mask_key]
-                        masking = True
-                        break
+        # Copy image file to the mirror drive
+        if self.use_mirror_drive:
+            with self.tracer.span('mirror'):
+                mirror_error = self.copy_to_mirror_drive([save_path])
+
+        # Check if image was saved and process it
+        if os.path.exists(save_path):
+
+            # Identify appropriate image mask for quality monitor
+            mask = None
+            masking = False
+            for mask_key, mask_size in self.gm.tile_sizes.items():
+                if mask_size == self.gm[grid_index].frame_size:
+                    mask = self.img_masks[mask_key]
+                    masking = True
+                    break
 
-                start_time = time()
+            # Time the duration of process_tile()
+            with self.tracer.span('inspect') as span:
                 (tile_img, mean, stddev, sharpness,
                  range_test_passed, slice_by_slice_test_passed, tile_selected,
-                 load_error, load_exception, grab_incomplete, frozen_frame_error) = (
+                 load_error, load_exception, grab_incomplete,
+                 frozen_frame_error) = (
                     self.img_inspector.process_tile(save_path,
                                                     grid_index,
                                                     tile_index,
-                                                    self.slice_counter, 
+                                                    self.slice_counter,
                                                     mask,
-                                                    masking)
+                                                    masking,
+                                                    frame)
                 )
-                # Time the duration of process_tile()
-                end_time = time()
-                inspect_duration = end_time - start_time
-                self.tile_inspect_durations.append(inspect_duration)
-                if inspect_duration > 1.5:
-                    self.log(
-                        'CTRL',
-                        'Warning: Inspecting tile took too '
-                        f'long ({inspect_duration:.1f} s).',
-                        'warning')
+            inspect_duration = span.duration
+            self.tile_inspect_durations.append(inspect_duration)
+            if inspect_duration > 1.5:
+                self.log(
+                    'CTRL',
+                    'Warning: Inspecting tile took too '
+                    f'long ({inspect_duration:.1f} s).',
+                    'warning')
 
-                if not load_error:
-                    # Assume tile_accepted, check against various errors below
-                    tile_accepted = True
-                    self.log('CTRL',
-                             f'Tile {tile_label}: '
-                             f'M:{mean:.2f}, '
-                             f'SD:{stddev:.2f}')
-                    # New preview available, show it (if tile previews active)
-                    self.main_controls_trigger.transmit('DRAW VP')
+            if not load_error:
+                # Assume tile_accepted, check against various errors below
+                tile_accepted = True
+                self.log('CTRL',
+                         f'Tile {tile_label}: '
+                         f'M:{mean:.2f}, '
+                         f'SD:{stddev:.2f}')
+                # New preview available, show it (if tile previews active)
+                self.main_controls_trigger.transmit('DRAW VP')
 
-                    if self.error_state in [
-                        Error.autofocus_smartsem,
-                        Error.autofocus_heuristic,
-                        Error.wd_stig_difference,
-                        Error.autofocus_afss,
-                    ]:
-                        # Don't accept tile if autofocus error has ocurred
+                if error_state in [
+                    Error.autofocus_smartsem,
+                    Error.autofocus_heuristic,
+                    Error.wd_stig_difference,
+                    Error.autofocus_afss,
+                ]:
+                    # Don't accept tile if autofocus error has ocurred
+                    tile_accepted = False
+                else:
+                    # Check for frozen or incomplete frames
+                    if frozen_frame_error:
                         tile_accepted = False
-                    else:
-                        # Check for frozen or incomplete frames
-                        if frozen_frame_error:
+                        error_state = Error.frame_frozen
+                        self.log(
+                            'SEM',
+                            f'Tile {tile_label}'
+                            ': SmartSEM frozen frame error!',
+                            'error')
+                    elif grab_incomplete:
+                        tile_accepted = False
+                        error_state = Error.grab_incomplete
+                        self.log(
+                            'SEM',
+                            f'Tile {tile_label}'
+                            ': SmartSEM grab incomplete error!',
+                            'error')
+                    elif self.monitor_images:
+                        # Two additional checks if 'image monitoring'
+                        # option is active
+                        if not range_test_passed:
                             tile_accepted = False
-                            self.error_state = Error.frame_frozen
+                            error_state = Error.tile_image_range
                             self.log(
-                                'SEM',
-                                f'Tile {tile_label}'
-                                ': SmartSEM frozen frame error!',
+                                'CTRL',
+                                'Tile outside of permitted mean/SD '
+                                'range!',
                                 'error')
-                        elif grab_incomplete:
+                        elif (
+                            slice_by_slice_test_passed is not None
+                            and not slice_by_slice_test_passed
+                        ):
                             tile_accepted = False
-                            self.error_state = Error.grab_incomplete
+                            error_state = Error.tile_image_compare
                             self.log(
-                                'SEM',
-                                f'Tile {tile_label}'
-                                ': SmartSEM grab incomplete error!',
+                                'CTRL',
+                                'Tile above mean/SD slice-by-slice '
+                                'thresholds.',
                                 'error')
-                        elif self.monitor_images:
-                            # Two additional checks if 'image monitoring'
-                            # option is active
-                            if not range_test_passed:
-                                tile_accepted = False
-                                self.error_state = Error.tile_image_range
-                                self.log(
-                                    'CTRL',
-                                    'Tile outside of permitted mean/SD '
-                                    'range!',
-                                    'error')
-                            elif (
-                                slice_by_slice_test_passed is not None
-                                and not slice_by_slice_test_passed
-                            ):
-                                tile_accepted = False
-                                self.error_state = Error.tile_image_compare
-                                self.log(
-                                    'CTRL',
-                                    'Tile above mean/SD slice-by-slice '
-                                    'thresholds.',
-                                    'error')
 
-                    # AFSS: Add sharpness value of the current tile-image to the correction series
-                    tile_id = f'{grid_index}.{tile_index}'
-                    af = self.autofocus
-
-                    if tile_accepted and tile_index in af.afss_data['ref_tiles'] and af.afss_active:
-                        if tile_id not in af.afss_wd_stig_corr:
-                            af.afss_wd_stig_corr[tile_id] = {}
-
-                        entry = {
-                            self.slice_counter: [
-                                [self.gm[grid_index][tile_index].wd, 0],
-                                self.gm[grid_index][tile_index].stig_xy,
-                                sharpness,
-                                save_path,
-                                stddev
-                            ]
-                        }
-                        af.afss_wd_stig_corr[tile_id].update(entry)
-                else:
-                    # Tile image file could not be loaded
-                    self.log(
-                        'CTRL',
-                        'Error: Failed to load tile '
-                        'image file.',
-                        'error')
-                    self.error_state = Error.image_load
+                # AFSS: Add sharpness value of the current tile-image to the correction series
+                tile_id = f'{grid_index}.{tile_index}'
+                af = self.autofocus
+
+                if tile_accepted and tile_index in af.afss_data['ref_tiles'] and af.afss_active:
+                    if tile_id not in af.afss_wd_stig_corr:
+                        af.afss_wd_stig_corr[tile_id] = {}
+
+                    entry = {
+                        self.slice_counter: [
+                            [self.gm[grid_index][tile_index].wd, 0],
+                            self.gm[grid_index][tile_index].stig_xy,
+                            sharpness,
+                            save_path,
+                            stddev
+                        ]
+                    }
+                    af.afss_wd_stig_corr[tile_id].update(entry)
+                    af.afss_cache_tile(tile_id, save_path, tile_img)
             else:
-                # File was not saved
+                # Tile image file could not be loaded
                 self.log(
-                    'SEM',
-                    'Tile image acquisition failure.',
+                    'CTRL',
+                    'Error: Failed to load tile '
+                    'image file.',
                     'error')
-                self.error_state = Error.grab_image
+                error_state = Error.image_load
+        else:
+            # File was not saved
+            self.log(
+                'SEM',
+                'Tile image acquisition failure.',
+                'error')
+            error_state = Error.grab_image
+
+        return (tile_img, tile_accepted, tile_selected, error_state,
+                mirror_error)
+
+    def check_tile_error_override(self, tile_error, tile_accepted):
+        """Apply the error state from inspect_tile() and ask the user whether
+        to accept the tile anyway if 'Ask User' mode is active (last stage
+        of acquire_tile()). Return tile_accepted and rejected_by_user.
+        """
+        rejected_by_user = False   # if True: rejected by user (Ask user mode)
+        if tile_error != Error.none:
+            self.error_state = tile_error
 
         # Check for "Ask User" override
         if (
@@ -2620,8 +3310,7 @@ class Acquisition:
                 rejected_by_user = True
             self.user_reply = None
 
-        return (tile_img, relative_save_path, save_path,
-                tile_accepted, tile_skipped, tile_selected, rejected_by_user)
+        return tile_accepted, rejected_by_user
 
     def register_accepted_tile(self, relative_save_path,
                                grid_index, tile_index):
@@ -2642,9 +3331,9 @@ class Acquisition:
                         f'{global_z};'
                         f'{self.slice_counter}\n')
         self.imagelist_file.write(tileinfo_str)
-        # Write the same information to the imagelist on the mirror drive
+        # Update the imagelist on the mirror drive
         if self.use_mirror_drive:
-            self.mirror_imagelist_file.write(tileinfo_str)
+            self.mirror_imagelist(self.imagelist_filename)
         self.tiles_acquired.append(tile_index)
         tile_width, tile_height = grid.frame_size
         tile_metadata = {
@@ -2686,9 +3375,9 @@ class Acquisition:
                             f'{global_z};'
                             f'{self.slice_counter}\n')
         self.imagelist_ov_file.write(overviewinfo_str)
-        # Write the same information to the ov_imagelist on the mirror drive
+        # Update the ov_imagelist on the mirror drive
         if self.use_mirror_drive:
-            self.mirror_imagelist_ov_file.write(overviewinfo_str)
+            self.mirror_imagelist(self.imagelist_ov_filename)
         ov_width, ov_height = self.ovm[ov_index].frame_size
         ov_metadata = {
             'ov_id': ov_id,
@@ -2722,7 +3411,7 @@ class Acquisition:
         rejected_tile_save_path = os.path.join(self.base_dir, 'tiles', 'rejected', filename)
         # Copy tile to folder 'rejected'
         try:
-            shutil.copy(tile_save_path, rejected_tile_save_path)
+            copy_image(tile_save_path, rejected_tile_save_path)
         except Exception as e:
             self.log(
                 'CTRL',
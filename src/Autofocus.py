@@ -16,11 +16,13 @@ et al. (2011), described in Appendix A of Binding et al. (2012).
 """
 
 import json
-from math import sqrt, exp, sin, cos
+from math import sin, cos
 import numpy as np
+import os
 import os.path
 import random
-from scipy.signal import fftconvolve
+import scipy.fft
+from concurrent.futures import ThreadPoolExecutor
 from statistics import mean
 from time import sleep
 from typing import Tuple, Optional
@@ -34,6 +36,7 @@ except ImportError:
 
 import autofocus_mapfost
 import utils
+from image_io import imread_metadata, imread_region
 import utils_afss
 from constants import *
 
@@ -70,13 +73,15 @@ class Autofocus:
         self.rot_angle, self.scale_factor = json.loads(
             self.cfg['autofocus']['heuristic_rot_scale'])
         self.ACORR_WIDTH = 64
-        self.fi_mask = np.empty((self.ACORR_WIDTH, self.ACORR_WIDTH))
-        self.fo_mask = np.empty((self.ACORR_WIDTH, self.ACORR_WIDTH))
-        self.apx_mask = np.empty((self.ACORR_WIDTH, self.ACORR_WIDTH))
-        self.amx_mask = np.empty((self.ACORR_WIDTH, self.ACORR_WIDTH))
-        self.apy_mask = np.empty((self.ACORR_WIDTH, self.ACORR_WIDTH))
-        self.amy_mask = np.empty((self.ACORR_WIDTH, self.ACORR_WIDTH))
+        # Number of images processed together in one batched FFT
+        self.HEURISTIC_BATCH_SIZE = 8
+        # Threads used by scipy.fft for the batched autocorrelation
+        self.heuristic_fft_workers = max(1, (os.cpu_count() or 2) // 2)
         self.make_heuristic_weight_function_masks()
+        # Tiles are processed in a background thread while the acquisition
+        # continues. heuristic_pending: {tile_key: (future, index in batch)}
+        self.heuristic_executor = None
+        self.heuristic_pending = {}
         # Estimators (dicts with tile keys)
         self.foc_est = {}
         self.astgx_est = {}
@@ -101,6 +106,8 @@ class Autofocus:
         self.mapfost_probe_conv = float(self.cfg['autofocus']['mapfost_probe_convergence_angle'])
         self.mapfost_stig_rot = float(self.cfg['autofocus']['mapfost_astig_rotation_deg'])
         self.mapfost_stig_scale = json.loads(self.cfg['autofocus']['mapfost_astig_scaling'])
+        # MAPFoSt runner with worker pool, kept for all MAPFoSt runs
+        self.mapfost_af = None
 
         # Automated Focus/Stigmator Series
         self.afss_wd_delta = float(self.cfg['autofocus'].get('afss_wd_delta', 1.5e-06))
@@ -137,6 +144,11 @@ class Autofocus:
         self.afss_stats = {'avg': 0, 'n_failed': 0, 'n_out_of_lim': 0, 'n_outliers': 0}
         self.afss_min_slope = 0.5  # Slope limit for sharpness linear fit
         self.save_reg_coll = False  # Enable/Disable saving images of registered series to stats folder
+        # Images of the series are kept in memory from grab time until the series is processed
+        self.afss_cache = utils_afss.SeriesCache(max_frames=self.afss_rounds)
+        # Ref. tiles are processed in parallel (created when first needed)
+        self.afss_executor = None
+        self.afss_workers = max(1, (os.cpu_count() or 2) // 2)
 
     def save_to_cfg(self):
         """Save current autofocus settings to ConfigParser object. Note that
@@ -274,11 +286,13 @@ class Autofocus:
                               'stig_rot_deg': self.mapfost_stig_rot,
                               'stig_scale': self.mapfost_stig_scale,
                               'crop_size': self.MAPFOST_PATCH_SIZE}
+            if self.mapfost_af is None:
+                self.mapfost_af = autofocus_mapfost.RunAutoFoc(self.sem)
             corrections = autofocus_mapfost.run(self.sem, working_distance_perturbations=[self.mapfost_wd_pert],
                                                 mapfost_params=mapfost_params, max_iters = self.mapfost_max_iters,
                                                 convergence_threshold = self.mapfost_conv_thresh,
                                                 aberr_mode_bools=aberr_mode_bools, large_aberrations=large_aberrations,
-                                                max_wd_stigx_stigy=max_wd_stigx_stigy)
+                                                max_wd_stigx_stigy=max_wd_stigx_stigy, af=self.mapfost_af)
             msg = 'Completed MAPFoSt AF. \n List of corrections : \n' + str(corrections)
         except Exception as e:
             msg = f'CTRL: Exception ({str(e)}) during MAPFoSt AF.'
@@ -299,51 +313,109 @@ class Autofocus:
                               'stig_rot_deg': 0,
                               'stig_scale': [1.,1.],
                               'crop_size': self.MAPFOST_PATCH_SIZE}
+            if self.mapfost_af is None:
+                self.mapfost_af = autofocus_mapfost.RunAutoFoc(self.sem)
             calib_param = autofocus_mapfost.calibrate(self.sem, mapfost_params=mapfost_params,
-                                                      calib_mode=calib_mode)
+                                                      calib_mode=calib_mode, af=self.mapfost_af)
             msg = calib_param
         except Exception as e:
             msg = f'CTRL: Exception ({str(e)}) during MAPFoSt AF.'
         return msg
 
+    def close_mapfost(self):
+        """Stop the MAPFoSt worker processes and release shared memory."""
+        if self.mapfost_af is not None:
+            self.mapfost_af.close()
+            self.mapfost_af = None
+
 
     # ================ Below: methods for heuristic autofocus ==================
 
-    def prepare_tile_for_heuristic_af(self, tile_img, tile_key):
+    def prepare_tile_for_heuristic_af(self, tile_img, tile_key, filename=None):
         """Crop tile_img provided as numpy array. Save in dictionary with
-        tile_key.
+        tile_key. If tile_img is None, only the central area is read from
+        the image file filename.
         """
-        height, width = tile_img.shape[0], tile_img.shape[1]
+        if tile_img is None:
+            width, height = imread_metadata(filename)['size']
+        else:
+            height, width = tile_img.shape[0], tile_img.shape[1]
         # Crop image to 512 x 512 central area
-        self.img[tile_key] = tile_img[int(height/2 - 256):int(height/2 + 256),
-                                      int(width/2 - 256):int(width/2 + 256)]
+        y0, y1 = int(height/2 - 256), int(height/2 + 256)
+        x0, x1 = int(width/2 - 256), int(width/2 + 256)
+        if tile_img is None:
+            self.img[tile_key] = imread_region(
+                filename, 0, y0, x0, y1 - y0, x1 - x0)
+        else:
+            self.img[tile_key] = tile_img[y0:y1, x0:x1]
+
+    def heuristic_estimators(self, images):
+        """Compute the single-image estimators for focus, astigmatism x and
+        astigmatism y as described in Appendix A of Binding et al. (2013)
+        for a list of images (all with the same shape). The autocorrelations
+        are computed in batches with scipy.fft. Return an array with one
+        row (focus, astig_x, astig_y) for each image.
+        """
+        height, width = np.shape(images[0])
+        # Only the central 64 x 64 px region of the autocorrelation (shifts
+        # -32..31) is needed. Zero padding by 32 px is sufficient to avoid
+        # wrap-around for these shifts in the circular autocorrelation.
+        half_width = self.ACORR_WIDTH // 2
+        fft_shape = (scipy.fft.next_fast_len(height + half_width, real=True),
+                     scipy.fft.next_fast_len(width + half_width, real=True))
+        rows = np.arange(-half_width, half_width) % fft_shape[0]
+        cols = np.arange(-half_width, half_width) % fft_shape[1]
+        estimators = []
+        for i in range(0, len(images), self.HEURISTIC_BATCH_SIZE):
+            batch = np.array(images[i:i + self.HEURISTIC_BATCH_SIZE],
+                             dtype=np.float64)
+            # Subtract (integer) mean of each image
+            batch -= np.trunc(batch.mean(axis=(1, 2)))[:, np.newaxis, np.newaxis]
+            norm = np.sum(batch ** 2, axis=(1, 2))
+            spectrum = scipy.fft.rfft2(batch, s=fft_shape,
+                                       workers=self.heuristic_fft_workers)
+            autocorr = scipy.fft.irfft2(
+                spectrum.real ** 2 + spectrum.imag ** 2, s=fft_shape,
+                workers=self.heuristic_fft_workers)
+            autocorr = (autocorr[:, rows[:, np.newaxis], cols]
+                        / norm[:, np.newaxis, np.newaxis])
+            # Coefficients fi, fo, apx, amx, apy, amy for all images
+            fi, fo, apx, amx, apy, amy = np.einsum(
+                'nij,kij->kn', autocorr, self.heuristic_masks)
+            estimators.append(np.stack(((fi - fo) / (fi + fo),
+                                        (apx - amx) / (apx + amx),
+                                        (apy - amy) / (apy + amy)), axis=1))
+        return np.concatenate(estimators)
+
+    def submit_heuristic_af_batch(self, tile_keys):
+        """Start computing the estimators for the tiles in tile_keys
+        (prepared with prepare_tile_for_heuristic_af()) in a background
+        thread. The results are used by process_image_for_heuristic_af().
+        """
+        if not tile_keys:
+            return
+        if self.heuristic_executor is None:
+            self.heuristic_executor = ThreadPoolExecutor(max_workers=1)
+        images = [self.img[tile_key] for tile_key in tile_keys]
+        future = self.heuristic_executor.submit(
+            self.heuristic_estimators, images)
+        for index, tile_key in enumerate(tile_keys):
+            self.heuristic_pending[tile_key] = (future, index)
 
     def process_image_for_heuristic_af(self, tile_key):
-        """Compute single-image estimators as described in Appendix A of
-        Binding et al. (2013).
+        """Add the single-image estimators for the tile specified by tile_key
+        to the estimators of the previous slice. Use the result from the
+        background thread if the tile was submitted with
+        submit_heuristic_af_batch(), otherwise compute the estimators now.
         """
-
-        # The image from the dictionary self.img is provided as a numpy array
-        # and already cropped to 512 x 512 pixels
-        img = self.img[tile_key]
-        mean = int(np.mean(img))
-        # Recast as int16 and subtract mean
-        img = img.astype(np.int16)
-        img -= mean
-        # Autocorrelation
-        norm = np.sum(img ** 2)
-        autocorr = fftconvolve(img, img[::-1, ::-1]) / norm
-        height, width = autocorr.shape[0], autocorr.shape[1]
-        # Crop to 64 x 64 px central region
-        autocorr = autocorr[int(height/2 - 32):int(height/2 + 32),
-                            int(width/2 - 32):int(width/2 + 32)]
-        # Calculate coefficients
-        fi = self.muliply_with_mask(autocorr, self.fi_mask)
-        fo = self.muliply_with_mask(autocorr, self.fo_mask)
-        apx = self.muliply_with_mask(autocorr, self.apx_mask)
-        amx = self.muliply_with_mask(autocorr, self.amx_mask)
-        apy = self.muliply_with_mask(autocorr, self.apy_mask)
-        amy = self.muliply_with_mask(autocorr, self.amy_mask)
+        if tile_key in self.heuristic_pending:
+            future, index = self.heuristic_pending.pop(tile_key)
+            foc, astgx, astgy = future.result()[index]
+        else:
+            # The image from the dictionary self.img is provided as a numpy
+            # array and already cropped to 512 x 512 pixels
+            foc, astgx, astgy = self.heuristic_estimators(
+                [self.img[tile_key]])[0]
         # Check if tile_key not in dictionary yet
         if not (tile_key in self.foc_est):
             self.foc_est[tile_key] = []
@@ -351,19 +423,16 @@ class Autofocus:
             self.astgx_est[tile_key] = []
         if not (tile_key in self.astgy_est):
             self.astgy_est[tile_key] = []
-        # Calculate single-image estimators for current tile key
+        # Store single-image estimators for current tile key
         if len(self.foc_est[tile_key]) > 1:
             self.foc_est[tile_key].pop(0)
-        self.foc_est[tile_key].append(
-            (fi - fo) / (fi + fo))
+        self.foc_est[tile_key].append(float(foc))
         if len(self.astgx_est[tile_key]) > 1:
             self.astgx_est[tile_key].pop(0)
-        self.astgx_est[tile_key].append(
-            (apx - amx) / (apx + amx))
+        self.astgx_est[tile_key].append(float(astgx))
         if len(self.astgy_est[tile_key]) > 1:
             self.astgy_est[tile_key].pop(0)
-        self.astgy_est[tile_key].append(
-            (apy - amy) / (apy + amy))
+        self.astgy_est[tile_key].append(float(astgy))
 
     def get_heuristic_corrections(self, tile_key):
         """Use the estimators to calculate corrections."""
@@ -422,8 +491,9 @@ class Autofocus:
             g, t = tile_key.split('.')
             g, t = int(g), int(t)
             self.gm[g][t].wd += self.wd_stig_corr[tile_key][0]
-            self.gm[g][t].stig_xy[0] += self.wd_stig_corr[tile_key][1]
-            self.gm[g][t].stig_xy[1] += self.wd_stig_corr[tile_key][2]
+            stig_x, stig_y = self.gm[g][t].stig_xy
+            self.gm[g][t].stig_xy = (stig_x + self.wd_stig_corr[tile_key][1],
+                                     stig_y + self.wd_stig_corr[tile_key][2])
 
     def make_heuristic_weight_function_masks(self):
         # Parameters as given in Appendix A of Binding et al. 2013
@@ -433,35 +503,32 @@ class Autofocus:
         δ = 0.5
         ε = 9
 
-        for i in range(self.ACORR_WIDTH):
-            for j in range(self.ACORR_WIDTH):
-                x, y = i - self.ACORR_WIDTH/2, j - self.ACORR_WIDTH/2
-                r = sqrt(x**2 + y**2)
-                if r == 0:
-                    r = 1  # Prevent division by zero
-                sinφ = x/r
-                cosφ = y/r
-                exp_astig = exp(-r**2/α) - exp(-r**2/β)
-
-                # Six masks for the calculation of coefficients:
-                # fi, fo, apx, amx, apy, amy
-                self.fi_mask[i, j] = exp(-r**2/γ) - exp(-r**2/δ)
-                self.fo_mask[i, j] = exp(-r**2/ε) - exp(-r**2/γ)
-                self.apx_mask[i, j] = sinφ**2 * exp_astig
-                self.amx_mask[i, j] = cosφ**2 * exp_astig
-                self.apy_mask[i, j] = 0.5 * (sinφ + cosφ)**2 * exp_astig
-                self.amy_mask[i, j] = 0.5 * (sinφ - cosφ)**2 * exp_astig
-
-    def muliply_with_mask(self, autocorr, mask):
-        numerator_sum = 0
-        norm = 0
-        for i in range(self.ACORR_WIDTH):
-            for j in range(self.ACORR_WIDTH):
-                numerator_sum += autocorr[i, j] * mask[i, j]
-                norm += mask[i, j]
-        return numerator_sum / norm
+        x, y = np.meshgrid(np.arange(self.ACORR_WIDTH) - self.ACORR_WIDTH/2,
+                           np.arange(self.ACORR_WIDTH) - self.ACORR_WIDTH/2,
+                           indexing='ij')
+        r = np.sqrt(x**2 + y**2)
+        r[r == 0] = 1  # Prevent division by zero
+        sinφ = x/r
+        cosφ = y/r
+        exp_astig = np.exp(-r**2/α) - np.exp(-r**2/β)
+
+        # Six masks for the calculation of coefficients:
+        # fi, fo, apx, amx, apy, amy
+        self.fi_mask = np.exp(-r**2/γ) - np.exp(-r**2/δ)
+        self.fo_mask = np.exp(-r**2/ε) - np.exp(-r**2/γ)
+        self.apx_mask = sinφ**2 * exp_astig
+        self.amx_mask = cosφ**2 * exp_astig
+        self.apy_mask = 0.5 * (sinφ + cosφ)**2 * exp_astig
+        self.amy_mask = 0.5 * (sinφ - cosφ)**2 * exp_astig
+        # Masks normalised by their sums, so that each coefficient is the
+        # weighted mean of the autocorrelation
+        masks = np.stack((self.fi_mask, self.fo_mask,
+                          self.apx_mask, self.amx_mask,
+                          self.apy_mask, self.amy_mask))
+        self.heuristic_masks = masks / masks.sum(axis=(1, 2), keepdims=True)
 
     def reset_heuristic_corrections(self):
+        self.heuristic_pending = {}
         self.foc_est = {}
         self.astgx_est = {}
         self.astgy_est = {}
@@ -471,23 +538,41 @@ class Autofocus:
     # ================ Methods for Automated Focus/Stigmator Series ==================
     # Implemented by Tomas Gancarcik, Friedrich Miescher Institute for Biomedical Research, 2025
 
+    def afss_cache_tile(self, tile_key: str, img_path: str, tile_img) -> None:
+        """Keeps the image of an AFSS ref. tile in memory for the series processing"""
+        if tile_img is None:
+            return
+        self.afss_cache.max_frames = self.afss_rounds
+        self.afss_cache.add(tile_key, img_path, tile_img)
+
+    def afss_map(self, func, items: list) -> list:
+        """Applies func to all items (one per ref. tile) in the AFSS thread pool"""
+        if len(items) < 2:
+            return [func(item) for item in items]
+        if self.afss_executor is None:
+            self.afss_executor = ThreadPoolExecutor(max_workers=self.afss_workers)
+        return list(self.afss_executor.map(func, items))
+
     def afss_compute_pair_shifts(self) -> None:
         """Computes shift vectors between the last two images of each tile in the AFSS """
         SHP_IND = 3
-        for key, tile_dict in self.afss_wd_stig_corr.items():
 
+        def _pair_shift(key):
+            slice_nrs = sorted(self.afss_wd_stig_corr[key].keys())[-2:]
+            fns = [self.afss_wd_stig_corr[key][slice_nr][SHP_IND] for slice_nr in slice_nrs]
+            if len(fns) < 2:
+                return max(slice_nrs), 0.0
+            return max(slice_nrs), self.afss_cache.pair_shift(key, fns[0], fns[1])
+
+        keys = []
+        for key, tile_dict in self.afss_wd_stig_corr.items():
             if not tile_dict:
                 utils.log(level='WARNING', message=f"Empty AFSS tile data for tile {key}")
                 continue
+            keys.append(key)
 
-            fns = []
-            slice_nrs = sorted(tile_dict.keys())[-2:]
-            for slice_nr in slice_nrs:
-                img_path = tile_dict[slice_nr][SHP_IND]
-                fns.append(img_path)
-
-            shift_vec = utils_afss.compute_shifts_cv2(fns)
-            self.afss_wd_stig_corr[key][max(slice_nrs)].append(shift_vec)
+        for key, (slice_nr, shift_vec) in zip(keys, self.afss_map(_pair_shift, keys)):
+            self.afss_wd_stig_corr[key][slice_nr].append(shift_vec)
         return
 
 
@@ -543,7 +628,7 @@ class Autofocus:
     def process_afss_collections(self):
         """Estimates sharpness of all images and all ref. tiles within an AFSS series """
 
-        for tile_key in self.afss_wd_stig_corr:
+        def _collection_sharpness(tile_key):
             fns = []
             shifts = []
 
@@ -553,9 +638,9 @@ class Autofocus:
                 if i != 0:  # Skip reading shift vector of first image as this was not registered to anything
                     shifts.append(self.afss_wd_stig_corr[tile_key][slice_nr][5][0])
 
-            # Load tile-image data, align them translationally and perform cropping
+            # Get tile-image data, align them translationally and perform cropping
             cumm_shifts = np.cumsum(shifts, axis=0)
-            ic = utils_afss.load_image_collection(fns)
+            ic = self.afss_cache.get_collection(tile_key, fns)
             ic = utils_afss.shift_collection(ic, cumm_shifts)
             ic = utils_afss.crop_image_collection(ic, cumm_shifts)
 
@@ -568,7 +653,10 @@ class Autofocus:
                 if self.save_reg_coll:
                     prefix = os.path.join(self.cfg['acq']['base_dir'], 'meta', 'stats')
                     utils_afss.store_reg_coll(ic, fns, prefix)
+            return coll_sharpness
 
+        tile_keys = list(self.afss_wd_stig_corr)
+        for tile_key, coll_sharpness in zip(tile_keys, self.afss_map(_collection_sharpness, tile_keys)):
             # Fill the results' dict with sharpness values from drift-corrected image collection
             for i, slice_nr in enumerate(self.afss_wd_stig_corr[tile_key]):
                 self.afss_wd_stig_corr[tile_key][slice_nr][2] = coll_sharpness[i]
@@ -985,6 +1073,7 @@ class Autofocus:
 
     def reset_afss_corrections(self):
         self.afss_wd_stig_corr = {}
+        self.afss_cache.clear()
         self.afss_wd_stig_corr_optima = {}
         self.afss_avg_corr = None
         self.afss_stats = {'avg': 0, 'n_failed': 0, 'n_out_of_lim': 0, 'n_outliers': 0}
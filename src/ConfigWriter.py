@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+
+# ==============================================================================
+#   This source file is part of SBEMimage (github.com/SBEMimage)
+#   (c) 2018-2020 Friedrich Miescher Institute for Biomedical Research, Basel,
+#   and the SBEMimage developers.
+#   This software is licensed under the terms of the MIT License.
+#   See LICENSE.txt in the project root folder.
+# ==============================================================================
+
+"""This module writes configuration files and tile previews to disk in a
+background thread.
+
+The text of a configuration is rendered section by section on the calling
+thread. Sections that have not changed since the previous call are taken
+from a cache, and the file is only written if its content has changed.
+Each file is first written to a temporary file, which then replaces the
+target file, so a crash never leaves a partially written file. If a file is
+submitted again before it has been written, only the latest version is
+written. Errors are not logged by the writer thread; they are collected
+and retrieved with take_errors() on the calling thread.
+"""
+
+import os
+import threading
+
+from collections import OrderedDict
+
+
+def temp_path(path):
+    """Return the path of the temporary file used to write path. The
+    extension is kept (image formats are selected by extension)."""
+    base, ext = os.path.splitext(path)
+    return base + '.tmp' + ext
+
+
+class ConfigWriter:
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        # Files waiting to be written: {path: text or QImage}
+        self.pending = OrderedDict()
+        # Path of the file currently being written
+        self.in_progress = None
+        # Text of the configuration files last submitted: {path: text}
+        self.submitted = {}
+        # Rendered sections: {path: {section: (items, text)}}
+        self.sections = {}
+        self.files_written = 0
+        self.last_error = None
+        # Errors not yet retrieved with take_errors()
+        self.errors = []
+        self.stop_requested = False
+        self.worker = threading.Thread(target=self.run, daemon=True)
+        self.worker.start()
+
+    @staticmethod
+    def render_section(section, items):
+        """Render a section in the format of ConfigParser.write()."""
+        lines = [f'[{section}]\n']
+        for key, value in items:
+            if value is None:
+                lines.append(f'{key}\n')
+            else:
+                value = str(value).replace('\n', '\n\t')
+                lines.append(f'{key} = {value}\n')
+        lines.append('\n')
+        return ''.join(lines)
+
+    def render(self, path, cfg):
+        """Return the text of cfg. Only changed sections are rendered."""
+        cached = self.sections.get(path, {})
+        sections = {}
+        for section in cfg.sections():
+            items = cfg.items(section, raw=True)
+            entry = cached.get(section)
+            if entry is None or entry[0] != items:
+                entry = items, self.render_section(section, items)
+            sections[section] = entry
+        self.sections[path] = sections
+        return ''.join(text for _, text in sections.values())
+
+    def write_config(self, path, cfg):
+        """Write ConfigParser object cfg to path in the background if it has
+        changed since the last call. Return True if the file will be
+        written."""
+        text = self.render(path, cfg)
+        with self.condition:
+            if self.submitted.get(path) == text:
+                return False
+            self.submitted[path] = text
+            self._add(path, text)
+        return True
+
+    def write_images(self, images):
+        """Save images (list of (path, QImage)) in the background."""
+        with self.condition:
+            for path, image in images:
+                self._add(path, image)
+
+    def _add(self, path, data):
+        """Add a file to be written. Condition must be held."""
+        self.pending.pop(path, None)
+        self.pending[path] = data
+        self.condition.notify_all()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.pending and not self.stop_requested:
+                    self.condition.wait()
+                if not self.pending:
+                    return
+                path, data = self.pending.popitem(last=False)
+                self.in_progress = path
+            error = None
+            try:
+                self.write(path, data)
+            except Exception as e:
+                error = str(e)
+            with self.condition:
+                self.in_progress = None
+                if error is None:
+                    self.files_written += 1
+                else:
+                    self.last_error = f'{path}: {error}'
+                    self.errors.append(f'Could not save {path}: {error}')
+                    # Write the configuration again at the next call
+                    self.submitted.pop(path, None)
+                self.condition.notify_all()
+
+    def take_errors(self):
+        """Return the error messages of the files that could not be written
+        since the previous call."""
+        with self.condition:
+            errors, self.errors = self.errors, []
+        return errors
+
+    def write(self, path, data):
+        """Write data to a temporary file, then replace path with it."""
+        tmp_path = temp_path(path)
+        if isinstance(data, str):
+            with open(tmp_path, 'w') as file:
+                file.write(data)
+                file.flush()
+                os.fsync(file.fileno())
+        elif not data.save(tmp_path):
+            raise OSError('Image could not be saved.')
+        os.replace(tmp_path, path)
+
+    def flush(self, timeout=None):
+        """Wait until all submitted files have been written. Return False
+        if timeout (in seconds) expired."""
+        with self.condition:
+            return self.condition.wait_for(
+                lambda: not self.pending and self.in_progress is None,
+                timeout=timeout)
+
+    def close(self, timeout=30):
+        """Write the remaining files, then stop the worker."""
+        success = self.flush(timeout)
+        with self.condition:
+            self.stop_requested = True
+            self.condition.notify_all()
+        self.worker.join(timeout=1)
+        return success
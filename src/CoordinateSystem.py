@@ -144,6 +144,13 @@ class CoordinateSystem:
         if self.rot_mat_determinant == 0:
             raise ValueError('Illegal values of the stage rotation angles. '
                              'Rotation matrix determinant is zero!')
+        # Full d -> s matrix (rotation and scaling) and its inverse for the
+        # batch conversions. Both are rebuilt whenever the calibration is
+        # (re)applied.
+        self._d_to_s_matrix = np.array([
+            [self.rot_mat_a * self.scale_x, self.rot_mat_b * self.scale_x],
+            [self.rot_mat_c * self.scale_y, self.rot_mat_d * self.scale_y]])
+        self._s_to_d_matrix = np.linalg.inv(self._d_to_s_matrix)
 
     def save_stage_calibration(self, eht, new_stage_calibration):
         """Save the new_stage_calibration for the specified eht in the system
@@ -181,13 +188,24 @@ class CoordinateSystem:
               / self.rot_mat_determinant)
         return np.array([dx, dy])
 
+    def convert_d_to_s_batch(self, d_coordinates) -> np.ndarray:
+        """Convert an array of SEM XY coordinates (N x 2) into stage
+        coordinates (N x 2) with a single matrix multiplication.
+        """
+        d_coordinates = np.asarray(d_coordinates, dtype=float).reshape(-1, 2)
+        return d_coordinates @ self._d_to_s_matrix.T
+
+    def convert_s_to_d_batch(self, s_coordinates) -> np.ndarray:
+        """Convert an array of stage XY coordinates (N x 2) into SEM
+        coordinates (N x 2) using the cached inverse matrix.
+        """
+        s_coordinates = np.asarray(s_coordinates, dtype=float).reshape(-1, 2)
+        return s_coordinates @ self._s_to_d_matrix.T
+
     def get_s_to_d_transform(self):
-        transform = [
-            [self.rot_mat_a * self.scale_x, self.rot_mat_b * self.scale_x, 0],
-            [self.rot_mat_c * self.scale_y, self.rot_mat_d * self.scale_y, 0],
-            [0, 0, 1]
-        ]
-        return np.linalg.inv(transform)
+        transform = np.identity(3)
+        transform[:2, :2] = self._s_to_d_matrix
+        return transform
 
     def get_sem_stage_flipped(self):
         yx_factor = self.rot_mat_d * self.scale_y / self.rot_mat_a * self.scale_x
@@ -203,6 +221,23 @@ class CoordinateSystem:
         """
         return (d_coordinates - self._vp_origin_dx_dy) * self._vp_scale
 
+    def convert_d_to_v_batch(self, d_coordinates) -> np.ndarray:
+        """Convert an array of SEM XY coordinates (N x 2) into Viewport
+        window coordinates (N x 2).
+        """
+        d_coordinates = np.asarray(d_coordinates, dtype=float).reshape(-1, 2)
+        return (d_coordinates - self._vp_origin_dx_dy) * self._vp_scale
+
+    def convert_s_to_v_batch(self, s_coordinates) -> np.ndarray:
+        """Convert an array of stage XY coordinates (N x 2) directly into
+        Viewport window coordinates (N x 2). The inverse stage calibration
+        and the Viewport scaling are applied in one matrix multiplication.
+        """
+        matrix = self._s_to_d_matrix.T * self._vp_scale
+        offset = self._vp_origin_dx_dy * self._vp_scale
+        s_coordinates = np.asarray(s_coordinates, dtype=float).reshape(-1, 2)
+        return s_coordinates @ matrix - offset
+
     def get_d_to_v_transform(self):
         scale = self._vp_scale
         transform = [
@@ -1,16 +1,18 @@
 from math import radians, cos, sin, sqrt
 import numpy as np
-from statistics import mean
 from typing import List
 
 import ArrayData
 import constants
 import utils
-from Tile import Tile
+from Tile import Tile, TileArrays
 
 
 class Grid(list):
-    """Store all grid parameters and a list of Tile objects."""
+    """Store all grid parameters and a list of Tile objects. The tile
+    parameters are stored in self.tile_data (TileArrays); the Tile objects
+    are views of single rows.
+    """
 
     def __init__(self, coordinate_system, sem,
                  active=True, origin_sx_sy=(0, 0), sw_sh=(0, 0), rotation=0,
@@ -123,7 +125,9 @@ class Grid(list):
     def initialize_tiles(self):
         """Create list of tile objects with default parameters."""
         self.clear()
-        self.extend([Tile() for _ in range(self.number_tiles)])
+        self.tile_data = TileArrays(self.number_tiles)
+        self.extend([Tile(arrays=self.tile_data, index=t)
+                     for t in range(self.number_tiles)])
 
     def update_tile_positions(self):
         """Calculate tile positions relative to the grid origin in pixel
@@ -136,30 +140,28 @@ class Grid(list):
         width_p, height_p = self.frame_size[0], self.frame_size[1]
         theta = radians(self.rotation)
 
-        for y_pos in range(rows):
-            for x_pos in range(cols):
-                tile_index = x_pos + y_pos * cols
-                x_coord = x_pos * (width_p - self.overlap)
-                y_coord = y_pos * (height_p - self.overlap)
-                # Introduce alternating shift in x direction
-                # to avoid quadruple beam exposure:
-                x_shift = self.row_shift * (y_pos % 2)
-                x_coord += x_shift
-                # Save position (non-rotated)
-                self[tile_index].px_py = np.array([x_coord, y_coord])
-                if theta != 0:
-                    # Rotate coordinates
-                    x_coord_rot = x_coord * cos(theta) - y_coord * sin(theta)
-                    y_coord_rot = x_coord * sin(theta) + y_coord * cos(theta)
-                    x_coord, y_coord = x_coord_rot, y_coord_rot
-                # Save SEM coordinates in microns (include rotation)
-                self[tile_index].dx_dy = np.array([
-                    x_coord * self.pixel_size / 1000,
-                    y_coord * self.pixel_size / 1000])
+        # Row and column of each tile (tile_index = x_pos + y_pos * cols)
+        y_pos, x_pos = np.divmod(np.arange(self.number_tiles), cols)
+        x_coord = x_pos * (width_p - self.overlap)
+        y_coord = y_pos * (height_p - self.overlap)
+        # Introduce alternating shift in x direction
+        # to avoid quadruple beam exposure:
+        x_coord = x_coord + self.row_shift * (y_pos % 2)
+        # Save positions (non-rotated)
+        self.tile_data.px_py = np.stack((x_coord, y_coord), axis=1)
+        if theta != 0:
+            # Rotate coordinates
+            x_coord_rot = x_coord * cos(theta) - y_coord * sin(theta)
+            y_coord_rot = x_coord * sin(theta) + y_coord * cos(theta)
+            x_coord, y_coord = x_coord_rot, y_coord_rot
+        # Save SEM coordinates in microns (include rotation)
+        self.tile_data.dx_dy = np.stack((x_coord * self.pixel_size / 1000,
+                                         y_coord * self.pixel_size / 1000),
+                                        axis=1)
 
         # Now calculate absolute stage positions.
-        for tile in self:
-            tile.sx_sy = self.cs.convert_d_to_s(tile.dx_dy) + self.origin_sx_sy
+        self.tile_data.sx_sy = (self.cs.convert_d_to_s_batch(self.tile_data.dx_dy)
+                                + self.origin_sx_sy)
 
     def calculate_wd_gradient(self):
         """Calculate the working distance gradient for this grid using
@@ -203,13 +205,11 @@ class Grid(list):
                 self.wd_gradient_params[0] = wd_at_origin
 
                 # Update wd for full grid:
-                for y_pos in range(self.size[0]):
-                    for x_pos in range(self.size[1]):
-                        tile_index = y_pos * row_length + x_pos
-                        self[tile_index].wd = (
-                            wd_at_origin
-                            + x_pos * slope_x
-                            + y_pos * slope_y)
+                y_pos, x_pos = np.divmod(np.arange(self.number_tiles),
+                                         row_length)
+                self.tile_data.wd[:] = (wd_at_origin
+                                        + x_pos * slope_x
+                                        + y_pos * slope_y)
         else:
             success = False
         return success
@@ -281,23 +281,18 @@ class Grid(list):
 
     def tile_positions_p(self) -> List[np.ndarray]:
         """Return list of relative pixel positions of all tiles in the grid."""
-        return [self[t].px_py for t in range(self.number_tiles)]
+        return list(self.tile_data.px_py.copy())
 
-    def gapped_tile_positions_p(self):
+    def gapped_tile_positions_p(self) -> np.ndarray:
         """Return unrotated tile positions in pixel coordinates with gaps
         between the tiles. The gaps are 5% of tile width/height.
         """
-        gapped_tile_positions = {}
         rows, cols = self.size
         width_p, height_p = self.frame_size
-        for y_pos in range(rows):
-            for x_pos in range(cols):
-                tile_index = x_pos + y_pos * cols
-                x_coord = 1.05 * x_pos * width_p
-                y_coord = 1.05 * y_pos * height_p
-                x_coord += self.row_shift * (y_pos % 2)
-                gapped_tile_positions[tile_index] = [x_coord, y_coord]
-        return gapped_tile_positions
+        y_pos, x_pos = np.divmod(np.arange(rows * cols), cols)
+        x_coord = 1.05 * x_pos * width_p + self.row_shift * (y_pos % 2)
+        y_coord = 1.05 * y_pos * height_p
+        return np.stack((x_coord, y_coord), axis=1)
 
     @property
     def size(self):
@@ -316,29 +311,29 @@ class Grid(list):
             new_number_tiles = new_rows * new_cols
             self._size = list(new_size)
             self.number_tiles = new_number_tiles
-            # Save old tile objects
+            # Save old tile objects and parameters
             old_tiles = self.copy()
+            old_tile_data = self.tile_data
             # Initialize new tile list
             self.initialize_tiles()
-            new_active_tiles = []
-            new_wd_gradient_ref_tiles = []
             # Preserve locations of active tiles and settings
-            for t in range(old_number_tiles):
-                # Calculate coordinate in grid of old size:
-                x_pos = t % old_cols
-                y_pos = t // old_cols
-                # Calculate tile number in new grid:
-                if (x_pos < new_cols) and (y_pos < new_rows):
-                    new_t = x_pos + y_pos * new_cols
-                    # Use tile from previous grid at the new position
-                    self[new_t] = old_tiles[t]
-                    if self[new_t].tile_active:
-                        new_active_tiles.append(new_t)
-                    if self[new_t].wd_grad_active:
-                        new_wd_gradient_ref_tiles.append(new_t)
-            self.active_tiles = new_active_tiles
-            self.wd_gradient_ref_tiles = (
-                new_wd_gradient_ref_tiles)
+            # Calculate coordinates in grid of old size:
+            y_pos, x_pos = np.divmod(np.arange(old_number_tiles), old_cols)
+            kept = (x_pos < new_cols) & (y_pos < new_rows)
+            old_t = np.flatnonzero(kept)
+            # Calculate tile numbers in new grid:
+            new_t = x_pos[kept] + y_pos[kept] * new_cols
+            self.tile_data.copy_from(old_tile_data, new_t, old_t)
+            # Use tile objects (previews) from previous grid at the new
+            # positions
+            for t, old in zip(new_t.tolist(), old_t.tolist()):
+                tile = old_tiles[old]
+                tile.arrays, tile.index = self.tile_data, t
+                self[t] = tile
+            self.active_tiles = np.flatnonzero(
+                self.tile_data.tile_active).tolist()
+            self.wd_gradient_ref_tiles = np.flatnonzero(
+                self.tile_data.wd_grad_active).tolist()
             if self.auto_update_tile_positions:
                 self.update_tile_positions()
 
@@ -495,9 +490,8 @@ class Grid(list):
                     ref_tiles[i] = -1
             self._wd_gradient_ref_tiles = ref_tiles
             # Set bool flags for ref tiles
-            for tile_index in range(self.number_tiles):
-                self[tile_index].wd_grad_active = (
-                    tile_index in ref_tiles)
+            self.tile_data.wd_grad_active[:] = np.isin(
+                np.arange(self.number_tiles), ref_tiles)
 
     def wd_gradient_ref_tile_selector_list(self):
         selector_list = []
@@ -516,42 +510,33 @@ class Grid(list):
 
     def set_wd_for_all_tiles(self, wd):
         """Set the same working distance for all tiles in the grid."""
-        for tile in self:
-            tile.wd = wd
+        self.tile_data.wd[:] = wd
 
     def set_delta_wd_for_all_tiles(self, dwd):
         """Shift working distance by dwd for all tiles in the grid."""
-        for tile in self.__tiles:
-            tile.wd += dwd
+        self.tile_data.wd += dwd
 
     def set_wd_stig_xy_for_uninitialized_tiles(self, wd, stig_xy):
         """Set all tiles that are uninitialized to specified working
         distance and stig_xy."""
-        for tile in self:
-            if tile.wd == 0:
-                tile.wd = wd
-                tile.stig_xy = stig_xy
+        uninitialized = self.tile_data.wd == 0
+        self.tile_data.wd[uninitialized] = wd
+        self.tile_data.stig_xy[uninitialized] = stig_xy
 
     def average_wd(self):
         """Return the average working distance of all tiles in the grid
         for which the working distance has been set."""
-        wd_list = []
-        for tile in self:
-            # Tiles with wd == 0 are ignored.
-            if tile.wd > 0:
-                wd_list.append(tile.wd)
-        if wd_list:
-            return mean(wd_list)
+        # Tiles with wd == 0 are ignored.
+        wd = self.tile_data.wd[self.tile_data.wd > 0]
+        if wd.size:
+            return float(np.mean(wd))
         else:
             return None
 
     def average_wd_of_autofocus_ref_tiles(self):
-        wd_list = []
-        for tile in self:
-            if tile.autofocus_active:
-                wd_list.append(tile.wd)
-        if wd_list:
-            return mean(wd_list)
+        wd = self.tile_data.wd[self.tile_data.autofocus_active]
+        if wd.size:
+            return float(np.mean(wd))
         else:
             return None
 
@@ -589,7 +574,7 @@ class Grid(list):
             ]
             for r in self.AFAS_results
         ])
-        xy_tiles = [tile.sx_sy for tile in self]
+        xy_tiles = self.tile_data.sx_sy
         wd_tiles, wd_outliers = ArrayData.focus_points_from_focused_points(
             wd_calibrated_points,
             xy_tiles,
@@ -609,50 +594,38 @@ class Grid(list):
         if len(stigy_outliers)>0:
             utils.log_warning(f"There are autostig_y outliers: {stigy_outliers}")
 
-        for tile, wd, stigx, stigy in zip(
-            self, wd_tiles, stigx_tiles, stigy_tiles
-        ):
-            tile.wd = wd[2]
-            tile.stig_xy = stigx[2], stigy[2]
+        self.tile_data.wd[:] = np.asarray(wd_tiles)[:, 2]
+        self.tile_data.stig_xy[:] = np.stack(
+            (np.asarray(stigx_tiles)[:, 2], np.asarray(stigy_tiles)[:, 2]),
+            axis=1)
 
     def set_stig_xy_for_all_tiles(self, stig_xy):
         """Set the same stigmation parameters for all tiles in the grid."""
-        for tile in self:
-            tile.stig_xy = stig_xy
+        self.tile_data.stig_xy[:] = stig_xy
 
     def average_stig_xy(self):
         """Return the average stigmation parameters of all tiles in the grid
         for which these parameters have been set."""
-        stig_x_list = []
-        stig_y_list = []
-        for tile in self:
-            if tile.wd > 0:
-                # A working distance of 0 means that focus parameters have
-                # not been set for this tile and it can be disregarded.
-                stig_x_list.append(tile.stig_xy[0])
-                stig_y_list.append(tile.stig_xy[1])
-        if stig_x_list:
-            return mean(stig_x_list), mean(stig_y_list)
+        # A working distance of 0 means that focus parameters have
+        # not been set for this tile and it can be disregarded.
+        stig_xy = self.tile_data.stig_xy[self.tile_data.wd > 0]
+        if len(stig_xy):
+            stig_x, stig_y = np.mean(stig_xy, axis=0)
+            return float(stig_x), float(stig_y)
         else:
             return None, None
 
     def average_stig_xy_of_autofocus_ref_tiles(self):
-        stig_x_list = []
-        stig_y_list = []
-        for tile in self:
-            if tile.autofocus_active:
-                stig_x, stig_y = tile.stig_xy
-                stig_x_list.append(stig_x)
-                stig_y_list.append(stig_y)
-        if stig_x_list and stig_y_list:
-            return [mean(stig_x_list), mean(stig_y_list)]
+        stig_xy = self.tile_data.stig_xy[self.tile_data.autofocus_active]
+        if len(stig_xy):
+            stig_x, stig_y = np.mean(stig_xy, axis=0)
+            return [float(stig_x), float(stig_y)]
         else:
             return [None, None]
 
     def reset_wd_stig_xy(self):
-        for tile in self:
-            tile.wd = 0
-            tile.stig_xy = 0
+        self.tile_data.wd[:] = 0
+        self.tile_data.stig_xy[:] = 0
 
     def distance_between_tiles(self, tile_index1, tile_index2) -> float:
         """Compute the distance between two tile centres in microns."""
@@ -667,14 +640,12 @@ class Grid(list):
     @active_tiles.setter
     def active_tiles(self, new_active_tiles):
         # Remove out-of-range active tiles
-        self._active_tiles = [tile_index for tile_index in new_active_tiles
-                              if tile_index < self.number_tiles]
+        new_active_tiles = np.asarray(new_active_tiles, dtype=int)
+        new_active_tiles = new_active_tiles[
+            (new_active_tiles >= 0) & (new_active_tiles < self.number_tiles)]
         # Set boolean flags to True for active tiles, otherwise to False
-        for tile_index in range(self.number_tiles):
-            if tile_index in new_active_tiles:
-                self[tile_index].tile_active = True
-            else:
-                self[tile_index].tile_active = False
+        self.tile_data.tile_active[:] = False
+        self.tile_data.tile_active[new_active_tiles] = True
         # Update tile acquisition order
         self.sort_tile_acq_order()
 
@@ -703,8 +674,7 @@ class Grid(list):
             return ' activated.'
 
     def deactivate_all_tiles(self):
-        for tile in self:
-            tile.tile_active = False
+        self.tile_data.tile_active[:] = False
         self._active_tiles = []
 
     def activate_all_tiles(self):
@@ -714,47 +684,40 @@ class Grid(list):
         """Use snake pattern to minimize number of long motor moves.
         This could be optimized further."""
         rows, cols = self.size
-        ordered_active_tiles = []
-        for row_pos in range(rows):
-            if row_pos % 2 == 0:
-                start_col, end_col, step = 0, cols, 1
-            else:
-                start_col, end_col, step = cols-1, -1, -1
-            for col_pos in range(start_col, end_col, step):
-                tile_index = row_pos * cols + col_pos
-                if self[tile_index].tile_active:
-                    ordered_active_tiles.append(tile_index)
-        self._active_tiles = ordered_active_tiles
+        # Tile indices in snake order: every other row reversed
+        snake_order = np.arange(rows * cols).reshape(rows, cols)
+        snake_order[1::2] = snake_order[1::2, ::-1]
+        snake_order = snake_order.ravel()
+        self._active_tiles = snake_order[
+            self.tile_data.tile_active[snake_order]].tolist()
 
     def tile_bounding_box(self, tile_index):
         """Return the bounding box of the specified tile in SEM coordinates."""
-        grid_origin_dx, grid_origin_dy = self.origin_dx_dy
-        tile_dx, tile_dy = self[tile_index].dx_dy
+        min_dx, max_dx, min_dy, max_dy = (
+            self.tile_bounding_boxes([tile_index])[0].tolist())
+        return min_dx, max_dx, min_dy, max_dy
+
+    def tile_bounding_boxes(self, tile_indices=None) -> np.ndarray:
+        """Return the bounding boxes of the specified tiles (default: all
+        tiles) in SEM coordinates as an array with one row
+        (min_dx, max_dx, min_dy, max_dy) per tile."""
+        if tile_indices is None:
+            tile_indices = slice(None)
+        centres = self.origin_dx_dy + self.tile_data.dx_dy[tile_indices]
         tile_width_d = self.tile_width_d()
         tile_height_d = self.tile_height_d()
-        # Calculate bounding box (unrotated):
-        top_left_dx = grid_origin_dx + tile_dx - tile_width_d/2
-        top_left_dy = grid_origin_dy + tile_dy - tile_height_d/2
-        points_x = [top_left_dx, top_left_dx + tile_width_d,
-                    top_left_dx, top_left_dx + tile_width_d]
-        points_y = [top_left_dy, top_left_dy,
-                    top_left_dy + tile_height_d, top_left_dy + tile_height_d]
+        # Corners relative to the tile centre (unrotated):
+        points_x = np.array([-1, 1, -1, 1]) * tile_width_d/2
+        points_y = np.array([-1, -1, 1, 1]) * tile_height_d/2
         theta = radians(self.rotation)
         if theta != 0:
-            pivot_dx = top_left_dx + tile_width_d/2
-            pivot_dy = top_left_dy + tile_height_d/2
-            for i in range(4):
-                points_x[i] -= pivot_dx
-                points_y[i] -= pivot_dy
-                x_rot = points_x[i] * cos(theta) - points_y[i] * sin(theta)
-                y_rot = points_x[i] * sin(theta) + points_y[i] * cos(theta)
-                points_x[i] = x_rot + pivot_dx
-                points_y[i] = y_rot + pivot_dy
+            points_x, points_y = (points_x * cos(theta) - points_y * sin(theta),
+                                  points_x * sin(theta) + points_y * cos(theta))
         # Find the maximum and minimum x and y coordinates:
-        max_dx, min_dx = max(points_x), min(points_x)
-        max_dy, min_dy = max(points_y), min(points_y)
-
-        return min_dx, max_dx, min_dy, max_dy
+        return np.stack((centres[:, 0] + points_x.min(),
+                         centres[:, 0] + points_x.max(),
+                         centres[:, 1] + points_y.min(),
+                         centres[:, 1] + points_y.max()), axis=1)
 
     def tile_cycle_time(self):
         """Calculate cycle time from SmartSEM data."""
@@ -764,11 +727,7 @@ class Grid(list):
 
     def autofocus_ref_tiles(self):
         """Return tile indices of autofocus ref tiles in this grid."""
-        autofocus_ref_tiles = []
-        for tile_index in range(self.number_tiles):
-            if self[tile_index].autofocus_active:
-                autofocus_ref_tiles.append(tile_index)
-        return autofocus_ref_tiles
+        return np.flatnonzero(self.tile_data.autofocus_active).tolist()
 
     def corner_tiles(self):
         """Return indices of corner tiles."""
@@ -782,9 +741,8 @@ class Grid(list):
 
     def bounding_box(self):
         """Return bounding box of (rotated) grid."""
-        bounding_boxes_of_corner_tiles = np.array([
-            self.tile_bounding_box(corner_tile_index)
-                for corner_tile_index in self.corner_tiles()])
+        bounding_boxes_of_corner_tiles = self.tile_bounding_boxes(
+            self.corner_tiles())
         min_x = np.min(bounding_boxes_of_corner_tiles.T[0])
         max_x = np.max(bounding_boxes_of_corner_tiles.T[1])
         min_y = np.min(bounding_boxes_of_corner_tiles.T[2])
@@ -798,7 +756,8 @@ class Grid(list):
 
     def activate_tiles_from_mask(self, mask):
         """Activate tiles based on a boolean mask."""
-        mask = mask.flatten()
+        mask = np.asarray(mask, dtype=bool).flatten()
         if len(mask) != self.number_tiles:
             raise ValueError('Mask length does not match number of tiles.')
-        self.active_tiles = np.where(mask)[0].tolist()
+        self.tile_data.tile_active[:] = mask
+        self.sort_tile_acq_order()
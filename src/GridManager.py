@@ -31,7 +31,7 @@ import scipy
 import ArrayData
 import utils
 from Grid import Grid
-from image_io import imread
+from PreviewManager import PreviewManager
 
 
 class GridManager(list):
@@ -142,9 +142,13 @@ class GridManager(list):
 
         # aberration gradient
         self.aberr_gradient_params = None
+        # Tile parameters and entries last saved by save_to_cfg() per grid
+        self._wd_stig_cache = {}
 
-        # Load tile previews for active tiles if available and if source tiles
-        # are present at the current slice number in the base directory
+        # Register tile previews for active tiles if available and if source
+        # tiles are present at the current slice number in the base directory.
+        # The previews are loaded when they are shown in the Viewport.
+        self.previews = PreviewManager()
         base_dir = self.cfg['acq']['base_dir']
         stack_name = base_dir[os.path.normpath(base_dir).rfind(os.sep) + 1:]
         slice_counter = int(self.cfg['acq']['slice_counter'])
@@ -164,9 +168,7 @@ class GridManager(list):
                 if (os.path.isfile(preview_path)
                     and (os.path.isfile(tile_path_current)
                          or os.path.isfile(tile_path_previous))):
-                    grid[tile_index].preview_img = utils.image_to_QPixmap(imread(preview_path))
-                else:
-                    grid[tile_index].preview_img = None
+                    self.previews.register(grid[tile_index], preview_path)
 
         # initialize Array settings
         array_path = grids_data.get('array_file')
@@ -204,13 +206,12 @@ class GridManager(list):
         params_stigy, res_stigy, _, _ = scipy.linalg.lstsq(a, arr_aberr[:, 2])  # stigy
         self.aberr_gradient_params = dict(wd=params_wd, stigx=params_stigx, stigy=params_stigy)
 
-        for g in range(self.number_grids):
-            for t in range(self[g].number_tiles):
-                corrected_wd = np.sum(self[g][t].sx_sy * params_wd[:2]) + params_wd[2]
-                corrected_stigx = np.sum(self[g][t].sx_sy * params_stigx[:2]) + params_stigx[2]
-                corrected_stigy = np.sum(self[g][t].sx_sy * params_stigy[:2]) + params_stigy[2]
-                self[g][t].stig_xy = (corrected_stigx, corrected_stigy)
-                self[g][t].wd = corrected_wd
+        for grid in self:
+            sx_sy = grid.tile_data.sx_sy
+            grid.tile_data.wd[:] = sx_sy @ params_wd[:2] + params_wd[2]
+            grid.tile_data.stig_xy[:] = np.stack(
+                (sx_sy @ params_stigx[:2] + params_stigx[2],
+                 sx_sy @ params_stigy[:2] + params_stigy[2]), axis=1)
 
     def save_to_cfg(self):
         """Save current grid configuration to ConfigParser object self.cfg.
@@ -277,36 +278,54 @@ class GridManager(list):
         # working distance gradient.
         wd_stig_dict = {}
         for grid_index in range(self.number_grids):
-            for tile_index in range(self[grid_index].number_tiles):
-                tile_key = str(grid_index) + '.' + str(tile_index)
-                if (self[grid_index][tile_index].wd > 0
-                    and (self[grid_index][tile_index].tile_active
-                         or self[grid_index][tile_index].autofocus_active
-                         or self[grid_index][tile_index].wd_grad_active)):
-                    # Only save tiles with WD != 0 which are active or
-                    # selected for autofocus or wd gradient.
-                    wd_stig_dict[tile_key] = [
-                        round(float(self[grid_index][tile_index].wd), 9),
-                        round(float(self[grid_index][tile_index].stig_xy[0]), 6),
-                        round(float(self[grid_index][tile_index].stig_xy[1]), 6)
-                    ]
+            wd_stig_dict.update(self._wd_stig_entries(grid_index))
         # Save as JSON string in config:
         grids_data['wd_stig_params'] = json.dumps(wd_stig_dict)
         # Also save list of autofocus reference tiles.
         self.cfg['autofocus']['ref_tiles'] = json.dumps(
             self.autofocus_ref_tiles)
-
-        # Save tile previews currently held in memory
-        # TODO: store with image_io / metadata
-        base_dir = self.cfg['acq']['base_dir']
-        for grid_index in range(self.number_grids):
-            grid = self[grid_index]
-            for tile_index in range(self[grid_index].number_tiles):
-                preview_path = utils.tile_preview_save_path(
-                    base_dir, grid_index, grid.array_index, grid.roi_index, tile_index)
-                img = self[grid_index][tile_index].preview_img
-                if img is not None:
-                    img.save(preview_path)
+        # New tile previews are saved by the caller (see
+        # PreviewManager.take_unsaved()).
+
+    def _wd_stig_entries(self, grid_index):
+        """Return the working distances and stigmation parameters of the
+        tiles in the specified grid as {tile_key: [wd, stig_x, stig_y]}.
+        The entries are only recomputed if the tile parameters of the grid
+        have changed since the previous call."""
+        tile_data = self[grid_index].tile_data
+        state = (tile_data.wd, tile_data.stig_xy, tile_data.tile_active,
+                 tile_data.autofocus_active, tile_data.wd_grad_active)
+        cached = self._wd_stig_cache.get(grid_index)
+        if cached is not None and all(
+                np.array_equal(saved, current)
+                for saved, current in zip(cached[0], state)):
+            return cached[1]
+        # Only save tiles with WD != 0 which are active or
+        # selected for autofocus or wd gradient.
+        selected = np.flatnonzero(
+            (tile_data.wd > 0)
+            & (tile_data.tile_active | tile_data.autofocus_active
+               | tile_data.wd_grad_active))
+        entries = {}
+        for tile_index, wd, (stig_x, stig_y) in zip(
+                selected.tolist(), tile_data.wd[selected].tolist(),
+                tile_data.stig_xy[selected].tolist()):
+            tile_key = str(grid_index) + '.' + str(tile_index)
+            entries[tile_key] = [
+                round(wd, 9), round(stig_x, 6), round(stig_y, 6)]
+        self._wd_stig_cache[grid_index] = (
+            [array.copy() for array in state], entries)
+        return entries
+
+    def set_tile_preview(self, grid_index, tile_index, image):
+        """Set the preview (QImage) of the specified tile. It is saved in
+        the base directory when the settings are saved to disk or when it
+        is released from memory."""
+        grid = self[grid_index]
+        preview_path = utils.tile_preview_save_path(
+            self.cfg['acq']['base_dir'], grid_index,
+            grid.array_index, grid.roi_index, tile_index)
+        self.previews.set_preview(grid[tile_index], image, preview_path)
 
     def add_new_grid(self, origin_sx_sy=None, sw_sh=(0, 0), active=True,
                      frame_size=None, frame_size_selector=None, overlap=None,
@@ -477,27 +496,24 @@ class GridManager(list):
             base_dir, 'meta', 'logs', 'tilepos_' + timestamp + '.txt')
         with open(file_name, 'w') as grid_map_file:
             for g in range(self.number_grids):
-                for t in range(self[g].number_tiles):
+                for t, (px, py) in enumerate(self[g].tile_data.px_py):
                     grid_map_file.write(
                         str(g) + '.' + str(t) + ';' +
-                        str(self[g][t].px_py[0]) + ';' +
-                        str(self[g][t].px_py[1]) + '\n')
+                        str(px) + ';' + str(py) + '\n')
         return file_name
 
     def delete_all_autofocus_ref_tiles(self):
         self._autofocus_ref_tiles = []
-        for g in range(self.number_grids):
-            for t in range(self[g].number_tiles):
-                self[g][t].autofocus_active = False
+        for grid in self:
+            grid.tile_data.autofocus_active[:] = False
 
     @property
     def autofocus_ref_tiles(self):
         """Return updated list of autofocus_ref_tiles."""
         self._autofocus_ref_tiles = []
         for g in range(self.number_grids):
-            for t in range(self[g].number_tiles):
-                if self[g][t].autofocus_active:
-                    self._autofocus_ref_tiles.append(str(g) + '.' + str(t))
+            for t in self[g].autofocus_ref_tiles():
+                self._autofocus_ref_tiles.append(str(g) + '.' + str(t))
         return self._autofocus_ref_tiles
 
     @autofocus_ref_tiles.setter
@@ -746,28 +762,19 @@ class GridManager(list):
         if len(input_points) == 0:
             return []
         grid = self[grid_index]
-        transformed_points = []
         scale_factor = (
             ArrayData.get_affine_scaling(self.array_data.transform.T)
             if self.array_data.calibrated
             else 1
         )
+        # _c indicates complex numbers; all points are transformed at once
         grid_center_c = np.dot(grid.centre_sx_sy, [1, 1j])
-        for point in input_points:
-            point_c = np.dot(point, [1, 1j])
-            transformed_point_c = (
-                grid_center_c
-                + (
-                    point_c
-                    * scale_factor
-                    * np.exp(1j * np.radians(grid.rotation))
-                )
-            )
-            transformed_points.append([
-                np.real(transformed_point_c),
-                np.imag(transformed_point_c),
-            ])
-        return transformed_points
+        points_c = np.dot(np.asarray(input_points, dtype=float), [1, 1j])
+        transformed_points_c = (
+            grid_center_c
+            + points_c * scale_factor * np.exp(1j * np.radians(grid.rotation)))
+        return np.stack((transformed_points_c.real,
+                         transformed_points_c.imag), axis=1).tolist()
 
     def array_convert_to_source(self, grid_index, input_points):
         """
@@ -776,30 +783,26 @@ class GridManager(list):
         then the distance to the center of the grid must be scaled according to the transform
         """
         grid = self[grid_index]
-        transformed_points = []
-
+        if len(input_points) == 0:
+            return []
         scale_factor = (
             1 / float(ArrayData.get_affine_scaling(self.array_data.transform.T))
             if self.array_data.calibrated
             else 1
         )
-        # _c indicates complex number
+        # _c indicates complex numbers; all points are transformed at once
         grid_center_c = np.dot(
             grid.centre_sx_sy,
             [1, 1j],
         )
-        for point in input_points:
-            point_c = np.dot(point, [1, 1j])
-            transformed_point_c = (
-                (point_c - grid_center_c)
-                * np.exp(1j * np.radians(-grid.rotation))
-                * scale_factor
-            )
-            transformed_points.append([
-                np.real(transformed_point_c),
-                np.imag(transformed_point_c),
-            ])
-        return transformed_points
+        points_c = np.dot(np.asarray(input_points, dtype=float), [1, 1j])
+        transformed_points_c = (
+            (points_c - grid_center_c)
+            * np.exp(1j * np.radians(-grid.rotation))
+            * scale_factor
+        )
+        return np.stack((transformed_points_c.real,
+                         transformed_points_c.imag), axis=1).tolist()
 
     def array_add_autofocus_point(self, grid_index, input_af_point):
         """input_af_point is in stage coordinates of
@@ -863,6 +866,9 @@ class GridManager(list):
                     # set all parameters in target grid
                     target_grid_rotation = (source_grid.rotation - source_rotation + target_rotation) % 360
 
+                    # Tile positions are updated once after all parameters
+                    # have been set
+                    target_grid.auto_update_tile_positions = False
                     target_grid.rotation = target_grid_rotation
                     target_grid.size = source_grid.size
                     target_grid.overlap = source_grid.overlap
@@ -894,6 +900,7 @@ class GridManager(list):
                     target_grid_center = utils.apply_transform(target_grid_center, self.array_data.transform)
 
                     target_grid.update_tile_positions()
+                    target_grid.auto_update_tile_positions = True
                     target_grid.centre_sx_sy = target_grid_center
 
     def array_revert_grid(self, grid_index, imported_image):
@@ -20,7 +20,8 @@ from scipy.signal import medfilt2d
 from collections import deque
 
 import constants
-from image_io import imread, imwrite
+from image_io import imread, imread_region, render_image
+from reslice_io import append_reslice
 import utils
 import utils_afss
 
@@ -45,6 +46,9 @@ class ImageInspector:
         self.ov_images = {}
         self.ov_reslice_line = {}
         self.prev_img_mean_stddev = [0, 0]
+        # Image writer (set by Acquisition). Images submitted to it are
+        # read only after they have been written.
+        self.image_writer = None
         # Moving average of mean and stddev differences in debris detection
         # region(s)
         self.mean_diffs = deque(maxlen=10)
@@ -116,26 +120,33 @@ class ImageInspector:
         self.cfg['debris']['histogram_diff_threshold'] = str(
             self.histogram_diff_threshold)
 
-    def load_and_inspect(self, filename):
+    def load_and_inspect(self, filename, img=None):
         """Load filename with error handling, convert to numpy array, calculate
         mean and stddev, and check if image appears incomplete.
+        If img (the frame returned by sem.acquire_frame()) is provided, it is
+        used instead of reading the image back from disk. It is rendered
+        in the same way as by imread() (16-bit images are normalised to
+        8 bit), so that the thresholds apply to both.
         """
-        img = None
         mean, stddev, sharpness = 0, 0, 0
         load_error = False
         load_exception = ''
         grab_incomplete = False
 
-        if not os.path.exists(filename):
-            load_error = True
-        try:
-            img = imread(filename)
-        except Exception as e:
-            load_exception = str(e)
-            load_error = True
+        if img is None:
+            if self.image_writer is not None:
+                self.image_writer.wait([filename])
+            if not os.path.exists(filename):
+                load_error = True
+            try:
+                img = imread(filename)
+            except Exception as e:
+                load_exception = str(e)
+                load_error = True
+        else:
+            # Grabbed frames are saved without channel metadata
+            img = render_image(np.asarray(img), [])
         if not load_error:
-            img = np.array(img)
-
             # Calculate mean and stddev
             mean = np.mean(img)
             stddev = np.std(img)
@@ -150,7 +161,8 @@ class ImageInspector:
 
         return img, mean, stddev, sharpness, load_error, load_exception, grab_incomplete
 
-    def process_tile(self, filename, grid_index, tile_index, slice_counter, mask, masking):
+    def process_tile(self, filename, grid_index, tile_index, slice_counter, mask, masking,
+                     img=None):
         range_test_passed, slice_by_slice_test_passed = False, False
         frozen_frame_error = False
         tile_selected = False
@@ -159,7 +171,7 @@ class ImageInspector:
         # process_mem_in_use_gb = psutil.Process().memory_info().rss / 1024 / 1024 / 1024
 
         img, mean, stddev, sharpness, load_error, load_exception, grab_incomplete = (
-            self.load_and_inspect(filename))
+            self.load_and_inspect(filename, img))
 
         # Compute masked stats only if masking is active and drift correction is not
         if not load_error and not self.afss_drift_corr and masking:
@@ -173,14 +185,12 @@ class ImageInspector:
                         + '_' + 't' + str(tile_index).zfill(constants.TILE_DIGITS))
             tile_key_short = str(grid_index) + '.' + str(tile_index)
 
-            # Release old image
-            if self.gm[grid_index][tile_index].preview_img is not None:
-                del self.gm[grid_index][tile_index].preview_img
-            # Save preview image
+            # Save preview image (replaces the old one)
             height, width = img.shape[:2]
             preview_img = utils.resize_image(img, PREVIEW_IMG_WIDTH)
-            # Convert to QPixmap and save in grid_manager
-            self.gm[grid_index][tile_index].preview_img = utils.image_to_QPixmap(preview_img)
+            # Convert to QImage and save in grid_manager
+            self.gm.set_tile_preview(
+                grid_index, tile_index, utils.image_to_QImage(preview_img))
 
             # Compare with previous mean and std to check for frozen frame
             # error in SmartSEM
@@ -298,17 +308,10 @@ class ImageInspector:
                 and self.tile_reslice_line[tile_key].shape[1] == 400):
             reslice_filename = utils.tile_reslice_save_path(
                 base_dir, grid_index, array_index, roi_index, tile_index)
-            # Open reslice file if it exists and save updated reslice
+            # Append line to reslice (created if it does not exist yet)
             try:
-                reslice_img = None
-                if os.path.isfile(reslice_filename):
-                    reslice_img = imread(reslice_filename)
-                if reslice_img is not None and reslice_img.shape[1] == 400:
-                    new_reslice_img = np.concatenate(
-                        (reslice_img, self.tile_reslice_line[tile_key]))
-                    imwrite(reslice_filename, new_reslice_img)
-                else:
-                    imwrite(reslice_filename, self.tile_reslice_line[tile_key])
+                append_reslice(reslice_filename,
+                               self.tile_reslice_line[tile_key])
             except Exception as e:
                 success = False  # couldn't write to disk
                 error_msg = str(e)
@@ -317,12 +320,13 @@ class ImageInspector:
             error_msg = 'Could not update reslice image for specified tile.'
         return success, error_msg
 
-    def process_ov(self, filename, ov_index, slice_counter):
-        """Load overview image from disk and perform standard tests."""
+    def process_ov(self, filename, ov_index, slice_counter, ov_img=None):
+        """Load overview image from disk (unless already provided as ov_img)
+        and perform standard tests."""
         range_test_passed = False
 
         ov_img, mean, stddev, sharpness, load_error, load_exception, grab_incomplete = (
-            self.load_and_inspect(filename))
+            self.load_and_inspect(filename, ov_img))
 
         if not load_error:
 
@@ -331,7 +335,14 @@ class ImageInspector:
             if len(self.ov_images[ov_index]) > 1:
                 # Only keep the current and the previous OV
                 self.ov_images[ov_index].pop(0)
-            self.ov_images[ov_index].append((slice_counter, ov_img))
+            # Only the debris detection area is kept in memory. If the area
+            # is changed, the new area is read from the file.
+            area = list(self.ovm[ov_index].debris_detection_area)
+            top_left_px, top_left_py, bottom_right_px, bottom_right_py = area
+            ov_roi = np.array(ov_img[top_left_py:bottom_right_py,
+                                     top_left_px:bottom_right_px])
+            self.ov_images[ov_index].append(
+                (slice_counter, filename, area, ov_roi))
 
             # Save mean and stddev in lists:
             if not (ov_index in self.ov_means):
@@ -399,17 +410,10 @@ class ImageInspector:
         if (ov_index in self.ov_reslice_line
             and self.ov_reslice_line[ov_index].shape[1] == 400):
             reslice_filename = utils.ov_reslice_save_path(base_dir, ov_index)
-            reslice_img = None
-            # Open reslice file if it exists and save updated reslice
+            # Append line to reslice (created if it does not exist yet)
             try:
-                if os.path.isfile(reslice_filename):
-                    reslice_img = imread(reslice_filename)
-                if reslice_img is not None and reslice_img.shape[1] == 400:
-                    new_reslice_img = np.concatenate(
-                        (reslice_img, self.ov_reslice_line[ov_index]))
-                    imwrite(reslice_filename, new_reslice_img)
-                else:
-                    imwrite(reslice_filename, self.ov_reslice_line[ov_index])
+                append_reslice(reslice_filename,
+                               self.ov_reslice_line[ov_index])
             except Exception as e:
                 success = False
                 error_msg = str(e)
@@ -423,12 +427,18 @@ class ImageInspector:
         msg = 'No debris detection method selected.'
         ov_roi = [None, None]
         # Crop to current debris detection area
-        top_left_px, top_left_py, bottom_right_px, bottom_right_py = (
-            self.ovm[ov_index].debris_detection_area)
+        area = list(self.ovm[ov_index].debris_detection_area)
+        top_left_px, top_left_py, bottom_right_px, bottom_right_py = area
         for i in range(2):
-            ov_img = self.ov_images[ov_index][i][1]
-            ov_roi[i] = ov_img[top_left_py:bottom_right_py,
-                               top_left_px:bottom_right_px]
+            _, filename, roi_area, ov_roi[i] = self.ov_images[ov_index][i]
+            if roi_area != area:
+                # Only decode the part of the image file in the new area
+                if self.image_writer is not None:
+                    self.image_writer.wait([filename])
+                ov_roi[i] = imread_region(
+                    filename, 0, top_left_py, top_left_px,
+                    bottom_right_py - top_left_py,
+                    bottom_right_px - top_left_px, render=True)
         height, width = ov_roi[0].shape
 
         if self.debris_detection_method == 0:
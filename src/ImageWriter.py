@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+
+# ==============================================================================
+#   This source file is part of SBEMimage (github.com/SBEMimage)
+#   (c) 2018-2020 Friedrich Miescher Institute for Biomedical Research, Basel,
+#   and the SBEMimage developers.
+#   This software is licensed under the terms of the MIT License.
+#   See LICENSE.txt in the project root folder.
+# ==============================================================================
+
+"""This module writes image files in background threads (write-behind).
+
+write() returns immediately with a future for the file, which is completed
+when the file has been written. Code that needs a file (inspection,
+mirroring, display) waits for the future of exactly that file, see wait()
+and when_written(). The images waiting to be written are kept in memory up
+to a memory budget; write() blocks while the budget is exceeded. If a file
+cannot be written, the exception is set on its future and kept until it
+is raised again by when_written(), flush() or close().
+
+Each file is first written to a temporary file, which then replaces the
+target file, so a crash never leaves a partially written image under its
+final name. Temporary files left over from a crash are deleted with
+remove_temp_files().
+"""
+
+import glob
+import os
+import threading
+
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from ConfigWriter import temp_path
+from constants import IMAGE_WRITER_MEMORY_BUDGET, IMAGE_WRITER_WORKERS
+from image_io import imwrite, remove_image
+
+
+def remove_temp_files(directory):
+    """Delete temporary files in directory left over from an interrupted
+    write. Return the number of files deleted."""
+    number_removed = 0
+    for path in glob.glob(os.path.join(glob.escape(directory), '*.tmp.*')):
+        try:
+            remove_image(path)
+            number_removed += 1
+        except OSError:
+            pass
+    return number_removed
+
+
+class WriteRequest:
+    __slots__ = ('image', 'kwargs', 'futures')
+
+    def __init__(self, image, kwargs):
+        self.image = image
+        self.kwargs = kwargs
+        # Futures of all write() calls for this file since it was last written
+        self.futures = [Future()]
+
+    @property
+    def nbytes(self):
+        return getattr(self.image, 'nbytes', 0)
+
+
+class ImageWriter:
+
+    def __init__(self, memory_budget=IMAGE_WRITER_MEMORY_BUDGET,
+                 number_workers=IMAGE_WRITER_WORKERS):
+        # Maximum size (in bytes) of the images waiting to be written
+        self.memory_budget = memory_budget
+        self.condition = threading.Condition()
+        # Files waiting to be written: {path: WriteRequest}
+        self.pending = OrderedDict()
+        # Files currently being written: {path: WriteRequest}
+        self.in_progress = {}
+        # Size of the images in pending and in_progress (in bytes)
+        self.memory_in_use = 0
+        self.files_written = 0
+        self.last_error = None
+        # Files that could not be written and whose error has not been
+        # raised yet: {path: exception}
+        self.failed = OrderedDict()
+        self.stop_requested = False
+        self.workers = []
+        for _ in range(number_workers):
+            worker = threading.Thread(target=self.run, daemon=True)
+            worker.start()
+            self.workers.append(worker)
+
+    def write(self, path, image, **kwargs):
+        """Write image to path with image_io.imwrite() (keyword arguments
+        kwargs) in the background and return a future that is completed
+        with path when the file has been written. The image must not be
+        changed by the caller afterwards. Blocks while the images waiting
+        to be written exceed the memory budget. If path is submitted again
+        before it has been written, only the latest image is written."""
+        path = os.path.abspath(path)
+        request = WriteRequest(image, kwargs)
+        with self.condition:
+            if self.stop_requested:
+                raise RuntimeError('Image writer has been closed.')
+            # Back-pressure: wait until the image fits into the budget
+            # (an image larger than the budget is accepted when no other
+            # images are waiting)
+            self.condition.wait_for(
+                lambda: (self.memory_in_use + request.nbytes
+                         <= self.memory_budget
+                         or self.memory_in_use == 0))
+            previous = self.pending.pop(path, None)
+            if previous is not None:
+                self.memory_in_use -= previous.nbytes
+                request.futures = previous.futures + request.futures
+            self.pending[path] = request
+            self.memory_in_use += request.nbytes
+            self.condition.notify_all()
+        return request.futures[-1]
+
+    def future(self, path):
+        """Return the future of path if it is waiting to be written or being
+        written, otherwise None."""
+        path = os.path.abspath(path)
+        with self.condition:
+            request = self.pending.get(path) or self.in_progress.get(path)
+            return request.futures[-1] if request is not None else None
+
+    def wait(self, paths, timeout=None):
+        """Wait until the files in paths (if submitted) have been written.
+        Return False if timeout (in seconds) expired."""
+        paths = [os.path.abspath(path) for path in paths]
+        with self.condition:
+            return self.condition.wait_for(
+                lambda: not any(path in self.pending or path in self.in_progress
+                                for path in paths),
+                timeout=timeout)
+
+    def when_written(self, paths, callback):
+        """Call callback(written_paths) when the files in paths have been
+        written. If no file in paths is waiting to be written, callback is
+        called immediately in the calling thread, otherwise in a writer
+        thread, with the files that have been written (files that fail are
+        left out, their errors are raised by flush() or close()). If files
+        in paths could not be written earlier, they are left out and the
+        exception of the first one is raised after the callback has been
+        set up for the others."""
+        errors = []
+        with self.condition:
+            for path in paths:
+                error = self.failed.pop(os.path.abspath(path), None)
+                if error is not None:
+                    errors.append((path, error))
+        if errors:
+            failed_paths = [path for path, _ in errors]
+            paths = [path for path in paths if path not in failed_paths]
+            if paths:
+                self.when_written(paths, callback)
+            raise errors[0][1]
+        futures = [future for future in map(self.future, paths)
+                   if future is not None]
+        if not futures:
+            callback(paths)
+            return
+        remaining = [len(futures)]
+        lock = threading.Lock()
+
+        def done(_):
+            with lock:
+                remaining[0] -= 1
+                if remaining[0] > 0:
+                    return
+            with self.condition:
+                written = [path for path in paths
+                           if os.path.abspath(path) not in self.failed]
+            if written:
+                callback(written)
+
+        for future in futures:
+            future.add_done_callback(done)
+
+    @property
+    def backlog(self):
+        """Number of files waiting to be written or being written."""
+        with self.condition:
+            return len(self.pending) + len(self.in_progress)
+
+    def next_request(self):
+        """Return the first waiting file that is not being written by
+        another worker, or None. Condition must be held."""
+        for path in self.pending:
+            if path not in self.in_progress:
+                return path
+        return None
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.next_request() is None and not self.stop_requested:
+                    self.condition.wait()
+                path = self.next_request()
+                if path is None:
+                    return
+                request = self.pending.pop(path)
+                self.in_progress[path] = request
+            error = None
+            try:
+                self.write_file(path, request.image, request.kwargs)
+            except Exception as e:
+                error = e
+            with self.condition:
+                del self.in_progress[path]
+                self.memory_in_use -= request.nbytes
+                if error is None:
+                    self.files_written += 1
+                    self.failed.pop(path, None)
+                else:
+                    self.last_error = f'{path}: {error}'
+                    self.failed[path] = error
+                self.condition.notify_all()
+            for future in request.futures:
+                if error is None:
+                    future.set_result(path)
+                else:
+                    future.set_exception(error)
+
+    @staticmethod
+    def write_file(path, image, kwargs):
+        """Write image to a temporary file, then replace path with it."""
+        tmp_path = temp_path(path)
+        if os.path.exists(tmp_path):
+            remove_image(tmp_path)
+        imwrite(tmp_path, image, **kwargs)
+        if os.path.isdir(tmp_path) and os.path.exists(path):
+            # OME-Zarr directory: a directory can only replace an empty one
+            remove_image(path)
+        os.replace(tmp_path, path)
+
+    def raise_failed(self):
+        """Raise the exception of the first file that could not be written
+        (if any). The exceptions of further files that could not be written
+        are only set on their futures. Condition must be held."""
+        if self.failed:
+            _, error = self.failed.popitem(last=False)
+            self.failed.clear()
+            raise error
+
+    def flush(self, timeout=None):
+        """Wait until all submitted files have been written. Return False
+        if timeout (in seconds) expired. Raise the exception of a file that
+        could not be written."""
+        with self.condition:
+            success = self.condition.wait_for(
+                lambda: not self.pending and not self.in_progress,
+                timeout=timeout)
+            self.raise_failed()
+        return success
+
+    def close(self, timeout=60):
+        """Write the remaining files, then stop the workers. Raise the
+        exception of a file that could not be written."""
+        try:
+            return self.flush(timeout)
+        finally:
+            with self.condition:
+                self.stop_requested = True
+                self.condition.notify_all()
+            for worker in self.workers:
+                worker.join(timeout=1)
@@ -53,7 +53,9 @@ class ImportedImage:
                 if isinstance(position[0], (list, tuple)):
                     position = position[0]
                 self.origin = position
-                image = imread(self.image_src)
+                # Metadata is cached, the file is opened only once. The
+                # image is converted to a QPixmap and can be memory-mapped.
+                image = imread(self.image_src, memmap=True)
                 height, width = image.shape[:2]
                 self.size = [width, height]
                 self.source_image = image_to_QPixmap(image)
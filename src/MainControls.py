@@ -20,6 +20,7 @@ The 'Main Controls' window consists of four tabs:
 The 'Main Controls' window is a QMainWindow, and it launches the Viewport
 window (in Viewport.py) as a QWidget.
 """
+import datetime
 import os
 import sys
 from typing import Optional
@@ -30,7 +31,8 @@ from time import sleep
 #import xml.etree.ElementTree as ET
 
 from qtpy.QtWidgets import QApplication, QMainWindow, QMessageBox, QInputDialog, QLineEdit, \
-                            QAbstractItemView, QPushButton, QProgressDialog, QFileDialog, QHeaderView
+                            QAbstractItemView, QPushButton, QProgressDialog, QFileDialog, QHeaderView, \
+                            QLabel
 from qtpy.QtCore import Qt, QRect, QSize, QEvent, QItemSelection, QItemSelectionModel
 from qtpy.QtGui import QIcon, QPalette, QColor, QPixmap, QKeyEvent, \
                         QStatusTipEvent, QStandardItem, QStandardItemModel
@@ -52,6 +54,7 @@ from ImportedImage import ImportedImages
 from GridManager import GridManager
 from TemplateManager import TemplateManager
 from CoordinateSystem import CoordinateSystem
+from ConfigWriter import ConfigWriter
 from Viewport import Viewport
 from ImageInspector import ImageInspector
 from Autofocus import Autofocus
@@ -91,6 +94,7 @@ from dialog.MotorStatusDlg import MotorStatusDlg
 from dialog.MicrotomeSettingsDlg import MicrotomeSettingsDlg
 from dialog.SEMSettingsDlg import SEMSettingsDlg
 from dialog.SaveConfigDlg import SaveConfigDlg
+from dialog.AcqStatsDlg import AcqStatsDlg
 from dialog.array.ArrayCalibrationDlg import ArrayCalibrationDlg
 
 
@@ -133,8 +137,11 @@ class MainControls(QMainWindow):
 
         # Set up trigger and queue to update Main Controls from the
         # acquisition thread or dialog windows.
+        # Commands are processed in batches (see utils.CommandCoalescer) so
+        # that repeated GUI updates are merged.
         self.trigger = utils.Trigger()
-        self.trigger.signal.connect(self.process_signal)
+        self.trigger_coalescer = utils.CommandCoalescer(
+            self.trigger, self.process_command)
         
         utils.show_progress_in_console(10)
 
@@ -224,6 +231,8 @@ class MainControls(QMainWindow):
         self.ovm = OverviewManager(self.cfg, self.sem, self.cs)
         self.gm = GridManager(self.cfg, self.sem, self.cs)
         self.tm = TemplateManager(self.ovm)
+        # Configuration files and tile previews are saved in the background
+        self.config_writer = ConfigWriter()
 
         utils.show_progress_in_console(30)
 
@@ -322,6 +331,8 @@ class MainControls(QMainWindow):
                                self.stage, self.ovm, self.gm, self.cs, 
                                self.img_inspector, self.autofocus, 
                                self.notifications, self.tcp_remote, self.trigger)
+        # Timing statistics of the acquisition (see open_acq_stats_dlg())
+        self.acq_stats_dlg = None
         # enable pause while milling
         if self.use_microtome and (self.syscfg['device']['microtome'] == '6'):
             self.microtome.acq = self.acq
@@ -422,6 +433,9 @@ class MainControls(QMainWindow):
 
         print('\n\nReady.\n')
         self.set_statusbar('Ready.')
+        # Mirror drive queue metrics (shown during acquisitions)
+        self.label_mirrorStatus = QLabel('')
+        self.statusBar().addPermanentWidget(self.label_mirrorStatus)
 
         # If user has selected the default configuration and no custom system
         # configuration files exist, provide guidance depending on whether presets
@@ -617,6 +631,7 @@ class MainControls(QMainWindow):
             self.open_cut_duration_dlg)
         self.actionExport.triggered.connect(self.open_export_dlg)
         self.actionUpdate.triggered.connect(self.open_update_dlg)
+        self.actionAcqStats.triggered.connect(self.open_acq_stats_dlg)
         # Buttons for testing purposes (third tab)
         self.pushButton_testGetMag.clicked.connect(self.test_get_mag)
         self.pushButton_testSetMag.clicked.connect(self.test_set_mag)
@@ -867,7 +882,8 @@ class MainControls(QMainWindow):
         # Get current estimates:
         (min_dose, max_dose, total_area, total_z, total_data,
         total_imaging, total_stage_moves, total_cutting,
-        date_estimate, remaining_time) = self.acq.calculate_estimates()
+        date_estimate, remaining_time, remaining_time_range,
+        stage_move_time_saved) = self.acq.calculate_estimates()
         total_duration = total_imaging + total_stage_moves + total_cutting
         if min_dose == max_dose:
             self.label_dose.setText(
@@ -884,12 +900,38 @@ class MainControls(QMainWindow):
             f'({total_imaging/total_duration * 100:.1f}% / '
             f'{total_stage_moves/total_duration * 100:.1f}% / '
             f'{total_cutting/total_duration * 100:.1f}%)')
+        if stage_move_time_saved > 0:
+            days, hours, minutes = utils.get_days_hours_minutes(
+                stage_move_time_saved)
+            self.label_totalDuration.setToolTip(
+                f'Optimised tile route saves {days} d {hours} h {minutes} min '
+                f'of stage moves (compared with snake pattern)')
+        else:
+            self.label_totalDuration.setToolTip('')
         self.label_totalArea.setText('{0:.1f}'.format(total_area) + ' µm²')
         self.label_totalZ.setText('{0:.2f}'.format(total_z) + ' µm')
         self.label_totalData.setText('{0:.1f}'.format(total_data) + ' GB')
         days, hours, minutes = utils.get_days_hours_minutes(remaining_time)
+        remaining_str = f'{days} d {hours} h {minutes} min'
+        if remaining_time_range is None:
+            self.label_dateEstimate.setToolTip(
+                'Estimate based on default timing. It will be calibrated '
+                'with the measured durations after the first slices.')
+        else:
+            # Confidence bounds from the measured slice durations
+            low, high = remaining_time_range
+            days, hours, minutes = utils.get_days_hours_minutes(
+                (high - low) / 2)
+            remaining_str += f' ± {days} d {hours} h {minutes} min'
+            now = datetime.datetime.now()
+            earliest, latest = [
+                str(now + datetime.timedelta(seconds=int(bound)))[:16]
+                for bound in remaining_time_range]
+            self.label_dateEstimate.setToolTip(
+                f'95% range of completion: {earliest} to {latest}\n'
+                '(calibrated with the durations measured in recent slices)')
         self.label_dateEstimate.setText(
-            date_estimate + f'   ({days} d {hours} h {minutes} min remaining)')
+            date_estimate + f'   ({remaining_str} remaining)')
 
     def update_acq_options(self):
         """Update the options for the stack acquisition selected by the user
@@ -1727,6 +1769,14 @@ class MainControls(QMainWindow):
         dialog = ExportDlg(self.acq)
         dialog.exec()
 
+    def open_acq_stats_dlg(self):
+        # Not modal: kept open and updated during the acquisition
+        if self.acq_stats_dlg is None:
+            self.acq_stats_dlg = AcqStatsDlg(self.acq.tracer)
+        self.acq_stats_dlg.show_current_stats()
+        self.acq_stats_dlg.show()
+        self.acq_stats_dlg.raise_()
+
     def open_update_dlg(self):
         dialog = UpdateDlg()
         dialog.exec()
@@ -1900,13 +1950,13 @@ class MainControls(QMainWindow):
             e = QStatusTipEvent(self.statusbar_msg)
         return super().event(e)
 
-    def process_signal(self):
-        """Process signals from the acquisition thread, the viewport, or from
+    def process_command(self, cmd):
+        """Process commands from the acquisition thread, the viewport, or from
         dialog windows. The trigger/queue approach is required to pass
         information between threads and to allow the GUI to be updated from a
-        thread.
+        thread. The commands received within one frame interval are merged
+        by self.trigger_coalescer before they are processed here.
         """
-        cmd = self.trigger.queue.get()
         msg = cmd['msg']
         args = cmd['args']
         kwargs = cmd['kwargs']
@@ -1935,6 +1985,10 @@ class MainControls(QMainWindow):
             self.show_stack_progress()
             self.show_stack_acq_estimates()
             self.viewport.m_show_motor_status()
+        elif msg == 'ACQ STATS':
+            if (self.acq_stats_dlg is not None
+                    and self.acq_stats_dlg.isVisible()):
+                self.acq_stats_dlg.show_current_stats()
         elif msg == 'MANUAL SWEEP SUCCESS':
             self.manual_sweep_success(True)
         elif msg == 'MANUAL SWEEP FAILURE':
@@ -1953,9 +2007,12 @@ class MainControls(QMainWindow):
         elif msg == 'SAVE CFG':
             self.save_config_to_disk()
         elif msg == 'ACQ IND OV':
-            self.viewport.vp_toggle_ov_acq_indicator(*args, **kwargs)
+            # Followed by 'DRAW VP' (see utils.coalesce_commands)
+            self.viewport.vp_toggle_ov_acq_indicator(
+                *args, redraw=False, **kwargs)
         elif msg == 'ACQ IND TILE':
-            self.viewport.vp_toggle_tile_acq_indicator(*args, **kwargs)
+            self.viewport.vp_toggle_tile_acq_indicator(
+                *args, redraw=False, **kwargs)
         elif msg == 'RESTRICT GUI':
             self.restrict_gui(True)
         elif msg == 'RESTRICT VP GUI':
@@ -2050,6 +2107,8 @@ class MainControls(QMainWindow):
             self.ask_debris_first_ov(*args, **kwargs)
         elif msg == 'ASK DEBRIS CONFIRMATION':
             self.ask_debris_confirmation(*args, **kwargs)
+        elif msg == 'MIRROR STATUS':
+            self.show_mirror_status(*args)
         elif msg == 'ASK IMAGE ERROR OVERRIDE':
             reply = QMessageBox.question(
                 self, 'Image inspector',
@@ -2058,11 +2117,31 @@ class MainControls(QMainWindow):
                 QMessageBox.Yes | QMessageBox.No,
                 QMessageBox.Yes)
             self.acq.user_reply = reply
+        elif msg == utils.LOG_LINES:
+            # Show all log lines of this batch with a single update
+            self.textarea_log.appendPlainText('\n'.join(args[0]))
+            self.textarea_log.ensureCursorVisible()
         else:
             # If msg is not a command, show it in log:
             self.textarea_log.appendPlainText(msg)
             self.textarea_log.ensureCursorVisible()
     
+    def show_mirror_status(self, metrics):
+        """Show backlog and copy rate of the mirror drive queue in the
+        status bar."""
+        if metrics is None:
+            self.label_mirrorStatus.setText('')
+            return
+        text = (f'Mirror: {metrics["backlog"]} file(s) '
+                f'({metrics["backlog_bytes"] / 1e6:.0f} MB) queued, '
+                f'{metrics["bandwidth"] / 1e6:.1f} MB/s')
+        if metrics['last_error']:
+            text += ' (error)'
+            self.label_mirrorStatus.setToolTip(metrics['last_error'])
+        else:
+            self.label_mirrorStatus.setToolTip('')
+        self.label_mirrorStatus.setText(text)
+
     def ask_debris_first_ov(self, ov_index):
         if not self.test_mode:
             self.viewport.vp_show_overview_for_user_inspection(ov_index)
@@ -2699,8 +2778,6 @@ class MainControls(QMainWindow):
             self.open_save_settings_new_file_dlg()
             return
 
-        # TODO: Saving may take a while -> run in thread
-        # TODO: Reconsider when and how tile previews are saved...
         if show_msg:
             # Show progress while saving (0..10)
             progress_dlg = QProgressDialog('Saving configuration and workspace status... '
@@ -2735,15 +2812,21 @@ class MainControls(QMainWindow):
 
         if show_msg:
             progress_dlg.setValue(9)
-        # Write config to disk
-        with open(os.path.join('cfg', self.cfg_file), 'w') as f:
-            self.cfg.write(f)
+        # Write new tile previews and the changed config files to disk
+        # in the background
+        self.config_writer.write_images(self.gm.previews.take_unsaved())
+        self.config_writer.write_config(
+            os.path.join('cfg', self.cfg_file), self.cfg)
         # Also save system settings
-        with open(os.path.join(
-            'cfg', self.cfg['sys']['sys_config_file']), 'w') as f:
-            self.syscfg.write(f)
+        self.config_writer.write_config(
+            os.path.join('cfg', self.cfg['sys']['sys_config_file']),
+            self.syscfg)
         if show_msg:
+            self.config_writer.flush()
             progress_dlg.setValue(10)  # final step, will close dialog
+        # Errors of previous (or, after flush, current) background writes
+        for error in self.config_writer.take_errors():
+            utils.log_error('CTRL', error)
 
         utils.log_info('CTRL', 'Settings saved to disk.')
 
@@ -2778,6 +2861,7 @@ class MainControls(QMainWindow):
                 if self.plc_initialized:
                     plasma_log_msg = self.plasma_cleaner.close_port()
                     utils.log_info(plasma_log_msg)
+                self.autofocus.close_mapfost()
                 if not self.acq_notes_saved:
                     # Switch to Notes tab
                     self.tabWidget.setCurrentIndex(2)
@@ -2832,6 +2916,16 @@ class MainControls(QMainWindow):
                                 self.open_save_settings_new_file_dlg()
                 self.viewport.active = False
                 self.viewport.close()
+                if self.acq_stats_dlg is not None:
+                    self.acq_stats_dlg.close()
+                # Wait until settings, previews and images are written
+                self.config_writer.close()
+                for error in self.config_writer.take_errors():
+                    utils.log_error('CTRL', error)
+                try:
+                    self.acq.image_writer.close()
+                except Exception as e:
+                    utils.log_error('CTRL', f'Image could not be saved: {e}')
                 QApplication.processEvents()
                 sleep(1)
                 # Recreate status.dat to indicate that program was closed
@@ -2975,9 +3069,9 @@ class MainControls(QMainWindow):
                     self.ovm[self.ft_selected_ov].wd_stig_xy[1] = (
                         self.ft_selected_stig_x)
                 elif self.ft_selected_tile >= 0:
-                    self.gm[self.ft_selected_grid][
-                            self.ft_selected_tile].stig_xy[0] = (
-                        self.ft_selected_stig_x)
+                    tile = self.gm[self.ft_selected_grid][
+                        self.ft_selected_tile]
+                    tile.stig_xy = (self.ft_selected_stig_x, tile.stig_xy[1])
             self.ft_reset()
 
         elif self.ft_mode == 3:
@@ -2993,9 +3087,9 @@ class MainControls(QMainWindow):
                     self.ovm[self.ft_selected_ov].wd_stig_xy[2] = (
                         self.ft_selected_stig_y)
                 elif self.ft_selected_tile >= 0:
-                    self.gm[self.ft_selected_grid][
-                            self.ft_selected_tile].stig_xy[1] = (
-                        self.ft_selected_stig_y)
+                    tile = self.gm[self.ft_selected_grid][
+                        self.ft_selected_tile]
+                    tile.stig_xy = (tile.stig_xy[0], self.ft_selected_stig_y)
             self.ft_reset()
 
     def ft_ask_user_save(self):
@@ -0,0 +1,317 @@
+# -*- coding: utf-8 -*-
+
+# ==============================================================================
+#   This source file is part of SBEMimage (github.com/SBEMimage)
+#   (c) 2018-2020 Friedrich Miescher Institute for Biomedical Research, Basel,
+#   and the SBEMimage developers.
+#   This software is licensed under the terms of the MIT License.
+#   See LICENSE.txt in the project root folder.
+# ==============================================================================
+
+"""This module sends metadata to the metadata server (VIME) in a background
+thread, so that a slow or unreachable server does not delay the acquisition.
+
+Every record is first written to a file in an outbox directory and only
+deleted after the server has accepted it. Records left in the outbox when
+SBEMimage is stopped or crashes are sent when the client is started again.
+Consecutive records of the same kind (for example tile metadata) can be
+combined into a single request containing a list of records. Batching is
+disabled by default. Batched records are sent to a separate endpoint
+(endpoint + BATCH_SUFFIX), so servers that expect one record per request
+are not affected. If the server rejects a batch request, the records are
+sent individually.
+"""
+
+import os
+import json
+import threading
+import requests
+
+from time import time
+
+import utils
+
+
+# Appended to the endpoint of requests that contain a list of records
+BATCH_SUFFIX = '/batch'
+
+
+class MetadataClient:
+
+    def __init__(self, server_url, outbox_dir, batch_interval=0,
+                 max_batch_size=100, request_timeout=10, retry_interval=5,
+                 max_retry_interval=60):
+        self.server_url = server_url
+        self.outbox_dir = outbox_dir
+        # Time in seconds during which batchable records are collected
+        # before they are sent (0: send each record individually)
+        self.batch_interval = batch_interval
+        self.max_batch_size = max_batch_size
+        self.request_timeout = request_timeout
+        self.retry_interval = retry_interval
+        self.max_retry_interval = max_retry_interval
+        # Description of the last failed request (None if the last
+        # request succeeded)
+        self.last_error = None
+        self.requests_sent = 0
+        self.records_sent = 0
+        # False if the server has rejected a batch request (records are
+        # then sent individually)
+        self.batch_supported = True
+        # Number of records rejected by the server (kept in the outbox with
+        # the extension .rejected)
+        self.rejected_count = 0
+
+        self.session = requests.Session()
+        self.condition = threading.Condition()
+        # Records waiting to be sent: list of (outbox file path, record)
+        self.pending = []
+        self.poll_endpoint = None
+        self.server_message = None
+        self.flush_requested = False
+        self.stop_requested = False
+        self.next_id = 0
+
+        os.makedirs(self.outbox_dir, exist_ok=True)
+        self.load_outbox()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    @property
+    def pending_count(self):
+        with self.condition:
+            return len(self.pending)
+
+    def load_outbox(self):
+        """Load records left in the outbox by a previous run."""
+        for file_name in sorted(os.listdir(self.outbox_dir)):
+            if not file_name.endswith('.json'):
+                continue
+            file_path = os.path.join(self.outbox_dir, file_name)
+            try:
+                with open(file_path) as file:
+                    record = json.load(file)
+            except (OSError, ValueError):
+                # Incomplete record (should not occur because records are
+                # written atomically)
+                utils.log_warning(
+                    'CTRL', f'Metadata outbox: unreadable record {file_name}')
+                continue
+            self.pending.append((file_path, record))
+            self.next_id = max(self.next_id, int(file_name[:-5]) + 1)
+        if self.pending:
+            utils.log_info(
+                'CTRL', f'Metadata outbox: {len(self.pending)} record(s) '
+                        f'from previous run will be sent.')
+
+    def queue(self, method, endpoint, data, batch=False):
+        """Add a record to the outbox. The request (method 'PUT' or 'POST')
+        is sent in the background. If batch is True, consecutive records for
+        the same endpoint are sent together as a list."""
+        record = {'method': method, 'endpoint': endpoint, 'data': data,
+                  'batch': batch, 'time': time()}
+        with self.condition:
+            file_path = os.path.join(self.outbox_dir,
+                                     str(self.next_id).zfill(10) + '.json')
+            self.next_id += 1
+        # The record is written outside the lock, so that the sending
+        # thread is not blocked by a slow drive
+        tmp_path = file_path + '.tmp'
+        with open(tmp_path, 'w') as file:
+            json.dump(record, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, file_path)
+        with self.condition:
+            self.pending.append((file_path, record))
+            self.condition.notify()
+
+    def poll(self, endpoint):
+        """Request a message from the server (GET endpoint) in the
+        background. The result can be retrieved with pop_server_message()."""
+        with self.condition:
+            self.poll_endpoint = endpoint
+            self.condition.notify()
+
+    def pop_server_message(self):
+        """Return the result of the last poll as (status, command, msg,
+        exception_str), or None if no result has been received."""
+        with self.condition:
+            message = self.server_message
+            self.server_message = None
+        return message
+
+    def flush(self, timeout=None):
+        """Send all pending records without waiting for the batch interval.
+        Return True if the outbox is empty."""
+        deadline = None if timeout is None else time() + timeout
+        with self.condition:
+            self.flush_requested = True
+            self.condition.notify()
+            while self.pending:
+                remaining = None if deadline is None else deadline - time()
+                if remaining is not None and remaining <= 0:
+                    break
+                self.condition.wait(remaining)
+            self.flush_requested = False
+            return not self.pending
+
+    def close(self, timeout=5):
+        """Try to send all pending records within timeout, then stop the
+        client. Unsent records remain in the outbox."""
+        success = self.flush(timeout)
+        with self.condition:
+            self.stop_requested = True
+            self.condition.notify()
+        self.thread.join(timeout=self.request_timeout)
+        self.session.close()
+        return success
+
+    def next_batch(self):
+        """Return the list of pending records to be sent next, or the number
+        of seconds to wait for further records. Condition must be held."""
+        file_path, record = self.pending[0]
+        if not self.batched(record):
+            return self.pending[:1]
+        batch = []
+        for file_path, next_record in self.pending[:self.max_batch_size]:
+            if (not next_record['batch']
+                    or next_record['endpoint'] != record['endpoint']
+                    or next_record['method'] != record['method']):
+                break
+            batch.append((file_path, next_record))
+        # Wait for further records unless the batch is complete (followed
+        # by a different record or full) or the batch interval has elapsed
+        complete = (len(batch) < len(self.pending)
+                    or len(batch) == self.max_batch_size)
+        remaining = record['time'] + self.batch_interval - time()
+        if not complete and remaining > 0 and not self.flush_requested:
+            return remaining
+        return batch
+
+    def batched(self, record):
+        """Return True if record is sent in a batch request."""
+        return (record['batch'] and self.batch_interval > 0
+                and self.batch_supported)
+
+    def run(self):
+        failures = 0
+        while True:
+            with self.condition:
+                wait_time = None
+                batch = []
+                while not self.stop_requested:
+                    if self.poll_endpoint is not None:
+                        break
+                    if self.pending:
+                        batch = self.next_batch()
+                        if isinstance(batch, list):
+                            break
+                        wait_time, batch = batch, []
+                    self.condition.wait(wait_time)
+                    wait_time = None
+                if self.stop_requested:
+                    return
+                poll_endpoint = self.poll_endpoint
+                self.poll_endpoint = None
+
+            if poll_endpoint is not None:
+                message = self.get_message(poll_endpoint)
+                with self.condition:
+                    self.server_message = message
+            if not batch:
+                continue
+
+            batched = self.batched(batch[0][1])
+            status, exception_str = self.send(batch)
+            if 200 <= status < 300:
+                failures = 0
+                self.last_error = None
+                self.remove_records(batch)
+            elif 400 <= status < 500 and batched:
+                # The server does not accept batch requests. The records
+                # remain pending and are sent individually.
+                self.batch_supported = False
+                utils.log_warning(
+                    'CTRL', f'Metadata server rejected batch request to '
+                            f'{batch[0][1]["endpoint"]}{BATCH_SUFFIX} '
+                            f'(status {status}). Sending records '
+                            f'individually.')
+            elif 400 <= status < 500:
+                # The server rejected the request, repeating it would fail
+                # again. Keep the records for manual inspection.
+                utils.log_error(
+                    'CTRL', f'Metadata server rejected request to '
+                            f'{batch[0][1]["endpoint"]} (status {status}).')
+                self.remove_records(batch, keep_as='.rejected')
+                with self.condition:
+                    self.rejected_count += len(batch)
+            else:
+                failures += 1
+                if exception_str:
+                    self.last_error = exception_str
+                else:
+                    self.last_error = f'Server error (status {status})'
+                delay = min(self.retry_interval * 2 ** (failures - 1),
+                            self.max_retry_interval)
+                with self.condition:
+                    if not self.stop_requested:
+                        self.condition.wait(delay)
+
+    def send(self, batch):
+        """Send the records in batch in one request. Return the status code
+        (100 if the request failed) and the exception string."""
+        record = batch[0][1]
+        endpoint = record['endpoint']
+        if self.batched(record):
+            endpoint += BATCH_SUFFIX
+            data = [next_record['data'] for _, next_record in batch]
+        else:
+            data = record['data']
+        try:
+            r = self.session.request(
+                record['method'], self.server_url + endpoint,
+                json=data, timeout=self.request_timeout)
+            status, exception_str = r.status_code, ''
+        except Exception as e:
+            status, exception_str = 100, str(e)
+        if 200 <= status < 300:
+            self.requests_sent += 1
+            self.records_sent += len(batch)
+        return status, exception_str
+
+    def get_message(self, endpoint):
+        command = None
+        msg = None
+        exception_str = ''
+        try:
+            r = self.session.get(self.server_url + endpoint,
+                                 timeout=self.request_timeout)
+            received = json.loads(r.content)
+            status = r.status_code
+            if 'command' in received:
+                command = received['command']
+            if 'message' in received:
+                msg = received['message']
+        except Exception as e:
+            status = 100
+            msg = 'Metadata server request failed.'
+            exception_str = str(e)
+        return status, command, msg, exception_str
+
+    def remove_records(self, batch, keep_as=None):
+        """Remove the records in batch (the first pending records) from
+        the outbox, or rename their files with the extension keep_as."""
+        for file_path, _ in batch:
+            try:
+                if keep_as is None:
+                    os.remove(file_path)
+                else:
+                    os.replace(file_path, file_path + keep_as)
+            except OSError as e:
+                utils.log_warning(
+                    'CTRL', f'Metadata outbox: could not remove '
+                            f'{file_path}: {e}')
+        with self.condition:
+            del self.pending[:len(batch)]
+            self.condition.notify_all()
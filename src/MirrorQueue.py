@@ -0,0 +1,297 @@
+# -*- coding: utf-8 -*-
+
+# ==============================================================================
+#   This source file is part of SBEMimage (github.com/SBEMimage)
+#   (c) 2018-2020 Friedrich Miescher Institute for Biomedical Research, Basel,
+#   and the SBEMimage developers.
+#   This software is licensed under the terms of the MIT License.
+#   See LICENSE.txt in the project root folder.
+# ==============================================================================
+
+"""This module copies files to the mirror drive in background threads.
+
+Files to be mirrored are recorded in a journal on the primary drive ('ADD'
+when a file is queued, 'DONE' when the copy has been completed), so files
+that were not copied when SBEMimage was stopped or crashed are copied when
+the queue is started again. A checksum is computed while a file is copied.
+If verification is enabled, the copy is read back and its checksum compared
+with the checksum of the original file.
+"""
+
+import os
+import hashlib
+import threading
+
+from collections import deque
+from time import time
+
+import utils
+
+
+COPY_CHUNK_SIZE = 1024 * 1024
+# Time window (in s) for the bandwidth measurement
+BANDWIDTH_WINDOW = 10
+
+
+class MirrorQueue:
+
+    def __init__(self, base_dir, mirror_dir, journal_filename,
+                 number_workers=2, verify=True, retry_interval=2,
+                 max_retry_interval=60):
+        # Files in base_dir are copied to the same relative path in mirror_dir
+        self.base_dir = base_dir
+        self.mirror_dir = mirror_dir
+        self.journal_filename = journal_filename
+        self.number_workers = number_workers
+        self.verify = verify
+        self.retry_interval = retry_interval
+        self.max_retry_interval = max_retry_interval
+
+        self.condition = threading.Condition()
+        # Files waiting to be copied (paths, in order of addition)
+        self.pending = deque()
+        # Files currently being copied
+        self.in_progress = set()
+        # Time before which a file whose copy failed is not copied again
+        # (path -> time)
+        self.retry_times = {}
+        self.stop_requested = False
+        self.failures = 0
+        # Description of the last failed copy (None if the last copy
+        # succeeded)
+        self.last_error = None
+        self.files_copied = 0
+        self.bytes_copied = 0
+        # (time, number of bytes) of recent copies for bandwidth estimate
+        self.recent_copies = deque()
+
+        self.load_journal()
+        self.journal_file = open(self.journal_filename, 'a')
+        self.workers = []
+        for _ in range(number_workers):
+            worker = threading.Thread(target=self.run, daemon=True)
+            worker.start()
+            self.workers.append(worker)
+
+    def load_journal(self):
+        """Load files not copied during a previous run from the journal and
+        rewrite the journal with only these files."""
+        if os.path.isfile(self.journal_filename):
+            counts = {}
+            order = []
+            with open(self.journal_filename) as file:
+                for line in file:
+                    fields = line.rstrip('\n').split('\t')
+                    if len(fields) < 2:
+                        # Incomplete line (interrupted write)
+                        continue
+                    if fields[0] == 'ADD':
+                        counts[fields[1]] = counts.get(fields[1], 0) + 1
+                        order.append(fields[1])
+                    elif fields[0] == 'DONE':
+                        counts[fields[1]] = counts.get(fields[1], 0) - 1
+            for path in order:
+                if counts[path] > 0 and path not in self.pending:
+                    self.pending.append(path)
+            if self.pending:
+                utils.log_info(
+                    'CTRL', f'Mirror queue: {len(self.pending)} file(s) from '
+                            f'previous run will be copied.')
+        else:
+            utils.validate_output_path(self.journal_filename, is_file=True)
+        tmp_filename = self.journal_filename + '.tmp'
+        with open(tmp_filename, 'w') as file:
+            for path in self.pending:
+                file.write(f'ADD\t{path}\n')
+        os.replace(tmp_filename, self.journal_filename)
+
+    def write_journal(self, line):
+        """Append line to the journal. Condition must be held."""
+        self.journal_file.write(line + '\n')
+        self.journal_file.flush()
+
+    def mirror_path(self, path):
+        return os.path.join(
+            self.mirror_dir, os.path.relpath(path, self.base_dir))
+
+    def add(self, file_list):
+        """Queue the files (or directories) in file_list for copying.
+        Files already waiting in the queue are not added again."""
+        with self.condition:
+            for path in file_list:
+                path = os.path.abspath(path)
+                if path in self.pending:
+                    continue
+                self.write_journal(f'ADD\t{path}')
+                self.pending.append(path)
+            self.condition.notify_all()
+
+    @property
+    def backlog(self):
+        """Number of files waiting to be copied or being copied."""
+        with self.condition:
+            return len(self.pending) + len(self.in_progress)
+
+    def bandwidth(self):
+        """Return the average copy rate (in bytes/s) during the last
+        BANDWIDTH_WINDOW seconds."""
+        with self.condition:
+            self.discard_old_copies()
+            return sum(size for _, size in self.recent_copies) / BANDWIDTH_WINDOW
+
+    def discard_old_copies(self):
+        while (self.recent_copies
+               and self.recent_copies[0][0] < time() - BANDWIDTH_WINDOW):
+            self.recent_copies.popleft()
+
+    def metrics(self):
+        """Return a dictionary with the current state of the queue."""
+        with self.condition:
+            pending_paths = list(self.pending) + list(self.in_progress)
+        pending_bytes = 0
+        for path in pending_paths:
+            try:
+                pending_bytes += os.path.getsize(path)
+            except OSError:
+                pass
+        return {'backlog': len(pending_paths),
+                'backlog_bytes': pending_bytes,
+                'bandwidth': self.bandwidth(),
+                'files_copied': self.files_copied,
+                'bytes_copied': self.bytes_copied,
+                'last_error': self.last_error}
+
+    def wait_until_empty(self, timeout=None):
+        """Wait until all queued files have been copied. Return True if the
+        queue is empty."""
+        deadline = None if timeout is None else time() + timeout
+        with self.condition:
+            while self.pending or self.in_progress:
+                remaining = None if deadline is None else deadline - time()
+                if remaining is not None and remaining <= 0:
+                    break
+                self.condition.wait(remaining)
+            return not (self.pending or self.in_progress)
+
+    def close(self, timeout=30):
+        """Wait up to timeout seconds for the queue to be empty, then stop
+        the workers. Files not copied remain in the journal."""
+        success = self.wait_until_empty(timeout)
+        with self.condition:
+            self.stop_requested = True
+            self.condition.notify_all()
+        for worker in self.workers:
+            worker.join(timeout=1)
+        with self.condition:
+            self.journal_file.close()
+        return success
+
+    def next_path(self):
+        """Return the first pending path that is due to be copied, or None
+        and the time (in s) until the next retry is due (None if there are
+        no pending paths). Condition must be held."""
+        now = time()
+        next_retry = None
+        for path in self.pending:
+            retry_time = self.retry_times.get(path, 0)
+            if retry_time <= now:
+                return path, None
+            if next_retry is None or retry_time < next_retry:
+                next_retry = retry_time
+        return None, None if next_retry is None else next_retry - now
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.stop_requested:
+                    path, wait_time = self.next_path()
+                    if path is not None:
+                        break
+                    self.condition.wait(wait_time)
+                if self.stop_requested:
+                    return
+                self.pending.remove(path)
+                self.in_progress.add(path)
+
+            try:
+                size, checksum = self.copy(path)
+                error = None
+            except Exception as e:
+                error = str(e)
+
+            with self.condition:
+                self.in_progress.discard(path)
+                if error is None:
+                    self.retry_times.pop(path, None)
+                    self.failures = 0
+                    self.last_error = None
+                    self.files_copied += 1
+                    self.bytes_copied += size
+                    self.recent_copies.append((time(), size))
+                    self.discard_old_copies()
+                    if not self.journal_file.closed:
+                        self.write_journal(f'DONE\t{path}\t{checksum}')
+                elif not os.path.exists(path):
+                    # File was deleted on the primary drive before it was
+                    # copied (for example a discarded tile)
+                    self.retry_times.pop(path, None)
+                    if not self.journal_file.closed:
+                        self.write_journal(f'DONE\t{path}\t')
+                else:
+                    self.failures += 1
+                    self.last_error = error
+                    utils.log_warning(
+                        'CTRL', f'Mirror queue: copying {path} failed: {error}')
+                    # Retry later. Other workers continue with other files
+                    # and do not copy this file before its retry time.
+                    delay = min(self.retry_interval * 2 ** (self.failures - 1),
+                                self.max_retry_interval)
+                    self.retry_times[path] = time() + delay
+                    if path not in self.pending:
+                        self.pending.append(path)
+                self.condition.notify_all()
+
+    def copy(self, path):
+        """Copy file or directory at path to the mirror drive. Return the
+        number of bytes copied and the checksum."""
+        hasher = hashlib.blake2b()
+        size = 0
+        if os.path.isdir(path):
+            for dir_path, _, file_names in sorted(os.walk(path)):
+                for file_name in sorted(file_names):
+                    file_path = os.path.join(dir_path, file_name)
+                    size += self.copy_file(file_path, hasher)
+        else:
+            size = self.copy_file(path, hasher)
+        return size, hasher.hexdigest()
+
+    def copy_file(self, path, hasher):
+        """Copy a single file, computing its checksum while copying. The copy
+        is written to a temporary file, which is renamed when complete."""
+        dst_path = self.mirror_path(path)
+        utils.validate_output_path(dst_path, is_file=True)
+        tmp_path = dst_path + '.part'
+        file_hasher = hashlib.blake2b()
+        size = 0
+        with open(path, 'rb') as src_file, open(tmp_path, 'wb') as dst_file:
+            while True:
+                chunk = src_file.read(COPY_CHUNK_SIZE)
+                if not chunk:
+                    break
+                file_hasher.update(chunk)
+                hasher.update(chunk)
+                self.write_chunk(dst_file, chunk)
+                size += len(chunk)
+        if self.verify:
+            copy_hasher = hashlib.blake2b()
+            with open(tmp_path, 'rb') as file:
+                for chunk in iter(lambda: file.read(COPY_CHUNK_SIZE), b''):
+                    copy_hasher.update(chunk)
+            if copy_hasher.digest() != file_hasher.digest():
+                os.remove(tmp_path)
+                raise IOError(f'Checksum mismatch for copy of {path}')
+        os.replace(tmp_path, dst_path)
+        return size
+
+    def write_chunk(self, file, chunk):
+        file.write(chunk)
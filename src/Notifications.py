@@ -28,6 +28,9 @@ from email import encoders, message_from_string
 
 import constants
 import utils
+from image_io import imwrite
+from reslice_io import read_reslice
+from MetadataClient import MetadataClient
 
 
 class Notifications:
@@ -76,6 +79,10 @@ class Notifications:
         self.metadata_server_url = self.syscfg['metaserver']['url']
         self.metadata_server_admin_email = (
             self.syscfg['metaserver']['admin_email'])
+        self.metadata_batch_interval = float(
+            self.cfg['sys'].get('metadata_batch_interval', '0'))
+        # Background client for metadata requests during acquisitions
+        self.metadata_client = None
 
     def save_to_cfg(self):
         self.cfg['monitoring']['user_email'] = self.user_email_addresses[0]
@@ -105,6 +112,8 @@ class Notifications:
             self.metadata_server_admin_email)
         self.cfg['sys']['metadata_server_admin'] = (
             self.metadata_server_admin_email)
+        self.cfg['sys']['metadata_batch_interval'] = str(
+            self.metadata_batch_interval)
 
     def send_email(self, subject, main_text, attached_files=[],
                    recipients=[]):
@@ -211,17 +220,13 @@ class Notifications:
         if self.send_ov_reslices:
             for ov_index in self.status_report_ov_list:
                 save_path = utils.ov_reslice_save_path(base_dir, ov_index)
-                if os.path.isfile(save_path):
-                    ov_reslice_img = Image.open(save_path)
-                    height = ov_reslice_img.size[1]
+                # Last 1000 lines of the reslice
+                ov_reslice_img = read_reslice(save_path, 1000)
+                if ov_reslice_img is not None:
                     cropped_ov_reslice_save_path = os.path.join(
                         base_dir, 'workspace', 'reslice_OV'
                         + str(ov_index).zfill(constants.OV_DIGITS) + constants.OV_IMAGE_FORMAT)
-                    if height > 1000:
-                        ov_reslice_img.crop(0, height - 1000, 400, height).save(
-                            cropped_ov_reslice_save_path)
-                    else:
-                        ov_reslice_img.save(cropped_ov_reslice_save_path)
+                    imwrite(cropped_ov_reslice_save_path, ov_reslice_img)
                     attachment_list.append(cropped_ov_reslice_save_path)
                     temp_file_list.append(cropped_ov_reslice_save_path)
                 else:
@@ -230,20 +235,16 @@ class Notifications:
             for tile_key in self.status_report_tile_list:
                 grid_index, tile_index = tile_key.split('.')
                 save_path = utils.tile_reslice_save_path(
-                    base_dir, grid_index, tile_index)
-                if os.path.isfile(save_path):
-                    reslice_img = Image.open(save_path)
-                    height = reslice_img.size[1]
+                    base_dir, grid_index, tile_index=tile_index)
+                # Last 1000 lines of the reslice
+                reslice_img = read_reslice(save_path, 1000)
+                if reslice_img is not None:
                     cropped_reslice_save_path = os.path.join(
                         base_dir, 'workspace', 'reslice_tile_g'
                         + str(grid_index).zfill(constants.GRID_DIGITS)
                         + 't' + str(tile_index).zfill(constants.TILE_DIGITS)
                         + constants.GRIDTILE_IMAGE_FORMAT)
-                    if height > 1000:
-                        reslice_img.crop(0, height - 1000, 400, height).save(
-                            cropped_reslice_save_path)
-                    else:
-                        reslice_img.save(cropped_reslice_save_path)
+                    imwrite(cropped_reslice_save_path, reslice_img)
                     attachment_list.append(cropped_reslice_save_path)
                     temp_file_list.append(cropped_reslice_save_path)
                 else:
@@ -354,8 +355,29 @@ class Notifications:
         except:
             return 'ERROR'
 
+    def start_metadata_client(self, outbox_dir):
+        """Start sending metadata in the background. Records not sent
+        during a previous run (found in outbox_dir) are sent first."""
+        if self.metadata_client is None:
+            self.metadata_client = MetadataClient(
+                self.metadata_server_url, outbox_dir,
+                batch_interval=self.metadata_batch_interval)
+
+    def stop_metadata_client(self, timeout=5):
+        """Try to send all queued metadata within timeout and stop the
+        client. Return True if all metadata has been sent."""
+        success = True
+        if self.metadata_client is not None:
+            success = self.metadata_client.close(timeout)
+            self.metadata_client = None
+        return success
+
     def metadata_put_request(self, endpoint, data):
-        """Send a PUT request to the metadata server."""
+        """Send a PUT request to the metadata server. If the metadata client
+        is running, the request is queued and status 202 is returned."""
+        if self.metadata_client is not None:
+            self.metadata_client.queue('PUT', endpoint, data)
+            return 202, ''
         exception_str = ''
         try:
             r = requests.put(self.metadata_server_url + endpoint, json=data)
@@ -365,8 +387,12 @@ class Notifications:
             exception_str = str(e)
         return status, exception_str
 
-    def metadata_post_request(self, endpoint, data):
-        """Send a POST request to the metadata server."""
+    def metadata_post_request(self, endpoint, data, batch=False):
+        """Send a POST request to the metadata server. If the metadata client
+        is running, the request is queued and status 202 is returned."""
+        if self.metadata_client is not None:
+            self.metadata_client.queue('POST', endpoint, data, batch)
+            return 202, ''
         exception_str = ''
         try:
             r = requests.post(self.metadata_server_url + endpoint, json=data)
@@ -427,11 +453,13 @@ class Notifications:
             + '/session/stopped', session_stopped_metadata)
 
     def send_tile_metadata(self, project_name, stack_name, tile_metadata):
-        """Send tile metadata after each tile acquisition."""
+        """Send tile metadata after each tile acquisition. If the metadata
+        client is running, the metadata of consecutive tiles is sent as a
+        list (see metadata_batch_interval)."""
         return self.metadata_post_request(
            '/project/' + project_name
             + '/stack/' + stack_name
-            + '/tile/completed', tile_metadata)
+            + '/tile/completed', tile_metadata, batch=True)
 
     def send_ov_metadata(self, project_name, stack_name, ov_metadata):
         """Send overview metadata after each overview acquisition."""
@@ -441,8 +469,17 @@ class Notifications:
             + '/ov/completed', ov_metadata)
 
     def read_server_message(self, project_name, stack_name):
-        """Read a message from the metadata server."""
-        return self.metadata_get_request(
-           '/project/' + project_name
-            + '/stack/' + stack_name
-            + '/signal/read')
+        """Read a message from the metadata server. If the metadata client is
+        running, the message requested by the previous call is returned
+        (status None if there is no message yet) and a new message is
+        requested in the background."""
+        endpoint = ('/project/' + project_name
+                    + '/stack/' + stack_name
+                    + '/signal/read')
+        if self.metadata_client is not None:
+            message = self.metadata_client.pop_server_message()
+            self.metadata_client.poll(endpoint)
+            if message is None:
+                return None, None, None, ''
+            return message
+        return self.metadata_get_request(endpoint)
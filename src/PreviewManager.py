@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+
+# ==============================================================================
+#   This source file is part of SBEMimage (github.com/SBEMimage)
+#   (c) 2018-2020 Friedrich Miescher Institute for Biomedical Research, Basel,
+#   and the SBEMimage developers.
+#   This software is licensed under the terms of the MIT License.
+#   See LICENSE.txt in the project root folder.
+# ==============================================================================
+
+"""This module loads tile previews on demand and keeps them within a memory
+budget.
+
+When a project is opened, only the file paths of the available previews are
+registered (Tile.preview_src). The Viewport requests the previews of the
+tiles it currently shows, and these are loaded in a background thread. Loaded
+previews are kept in an LRU cache; if the memory budget is exceeded, previews
+of tiles that are not visible are released first. Previews of newly acquired
+tiles that have not been saved to disk yet are saved by the loader thread
+when they are released, outside the lock, so that eviction triggered from
+the GUI thread does not wait for the disk. Previews are kept as QImages,
+which (unlike QPixmaps) can be created and saved in the loader thread.
+"""
+
+import os
+import threading
+
+from collections import OrderedDict
+
+import utils
+from constants import PREVIEW_CACHE_SIZE
+from image_io import imread
+
+
+class PreviewManager:
+
+    def __init__(self, max_bytes=PREVIEW_CACHE_SIZE, on_loaded=None):
+        self.max_bytes = max_bytes
+        # Called (from the loader thread) after requested previews have
+        # been loaded, for example to redraw the Viewport
+        self.on_loaded = on_loaded
+        self.condition = threading.Condition()
+        # Tiles with a preview in memory and its size: {tile: nbytes}
+        # (least recently used first)
+        self.loaded = OrderedDict()
+        self.nbytes = 0
+        # Previews not saved to disk yet: {tile: path}
+        self.unsaved = {}
+        # Released previews to be saved by the loader thread: [(path, QImage)]
+        self.to_save = []
+        # Previews being saved by the loader thread
+        self.saving = []
+        # Tiles waiting to be loaded: {tile: path}
+        self.pending = OrderedDict()
+        # Tiles currently shown in the Viewport
+        self.visible = set()
+        # Tile whose preview is being loaded
+        self.loading = None
+        self.number_loaded = 0
+        self.stop_requested = False
+        self.worker = threading.Thread(target=self.run, daemon=True)
+        self.worker.start()
+
+    @staticmethod
+    def preview_nbytes(image):
+        return image.height() * image.bytesPerLine()
+
+    def register(self, tile, path):
+        """Set the preview file of tile without loading it."""
+        with self.condition:
+            self._release(tile, save=False)
+            tile.preview_src = path
+
+    def set_preview(self, tile, image, path):
+        """Set a new preview (QImage) of tile. It is saved as path when it
+        is released, or by the caller of take_unsaved()."""
+        with self.condition:
+            self._release(tile, save=False)
+            tile.preview_src = path
+            tile.preview_img = image
+            self.unsaved[tile] = path
+            self._add(tile, image)
+            self._evict()
+
+    def take_unsaved(self):
+        """Return the previews that have not been saved yet (including
+        released previews not yet saved by the loader thread) as a list of
+        (path, QImage) and mark them as saved. The caller must save them."""
+        with self.condition:
+            unsaved = self.to_save + [
+                (path, tile.preview_img)
+                for tile, path in self.unsaved.items()
+                if tile.preview_img is not None]
+            self.unsaved.clear()
+            self.to_save = []
+        return unsaved
+
+    def request(self, visible_tiles, missing_tiles):
+        """Update the tiles shown in the Viewport (visible_tiles) and load
+        the previews of missing_tiles in the background. Previews requested
+        earlier and not loaded yet are discarded."""
+        with self.condition:
+            self.visible = set(visible_tiles)
+            for tile in visible_tiles:
+                if tile in self.loaded:
+                    self.loaded.move_to_end(tile)
+            self.pending = OrderedDict(
+                (tile, tile.preview_src) for tile in missing_tiles
+                if tile.preview_src and tile not in self.loaded)
+            self._evict()
+            self.condition.notify_all()
+
+    def _add(self, tile, image):
+        nbytes = self.preview_nbytes(image)
+        self.loaded[tile] = nbytes
+        self.nbytes += nbytes
+
+    def _release(self, tile, save=True):
+        """Release the preview of tile. If it has not been saved, it is
+        handed to the loader thread to be saved. Condition must be held."""
+        nbytes = self.loaded.pop(tile, None)
+        if nbytes is not None:
+            self.nbytes -= nbytes
+        path = self.unsaved.pop(tile, None)
+        if save and path is not None and tile.preview_img is not None:
+            self.to_save.append((path, tile.preview_img))
+            self.condition.notify_all()
+        tile.preview_img = None
+
+    def _evict(self):
+        """Release least recently used previews of tiles that are not
+        visible until the memory budget is met. Condition must be held."""
+        for tile in list(self.loaded):
+            if self.nbytes <= self.max_bytes:
+                break
+            if tile not in self.visible or tile.preview_img is None:
+                self._release(tile)
+
+    def _budget_full(self):
+        """True if the budget is used up by visible previews."""
+        return (self.nbytes >= self.max_bytes
+                and all(tile in self.visible for tile in self.loaded))
+
+    def _save_released(self):
+        """Save the released previews (loader thread). Return False if there
+        were none."""
+        with self.condition:
+            self.saving, self.to_save = self.to_save, []
+        if not self.saving:
+            return False
+        for path, image in self.saving:
+            image.save(path)
+        with self.condition:
+            self.saving = []
+            self.condition.notify_all()
+        return True
+
+    def run(self):
+        while True:
+            # Released previews are saved before previews are loaded, so
+            # that a preview released and requested again is found on disk
+            while self._save_released():
+                pass
+            with self.condition:
+                while (not self.pending and not self.to_save
+                       and not self.stop_requested):
+                    self.condition.wait()
+                if self.stop_requested:
+                    break
+                if self.to_save:
+                    continue
+                if self._budget_full():
+                    # Placeholders are shown for the remaining tiles
+                    self.pending.clear()
+                    continue
+                tile, path = self.pending.popitem(last=False)
+                self.loading = tile
+            image = None
+            if os.path.isfile(path):
+                try:
+                    image = utils.image_to_QImage(imread(path))
+                except Exception:
+                    pass
+            with self.condition:
+                # Discard if preview was changed in the meantime
+                if (image is not None and tile.preview_src == path
+                        and tile.preview_img is None):
+                    tile.preview_img = image
+                    self._add(tile, image)
+                    self.number_loaded += 1
+                    self._evict()
+                self.loading = None
+                finished = not self.pending
+                self.condition.notify_all()
+            if finished and self.on_loaded is not None:
+                self.on_loaded()
+        self._save_released()
+
+    def wait_until_loaded(self, timeout=None):
+        """Wait until all requested previews have been loaded and the
+        released previews have been saved. For tests."""
+        with self.condition:
+            return self.condition.wait_for(
+                lambda: (not self.pending and self.loading is None
+                         and not self.to_save and not self.saving),
+                timeout=timeout)
+
+    def close(self):
+        with self.condition:
+            self.stop_requested = True
+            self.condition.notify_all()
+        self.worker.join()
@@ -15,6 +15,8 @@ Depending on the initialization, either the microtome stage or the SEM stage or
 some other custom stage will be used when carrying out the commands.
 """
 
+import tile_route
+
 
 class Stage:
     def __init__(self, sem, microtome, use_microtome=True):
@@ -171,6 +173,14 @@ class Stage:
         return self._stage.stage_move_duration(
             from_x, from_y, to_x, to_y)
 
+    def stage_move_durations(self, from_sx_sy, to_sx_sy):
+        """Return the matrix of move durations from each position in
+        from_sx_sy to each position in to_sx_sy (arrays of stage positions)
+        using the same model as stage_move_duration()."""
+        return tile_route.move_durations(
+            from_sx_sy, to_sx_sy, self.motor_speed_x, self.motor_speed_y,
+            self.stage_move_wait_interval)
+
     @property
     def limits(self):
         return self._stage.stage_limits
@@ -1,4 +1,6 @@
 import os
+import threading
+from qtpy.QtGui import QPainter, QPixmap
 
 import utils
 from Grid import Grid
@@ -25,15 +27,37 @@ class StubOverview(Grid):
         self.lm_mode = False
         # Set the centre coordinates, which will update the origin.
         self.centre_sx_sy = centre_sx_sy
-        # QPixmaps of current stub OV (original and downsampled)
+        # QImages of current stub OV (original and downsampled). They can
+        # be updated outside the GUI thread (acquisition thread); they are
+        # converted to QPixmaps in image(), which is called by the Viewport
+        # in the GUI thread.
+        self.images_ = {1: None, 2: None, 4: None, 8: None, 16: None}
+        # QPixmaps converted from images_, and the mags whose QImage has
+        # changed since the last conversion
         self.pixmaps_ = {1: None, 2: None, 4: None, 8: None, 16: None}
-        # QPixmaps are loaded when file path is set/changed.
+        self.changed_ = set()
+        self.images_lock = threading.Lock()
+        # QImages are loaded when file path is set/changed.
         self.vp_file_path = vp_file_path
 
     def image(self, mag=1):
-        if mag in [1, 2, 4, 8, 16]:
+        """Return the stub OV (downsampled by mag) as QPixmap. Must be
+        called in the GUI thread."""
+        if mag not in [1, 2, 4, 8, 16]:
+            return None
+        with self.images_lock:
+            if mag in self.changed_:
+                image = self.images_[mag]
+                self.pixmaps_[mag] = (QPixmap.fromImage(image)
+                                      if image is not None else None)
+                self.changed_.discard(mag)
             return self.pixmaps_[mag]
-        return None
+
+    def _set_images(self, images):
+        """Replace the QImages ({mag: QImage or None})."""
+        with self.images_lock:
+            self.images_ = images
+            self.changed_ = set(images)
 
     @property
     def vp_file_path(self):
@@ -42,15 +66,42 @@ class StubOverview(Grid):
     @vp_file_path.setter
     def vp_file_path(self, file_path):
         self._vp_file_path = file_path
-        # Release old images
-        del self.pixmaps_
-        self.pixmaps_ = {1: None, 2: None, 4: None, 8: None, 16: None}
-        # Load images as QPixmaps:
+        # Load images as QImages:
         file_exists = os.path.isfile(file_path)
+        images = {}
         for level, mag in enumerate([1, 2, 4, 8, 16]):
             image = None
             if file_exists:
                 image = imread(file_path, level=level)
                 if image is not None:
-                    image = utils.image_to_QPixmap(image)
-            self.pixmaps_[mag] = image
+                    image = utils.image_to_QImage(image)
+            images[mag] = image
+        self._set_images(images)
+
+    def show_mosaic(self, mosaic):
+        """Show the pyramid levels of mosaic (MosaicWriter) in the Viewport
+        while the stub OV is being acquired."""
+        images = {}
+        for level, mag in enumerate([1, 2, 4, 8, 16]):
+            image = None
+            if level < len(mosaic.levels):
+                image = utils.image_to_QImage(mosaic.levels[level])
+            images[mag] = image
+        self._set_images(images)
+
+    def update_mosaic_region(self, mosaic, rect):
+        """Update only the region rect (x, y, width, height) of the QImages
+        shown in the Viewport from mosaic (MosaicWriter)."""
+        for level, mag in enumerate([1, 2, 4, 8, 16]):
+            if level >= len(mosaic.levels):
+                continue
+            x, y, region = mosaic.level_region(level, rect)
+            region = utils.image_to_QImage(region)
+            with self.images_lock:
+                image = self.images_[mag]
+                if image is None:
+                    continue
+                painter = QPainter(image)
+                painter.drawImage(x, y, region)
+                painter.end()
+                self.changed_.add(mag)
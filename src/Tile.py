@@ -1,8 +1,32 @@
 import numpy as np
-import os
 
-from image_io import imread
-import utils
+
+class TileArrays:
+    """Store the positions, working distances, stigmation parameters and
+    flags of all tiles in a grid as contiguous arrays (one row per tile).
+    Grid operations (position updates, activating tiles, averages) work
+    on these arrays directly.
+    """
+
+    def __init__(self, number_tiles):
+        # See class Tile for a description of the parameters
+        self.px_py = np.zeros((number_tiles, 2))
+        self.dx_dy = np.zeros((number_tiles, 2))
+        self.sx_sy = np.zeros((number_tiles, 2))
+        self.wd = np.zeros(number_tiles)
+        self.stig_xy = np.zeros((number_tiles, 2))
+        self.tile_active = np.zeros(number_tiles, dtype=bool)
+        self.autofocus_active = np.zeros(number_tiles, dtype=bool)
+        self.wd_grad_active = np.zeros(number_tiles, dtype=bool)
+
+    def __len__(self):
+        return len(self.wd)
+
+    def copy_from(self, other, indices, other_indices):
+        """Copy the parameters of the tiles other_indices in other to the
+        tiles indices."""
+        for name in vars(self):
+            getattr(self, name)[indices] = getattr(other, name)[other_indices]
 
 
 class Tile:
@@ -11,23 +35,36 @@ class Tile:
     Note that the tile size and all acquisition parameters are set in
     class Grid because all tiles in a grid have the same size and
     acquisition parameters.
+    A Tile is a view of row index in the TileArrays of its grid. Positions
+    and stigmation parameters are returned as copies (stig_xy as a list);
+    assign the full value to change them.
     """
 
-    # TBD: Keep this class or include as dict in class Grid?
-    # Or make this a dataclass (new in Python 3.7)?
+    __slots__ = ('arrays', 'index', 'preview_img', '_preview_src')
 
     def __init__(self, px_py=(0, 0), dx_dy=(0, 0), sx_sy=(0, 0),
                  wd=0, stig_xy=(0, 0), tile_active=False,
-                 autofocus_active=False, wd_grad_active=False):
+                 autofocus_active=False, wd_grad_active=False,
+                 arrays=None, index=0):
+        self.preview_img = None
+        self._preview_src = ''
+        if arrays is not None:
+            # View of existing tile parameters
+            self.arrays = arrays
+            self.index = index
+            return
+        # Stand-alone tile with its own arrays
+        self.arrays = TileArrays(1)
+        self.index = 0
         # Relative pixel (p) coordinates of the tile, unrotated grid:
         # Upper left (origin) tile: 0, 0
-        self.px_py = np.array(px_py)
+        self.px_py = px_py
         # Relative SEM (d) coordinates (distances as shown in SEM images)
         # with grid rotation applied (if theta <> 0)
-        self.dx_dy = np.array(dx_dy)
+        self.dx_dy = dx_dy
         # Absolute stage coordinates in microns. The stage calibration
         # parameters are needed to calculate these coordinates.
-        self.sx_sy = np.array(sx_sy)
+        self.sx_sy = sx_sy
         # wd: working distance in m
         self.wd = wd
         # stig_xy: stigmation parameters in %
@@ -38,7 +75,70 @@ class Tile:
         self.tile_active = tile_active
         self.autofocus_active = autofocus_active
         self.wd_grad_active = wd_grad_active
-        self.preview_img = None
+
+    @property
+    def px_py(self):
+        return self.arrays.px_py[self.index].copy()
+
+    @px_py.setter
+    def px_py(self, px_py):
+        self.arrays.px_py[self.index] = px_py
+
+    @property
+    def dx_dy(self):
+        return self.arrays.dx_dy[self.index].copy()
+
+    @dx_dy.setter
+    def dx_dy(self, dx_dy):
+        self.arrays.dx_dy[self.index] = dx_dy
+
+    @property
+    def sx_sy(self):
+        return self.arrays.sx_sy[self.index].copy()
+
+    @sx_sy.setter
+    def sx_sy(self, sx_sy):
+        self.arrays.sx_sy[self.index] = sx_sy
+
+    @property
+    def wd(self):
+        return float(self.arrays.wd[self.index])
+
+    @wd.setter
+    def wd(self, wd):
+        self.arrays.wd[self.index] = wd
+
+    @property
+    def stig_xy(self):
+        return self.arrays.stig_xy[self.index].tolist()
+
+    @stig_xy.setter
+    def stig_xy(self, stig_xy):
+        self.arrays.stig_xy[self.index] = stig_xy
+
+    @property
+    def tile_active(self):
+        return bool(self.arrays.tile_active[self.index])
+
+    @tile_active.setter
+    def tile_active(self, active):
+        self.arrays.tile_active[self.index] = active
+
+    @property
+    def autofocus_active(self):
+        return bool(self.arrays.autofocus_active[self.index])
+
+    @autofocus_active.setter
+    def autofocus_active(self, active):
+        self.arrays.autofocus_active[self.index] = active
+
+    @property
+    def wd_grad_active(self):
+        return bool(self.arrays.wd_grad_active[self.index])
+
+    @wd_grad_active.setter
+    def wd_grad_active(self, active):
+        self.arrays.wd_grad_active[self.index] = active
 
     @property
     def preview_src(self):
@@ -46,13 +146,9 @@ class Tile:
 
     @preview_src.setter
     def preview_src(self, src):
+        """Set the file path of the preview image. The image itself is
+        loaded on demand by the PreviewManager of the grid manager. The
+        preview in memory is released if the path changes."""
+        if src != self._preview_src:
+            self.preview_img = None
         self._preview_src = src
-        # Release old image
-        if self.preview_img is not None:
-            del self.preview_img
-        self.preview_img = None
-        if os.path.isfile(src):
-            try:
-                self.preview_img = utils.image_to_QPixmap(imread(src))
-            except:
-                pass
@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+
+# ==============================================================================
+#   This source file is part of SBEMimage (github.com/SBEMimage)
+#   (c) 2018-2020 Friedrich Miescher Institute for Biomedical Research, Basel,
+#   and the SBEMimage developers.
+#   This software is licensed under the terms of the MIT License.
+#   See LICENSE.txt in the project root folder.
+# ==============================================================================
+
+"""This module records how long the phases of an acquisition take.
+
+A phase (stage move, frame grab, inspection, cut, ...) is timed with a span:
+
+    with self.tracer.span('grab'):
+        self.sem.acquire_frame(...)
+
+Each span adds a record to a ring buffer in memory. After each slice, the
+buffer is flushed to a CSV file in meta/stats, and the durations are kept
+for the most recent slices to show per-phase percentiles and the main sources
+of idle time (time on the acquisition thread in which no frame is acquired)
+in the acquisition statistics dialog. Spans can be nested (for example a
+'save' span in an 'inspect' span). The time of nested spans is subtracted
+from the enclosing span in the summary and the idle sources, so that it is
+counted only once.
+"""
+
+import threading
+
+from collections import defaultdict, deque
+from time import perf_counter
+
+import numpy as np
+
+from constants import TRACE_BUFFER_SIZE, TRACE_SUMMARY_SLICES
+
+
+# Phases in which frames are acquired. All other phases on the acquisition
+# thread, and the time not covered by any span, count as idle time.
+SCAN_PHASES = ('grab',)
+# Idle source for the time on the acquisition thread not covered by any span
+UNTRACED = 'untraced'
+
+CSV_HEADER = 'slice,phase,thread,start_s,duration_s,parent\n'
+
+
+class Span:
+    """Time one phase, see Tracer.span(). The duration (in seconds) is
+    available after the with block."""
+    __slots__ = ('buffer', 'phase', 'stack', 'parent', 'start', 'duration',
+                 'child_duration')
+
+    def __init__(self, buffer, phase, stack):
+        self.buffer = buffer
+        self.phase = phase
+        # Spans of the calling thread that are currently open
+        self.stack = stack
+        self.parent = None
+        self.start = None
+        self.duration = None
+        # Total duration of the spans nested in this span
+        self.child_duration = 0
+
+    def __enter__(self):
+        if self.stack:
+            self.parent = self.stack[-1]
+        self.stack.append(self)
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.duration = perf_counter() - self.start
+        self.stack.pop()
+        parent_phase = ''
+        if self.parent is not None:
+            self.parent.child_duration += self.duration
+            parent_phase = self.parent.phase
+        self.buffer.append(
+            (self.phase, self.start, self.duration, threading.get_ident(),
+             parent_phase, self.duration - self.child_duration))
+        return False
+
+
+class Tracer:
+
+    def __init__(self, buffer_size=TRACE_BUFFER_SIZE,
+                 summary_slices=TRACE_SUMMARY_SLICES):
+        # Spans recorded since the last flush: (phase, start, duration,
+        # thread id, phase of enclosing span or '', duration without nested
+        # spans). The spans may be recorded in several threads
+        # (deque.append() is thread-safe).
+        self.buffer = deque(maxlen=buffer_size)
+        # Open spans of each thread (for nested spans)
+        self.local = threading.local()
+        # Most recent slices: (slice_counter, duration,
+        # {phase: durations of all spans}, {phase: total on acq. thread}).
+        # The durations do not include the time of nested spans.
+        self.slices = deque(maxlen=summary_slices)
+        self.lock = threading.Lock()
+        self.file = None
+        self.file_name = None
+        # Thread that runs the acquisition (the thread that called open())
+        self.acq_thread = threading.get_ident()
+        # Thread ids are numbered in the CSV file: 0 is the acquisition thread
+        self.thread_numbers = {}
+        self.start_time = self.slice_start_time = perf_counter()
+
+    def span(self, phase):
+        """Return a context manager that records the duration of phase."""
+        try:
+            stack = self.local.stack
+        except AttributeError:
+            stack = self.local.stack = []
+        return Span(self.buffer, phase, stack)
+
+    def open(self, file_name):
+        """Start a new run: record the spans of the calling thread as
+        spans of the acquisition thread and write them to the CSV file
+        file_name after each slice."""
+        self.close()
+        self.buffer.clear()
+        self.acq_thread = threading.get_ident()
+        self.thread_numbers = {self.acq_thread: 0}
+        self.start_time = self.slice_start_time = perf_counter()
+        self.file_name = file_name
+        self.file = open(file_name, 'w')
+        self.file.write(CSV_HEADER)
+        self.file.flush()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def start_slice(self):
+        """Start timing the duration of a slice (until the next flush)."""
+        self.slice_start_time = perf_counter()
+
+    def flush(self, slice_counter):
+        """Write all spans recorded since the previous flush to the CSV file
+        and add them to the summary as slice slice_counter (the slice that
+        was acquired). Return (success, error_msg)."""
+        now = perf_counter()
+        # Only this method removes records, so the count cannot shrink
+        records = [self.buffer.popleft() for _ in range(len(self.buffer))]
+        durations = defaultdict(list)
+        acq_thread_totals = defaultdict(float)
+        lines = []
+        for phase, start, duration, thread, parent, own_duration in records:
+            durations[phase].append(own_duration)
+            if thread == self.acq_thread:
+                acq_thread_totals[phase] += own_duration
+            thread_number = self.thread_numbers.setdefault(
+                thread, len(self.thread_numbers))
+            lines.append(f'{slice_counter},{phase},{thread_number},'
+                         f'{start - self.start_time:.6f},{duration:.6f},'
+                         f'{parent}\n')
+        with self.lock:
+            self.slices.append((
+                slice_counter, now - self.slice_start_time,
+                {phase: np.array(values)
+                 for phase, values in durations.items()},
+                dict(acq_thread_totals)))
+        self.slice_start_time = now
+        if self.file is None:
+            return True, ''
+        try:
+            self.file.writelines(lines)
+            self.file.flush()
+        except Exception as e:
+            return False, str(e)
+        return True, ''
+
+    def slice_durations(self):
+        """Return the durations (in seconds) of the most recent slices."""
+        with self.lock:
+            return [duration for _, duration, _, _ in self.slices]
+
+    def slice_totals(self):
+        """Return (slice_counter, duration, {phase: total duration}) of
+        the most recent slices, with the spans of the acquisition thread."""
+        with self.lock:
+            return [(slice_counter, duration, dict(totals))
+                    for slice_counter, duration, _, totals in self.slices]
+
+    def summary(self):
+        """Return the statistics of the span durations of the most recent
+        slices (in seconds) per phase: {phase: {'count', 'mean', 'p50',
+        'p90', 'p99', 'max', 'per_slice'}}. per_slice is the total duration
+        per slice. The durations do not include nested spans."""
+        with self.lock:
+            slices = list(self.slices)
+        durations = defaultdict(list)
+        for _, _, phase_durations, _ in slices:
+            for phase, values in phase_durations.items():
+                durations[phase].append(values)
+        summary = {}
+        for phase, arrays in durations.items():
+            values = np.concatenate(arrays)
+            p50, p90, p99 = np.percentile(values, [50, 90, 99])
+            summary[phase] = {
+                'count': len(values),
+                'mean': float(values.mean()),
+                'p50': float(p50),
+                'p90': float(p90),
+                'p99': float(p99),
+                'max': float(values.max()),
+                'per_slice': float(values.sum()) / len(slices),
+            }
+        return summary
+
+    def idle_sources(self, number_sources=5):
+        """Return the largest sources of idle time on the acquisition thread
+        in the most recent slices, sorted by duration: list of
+        (phase, seconds per slice, fraction of slice duration)."""
+        with self.lock:
+            slices = list(self.slices)
+        total_duration = sum(duration for _, duration, _, _ in slices)
+        if not slices or total_duration <= 0:
+            return []
+        totals = defaultdict(float)
+        traced = 0
+        for _, _, _, acq_thread_totals in slices:
+            for phase, total in acq_thread_totals.items():
+                traced += total
+                if phase not in SCAN_PHASES:
+                    totals[phase] += total
+        totals[UNTRACED] = max(total_duration - traced, 0)
+        sources = sorted(totals.items(), key=lambda item: item[1],
+                         reverse=True)[:number_sources]
+        return [(phase, total / len(slices), total / total_duration)
+                for phase, total in sources]
@@ -33,6 +33,8 @@ import acq_func
 import constants
 import utils
 from image_io import imread
+from reslice_io import read_reslice
+from vp_render_cache import RenderCache
 from dialog.viewport.ModifyImagesDlg import ModifyImagesDlg
 from dialog.viewport.ImportImageDlg import ImportImageDlg
 from dialog.viewport.TemplateRotationDlg import TemplateRotationDlg
@@ -61,6 +63,9 @@ class Viewport(QWidget):
         self.acq = acquisition
         self.img_inspector = img_inspector
         self.main_controls_trigger = main_controls_trigger
+        # Redraw when tile previews have been loaded in the background
+        self.gm.previews.on_loaded = (
+            lambda: self.main_controls_trigger.transmit('DRAW VP'))
 
         # Set Viewport zoom parameters depending on which stage is used for XY
         if self.stage.use_microtome_xy:
@@ -897,6 +902,8 @@ class Viewport(QWidget):
 
         # Canvas
         self.vp_canvas = QPixmap(self.cs.vp_width, self.cs.vp_height)
+        # Pre-scaled tiles of OVs, stub OVs and imported images
+        self.vp_render_cache = RenderCache()
         # Help panel
         self.vp_help_panel_img = QPixmap(
             os.path.join('..', 'img', 'help-viewport.png'))
@@ -1029,19 +1036,21 @@ class Viewport(QWidget):
         self.show_imported = self.checkBox_showImported.isChecked()
         self.vp_draw()
 
-    def vp_toggle_tile_acq_indicator(self, grid_index, tile_index):
+    def vp_toggle_tile_acq_indicator(self, grid_index, tile_index, redraw=True):
         if self.tile_acq_indicator[0] is None:
             self.tile_acq_indicator = [grid_index, tile_index]
         else:
             self.tile_acq_indicator = [None, None]
-        self.vp_draw()
+        if redraw:
+            self.vp_draw()
 
-    def vp_toggle_ov_acq_indicator(self, ov_index):
+    def vp_toggle_ov_acq_indicator(self, ov_index, redraw=True):
         if self.ov_acq_indicator is None:
             self.ov_acq_indicator = ov_index
         else:
             self.ov_acq_indicator = None
-        self.vp_draw()
+        if redraw:
+            self.vp_draw()
 
     def vp_toggle_show_stage_pos(self):
         self.show_stage_pos ^= True
@@ -1347,12 +1356,9 @@ class Viewport(QWidget):
 
     def vp_dx_dy_range(self):
         x_min, x_max, y_min, y_max = self.stage.limits
-        dx, dy = [0, 0, 0, 0], [0, 0, 0, 0]
-        dx[0], dy[0] = self.cs.convert_s_to_d((x_min, y_min))
-        dx[1], dy[1] = self.cs.convert_s_to_d((x_max, y_min))
-        dx[2], dy[2] = self.cs.convert_s_to_d((x_max, y_max))
-        dx[3], dy[3] = self.cs.convert_s_to_d((x_min, y_max))
-        return min(dx), max(dx), min(dy), max(dy)
+        dx, dy = self.cs.convert_s_to_d_batch(
+            [(x_min, y_min), (x_max, y_min), (x_max, y_max), (x_min, y_max)]).T
+        return dx.min(), dx.max(), dy.min(), dy.max()
 
     def vp_draw(self, suppress_labels=False, suppress_previews=False):
         """Draw all elements on Viewport canvas"""
@@ -1397,12 +1403,20 @@ class Viewport(QWidget):
         else:
             # show all grids
             grid_indices = range(self.gm.number_grids)
+        # Tiles shown with previews and tiles whose previews are not loaded
+        self.vp_preview_tiles_visible, self.vp_preview_tiles_missing = [], []
         for grid_index in grid_indices:
             self._vp_place_grid(grid_index,
                                 show_grid,
                                 show_previews,
                                 with_gaps,
                                 suppress_labels)
+        if (show_previews
+                and not self.fov_drag_active
+                and not self.grid_drag_active):
+            # Load missing previews in the background
+            self.gm.previews.request(self.vp_preview_tiles_visible,
+                                     self.vp_preview_tiles_missing)
 
         # Finally, show imported images
         if self.show_imported:
@@ -1615,6 +1629,29 @@ class Viewport(QWidget):
             return False
         return True
 
+    def _vp_elements_visible(self, vx, vy, width, height, resize_ratio,
+                             pivot_vx=0, pivot_vy=0, angle=0):
+        """Array version of _vp_element_visible() for elements of the same
+        size at the positions vx, vy (arrays). Return a boolean array."""
+        vx, vy = np.asarray(vx, dtype=float), np.asarray(vy, dtype=float)
+        # Corner offsets of the unrotated bounding box, shape (4,)
+        corners_x = np.array([0, width, 0, width]) * resize_ratio
+        corners_y = np.array([0, 0, height, height]) * resize_ratio
+        # All corners of all elements, shape (n, 4)
+        points_x = vx[:, np.newaxis] + corners_x
+        points_y = vy[:, np.newaxis] + corners_y
+        if angle > 0:
+            angle = radians(angle)
+            points_x -= pivot_vx
+            points_y -= pivot_vy
+            points_x, points_y = (
+                points_x * cos(angle) - points_y * sin(angle) + pivot_vx,
+                points_x * sin(angle) + points_y * cos(angle) + pivot_vy)
+        return ~((points_x.min(axis=1) > self.cs.vp_width)
+                 | (points_x.max(axis=1) < 0)
+                 | (points_y.min(axis=1) > self.cs.vp_height)
+                 | (points_y.max(axis=1) < 0))
+
     def _vp_place_stub_overview(self, stub_ovm):
         """Place stub overview image onto the Viewport canvas. Crop and resize
         the image before placing it. QPainter object self.vp_qp must be active
@@ -1635,20 +1672,19 @@ class Viewport(QWidget):
 
         width_px, height_px = np.array(stub_ovm.size_p()) // mag_level
         resize_ratio = resize_ratio0 * mag_level
-        # Crop and resize stub OV before placing it
-        visible, crop_area, vx_cropped, vy_cropped = self._vp_visible_area(
+        visible = self._vp_element_visible(
             vx, vy, width_px, height_px, resize_ratio)
         if visible:
             image = stub_ovm.image(mag=mag_level)
             if image is None:
                 return
-            cropped_img = image.copy(crop_area)
-            v_width = cropped_img.size().width()
-            cropped_resized_img = cropped_img.scaledToWidth(
-                int(v_width * resize_ratio))
-            # Draw stub OV on canvas
-            self.vp_qp.drawPixmap(QPointF(vx_cropped, vy_cropped),
-                                  cropped_resized_img)
+            # Draw the visible pre-scaled tiles of the stub OV on canvas
+            key = 'stub_lm' if stub_ovm.lm_mode else 'stub'
+            version = (stub_ovm.vp_file_path, stub_ovm.image().cacheKey())
+            self.vp_render_cache.draw(
+                self.vp_qp, key, version, stub_ovm.image, vx, vy,
+                resize_ratio0, self.cs.vp_width, self.cs.vp_height,
+                mag=mag_level)
             # Draw dark grey rectangle around stub OV
             pen = QPen(QColor(*constants.COLOUR_SELECTOR[11]), 2, Qt.SolidLine)
             self.vp_qp.setPen(pen)
@@ -1699,7 +1735,15 @@ class Viewport(QWidget):
             # Compute position of image in viewport:
             transform_s_d = self.cs.get_s_to_d_transform()
             center_position = utils.apply_transform(imported.centre_sx_sy, transform_s_d)
-            image = imported.image.transformed(utils.transform_to_QTransform(transform_s_d))
+            # The transformed image is only computed again if the image or
+            # the stage calibration has changed
+            version = (imported.image_src, imported.image.cacheKey(),
+                       tuple(np.ravel(transform_s_d)))
+            image = self.vp_render_cache.cached_level(('imported', index),
+                                                      version)
+            if image is None:
+                image = imported.image.transformed(
+                    utils.transform_to_QTransform(transform_s_d))
 
             width, height = image.width(), image.height()
             position = center_position - np.array([width, height]) / 2 * image_pixel_size / 1000
@@ -1707,19 +1751,14 @@ class Viewport(QWidget):
             #vx, vy = utils.apply_transform(position, transform_d_v)
             vx, vy = self.cs.convert_d_to_v(position)
 
-            # Get width and height of the imported QPixmap:
-            # Crop and resize image before placing it into viewport:
-            visible, crop_area, vx_cropped, vy_cropped = self._vp_visible_area(
-                vx, vy, width, height, resize_ratio)
-            if visible:
-                cropped_img = image.copy(crop_area)
-                v_width = cropped_img.size().width()
-                cropped_resized_img = cropped_img.scaledToWidth(
-                    int(v_width * resize_ratio))
+            if self._vp_element_visible(vx, vy, width, height, resize_ratio):
                 self.vp_qp.setOpacity(
                     1 - imported.transparency / 100)
-                self.vp_qp.drawPixmap(QPointF(vx_cropped, vy_cropped),
-                                      cropped_resized_img)
+                # Draw the visible pre-scaled tiles of the image
+                self.vp_render_cache.draw(
+                    self.vp_qp, ('imported', index), version,
+                    lambda mag: image if mag == 1 else None,
+                    vx, vy, resize_ratio, self.cs.vp_width, self.cs.vp_height)
                 self.vp_qp.setOpacity(1)
 
     def _vp_place_overview(self, ov_index,
@@ -1751,8 +1790,7 @@ class Viewport(QWidget):
                      or self.fov_drag_active
                      or self.grid_drag_active))
 
-        # Crop and resize OV before placing it.
-        visible, crop_area, vx_cropped, vy_cropped = self._vp_visible_area(
+        visible = self._vp_element_visible(
             vx, vy, width_px, height_px, resize_ratio)
 
         if not visible:
@@ -1788,14 +1826,14 @@ class Viewport(QWidget):
         if not self.ovm[ov_index].active:
             return
 
-        cropped_img = self.ovm[ov_index].image.copy(crop_area)
-        v_width = cropped_img.size().width()
-        cropped_resized_img = cropped_img.scaledToWidth(
-            int(v_width * resize_ratio))
         if not (self.ov_drag_active and ov_index == self.selected_ov):
-            # Draw OV
-            self.vp_qp.drawPixmap(QPointF(vx_cropped, vy_cropped),
-                                  cropped_resized_img)
+            # Draw the visible pre-scaled tiles of the OV
+            image = self.ovm[ov_index].image
+            version = (self.ovm[ov_index].vp_file_path, image.cacheKey())
+            self.vp_render_cache.draw(
+                self.vp_qp, ('ov', ov_index), version,
+                lambda mag: image if mag == 1 else None,
+                vx, vy, resize_ratio, self.cs.vp_width, self.cs.vp_height)
         # Draw blue rectangle around OV.
         self.vp_qp.setPen(
             QPen(QColor(*constants.COLOUR_SELECTOR[10]), 2, Qt.SolidLine))
@@ -1956,20 +1994,28 @@ class Viewport(QWidget):
             width_px = grid.tile_width_p()
             height_px = grid.tile_height_p()
 
-            for tile_index in grid.active_tiles:
-                vx = tile_map[tile_index][0] * resize_ratio
-                vy = tile_map[tile_index][1] * resize_ratio
-                tile_visible = self._vp_element_visible(
-                    topleft_vx + vx, topleft_vy + vy,
-                    width_px, height_px, resize_ratio,
-                    origin_vx, origin_vy, theta)
-                if not tile_visible:
-                    continue
-                # Show tile preview
-                preview_img = grid[tile_index].preview_img
+            active_tiles = np.array(grid.active_tiles, dtype=int)
+            tile_vx_vy = np.asarray(tile_map)[active_tiles] * resize_ratio
+            # Test the visibility of all active tiles at once
+            tiles_visible = self._vp_elements_visible(
+                topleft_vx + tile_vx_vy[:, 0], topleft_vy + tile_vx_vy[:, 1],
+                width_px, height_px, resize_ratio,
+                origin_vx, origin_vy, theta)
+            for tile_index, (vx, vy) in zip(active_tiles[tiles_visible],
+                                            tile_vx_vy[tiles_visible]):
+                # Show tile preview, or a placeholder if the preview has
+                # not been loaded yet
+                tile = grid[tile_index]
+                self.vp_preview_tiles_visible.append(tile)
+                preview_img = tile.preview_img
                 if preview_img is not None:
                     tile_img = preview_img.scaledToWidth(int(tile_width_v))
-                    self.vp_qp.drawPixmap(QPointF(vx, vy), tile_img)
+                    self.vp_qp.drawImage(QPointF(vx, vy), tile_img)
+                elif tile.preview_src:
+                    self.vp_preview_tiles_missing.append(tile)
+                    self.vp_qp.fillRect(
+                        QRectF(vx, vy, tile_width_v, tile_height_v),
+                        QColor(128, 128, 128, 60))
 
         # Display grid lines
         rows, cols = grid.size
@@ -2233,10 +2279,8 @@ class Viewport(QWidget):
         """Calculate and show bounding box around the area accessible to the
         stage motors."""
         x_min, x_max, y_min, y_max = self.stage.limits
-        b_left = self.cs.convert_d_to_v(self.cs.convert_s_to_d((x_min, y_min)))
-        b_top = self.cs.convert_d_to_v(self.cs.convert_s_to_d((x_max, y_min)))
-        b_right = self.cs.convert_d_to_v(self.cs.convert_s_to_d((x_max, y_max)))
-        b_bottom = self.cs.convert_d_to_v(self.cs.convert_s_to_d((x_min, y_max)))
+        b_left, b_top, b_right, b_bottom = self.cs.convert_s_to_v_batch(
+            [(x_min, y_min), (x_max, y_min), (x_max, y_max), (x_min, y_max)])
         self.vp_qp.setPen(QColor(255, 255, 255))
         self.vp_qp.drawLine(QPointF(*b_left), QPointF(*b_top))
         self.vp_qp.drawLine(QPointF(*b_top), QPointF(*b_right))
@@ -2267,14 +2311,9 @@ class Viewport(QWidget):
     def _vp_draw_stage_axes(self):
         """Calculate and show the x axis and the y axis of the stage."""
         x_min, x_max, y_min, y_max = self.stage.limits
-        x_axis_start = self.cs.convert_d_to_v(
-            self.cs.convert_s_to_d((x_min - 100, 0)))
-        x_axis_end = self.cs.convert_d_to_v(
-            self.cs.convert_s_to_d((x_max + 100, 0)))
-        y_axis_start = self.cs.convert_d_to_v(
-            self.cs.convert_s_to_d((0, y_min - 100)))
-        y_axis_end = self.cs.convert_d_to_v(
-            self.cs.convert_s_to_d((0, y_max + 100)))
+        x_axis_start, x_axis_end, y_axis_start, y_axis_end = (
+            self.cs.convert_s_to_v_batch([(x_min - 100, 0), (x_max + 100, 0),
+                                          (0, y_min - 100), (0, y_max + 100)]))
         self.vp_qp.setPen(QPen(QColor(255, 255, 255), 1, Qt.DashLine))
         self.vp_qp.drawLine(QPointF(*x_axis_start), QPointF(*x_axis_end))
         self.vp_qp.drawLine(QPointF(*y_axis_start), QPointF(*y_axis_end))
@@ -2456,17 +2495,22 @@ class Viewport(QWidget):
             grid_range = range(self.vp_current_grid, self.vp_current_grid + 1)
             selected_grid, selected_tile = self.vp_current_grid, None
 
+        # Calculate origins of all visible grids with respect to viewport
+        # canvas in one batch (many grids in array mode)
+        grid_range = list(grid_range)
+        grid_origins_v = self.cs.convert_d_to_v_batch(
+            [self.gm[grid_index].origin_dx_dy for grid_index in grid_range])
+
         # Go through all visible grids to check for overlap with mouse click
         # position. Check grids with a higher grid index first.
-        for grid_index in grid_range:
-            # Calculate origin of the grid with respect to viewport canvas
-            dx, dy = self.gm[grid_index].origin_dx_dy
-            grid_origin_vx, grid_origin_vy = self.cs.convert_d_to_v((dx, dy))
+        for grid_index, grid_origin_v in zip(grid_range, grid_origins_v):
+            grid_origin_vx, grid_origin_vy = grid_origin_v
             pixel_size = self.gm[grid_index].pixel_size
             # Calculate top-left corner of unrotated grid
-            dx -= self.gm[grid_index].tile_width_d() / 2
-            dy -= self.gm[grid_index].tile_height_d() / 2
-            grid_topleft_vx, grid_topleft_vy = self.cs.convert_d_to_v((dx, dy))
+            grid_topleft_vx = (grid_origin_vx - self.gm[grid_index].tile_width_d()
+                               / 2 * self.cs.vp_scale)
+            grid_topleft_vy = (grid_origin_vy - self.gm[grid_index].tile_height_d()
+                               / 2 * self.cs.vp_scale)
             cols = self.gm[grid_index].number_cols()
             rows = self.gm[grid_index].number_rows()
             overlap = self.gm[grid_index].overlap
@@ -3813,18 +3857,17 @@ class Viewport(QWidget):
                                                     grid.array_index, grid.roi_index,
                                                     self.m_current_tile)
         canvas = self.reslice_canvas_template.copy()
-        if filename is not None and os.path.isfile(filename):
-            current_reslice = utils.image_to_QPixmap(imread(filename))
+        reslice_img = None
+        if filename is not None:
+            # Only read the last 500 lines
+            reslice_img = read_reslice(filename, 500)
+        if reslice_img is not None and len(reslice_img) > 0:
+            current_reslice = utils.image_to_QPixmap(reslice_img)
             self.m_qp.begin(canvas)
             self.m_qp.setPen(QColor(0, 0, 0))
             self.m_qp.setBrush(QColor(0, 0, 0))
             self.m_qp.drawRect(QRect(30, 260, 340, 40))
             h = current_reslice.height()
-            if h > 500:
-                # Crop it to last 500:
-                rect = QRect(0, h-500, 400, 500)
-                current_reslice = current_reslice.copy(rect)
-                h = 500
             self.m_qp.drawPixmap(0, 0, current_reslice)
             # Draw red line on currently selected slice:
             if self.m_selected_slice_number is not None:
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+
+# ==============================================================================
+#   This source file is part of SBEMimage (github.com/SBEMimage)
+#   (c) 2018-2020 Friedrich Miescher Institute for Biomedical Research, Basel,
+#   and the SBEMimage developers.
+#   This software is licensed under the terms of the MIT License.
+#   See LICENSE.txt in the project root folder.
+# ==============================================================================
+
+"""This module estimates the duration of a stack acquisition.
+
+Grids and overviews are acquired in intervals (every acq_interval slices,
+starting at slice acq_interval_offset). Once all offsets have been reached,
+the set of items acquired in a slice repeats with the least common multiple
+of the intervals as period, so a stack contains only a few distinct slice
+patterns. slice_patterns() returns these patterns and how often each occurs
+in a range of slices without running through the slices one by one. The
+duration of each pattern only has to be calculated once.
+
+The duration of a slice is modelled as
+
+    scan time + move_scale * stage move time + overhead_per_frame * frames
+    + cut_time
+
+where the stage move time is calculated with the stage model (motor speeds
+and wait interval). TimingModel starts with default parameters and
+calibrates them with the measured durations of the current run (see
+Tracer). The spread of the measured slice durations around the model gives
+confidence bounds for the remaining time.
+"""
+
+import numpy as np
+
+
+# Minimum number of measured slices to calibrate the model
+MIN_CALIBRATION_SLICES = 2
+# z-value of the confidence bounds of the remaining time (95%)
+CONFIDENCE_Z = 1.96
+
+
+def active_counts(intervals, offsets, from_slice, to_slice):
+    """Return the number of slices from_slice..to_slice-1 in which each item
+    (grid or overview with acquisition interval and offset) is acquired."""
+    intervals = np.asarray(intervals, dtype=np.int64)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    start = np.maximum(from_slice, offsets)
+    # First slice >= start with (slice - offset) % interval == 0
+    first = start + (offsets - start) % intervals
+    return np.where(first < to_slice,
+                    (to_slice - 1 - first) // intervals + 1, 0)
+
+
+def slice_patterns(intervals, offsets, active, from_slice, to_slice):
+    """Return the distinct patterns of acquired items in the slices
+    from_slice..to_slice-1 (boolean array: pattern x item), the number of
+    slices with each pattern, and the first slice with each pattern.
+    Items that are not active are never acquired."""
+    intervals = np.asarray(intervals, dtype=np.int64)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    active = np.asarray(active, dtype=bool)
+    if to_slice <= from_slice:
+        return (np.zeros((0, len(intervals)), dtype=bool),
+                np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64))
+    period = int(np.lcm.reduce(intervals)) if len(intervals) else 1
+    # From slice 'steady' on, the patterns repeat with period
+    steady = max(from_slice, int(offsets.max()) if len(offsets) else 0)
+    slices = np.arange(from_slice, min(to_slice, steady + period))
+    acquired = (
+        (slices[:, np.newaxis] >= offsets)
+        & ((slices[:, np.newaxis] - offsets) % intervals == 0)
+        & active)
+    # Slices s, s + period, s + 2 * period, ... have the same pattern
+    counts = np.where(slices >= steady, (to_slice - 1 - slices) // period + 1, 1)
+    patterns, first_index, inverse = np.unique(
+        acquired, axis=0, return_index=True, return_inverse=True)
+    pattern_counts = np.bincount(inverse.ravel(), weights=counts,
+                                 minlength=len(patterns)).astype(np.int64)
+    return patterns, pattern_counts, slices[first_index]
+
+
+class TimingModel:
+    """Durations of slices: scan time + move_scale * stage move time (stage
+    model) + overhead_per_frame * number of frames + cut_time. The default
+    parameters are replaced by calibrate() with measured durations."""
+
+    def __init__(self, overhead_per_frame, cut_time):
+        self.overhead_per_frame = overhead_per_frame
+        self.cut_time = cut_time
+        self.move_scale = 1.0
+        # Number of measured slices used for the calibration
+        self.number_calibration_slices = 0
+        # Relative standard deviation of the measured slice durations
+        # around the model
+        self.relative_sd = None
+
+    @property
+    def calibrated(self):
+        return self.number_calibration_slices > 0
+
+    def slice_durations(self, scan_time, move_time, frames, cut=True):
+        """Return the modelled durations of slices (arrays of scan time,
+        stage move time according to the stage model, and number of
+        frames)."""
+        return (np.asarray(scan_time, dtype=float)
+                + self.move_scale * np.asarray(move_time, dtype=float)
+                + self.overhead_per_frame * np.asarray(frames, dtype=float)
+                + (self.cut_time if cut else 0))
+
+    def calibrate(self, measured, scan_time, move_time, frames, cut=True):
+        """Calibrate the model with measured slices. measured: arrays
+        (duration, stage move time, cut time) of the measured slices;
+        scan_time, move_time (stage model) and frames: the expected values
+        for the same slices. Slices without frames are ignored. Return True
+        if the model was calibrated."""
+        duration, measured_moves, measured_cut = (
+            np.asarray(values, dtype=float) for values in measured)
+        scan_time = np.asarray(scan_time, dtype=float)
+        move_time = np.asarray(move_time, dtype=float)
+        frames = np.asarray(frames, dtype=float)
+        use = frames > 0
+        if use.sum() < MIN_CALIBRATION_SLICES:
+            return False
+        duration, measured_moves, measured_cut = (
+            duration[use], measured_moves[use], measured_cut[use])
+        scan_time, move_time, frames = scan_time[use], move_time[use], frames[use]
+
+        if move_time.sum() > 0:
+            self.move_scale = measured_moves.sum() / move_time.sum()
+        if cut:
+            self.cut_time = float(np.median(measured_cut))
+        # Remaining time on the acquisition thread per frame: saving,
+        # inspection, settings, GUI updates, ...
+        remaining = (duration - scan_time - measured_moves
+                     - (measured_cut if cut else 0))
+        self.overhead_per_frame = max(float(remaining.sum() / frames.sum()), 0)
+
+        expected = self.slice_durations(scan_time, move_time, frames, cut)
+        ratio = duration / np.maximum(expected, 1e-9)
+        self.relative_sd = float(np.std(ratio, ddof=1))
+        self.number_calibration_slices = len(duration)
+        return True
+
+    def bounds(self, durations, counts):
+        """Return the confidence bounds (low, high) of the total duration of
+        slices with modelled durations (one per slice pattern) and the
+        numbers of slices with each pattern, or None if the model is not
+        calibrated. The deviations of the slices are assumed to be
+        independent, with the spread measured during calibration. The
+        uncertainty of the calibration itself is included."""
+        if not self.calibrated:
+            return None
+        durations = np.asarray(durations, dtype=float)
+        counts = np.asarray(counts, dtype=float)
+        total = float((durations * counts).sum())
+        variance = self.relative_sd ** 2 * (
+            (durations ** 2 * counts).sum()
+            + total ** 2 / self.number_calibration_slices)
+        half_width = CONFIDENCE_Z * float(np.sqrt(variance))
+        return max(total - half_width, 0), total + half_width
@@ -23,7 +23,7 @@ from time import sleep
 
 import constants
 from constants import Error
-from image_io import imwrite
+from mosaic_io import MosaicWriter
 import utils
 
 
@@ -86,22 +86,24 @@ def acquire_ov(base_dir, selection, sem, stage, ovm, img_inspector,
             utils.log_info('SEM', f'Acquiring OV {ov_index}.')
             # Indicate the overview being acquired in the viewport
             viewport_trigger.transmit('ACQ IND OV', ov_index)
-            success = sem.acquire_frame(save_path, stage)
+            success, ov_img = sem.acquire_frame(save_path, stage,
+                                                return_image=True)
             # Remove indicator colour
             viewport_trigger.transmit('ACQ IND OV', ov_index)
             _, _, _, _, load_error, _, grab_incomplete = (
-                img_inspector.load_and_inspect(save_path))
+                img_inspector.load_and_inspect(save_path, ov_img))
             if load_error or grab_incomplete and check_ov_acceptance:
                 # Try again
                 sleep(0.5)
                 #main_controls_trigger.transmit(utils.format_log_entry('SEM: Second attempt: Acquiring OV %d.' % ov_index))
                 utils.log_info('SEM', f'Second attempt: Acquiring OV {ov_index}.')
                 viewport_trigger.transmit('ACQ IND OV', ov_index)
-                success = sem.acquire_frame(save_path, stage)
+                success, ov_img = sem.acquire_frame(save_path, stage,
+                                                    return_image=True)
                 viewport_trigger.transmit('ACQ IND OV', ov_index)
                 sleep(1)
                 _, _, _, _, load_error, _, grab_incomplete = (
-                    img_inspector.load_and_inspect(save_path))
+                    img_inspector.load_and_inspect(save_path, ov_img))
                 if load_error or grab_incomplete:
                     success = False
                     if load_error:
@@ -157,22 +159,18 @@ def acquire_stub_ov(sem, stage, stub_ovm, acq, img_inspector,
         # minimize motor move durations
         stub_ovm.activate_all_tiles()
 
-        # NumPy array for final stitched image
-        temp_save_path = os.path.join(
-            acq.base_dir, 'workspace', 'temp_stub_ov' + constants.TEMP_IMAGE_FORMAT)
-        stub_ovm.vp_file_path = temp_save_path
+        # Stitched image and its pyramid levels, updated tile by tile and
+        # shown in the Viewport as live preview during the acquisition
         is_single_tile = (len(stub_ovm.active_tiles) == 1)
+        mosaic = None
         if not is_single_tile:
             shape = [stub_ovm.height_p(), stub_ovm.width_p()]
             depth = stub_ovm.tile_depth()
             if depth > 1:
                 shape += [depth]
-            full_stub_image = np.zeros(shape, dtype=np.uint8)
-            # Save current stub image to temp_save_path to show live preview
-            # during the acquisition
-            imwrite(temp_save_path, full_stub_image, npyramid_add=constants.DEFAULT_PYRAMID_LEVELS)
-        else:
-            full_stub_image = None
+            mosaic = MosaicWriter(shape, dtype=np.uint8)
+            stub_ovm.show_mosaic(mosaic)
+            stub_dlg_trigger.transmit('DRAW VP')
 
         for tile_index in stub_ovm.active_tiles:
             if not abort_queue.empty():
@@ -217,24 +215,28 @@ def acquire_stub_ov(sem, stage, stub_ovm, acq, img_inspector,
                             stub_ovm.pixel_size,
                             stub_ovm.dwell_time)
                         sem.set_bit_depth(stub_ovm.bit_depth_selector)
+                        sem.set_compression(acq.stub_ov_compression)
                         first_tile = False
+                    frame = None
                     if stub_ovm.lm_mode:
                         success = sem.acquire_frame_lm(save_path, stage)
                     else:
-                        success = sem.acquire_frame(save_path, stage)
+                        success, frame = sem.acquire_frame(
+                            save_path, stage, return_image=True)
                     sleep(0.5)
                     tile_img, _, _, _, load_error, _, grab_incomplete = (
-                        img_inspector.load_and_inspect(save_path))
+                        img_inspector.load_and_inspect(save_path, frame))
                     if load_error or grab_incomplete:
                         # Try again
                         sem.reset_error_state()
                         if stub_ovm.lm_mode:
                             success = sem.acquire_frame_lm(save_path, stage)
                         else:
-                            success = sem.acquire_frame(save_path, stage)
+                            success, frame = sem.acquire_frame(
+                                save_path, stage, return_image=True)
                         sleep(1.5)
                         tile_img, _, _, _, load_error, _, grab_incomplete = (
-                            img_inspector.load_and_inspect(save_path))
+                            img_inspector.load_and_inspect(save_path, frame))
                         if load_error:
                             success = False
                             if load_error:
@@ -249,23 +251,22 @@ def acquire_stub_ov(sem, stage, stub_ovm, acq, img_inspector,
                                 f'acquired after two attempts ({cause}).')
                     if success:
                         # Paste NumPy array of acquired tile (tile_img) into
-                        # full_stub_image at the tile XY position
+                        # the stitched mosaic at the tile XY position
                         x = tile_index % number_cols
                         y = tile_index // number_cols
                         x_pos = x * (tile_width - overlap)
                         y_pos = y * (tile_height - overlap)
-                        if is_single_tile:
-                            full_stub_image = tile_img
-                        else:
-                            full_stub_image[y_pos:y_pos + tile_height,
-                                            x_pos:x_pos + tile_width] = tile_img
-                        # Save current stitched image and show it in Viewport
+                        if mosaic is None:
+                            mosaic = MosaicWriter(tile_img.shape, tile_img.dtype)
+                            stub_ovm.show_mosaic(mosaic)
+                        # Update the stitched image and the Viewport preview
+                        # only in the region of the new tile
+                        dirty_rect = mosaic.paste(tile_img, x_pos, y_pos)
+                        if dirty_rect is not None:
+                            stub_ovm.update_mosaic_region(mosaic, dirty_rect)
                         metadata = {'pixel_size': [stub_ovm.pixel_size * 1e-3] * 2,
                                     'position': stub_ovm.centre_sx_sy,
                                     'rotation': stub_ovm.rotation}
-                        imwrite(temp_save_path, full_stub_image, metadata=metadata, npyramid_add=constants.DEFAULT_PYRAMID_LEVELS)
-                        # Setting vp_file_path to temp_save_path reloads the current file
-                        stub_ovm.vp_file_path = temp_save_path
                         stub_dlg_trigger.transmit('DRAW VP')
                         sleep(0.1)
 
@@ -280,7 +281,7 @@ def acquire_stub_ov(sem, stage, stub_ovm, acq, img_inspector,
                 'UPDATE PROGRESS', percentage_done)
 
         # Write final full stub overview image and downsampled copies to disk unless acq aborted
-        if not aborted:
+        if not aborted and mosaic is not None:
             stub_dir = os.path.join(acq.base_dir, 'overviews', 'stub')
             if not os.path.exists(stub_dir):
                 os.makedirs(stub_dir)
@@ -293,7 +294,8 @@ def acquire_stub_ov(sem, stage, stub_ovm, acq, img_inspector,
                 + str(acq.slice_counter).zfill(5)
                 + '_' + timestamp + constants.STUBOV_IMAGE_FORMAT)
 
-            imwrite(stub_overview_file_name, full_stub_image, metadata=metadata, npyramid_add=constants.DEFAULT_PYRAMID_LEVELS)
+            mosaic.write(stub_overview_file_name, metadata=metadata,
+                         compression=acq.stub_ov_compression)
             stub_ovm.vp_file_path = stub_overview_file_name
         else:
             # Restore previous stub OV
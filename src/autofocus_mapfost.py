@@ -19,14 +19,13 @@
 
 import os
 import time
-import glob
 import shutil
 import tempfile
 import numpy as np
 
 from PIL import Image
 from typing import Union
-from multiprocessing import Pool
+from multiprocessing import Pool, resource_tracker, shared_memory
 from mapfost import mapfost as mf
 from scipy.optimize import minimize
 
@@ -41,25 +40,34 @@ import constants
 
 
 class RunAutoFoc:
+    """Control of the SEM during the MAPFoSt routine and estimation of the
+    aberrations. An instance owns a pool of worker processes that is reused
+    for all iterations (and for all tiles if the instance is kept). The test
+    images are passed to the workers in shared memory.
+    """
 
-    def __init__(self, exps_dir, exp_id, sem):
-        self.exps_dir = exps_dir
-        self.exp_id = exp_id
+    def __init__(self, sem, exps_dir=None, number_workers=None):
+        self.exps_dir = [exps_dir, tempfile.gettempdir()][exps_dir is None]
+        self.exp_id = str(int(time.time()))
         self.additional_cycle_time = 0
-        self.path_to_exp = self.exps_dir + self.exp_id
+        self.path_to_exp = os.path.join(self.exps_dir, 'mapfost_' + self.exp_id)
         self.result_path = self.path_to_exp + "/Result"
-        self.perturbed_ims_path = self.path_to_exp + "/Test_Images" + "_" + self.exp_id
         self.sem = sem
-        self.sem_api = sem.sem_api  # TODO: replace all calls to sem_api with self.sem.calls
-        self.create_exps_dir()
+        # TODO: replace all calls to sem_api with self.sem.calls
+        self.sem_api = sem.sem_api if sem is not None else None
+        if number_workers is None:
+            number_workers = max(1, (os.cpu_count() or 2) - 1)
+        self.number_workers = number_workers
+        self.pool = None
+        # Shared memory block for the test images
+        self.shm = None
+        self.final_res = [0, 0, 0]
 
     def create_exps_dir(self):
         if not os.path.exists(self.path_to_exp):
-            os.mkdir(self.path_to_exp)
+            os.makedirs(self.path_to_exp)
         if not os.path.exists(self.result_path):
             os.mkdir(self.result_path)
-        if not os.path.exists(self.perturbed_ims_path):
-            os.mkdir(self.perturbed_ims_path)
 
     def predict_refresh_time(self):
         no_of_pixels = np.multiply(*self.get_store_resolution())
@@ -150,16 +158,24 @@ class RunAutoFoc:
         time.sleep(0.1 + np.min([0.01*aberr_normed,1]))# very imp, otherwise the scans can be discontinuous in case of large shifts
         self.set_wd_and_stig_vals(final_aberr_params)
 
-    def grab_and_save_perturbed_ims(self, aberr_perturbation):
+    def grab_perturbed_ims(self, aberr_perturbation):
+        """Acquire one image for each perturbation in aberr_perturbation and
+        return the images as numpy arrays (in the same order). The SEM API
+        saves each grabbed frame to a file, which is read and deleted
+        immediately."""
+        self.create_exps_dir()
         current_aberr_params = self.get_wd_and_stig_vals()
         final_aberr_params = [np.add(aberr, current_aberr_params) for aberr in aberr_perturbation]
-        for key, par in enumerate(final_aberr_params):
+        perturbed_ims = []
+        save_as = self.path_to_exp + "/perturbed" + constants.TEMP_IMAGE_FORMAT
+        for par in final_aberr_params:
             self.set_wd_and_stig_vals(par)
-            save_as = (self.perturbed_ims_path + "/" + "_".join([str(ab) for ab in aberr_perturbation[key]])
-                       + constants.TEMP_IMAGE_FORMAT)
             self.acquire_frame(save_as)
+            with Image.open(save_as) as img:
+                perturbed_ims.append(np.array(img))
+            os.remove(save_as)
         self.set_wd_and_stig_vals(current_aberr_params)
-        return 0
+        return perturbed_ims
 
     def reverse_aberr(self, save_result=False):
         current_aberr_params = self.get_wd_and_stig_vals()
@@ -178,13 +194,99 @@ class RunAutoFoc:
         if waitTillComplete:
             time.sleep(self.predict_refresh_time())
 
+    def start_pool(self):
+        if self.pool is None:
+            if os.name != 'nt':
+                # Workers must use the resource tracker of this process.
+                # Otherwise their own tracker would remove the shared memory
+                # block when they are stopped.
+                resource_tracker.ensure_running()
+            self.pool = Pool(self.number_workers)
+
+    def share_images(self, images):
+        """Copy images to the shared memory block (created or enlarged if
+        necessary). Return (name, shape, dtype) for the workers."""
+        images = np.asarray(images)
+        if self.shm is None or self.shm.size < images.nbytes:
+            self.release_shared_memory()
+            self.shm = shared_memory.SharedMemory(create=True, size=max(images.nbytes, 1))
+        shared_images = np.ndarray(images.shape, dtype=images.dtype, buffer=self.shm.buf)
+        shared_images[:] = images
+        del shared_images
+        return self.shm.name, images.shape, images.dtype.str
+
+    def release_shared_memory(self):
+        if self.shm is not None:
+            self.shm.close()
+            self.shm.unlink()
+            self.shm = None
+
+    def close(self):
+        """Stop the worker processes and release the shared memory."""
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+        self.release_shared_memory()
+
+    def estimate_aberrations(self, aberr_perturbations, test_imarrs, mapfost_params):
+        """Return the estimated aberration vector for the pair of test images
+        (see process_ims_and_est_aberr()), using the worker pool."""
+        crop_refs = get_crop_refs_from_scan_size(test_imarrs[0].shape, mapfost_params['crop_size'])
+        self.start_pool()
+        shared_images = self.share_images(test_imarrs[:2])
+        ret_vals = self.pool.starmap(
+            est_aberr_shared,
+            [(shared_images, aberr_perturbations, crop_refs[i][::-1], mapfost_params)
+             for i in range(len(crop_refs))])
+        result_procs = []
+        for ret_val in ret_vals:
+            if ret_val[0]:
+                if ret_val[2].success:
+                    result_procs.append([True, ret_val[2].x])
+                else:
+                    print("optimizer failed for crop ref ", ret_val[1])
+            else:
+                print("cropping not valid for crop ref ", ret_val[1])
+        if len(result_procs) > 0:
+            est_aberr = np.mean(np.array(result_procs, dtype=object)[:,1], axis=0)
+        else:
+            est_aberr = None
+        return est_aberr
+
+
 def est_aberr_proc(perturbed_ims, aberr_perturbations, crop_ref, mapfost_params):
     mapfost_params['crop_ref'] = crop_ref
     cr_valid , crop_ref, res = mf.est_aberr([perturbed_ims[0], perturbed_ims[1]], aberr_perturbations, **mapfost_params)
     # print(" cr_valid, crop_ref, res",  cr_valid, crop_ref, res)
     return cr_valid, crop_ref, res
 
-def process_ims_and_est_aberr(aberr_perturbations, test_imarrs, mapfost_params={}):
+
+# Shared memory block attached in a worker process (kept open for the
+# following tasks): [name, SharedMemory]
+_worker_shm = [None, None]
+
+
+def attach_shared_images(shared_images):
+    """Return the test images in the shared memory block described by
+    shared_images (name, shape, dtype) without copying them."""
+    name, shape, dtype = shared_images
+    if _worker_shm[0] != name:
+        if _worker_shm[1] is not None:
+            _worker_shm[1].close()
+        # The block is owned (and unlinked) by the main process. The workers
+        # share its resource tracker, so attaching does not register the
+        # block a second time.
+        _worker_shm[:] = [name, shared_memory.SharedMemory(name=name)]
+    return np.ndarray(shape, dtype=dtype, buffer=_worker_shm[1].buf)
+
+
+def est_aberr_shared(shared_images, aberr_perturbations, crop_ref, mapfost_params):
+    return est_aberr_proc(attach_shared_images(shared_images), aberr_perturbations,
+                          crop_ref, mapfost_params)
+
+
+def process_ims_and_est_aberr(aberr_perturbations, test_imarrs, mapfost_params={}, af=None):
 
     """
     Returns the estimated aberration using two test images which are split into smaller patches of size
@@ -202,125 +304,118 @@ def process_ims_and_est_aberr(aberr_perturbations, test_imarrs, mapfost_params={
                         'test_ims_aligned': 0, set this to 0 if the test_ims are not already aligned.
                         'use_bessel' : 1, bessel MTF is used if True, the Gaussian approx is used if False, (recommended Gaussian)
                         'crop_size': [768,768], the fov will be split into smaller patches of this size (regular only)
+        af: RunAutoFoc instance whose worker pool is used. If None, a
+            temporary pool is used.
 
     Returns:
         the estimated aberration vector of length 3. [defocus(um), astigx(%), astigy(%)]. None in case of exception.
     """
-
-    result_procs = []
-
-    def proc_res(ret_val):
-        if ret_val[0]:
-            if ret_val[2].success:
-                result_procs.append([True, ret_val[2].x])
-            else:
-                print("optimizer failed for crop ref ", ret_val[1])
-        else:
-            print("cropping not valid for crop ref ", ret_val[1])
-
-    crop_refs = get_crop_refs_from_scan_size(test_imarrs[0].shape, mapfost_params['crop_size'])
-
-    p = Pool(len(crop_refs))
-    _ = [p.apply_async(est_aberr_proc, args=[test_imarrs, aberr_perturbations, crop_refs[i][::-1], mapfost_params], callback=proc_res)
-         for i in range(len(crop_refs))]
-
-    p.close()
-    p.join()
-    if len(result_procs) > 0:
-        est_aberr = np.mean(np.array(result_procs, dtype=object)[:,1], axis=0)
-    else:
-        est_aberr = None
-
-    return est_aberr
+    if af is not None:
+        return af.estimate_aberrations(aberr_perturbations, test_imarrs, mapfost_params)
+    af = RunAutoFoc(None)
+    try:
+        return af.estimate_aberrations(aberr_perturbations, test_imarrs, mapfost_params)
+    finally:
+        af.close()
 
 
 def run(sem, working_distance_perturbations, exps_dir=None, mapfost_params={},
         induce_aberration_vec=[0,0,0], max_iters=7, convergence_threshold = 0.2,
-        aberr_mode_bools = [1,1,1],large_aberrations=0, max_wd_stigx_stigy=None):
+        aberr_mode_bools = [1,1,1],large_aberrations=0, max_wd_stigx_stigy=None,
+        af=None):
+    """Run the MAPFoSt routine. If af (RunAutoFoc instance) is given, its
+    worker pool is used and kept running for the next call."""
 
-    exps_dir = [exps_dir, tempfile.gettempdir()][exps_dir is None]
+    own_af = af is None
+    if own_af:
+        af = RunAutoFoc(sem, exps_dir)
 
     corrections = []
     iter = 0
     aberr_estimation = [10,10,10]
-    while np.linalg.norm(aberr_estimation) > convergence_threshold and iter < max_iters:
-        iter+=1
-        if large_aberrations:
-            if iter < 3:
-                mapfost_params['radial_aperture'] = 0.1
-                working_distance_perturbations = [20]
-            else:
-                mapfost_params['radial_aperture'] = 0.25
-                working_distance_perturbations = [4]
-        for exp_itr, ta in enumerate(working_distance_perturbations):
-            aberr_perturbation = [[-1*ta, 0, 0], [ta, 0, 0]]
-            exp_id =  str(int(time.time())) + "_" + str(exp_itr)
-            af = RunAutoFoc(exps_dir, exp_id, sem=sem)
-
-            if np.any(induce_aberration_vec) !=0:
-                af.induce_aberration(induce_aberration_vec)
-                print("induced aberr, ", induce_aberration_vec)
-                induce_aberration_vec = [0,0,0]
-
-            af.grab_and_save_perturbed_ims(aberr_perturbation)
-            pix_size_um = af.get_pix_size_um()
-            mapfost_params['pix_size_um'] = pix_size_um
-            perturbed_ims, aberr_perturbation = get_perturbed_ims(af.perturbed_ims_path)
-
-            aberr_perturbation_defocus = [aberr_perturbation[0][0], aberr_perturbation[1][0]]
-
-            aberr_estimation = process_ims_and_est_aberr(aberr_perturbation_defocus, perturbed_ims, mapfost_params)
-
-            if aberr_estimation is not None:
-                try:
-                    af.final_res = np.multiply(aberr_estimation,aberr_mode_bools)
-                    print("max_wd_stigx_stigy", max_wd_stigx_stigy)
-                    if max_wd_stigx_stigy is not None:
-                        clipped_res = [np.clip(-1*max_wd_stigx_stigy[ii],
-                                                  max_wd_stigx_stigy[ii],
-                                                  af.final_res[ii]) for ii in range(3)]
-                        af.final_res = clipped_res
-                    aberr_estimation = af.final_res
-                except Exception as e:
-                    print("Could not multiply aberr_mode_bools (#1) on aberr est(#2) ",aberr_mode_bools, aberr_estimation)
-                af.reverse_aberr(save_result=False)
-                corrections.append(list(np.round(af.final_res,3)))
-            print("corrections", corrections[-1])
+    try:
+        while np.linalg.norm(aberr_estimation) > convergence_threshold and iter < max_iters:
+            iter+=1
+            if large_aberrations:
+                if iter < 3:
+                    mapfost_params['radial_aperture'] = 0.1
+                    working_distance_perturbations = [20]
+                else:
+                    mapfost_params['radial_aperture'] = 0.25
+                    working_distance_perturbations = [4]
+            for exp_itr, ta in enumerate(working_distance_perturbations):
+                aberr_perturbation = [[-1*ta, 0, 0], [ta, 0, 0]]
+
+                if np.any(induce_aberration_vec) !=0:
+                    af.induce_aberration(induce_aberration_vec)
+                    print("induced aberr, ", induce_aberration_vec)
+                    induce_aberration_vec = [0,0,0]
+
+                perturbed_ims = af.grab_perturbed_ims(aberr_perturbation)
+                pix_size_um = af.get_pix_size_um()
+                mapfost_params['pix_size_um'] = pix_size_um
+
+                aberr_perturbation_defocus = [aberr_perturbation[0][0], aberr_perturbation[1][0]]
+
+                aberr_estimation = process_ims_and_est_aberr(aberr_perturbation_defocus, perturbed_ims,
+                                                             mapfost_params, af=af)
+
+                if aberr_estimation is not None:
+                    try:
+                        af.final_res = np.multiply(aberr_estimation,aberr_mode_bools)
+                        print("max_wd_stigx_stigy", max_wd_stigx_stigy)
+                        if max_wd_stigx_stigy is not None:
+                            clipped_res = [np.clip(-1*max_wd_stigx_stigy[ii],
+                                                      max_wd_stigx_stigy[ii],
+                                                      af.final_res[ii]) for ii in range(3)]
+                            af.final_res = clipped_res
+                        aberr_estimation = af.final_res
+                    except Exception as e:
+                        print("Could not multiply aberr_mode_bools (#1) on aberr est(#2) ",aberr_mode_bools, aberr_estimation)
+                    af.reverse_aberr(save_result=False)
+                    corrections.append(list(np.round(af.final_res,3)))
+                print("corrections", corrections[-1])
+    finally:
+        if own_af:
+            af.close()
     return corrections
 
 def calibrate(sem, mapfost_params={},
-              calib_mode=None,exps_dir=None):
+              calib_mode=None,exps_dir=None, af=None):
 
     working_distance_perturbations = [4]
 
-    exps_dir = [exps_dir, tempfile.gettempdir()][exps_dir is None]
-
     if calib_mode == "defocus":
         induce_aberration_vec = [8,0,0]
     elif calib_mode == "astig":
         induce_aberration_vec = [0,2,2]
     else:
         return "No calibration mode (defocus or astig) given"
-    for exp_itr, ta in enumerate(working_distance_perturbations):
-        aberr_perturbation = [[-1*ta, 0, 0], [ta, 0, 0]]
-        exp_id =  str(int(time.time())) + "_" + str(exp_itr)
-        af = RunAutoFoc(exps_dir, exp_id, sem=sem)
-        if np.any(induce_aberration_vec) !=0:
-            af.induce_aberration(induce_aberration_vec)
-            print("induced aberr, ", induce_aberration_vec)
-            cp_induce_aberr= induce_aberration_vec
-            induce_aberration_vec = [0,0,0]
-        af.grab_and_save_perturbed_ims(aberr_perturbation)
-        pix_size_um = af.get_pix_size_um()
-        mapfost_params['pix_size_um'] = pix_size_um
-        perturbed_ims, aberr_perturbation = get_perturbed_ims(af.perturbed_ims_path)
-
-        aberr_perturbation_defocus = [aberr_perturbation[0][0], aberr_perturbation[1][0]]
-
-        calib_params = get_caliberation_for_mapfost_routine(cp_induce_aberr, aberr_perturbation_defocus,
-                                                            perturbed_ims, mapfost_params,calib_mode=calib_mode)
-        af.induce_aberration(np.multiply(cp_induce_aberr,-1))
-    af.freeze_frame(waitTillComplete=1)
+    own_af = af is None
+    if own_af:
+        af = RunAutoFoc(sem, exps_dir)
+    try:
+        for exp_itr, ta in enumerate(working_distance_perturbations):
+            aberr_perturbation = [[-1*ta, 0, 0], [ta, 0, 0]]
+            if np.any(induce_aberration_vec) !=0:
+                af.induce_aberration(induce_aberration_vec)
+                print("induced aberr, ", induce_aberration_vec)
+                cp_induce_aberr= induce_aberration_vec
+                induce_aberration_vec = [0,0,0]
+            perturbed_ims = af.grab_perturbed_ims(aberr_perturbation)
+            pix_size_um = af.get_pix_size_um()
+            mapfost_params['pix_size_um'] = pix_size_um
+
+            aberr_perturbation_defocus = [aberr_perturbation[0][0], aberr_perturbation[1][0]]
+
+            calib_params = get_caliberation_for_mapfost_routine(cp_induce_aberr, aberr_perturbation_defocus,
+                                                                perturbed_ims, mapfost_params,calib_mode=calib_mode,
+                                                                af=af)
+            af.induce_aberration(np.multiply(cp_induce_aberr,-1))
+        af.freeze_frame(waitTillComplete=1)
+    finally:
+        if own_af:
+            af.close()
     return calib_params
 
 def get_calibrated_probe_convergence_angle(target_defocus, estimated_defocus, mapfost_params):
@@ -353,32 +448,10 @@ def get_astig_scaling_rotation_param(target_astig, est_astig, mapfost_params):
     scale_sign_est = scale_signs[min_cost_arg]
     return list([float(np.round(resS[min_cost_arg].x, 2)), list(np.round(np.multiply(scale_sign_est, [1 / scale, 1 / scale]),2))])
 
-def get_caliberation_for_mapfost_routine(target_aberration, aberr_perturbations, test_imarrs, mapfost_params={}, calib_mode=None):
-
-    result_procs = []
-
-    crop_refs = get_crop_refs_from_scan_size(test_imarrs[0].shape, mapfost_params['crop_size'])
-
-    def proc_res(ret_val):
-        if ret_val[0]:
-            if ret_val[2].success:
-                result_procs.append([True, ret_val[2].x])
-            else:
-                print("optimizer failed for crop ref ", ret_val[1])
-        else:
-            print("cropping not valid for crop ref ", ret_val[1])
+def get_caliberation_for_mapfost_routine(target_aberration, aberr_perturbations, test_imarrs, mapfost_params={},
+                                         calib_mode=None, af=None):
 
-    p = Pool(len(crop_refs))
-    _ = [p.apply_async(est_aberr_proc, args=[test_imarrs, aberr_perturbations, crop_refs[i][::-1], mapfost_params],
-                       callback=proc_res)
-         for i in range(len(crop_refs))]
-
-    p.close()
-    p.join()
-    if len(result_procs) > 0:
-        est_aberr = np.mean(np.array(result_procs, dtype=object)[:, 1], axis=0)
-    else:
-        est_aberr = None
+    est_aberr = process_ims_and_est_aberr(aberr_perturbations, test_imarrs, mapfost_params, af=af)
     if calib_mode=="defocus":
         calr = get_calibrated_probe_convergence_angle(target_aberration[0], est_aberr[0], mapfost_params)
     elif calib_mode=="astig":
@@ -474,14 +547,3 @@ def crop_from_ref(perturbed_ims, crop_size, ref=(0, 0)):
     perturbed_ims = np.array(perturbed_ims)
     perturbed_ims = perturbed_ims[ref[0]:ref[0]+int(crop_size[0]), ref[1]:ref[1] + int(crop_size[1])]
     return perturbed_ims
-
-def aberr_perturbation_from_tifname(name):
-    aberr_perturbation = [float(aa) for aa in os.path.basename(name).split(".")[0].split("_")]
-    return aberr_perturbation
-
-def get_perturbed_ims(perturbed_ims_path):
-    perturbed_ims_abs_paths = glob.glob(perturbed_ims_path + "/*" + constants.TEMP_IMAGE_FORMAT)
-    perturbed_ims = [np.array(Image.open(imgPath)) for imgPath in perturbed_ims_abs_paths]
-    aberr_perturbation = [aberr_perturbation_from_tifname(t) for t in perturbed_ims_abs_paths]
-
-    return perturbed_ims, aberr_perturbation
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+
+# ==============================================================================
+#   This source file is part of SBEMimage (github.com/SBEMimage)
+#   (c) 2018-2020 Friedrich Miescher Institute for Biomedical Research, Basel,
+#   and the SBEMimage developers.
+#   This software is licensed under the terms of the MIT License.
+#   See LICENSE.txt in the project root folder.
+# ==============================================================================
+
+"""This module measures what the compression codecs cost per frame.
+
+Tiles, overviews and stub overviews can be saved with any of the codecs in
+image_io.COMPRESSION_CODECS (tile_compression, ov_compression and
+stub_ov_compression in the [acq] section of the configuration). A codec
+that compresses better takes longer to encode, and saving a frame must not
+take longer than acquiring the next one.
+
+calibrate() writes a sample frame with each available codec to memory, in
+the same way as an acquired frame is saved (pyramid levels, parallel
+encoding), and measures the encode throughput and the compression ratio.
+recommend() selects the codec with the best ratio whose encode time stays
+below a fraction of the tile cycle time.
+"""
+
+import io
+
+from time import perf_counter
+
+from constants import (CODEC_CALIBRATION_REPEATS, CODEC_TIME_FRACTION,
+                       DEFAULT_COMPRESSION, DEFAULT_PYRAMID_LEVELS)
+from image_io import (COMPRESSION_CODECS, available_codecs, codec_available,
+                      imwrite_tiff, pyramid_levels)
+
+
+def measure_codec(image, codec, npyramid_add=DEFAULT_PYRAMID_LEVELS,
+                  repeats=CODEC_CALIBRATION_REPEATS, pyramid=None):
+    """Write image as TIFF with codec to memory. Return the shortest encode
+    time (in seconds) of repeats runs and the size of the file in bytes.
+    The pyramid levels (computed once if not provided) are included."""
+    if pyramid is None:
+        pyramid = list(pyramid_levels(image, npyramid_add))
+    encode_time = None
+    for _ in range(repeats):
+        buffer = io.BytesIO()
+        start_time = perf_counter()
+        imwrite_tiff(buffer, image, compression=codec, pyramid=pyramid)
+        duration = perf_counter() - start_time
+        if encode_time is None or duration < encode_time:
+            encode_time = duration
+    return encode_time, buffer.getbuffer().nbytes
+
+
+def calibrate(image, codecs=None, npyramid_add=DEFAULT_PYRAMID_LEVELS,
+              repeats=CODEC_CALIBRATION_REPEATS):
+    """Measure the codecs (default: all available codecs) on the sample
+    frame image. Return {codec: {'encode_time', 'mb_per_s', 'ratio'}}:
+    encode time in seconds, throughput in MB/s of uncompressed data
+    (including the pyramid levels), and compression ratio (uncompressed
+    size / file size)."""
+    if codecs is None:
+        codecs = available_codecs()
+    pyramid = list(pyramid_levels(image, npyramid_add))
+    uncompressed = image.nbytes + sum(level.nbytes for level in pyramid)
+    results = {}
+    for codec in codecs:
+        encode_time, size = measure_codec(image, codec, repeats=repeats,
+                                          pyramid=pyramid)
+        results[codec] = {
+            'encode_time': encode_time,
+            'mb_per_s': uncompressed / 1e6 / max(encode_time, 1e-9),
+            'ratio': uncompressed / size,
+        }
+    return results
+
+
+def recommend(results, tile_cycle_time, fraction=CODEC_TIME_FRACTION):
+    """Return the codec in results (see calibrate()) with the best
+    compression ratio that encodes a frame in less than fraction *
+    tile_cycle_time, or DEFAULT_COMPRESSION if no codec is fast enough."""
+    max_encode_time = fraction * tile_cycle_time
+    fast_enough = [codec for codec, result in results.items()
+                   if result['encode_time'] <= max_encode_time]
+    if not fast_enough:
+        return DEFAULT_COMPRESSION
+    # Best ratio first, then the faster codec
+    return max(fast_enough,
+               key=lambda codec: (results[codec]['ratio'],
+                                  -results[codec]['encode_time']))
+
+
+def checked_codec(codec, setting):
+    """Return (codec, None) if codec is a known codec that is available,
+    otherwise (DEFAULT_COMPRESSION, warning message). setting: name of the
+    configuration entry (for the message)."""
+    codec = codec.strip().lower()
+    if codec not in COMPRESSION_CODECS:
+        return DEFAULT_COMPRESSION, (
+            f'Unknown compression codec {setting} = {codec}, using '
+            f'{DEFAULT_COMPRESSION}. Codecs: ' + ', '.join(COMPRESSION_CODECS))
+    if not codec_available(codec):
+        return DEFAULT_COMPRESSION, (
+            f'Compression codec {codec} ({setting}) is not available in the '
+            f'installed imagecodecs, using {DEFAULT_COMPRESSION}.')
+    return codec, None
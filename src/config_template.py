@@ -27,7 +27,7 @@ BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 #CFG_TEMPLATE_FILE = 'src/default_cfg/default.ini'    # Template of session configuration
 CFG_TEMPLATE_FILE = os.path.join(BASE_DIR, "default_cfg", "default.ini")
 CFG_NUMBER_SECTIONS = 12
-CFG_NUMBER_KEYS = 259
+CFG_NUMBER_KEYS = 270
 
 #SYSCFG_TEMPLATE_FILE = 'src/default_cfg/system.cfg'  # Template of system configuration
 SYSCFG_TEMPLATE_FILE = os.path.join(BASE_DIR, "default_cfg", "system.cfg")
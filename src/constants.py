@@ -37,6 +37,34 @@ VP_MARGIN_Y = 40
 VP_WINDOW_DIFF_X = 50
 VP_WINDOW_DIFF_Y = 150
 
+# Size in Viewport pixels of the pre-scaled image tiles kept in the render
+# cache, and the maximum memory used by the cached tiles (in bytes).
+VP_RENDER_TILE_SIZE = 256
+VP_RENDER_CACHE_SIZE = 256 * 1024 ** 2
+
+# Maximum memory used by the tile previews held in memory (in bytes).
+# Previews of tiles that are not shown in the Viewport are released first.
+PREVIEW_CACHE_SIZE = 512 * 1024 ** 2
+
+# Maximum number of image files whose metadata is kept in memory by image_io
+# (identified by path, modification time and file size).
+IMAGE_METADATA_CACHE_SIZE = 1000
+
+# Maximum memory used by the images waiting to be written by the image
+# writer (in bytes), and the number of threads writing them.
+IMAGE_WRITER_MEMORY_BUDGET = 1024 ** 3
+IMAGE_WRITER_WORKERS = 2
+
+# Maximum number of timed spans of the acquisition kept in memory between
+# two flushes to meta/stats (the oldest spans are dropped first), and the
+# number of recent slices summarized in the acquisition statistics.
+TRACE_BUFFER_SIZE = 100000
+TRACE_SUMMARY_SLICES = 20
+
+# Interval in ms in which GUI updates sent from other threads are collected
+# and merged before they are processed (about 25 frames per second).
+GUI_FRAME_INTERVAL = 40
+
 # Scaling parameters to convert between the scale factors and the position
 # of the zoom sliders in the Viewport (VP) and the Slice-by-Slice viewer
 # (SV). Settings for tiles and for OVs are stored separately because
@@ -76,17 +104,32 @@ RE_TILE_LIST = re.compile('^((0|[1-9][0-9]*)[.](0|[1-9][0-9]*))'
 RE_OV_LIST = re.compile('^([0-9]+)([ ]*,[ ]*[0-9]+)*$')
 
 # Image format / extensions
+# DEFAULT_IMAGE_FORMAT can be set to ZARR_IMAGE_FORMAT to store images as OME-Zarr
 DEFAULT_IMAGE_FORMAT = '.ome.tif'
+ZARR_IMAGE_FORMAT = '.ome.zarr'
 STUBOV_IMAGE_FORMAT = DEFAULT_IMAGE_FORMAT
 OV_IMAGE_FORMAT = DEFAULT_IMAGE_FORMAT
 GRIDTILE_IMAGE_FORMAT = DEFAULT_IMAGE_FORMAT
 FRAME_IMAGE_FORMAT = DEFAULT_IMAGE_FORMAT
 TEMP_IMAGE_FORMAT = '.tif'
 SCREENSHOT_FORMAT = '.png'
+# Append-only reslice store (see reslice_io.py)
+RESLICE_FORMAT = '.reslice'
+# Formats of reslice images written by previous versions
+LEGACY_RESLICE_FORMATS = ['.ome.tif', '.tif', '.png']
 
 DEFAULT_PYRAMID_DOWNSAMPLE = 2
 DEFAULT_PYRAMID_LEVELS = 4
 
+# Compression codec of saved images if none is configured (see
+# image_io.COMPRESSION_CODECS). The codec recommended by the compression
+# calibration (see codec_calibration.py) encodes a frame in less than
+# CODEC_TIME_FRACTION of the tile cycle time; each codec is measured
+# CODEC_CALIBRATION_REPEATS times.
+DEFAULT_COMPRESSION = 'none'
+CODEC_TIME_FRACTION = 0.25
+CODEC_CALIBRATION_REPEATS = 3
+
 LOG_FILENAME = 'log/SBEMimage.log'
 # Custom date/time / format to get '.' instead of ',' as millisecond separator
 LOG_FORMAT = '%(asctime)s.%(msecs)03d %(levelname)s %(category)s: %(message)s'
@@ -0,0 +1,50 @@
+from qtpy.QtCore import Qt
+from qtpy.QtWidgets import QDialog, QTableWidgetItem
+from qtpy.uic import loadUi
+
+import utils
+
+
+class AcqStatsDlg(QDialog):
+    """Show the durations of the acquisition phases in the most recent
+    slices and the largest sources of idle time. The dialog is not modal
+    and is updated after each slice while it is open."""
+
+    def __init__(self, tracer):
+        super().__init__()
+        self.tracer = tracer
+        loadUi('gui/acq_stats_dlg.ui', self)
+        self.setWindowModality(Qt.NonModal)
+        self.setWindowIcon(utils.get_window_icon())
+        self.setFixedSize(self.size())
+        self.pushButton_update.clicked.connect(self.show_current_stats)
+        self.show_current_stats()
+
+    def show_current_stats(self):
+        slice_durations = self.tracer.slice_durations()
+        if slice_durations:
+            self.label_slices.setText(
+                f'Last {len(slice_durations)} slice(s): '
+                f'{sum(slice_durations) / len(slice_durations):.1f} s '
+                f'per slice on average.')
+        else:
+            self.label_slices.setText('No slices acquired in this session.')
+
+        summary = sorted(self.tracer.summary().items(),
+                         key=lambda item: item[1]['per_slice'], reverse=True)
+        self.tableWidget_phases.setRowCount(len(summary))
+        for row, (phase, stats) in enumerate(summary):
+            values = [phase, str(stats['count'])] + [
+                f'{stats[key]:.3f}'
+                for key in ['p50', 'p90', 'p99', 'max', 'per_slice']]
+            for column, value in enumerate(values):
+                self.tableWidget_phases.setItem(
+                    row, column, QTableWidgetItem(value))
+
+        idle_sources = self.tracer.idle_sources()
+        self.tableWidget_idle.setRowCount(len(idle_sources))
+        for row, (source, per_slice, fraction) in enumerate(idle_sources):
+            values = [source, f'{per_slice:.1f}', f'{fraction * 100:.1f}']
+            for column, value in enumerate(values):
+                self.tableWidget_idle.setItem(
+                    row, column, QTableWidgetItem(value))
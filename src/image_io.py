@@ -1,15 +1,59 @@
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from copy import deepcopy
 from datetime import datetime
 import imageio.v3 as iio
 import numpy as np
 import os
+import shutil
+import threading
 import tifffile
 from tifffile import TiffWriter, PHOTOMETRIC
 
-from constants import VERSION, DEFAULT_PYRAMID_DOWNSAMPLE
-from utils import resize_image, int2float_image, float2int_image, norm_image_quantiles, validate_output_path
-
-# TODO: add ome.zarr support
-
+try:
+    import zarr
+    import numcodecs
+except ImportError:
+    zarr = None
+
+try:
+    import imagecodecs
+except ImportError:
+    imagecodecs = None
+# imagecodecs.numcodecs, imported when needed (see register_zarr_imagecodecs())
+zarr_imagecodecs = None
+
+from constants import VERSION, DEFAULT_PYRAMID_DOWNSAMPLE, IMAGE_METADATA_CACHE_SIZE
+from utils import (resize_image, downsample_image, int2float_image, float2int_image, norm_image_quantiles,
+                   validate_output_path)
+
+
+# Chunk size for OME-Zarr images if no tile size is specified
+ZARR_CHUNK_SIZE = 1024
+# Version of the OME-NGFF specification used for OME-Zarr images
+NGFF_VERSION = '0.4'
+# Minimum size (in bytes) of a TIFF image that is memory-mapped by imread()
+# with memmap=True. Smaller images are read faster into memory.
+MEMMAP_MIN_SIZE = 64 * 1024 ** 2
+# Number of threads that compress the tiles or strips of a TIFF image, and
+# the minimum size (in bytes) of an image (or pyramid level) that is
+# compressed in parallel. Smaller or uncompressed images are written by the
+# calling thread, the thread pool would cost more than it saves.
+COMPRESSION_WORKERS = max(1, (os.cpu_count() or 2) // 2)
+PARALLEL_COMPRESSION_MIN_SIZE = 4 * 1024 ** 2
+# Compression codecs that can be selected for tiles, overviews and stub
+# overviews: {name: (tifffile compression, compression arguments)}.
+# All codecs are lossless.
+COMPRESSION_CODECS = OrderedDict([
+    ('none', (None, None)),
+    ('lzw', ('lzw', None)),
+    ('deflate_1', ('zlib', {'level': 1})),
+    ('deflate_6', ('zlib', {'level': 6})),
+    ('deflate_9', ('zlib', {'level': 9})),
+    ('zstd', ('zstd', {'level': 3})),
+    ('jpegxl', ('jpegxl', {'lossless': True})),
+])
 
 CONVERSIONS = {'nm': 1e-3, 'nanometer': 1e-3,
                'µm': 1, 'um': 1, 'micrometer': 1,
@@ -18,54 +62,228 @@ CONVERSIONS = {'nm': 1e-3, 'nanometer': 1e-3,
                'm': 1e6, 'meter': 1e6}
 
 
-def imread(path, level=None, source_pixel_size_um=None, target_pixel_size_um=None, channeli=None, render=True):
+def imread(path, level=None, source_pixel_size_um=None, target_pixel_size_um=None, channeli=None, render=True,
+           memmap=False):
+    """Read an image (TIFF, OME-Zarr or any format supported by imageio).
+    TIFF pixels, pyramid level and metadata are read in a single TiffFile
+    session. If memmap is True, uncompressed contiguous TIFF images (of at
+    least MEMMAP_MIN_SIZE bytes) are returned as copy-on-write memory maps of
+    the file instead of being read into memory. Use this only if the image is not kept (the file cannot be
+    overwritten on Windows while it is mapped)."""
     image = None
     if os.path.exists(path):
         paths = os.path.splitext(path)
         ext = paths[-1].lower()
         is_tiff = ext in ['.tif', '.tiff']
-        metadata = imread_metadata(path)
+        is_zarr = (ext == '.zarr')
+        if is_tiff:
+            with tifffile.TiffFile(path) as tiff:
+                metadata = cached_metadata(path, lambda: parse_metadata(path, tiff))
+                level = select_level(metadata, level, source_pixel_size_um, target_pixel_size_um)
+                if level is None or level < len(metadata['sizes']):
+                    image = read_tiff_level(tiff, level or 0, memmap)
+        else:
+            metadata = imread_metadata(path)
+            level = select_level(metadata, level, source_pixel_size_um, target_pixel_size_um)
+            if is_zarr:
+                if level is None or level < len(metadata['sizes']):
+                    image = np.asarray(open_zarr_level(path, level or 0)[...])
+            else:
+                try:
+                    image = iio.imread(path)
+                except Exception as e:
+                    raise TypeError(f'Error reading image {path}\n{e}')
         dimension_order = metadata.get('dimension_order', -1)
         if 'c' in dimension_order:
             c_index = dimension_order.index('c')
         else:
             c_index = None
-        size = metadata['size']
-        nlevels = len(metadata['sizes'])
-        if source_pixel_size_um is not None:
-            source_pixel_size = source_pixel_size_um
-        else:
-            source_pixel_size = metadata.get('pixel_size')
-        scale_by_pixel_size = (target_pixel_size_um is not None and source_pixel_size is not None)
-        if scale_by_pixel_size:
-            target_size = (np.divide(source_pixel_size, target_pixel_size_um) * size).astype(int)
-        else:
-            target_size = 1
-
-        if is_tiff:
-            if scale_by_pixel_size:
-                for level1, size1 in enumerate(metadata['sizes']):
-                    if np.all(size1 > target_size):
-                        level = level1
-            if level is None or level < nlevels:
-                image = tifffile.imread(path, level=level)
-                # ensure colour channel is at the end
-                if c_index is not None and c_index < len(dimension_order) - 1:
-                    image = np.moveaxis(image, c_index, -1)
-                    if channeli is not None:
-                        image = image[..., channeli]
-        else:
-            try:
-                image = iio.imread(path)
-            except Exception as e:
-                raise TypeError(f'Error reading image {path}\n{e}')
-        if scale_by_pixel_size and not np.all(target_size == size):
+        if (is_tiff or is_zarr) and image is not None:
+            # ensure colour channel is at the end
+            if c_index is not None and c_index < len(dimension_order) - 1:
+                image = np.moveaxis(image, c_index, -1)
+                if channeli is not None:
+                    image = image[..., channeli]
+        target_size = scaled_size(metadata, source_pixel_size_um, target_pixel_size_um)
+        if image is not None and target_size is not None and not np.all(target_size == metadata['size']):
             image = resize_image(image, target_size)
         if render and image is not None:
             image = render_image(image, metadata.get('channels', []))
     return image
 
 
+def scaled_size(metadata, source_pixel_size_um=None, target_pixel_size_um=None):
+    """Return the size (width, height) of the full-resolution image scaled to
+    target_pixel_size_um, or None if no scaling is needed or possible."""
+    if source_pixel_size_um is not None:
+        source_pixel_size = source_pixel_size_um
+    else:
+        source_pixel_size = metadata.get('pixel_size')
+    if target_pixel_size_um is None or source_pixel_size is None:
+        return None
+    return (np.divide(source_pixel_size, target_pixel_size_um) * metadata['size']).astype(int)
+
+
+def select_level(metadata, level=None, source_pixel_size_um=None, target_pixel_size_um=None):
+    """Return the smallest pyramid level that is still larger than the image
+    scaled to target_pixel_size_um, or level if no scaling is requested."""
+    target_size = scaled_size(metadata, source_pixel_size_um, target_pixel_size_um)
+    if target_size is not None:
+        for level1, size1 in enumerate(metadata['sizes']):
+            if np.all(size1 > target_size):
+                level = level1
+    return level
+
+
+def read_tiff_level(tiff, level=0, memmap=False):
+    """Read the pixels of a pyramid level of the first series of an open
+    TiffFile."""
+    series = tiff.series[0]
+    if level > 0:
+        series = series.levels[level]
+    if memmap and series.nbytes >= MEMMAP_MIN_SIZE:
+        # Only set for uncompressed images stored contiguously in the file
+        offset = series.dataoffset
+        if offset is not None:
+            dtype = np.dtype(tiff.byteorder + series.dtype.char)
+            return np.memmap(tiff.filehandle.path, dtype=dtype, mode='c',
+                             offset=offset, shape=series.shape)
+    return series.asarray()
+
+
+def imread_region(path, level, y0, x0, h, w, source_pixel_size_um=None, target_pixel_size_um=None,
+                  render=False):
+    """Read the region y0:y0+h, x0:x0+w of an image. Only the TIFF tiles or
+    strips (or OME-Zarr chunks) that intersect the region are decoded; other
+    formats are read in full and sliced. The result is the same as slicing
+    the image returned by imread() (colour channel at the end). If level is
+    None, the region is given in full-resolution pixels, and the pyramid
+    level is selected with source_pixel_size_um and target_pixel_size_um as
+    in imread() (the region is read at the resolution of that level, it is
+    not resized)."""
+    if not os.path.exists(path):
+        return None
+    metadata = imread_metadata(path)
+    if level is None:
+        level = select_level(metadata, None, source_pixel_size_um, target_pixel_size_um) or 0
+        if level > 0:
+            # Convert the region to pixels of the selected level
+            scale = np.divide(metadata['sizes'][level], metadata['size'])
+            y1, x1 = int(np.ceil((y0 + h) * scale[1])), int(np.ceil((x0 + w) * scale[0]))
+            y0, x0 = int(y0 * scale[1]), int(x0 * scale[0])
+            h, w = y1 - y0, x1 - x0
+    # Clip the region to the image as numpy slicing does
+    width, height = metadata['sizes'][level]
+    y0, x0 = min(max(y0, 0), height), min(max(x0, 0), width)
+    h, w = max(min(h, height - y0), 0), max(min(w, width - x0), 0)
+
+    ext = os.path.splitext(path)[-1].lower()
+    dimension_order = metadata['dimension_order']
+    if ext in ['.tif', '.tiff']:
+        with tifffile.TiffFile(path) as tiff:
+            image = read_tiff_region(tiff, level, y0, x0, h, w)
+    elif ext == '.zarr':
+        image = np.asarray(open_zarr_level(path, level)[..., y0:y0 + h, x0:x0 + w])
+    else:
+        image = imread(path, level=level, render=False)[y0:y0 + h, x0:x0 + w]
+        dimension_order = 'yxc'
+    if 'c' in dimension_order:
+        c_index = dimension_order.index('c')
+        if c_index < len(dimension_order) - 1:
+            image = np.moveaxis(image, c_index, -1)
+    if render:
+        image = render_image(image, metadata.get('channels', []))
+    return image
+
+
+def read_tiff_region(tiff, level, y0, x0, h, w):
+    """Read the region y0:y0+h, x0:x0+w (within the image) of a pyramid level
+    of the first series of an open TiffFile. Only the intersecting tiles or
+    strips are read and decoded."""
+    series = tiff.series[0]
+    if level > 0:
+        series = series.levels[level]
+    pages = series.pages
+    keyframe = pages[0].keyframe
+    # Page shape normalised by tifffile:
+    # (separate samples, depth, length, width, contiguous samples)
+    planes, depth, length, width, samples = keyframe.shaped
+    leading_shape = series.shape[:len(series.shape) - len(keyframe.shape)]
+    if keyframe.is_tiled:
+        segment_length, segment_width = keyframe.tilelength, keyframe.tilewidth
+    else:
+        segment_length, segment_width = min(keyframe.rowsperstrip, length), width
+    rows = -(-length // segment_length)
+    columns = -(-width // segment_width)
+    if (depth > 1 or int(np.prod(leading_shape)) != len(pages)
+            or len(keyframe.dataoffsets) != planes * rows * columns):
+        # Not a plain 2D tiled or striped image: read in full and slice
+        return read_tiff_level(tiff, level)[tuple(
+            slice(y0, y0 + h) if axis == 'Y' else slice(x0, x0 + w) if axis == 'X' else slice(None)
+            for axis in series.axes)]
+
+    region_shape = tuple(h if axis == 'Y' else w if axis == 'X' else size
+                         for axis, size in zip(keyframe.axes, keyframe.shape))
+    region = np.zeros((len(pages), planes, 1, h, w, samples), dtype=keyframe.dtype)
+    if h > 0 and w > 0:
+        segment_rows = range(y0 // segment_length, (y0 + h - 1) // segment_length + 1)
+        segment_columns = range(x0 // segment_width, (x0 + w - 1) // segment_width + 1)
+        indices = [plane * rows * columns + row * columns + column
+                   for plane in range(planes) for row in segment_rows for column in segment_columns]
+        for page_index, page in enumerate(pages):
+            offsets = [page.dataoffsets[index] for index in indices]
+            bytecounts = [page.databytecounts[index] for index in indices]
+            segments = tiff.filehandle.read_segments(offsets, bytecounts, sort=True)
+            for data, i in segments:
+                segment, (plane, _, y, x, _), shape = keyframe.decode(
+                    data, indices[i], jpegtables=keyframe.jpegtables, jpegheader=keyframe.jpegheader)
+                if segment is None:
+                    # Empty segment
+                    continue
+                segment = segment[0, :shape[1], :shape[2]]
+                # Intersection of segment and region
+                top, left = max(y, y0), max(x, x0)
+                bottom, right = min(y + shape[1], y0 + h), min(x + shape[2], x0 + w)
+                region[page_index, plane, 0, top - y0:bottom - y0, left - x0:right - x0] = (
+                    segment[top - y:bottom - y, left - x:right - x])
+    return region.reshape(leading_shape + region_shape)
+
+
+# Metadata of the most recently read images, see cached_metadata()
+_metadata_cache = OrderedDict()
+_metadata_cache_lock = threading.Lock()
+
+
+def cached_metadata(path, parse):
+    """Return a copy of the cached metadata of the image file path, or call
+    parse() to read it. Files are identified by path, modification time and
+    size, so a file that is overwritten is read again. OME-Zarr directories
+    are not cached."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return parse()
+    if not os.path.isfile(path):
+        return parse()
+    key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+    with _metadata_cache_lock:
+        metadata = _metadata_cache.get(key)
+        if metadata is not None:
+            _metadata_cache.move_to_end(key)
+            return deepcopy(metadata)
+    metadata = parse()
+    with _metadata_cache_lock:
+        _metadata_cache[key] = deepcopy(metadata)
+        while len(_metadata_cache) > IMAGE_METADATA_CACHE_SIZE:
+            _metadata_cache.popitem(last=False)
+    return metadata
+
+
+def clear_metadata_cache():
+    with _metadata_cache_lock:
+        _metadata_cache.clear()
+
+
 def render_image(image, channels):
     total_image = None
     nchannels = image.shape[-1] if image.ndim >= 3 else 1
@@ -114,18 +332,57 @@ def render_image(image, channels):
 
 
 def imread_metadata(path):
+    return cached_metadata(path, lambda: parse_metadata(path))
+
+
+def parse_metadata(path, tiff=None):
+    """Read the metadata of an image file. tiff: TiffFile of path if it is
+    already open."""
     all_metadata = {}
     paths = os.path.splitext(path)
     ext = paths[-1].lower()
     is_tiff = ext in ['.tif', '.tiff']
+    is_zarr = (ext == '.zarr')
     pixel_size = []
     position = []
     rotation = None
     dimension_order = 'yxc'
     channels = []
 
-    if is_tiff:
-        with tifffile.TiffFile(path) as tiff:
+    if is_zarr:
+        group = open_zarr_group(path)
+        multiscale = group.attrs['multiscales'][0]
+        axes = multiscale['axes']
+        dimension_order = ''.join(axis['name'] for axis in axes)
+        x_index = dimension_order.index('x')
+        y_index = dimension_order.index('y')
+        units = [axis.get('unit', 'micrometer') for axis in axes]
+        sizes = []
+        for dataset in multiscale['datasets']:
+            shape = group[dataset['path']].shape
+            sizes.append((shape[x_index], shape[y_index]))
+        size = sizes[0]
+        for transformation in multiscale['datasets'][0].get('coordinateTransformations', []):
+            if transformation['type'] == 'scale':
+                scale = transformation['scale']
+                pixel_size = [(scale[x_index], units[x_index]),
+                              (scale[y_index], units[y_index])]
+            elif transformation['type'] == 'translation':
+                translation = transformation['translation']
+                position = [convert_units_micrometer(
+                    [(translation[x_index], units[x_index]),
+                     (translation[y_index], units[y_index])])]
+        sbemimage_metadata = group.attrs.get('sbemimage', {})
+        # Positions including z (not part of the 2D coordinate transformations)
+        position = sbemimage_metadata.get('position', position)
+        rotation = sbemimage_metadata.get('rotation')
+        for channeli, channel0 in enumerate(group.attrs.get('omero', {}).get('channels', [])):
+            channel = {'label': channel0.get('label') or f'#{channeli}'}
+            if 'color' in channel0:
+                channel['color'] = color_hex_to_rgba(channel0['color'])
+            channels.append(channel)
+    elif is_tiff:
+        with nullcontext(tiff) if tiff is not None else tifffile.TiffFile(path) as tiff:
             size = tiff.pages.first.imagewidth, tiff.pages.first.imagelength
             sizes = [size]
             if hasattr(tiff, 'series'):
@@ -259,6 +516,19 @@ def imread_metadata(path):
     return all_metadata
 
 
+def number_planes(shape):
+    """Return the number of image planes written for data of shape (see
+    imwrite_tiff()): RGB(A) samples form one plane, other channels (last
+    axis, if smaller than the first) are written as separate planes."""
+    if len(shape) <= 3 and shape[-1] in (3, 4):
+        return 1
+    if len(shape) >= 3 and shape[-1] < shape[0]:
+        h_index, w_index = -3, -2
+    else:
+        h_index, w_index = -2, -1
+    return int(np.prod(shape)) // (shape[h_index] * shape[w_index])
+
+
 def create_tiff_metadata(metadata, shape, is_ome=False):
     # TODO: give position instead of center in metadata everywhere, then remove obsolete center -> position conversion
     ome_metadata = None
@@ -292,6 +562,10 @@ def create_tiff_metadata(metadata, shape, is_ome=False):
         positions = metadata.get('position', [])
     if not isinstance(positions, list):
         positions = [positions]
+    nplanes = number_planes(shape)
+    if len(positions) == 1 and nplanes > 1:
+        # Same position for all planes (channels) of the image
+        positions = positions * nplanes
     rotation = metadata.get('rotation')
     channels = metadata.get('channels', [])
 
@@ -335,10 +609,13 @@ def create_tiff_metadata(metadata, shape, is_ome=False):
 
 
 def imwrite(path, data, metadata=None, tile_size=None, compression=None,
-            npyramid_add=0, pyramid_downsample=DEFAULT_PYRAMID_DOWNSAMPLE):
-    resolution = None
-    resolution_unit = None
-
+            npyramid_add=0, pyramid_downsample=DEFAULT_PYRAMID_DOWNSAMPLE, pyramid=None):
+    """Write data as image file. TIFF and OME-Zarr images get npyramid_add
+    additional pyramid levels, each averaged from the previous one.
+    pyramid: list of additional levels that are already available (for
+    example kept up to date by MosaicWriter), used instead of npyramid_add.
+    compression: codec name (see COMPRESSION_CODECS) or tifffile
+    compression, see tiff_compression()."""
     if data is None:
         return
 
@@ -347,41 +624,291 @@ def imwrite(path, data, metadata=None, tile_size=None, compression=None,
     paths = path.split('.', 1)
     ext = paths[-1].lower()
     is_tiff = 'tif' in ext
+    is_zarr = ext.endswith('zarr')
     is_ome = paths[-1].lower().startswith('ome')
+
+    if is_zarr:
+        imwrite_zarr(path, data, metadata, tile_size, compression,
+                     npyramid_add, pyramid_downsample, pyramid)
+    elif is_tiff:
+        imwrite_tiff(path, data, metadata, tile_size, compression,
+                     npyramid_add, pyramid_downsample, pyramid, is_ome)
+    else:
+        iio.imwrite(path, data)
+
+
+def imwrite_tiff(file, data, metadata=None, tile_size=None, compression=None,
+                 npyramid_add=0, pyramid_downsample=DEFAULT_PYRAMID_DOWNSAMPLE, pyramid=None,
+                 is_ome=False):
+    """Write data as (OME-)TIFF to file (path or binary file object), see
+    imwrite(). The tiles or strips of large images are compressed in
+    parallel (see compression_workers())."""
+    resolution = None
+    resolution_unit = None
+    if pyramid is not None:
+        npyramid_add = len(pyramid)
+    compression, compressionargs = tiff_compression(compression)
+
+    if data.ndim <= 3 and data.shape[-1] in (3, 4):
+        photometric = PHOTOMETRIC.RGB
+        move_channel = False
+    else:
+        photometric = PHOTOMETRIC.MINISBLACK
+        # move channel axis to front
+        move_channel = (data.ndim >= 3 and data.shape[-1] < data.shape[0])
+
+    if metadata is not None:
+        tiff_metadata, resolution, resolution_unit = create_tiff_metadata(metadata, data.shape, is_ome)
+    else:
+        tiff_metadata = None
+    with TiffWriter(file) as writer:
+        ordered_data = np.moveaxis(data, -1, 0) if move_channel else data
+        writer.write(ordered_data, photometric=photometric, subifds=npyramid_add,
+                     tile=tile_size, compression=compression, compressionargs=compressionargs,
+                     maxworkers=compression_workers(ordered_data, compression),
+                     resolution=resolution, resolutionunit=resolution_unit,
+                     metadata=tiff_metadata)
+        if pyramid is None:
+            pyramid = pyramid_levels(data, npyramid_add, pyramid_downsample)
+        for resized_data in pyramid:
+            if resolution is not None:
+                resolution = tuple(np.divide(resolution, pyramid_downsample))
+            ordered_data = np.moveaxis(resized_data, -1, 0) if move_channel else resized_data
+            writer.write(ordered_data, subfiletype=1,
+                         tile=tile_size, compression=compression, compressionargs=compressionargs,
+                         maxworkers=compression_workers(ordered_data, compression),
+                         resolution=resolution, resolutionunit=resolution_unit)
+
+
+def compression_workers(data, compression):
+    """Return the number of threads that compress data with (tifffile)
+    compression: COMPRESSION_WORKERS for compressed images of at least
+    PARALLEL_COMPRESSION_MIN_SIZE bytes, otherwise 1."""
+    if compression is None or data.nbytes < PARALLEL_COMPRESSION_MIN_SIZE:
+        return 1
+    return COMPRESSION_WORKERS
+
+
+def is_compressible(path):
+    """Return True if imwrite() applies a compression codec to path (TIFF
+    and OME-Zarr files)."""
+    return os.path.splitext(path)[1].lower() in ['.tif', '.tiff', '.zarr']
+
+
+def tiff_compression(compression):
+    """Return (compression, compressionargs) for tifffile. compression is a
+    codec name (see COMPRESSION_CODECS), a tifffile compression name, or a
+    tuple (tifffile compression name, level)."""
+    if isinstance(compression, (list, tuple)):
+        return compression[0], {'level': compression[1]}
+    if isinstance(compression, str) and compression.lower() in COMPRESSION_CODECS:
+        return COMPRESSION_CODECS[compression.lower()]
+    return compression, None
+
+
+def codec_available(codec):
+    """Return True if the encoder of codec (see COMPRESSION_CODECS) is
+    available. LZW, zstd and JPEG XL require imagecodecs (JPEG XL is not
+    included in all builds)."""
+    if codec not in COMPRESSION_CODECS:
+        return False
+    compression = COMPRESSION_CODECS[codec][0]
+    if compression in (None, 'zlib'):
+        # zlib is part of the standard library
+        return True
+    if imagecodecs is None:
+        return False
+    return bool(getattr(getattr(imagecodecs, compression.upper(), None), 'available', False))
+
+
+def available_codecs():
+    """Return the names of the codecs in COMPRESSION_CODECS that can be
+    used."""
+    return [codec for codec in COMPRESSION_CODECS if codec_available(codec)]
+
+
+def pyramid_levels(data, npyramid_add, pyramid_downsample=DEFAULT_PYRAMID_DOWNSAMPLE):
+    """Yield the additional pyramid levels 1..npyramid_add of data (colour
+    channel at the end). Level i has the size of data divided by
+    pyramid_downsample ** i (rounded) and is averaged from level i - 1."""
     size = np.flip(data.shape[:2])
+    level_data = data
+    for level in range(1, npyramid_add + 1):
+        int_size = np.round(size / pyramid_downsample ** level).astype(int)
+        level_data = downsample_image(level_data, int_size)
+        yield level_data
+
+
+def register_zarr_imagecodecs():
+    """Register the imagecodecs codecs (LZW, JPEG XL) with numcodecs, so
+    that OME-Zarr images using them can be written and read."""
+    global zarr_imagecodecs
+    if zarr_imagecodecs is None and imagecodecs is not None:
+        from imagecodecs import numcodecs as zarr_imagecodecs
+        zarr_imagecodecs.register_codecs(verbose=False)
+    return zarr_imagecodecs
+
+
+def open_zarr_group(path, mode='r'):
+    if zarr is None:
+        raise ImportError('The zarr package is required for OME-Zarr images')
+    register_zarr_imagecodecs()
+    if mode == 'w':
+        # OME-NGFF 0.4 is based on the zarr v2 format
+        return zarr.open_group(path, mode=mode, zarr_format=2)
+    return zarr.open_group(path, mode=mode)
+
+
+def open_zarr_level(path, level=0):
+    """Return the specified pyramid level of an OME-Zarr image as a zarr
+    array. Only the chunks of the regions accessed are read from disk."""
+    group = open_zarr_group(path)
+    datasets = group.attrs['multiscales'][0]['datasets']
+    return group[datasets[level]['path']]
+
+
+def create_zarr_compressor(compression):
+    """Return the numcodecs codec for a codec name (see COMPRESSION_CODECS)
+    or tifffile-style compression. Return None for no compression."""
+    compression, compressionargs = tiff_compression(compression)
+    if compression is None:
+        return None
+    level = (compressionargs or {}).get('level')
+    compression = compression.lower()
+    if compression in ('zlib', 'deflate', 'adobe_deflate'):
+        return numcodecs.Zlib(level=level if level is not None else 1)
+    if compression == 'zstd':
+        return numcodecs.Zstd(level=level if level is not None else 0)
+    if compression == 'lzma':
+        return numcodecs.LZMA()
+    if compression in ('lz4', 'blosc'):
+        return numcodecs.Blosc(cname='lz4', clevel=level if level is not None else 5)
+    if compression in ('lzw', 'jpegxl'):
+        # numcodecs does not include LZW and JPEG XL, imagecodecs does
+        codecs = register_zarr_imagecodecs()
+        if codecs is None:
+            raise ImportError(f'The imagecodecs package is required for '
+                              f'{compression} compression')
+        if compression == 'lzw':
+            return codecs.Lzw()
+        return codecs.Jpegxl(**(compressionargs or {}))
+    if compression == 'none':
+        return None
+    raise ValueError(f'Unsupported compression for OME-Zarr: {compression}')
+
+
+def imwrite_zarr(path, data, metadata=None, tile_size=None, compression=None,
+                 npyramid_add=0, pyramid_downsample=DEFAULT_PYRAMID_DOWNSAMPLE, pyramid=None):
+    """Write data as OME-Zarr (OME-NGFF multiscale group). Each pyramid level
+    is a chunked array (chunk size: tile_size), the levels are written in
+    parallel. Metadata is converted using create_tiff_metadata(). See
+    imwrite() for pyramid."""
+    if pyramid is not None:
+        npyramid_add = len(pyramid)
+    # channel axis (RGB or multichannel) is stored in front
+    has_channels = (data.ndim >= 3)
+    if tile_size is None:
+        tile_size = ZARR_CHUNK_SIZE
+    chunks = tuple(np.broadcast_to(tile_size, 2).tolist())
+    if has_channels:
+        chunks = (1,) + chunks
+    compressor = create_zarr_compressor(compression)
+
+    ome_metadata = {}
+    if metadata is not None:
+        ome_metadata, _, _ = create_tiff_metadata(metadata, data.shape, is_ome=True)
+    pixel_size = [ome_metadata.get('PhysicalSizeY', 1), ome_metadata.get('PhysicalSizeX', 1)]
+    plane = ome_metadata.get('Plane', {})
+    translation = [plane.get('PositionY', [0])[0], plane.get('PositionX', [0])[0]]
+    axes = [{'name': 'y', 'type': 'space', 'unit': 'micrometer'},
+            {'name': 'x', 'type': 'space', 'unit': 'micrometer'}]
+    if has_channels:
+        axes = [{'name': 'c', 'type': 'channel'}] + axes
+        pixel_size = [1] + pixel_size
+        translation = [0] + translation
 
-    if is_tiff:
-        if data.ndim <= 3 and data.shape[-1] in (3, 4):
-            photometric = PHOTOMETRIC.RGB
-            move_channel = False
+    if os.path.exists(path):
+        remove_image(path)
+    group = open_zarr_group(path, mode='w')
+
+    # Create the arrays for all levels first, then write them in parallel
+    size = np.array(data.shape[:2])
+    datasets = []
+    level_arrays = []
+    for level in range(npyramid_add + 1):
+        if pyramid is not None and level > 0:
+            shape = tuple(pyramid[level - 1].shape[:2])
         else:
-            photometric = PHOTOMETRIC.MINISBLACK
-            # move channel axis to front
-            move_channel = (data.ndim >= 3 and data.shape[-1] < data.shape[0])
+            shape = tuple(np.round(size / pyramid_downsample ** level).astype(int).tolist())
+        if has_channels:
+            shape = (data.shape[-1],) + shape
+        level_arrays.append(group.create_array(
+            str(level), shape=shape, chunks=chunks, dtype=data.dtype, compressors=compressor,
+            chunk_key_encoding={'name': 'v2', 'separator': '/'}))
+        scale = list(pixel_size)
+        scale[-2:] = [s * pyramid_downsample ** level for s in scale[-2:]]
+        datasets.append({'path': str(level),
+                         'coordinateTransformations': [
+                             {'type': 'scale', 'scale': scale},
+                             {'type': 'translation', 'translation': translation}]})
+
+    def write_level(level, level_data):
+        if has_channels:
+            level_data = np.moveaxis(level_data, -1, 0)
+        level_arrays[level][...] = level_data
+
+    # Each level is averaged from the previous one, while the levels
+    # already built are compressed and written in parallel
+    with ThreadPoolExecutor() as executor:
+        futures = [executor.submit(write_level, 0, data)]
+        if pyramid is None:
+            pyramid = pyramid_levels(data, npyramid_add, pyramid_downsample)
+        for level, level_data in enumerate(pyramid, 1):
+            futures.append(executor.submit(write_level, level, level_data))
+        for future in futures:
+            future.result()
+
+    group.attrs['multiscales'] = [{
+        'version': NGFF_VERSION,
+        'name': os.path.basename(path),
+        'axes': axes,
+        'datasets': datasets}]
+    channels = ome_metadata.get('Channel', [])
+    if channels:
+        omero_channels = []
+        for channel in channels:
+            omero_channel = {'label': channel.get('Name', '')}
+            if 'Color' in channel:
+                omero_channel['color'] = color_rgba_to_hex(color_int_to_rgba(channel['Color']))
+            omero_channels.append(omero_channel)
+        group.attrs['omero'] = {'channels': omero_channels}
+    sbemimage_metadata = {}
+    if metadata is not None:
+        sbemimage_metadata = {'creator': ome_metadata.get('Creator'),
+                              'acquisition_date': ome_metadata.get('AcquisitionDate')}
+        if plane:
+            sbemimage_metadata['position'] = [
+                list(position) for position in zip(plane.get('PositionX', []),
+                                                   plane.get('PositionY', []))]
+        if metadata.get('rotation') is not None:
+            sbemimage_metadata['rotation'] = metadata['rotation']
+    group.attrs['sbemimage'] = sbemimage_metadata
+
+
+def remove_image(path):
+    """Delete image file (or OME-Zarr directory)."""
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    else:
+        os.remove(path)
 
-        if metadata is not None:
-            tiff_metadata, resolution, resolution_unit = create_tiff_metadata(metadata, data.shape, is_ome)
-        else:
-            tiff_metadata = None
-        with TiffWriter(path) as writer:
-            new_size = size
-            ordered_data = np.moveaxis(data, -1, 0) if move_channel else data
-            writer.write(ordered_data, photometric=photometric, subifds=npyramid_add,
-                         tile=tile_size, compression=compression,
-                         resolution=resolution, resolutionunit=resolution_unit,
-                         metadata=tiff_metadata)
-            for i in range(npyramid_add):
-                new_size = new_size / pyramid_downsample    # implicit int -> float conversion
-                if resolution is not None:
-                    resolution = tuple(np.divide(resolution, pyramid_downsample))
-                int_size = np.round(new_size).astype(int)
-                resized_data = resize_image(data, int_size)
-                ordered_data = np.moveaxis(resized_data, -1, 0) if move_channel else resized_data
-                writer.write(ordered_data, subfiletype=1,
-                             tile=tile_size, compression=compression,
-                             resolution=resolution, resolutionunit=resolution_unit)
+
+def copy_image(src_path, dst_path):
+    """Copy image file (or OME-Zarr directory)."""
+    if os.path.isdir(src_path):
+        shutil.copytree(src_path, dst_path, dirs_exist_ok=True)
     else:
-        iio.imwrite(path, data)
+        shutil.copy(src_path, dst_path)
 
 
 def convert_units_micrometer(value_units0: list):
@@ -413,4 +940,12 @@ def color_int_to_rgba(intrgba: int) -> list:
 
 def color_rgba_to_int(rgba: list) -> int:
     intrgba = int.from_bytes([int(x * 255) for x in rgba], signed=True, byteorder="big")
-    return intrgba
\ No newline at end of file
+    return intrgba
+
+
+def color_rgba_to_hex(rgba: list) -> str:
+    return ''.join(f'{int(x * 255):02X}' for x in rgba[:3])
+
+
+def color_hex_to_rgba(hexrgb: str) -> list:
+    return [int(hexrgb[i:i + 2], 16) / 255 for i in (0, 2, 4)] + [1]
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+
+# ==============================================================================
+#   This source file is part of SBEMimage (github.com/SBEMimage)
+#   (c) 2018-2020 Friedrich Miescher Institute for Biomedical Research, Basel,
+#   and the SBEMimage developers.
+#   This software is licensed under the terms of the MIT License.
+#   See LICENSE.txt in the project root folder.
+# ==============================================================================
+
+"""This module provides an incremental writer for tiled mosaics such as the
+stub overview.
+
+The mosaic and its downsampled copies (pyramid levels) are kept in memory.
+Pasting a tile updates only the region of each level covered by the tile and
+returns this (dirty) region, so the cost per tile does not depend on the size
+of the mosaic or the number of tiles already acquired. The pyramidal image
+file is written once, when the mosaic is complete.
+"""
+
+import numpy as np
+
+from constants import DEFAULT_PYRAMID_LEVELS, DEFAULT_PYRAMID_DOWNSAMPLE
+from image_io import imwrite
+
+
+class MosaicWriter:
+
+    def __init__(self, shape, dtype=np.uint8,
+                 npyramid_add=DEFAULT_PYRAMID_LEVELS,
+                 pyramid_downsample=DEFAULT_PYRAMID_DOWNSAMPLE):
+        self.npyramid_add = npyramid_add
+        self.pyramid_downsample = pyramid_downsample
+        # Full resolution image and downsampled copies
+        self.levels = [np.zeros(shape, dtype=dtype)]
+        for _ in range(npyramid_add):
+            prev_shape = self.levels[-1].shape
+            level_shape = ((-(-prev_shape[0] // pyramid_downsample),
+                            -(-prev_shape[1] // pyramid_downsample))
+                           + prev_shape[2:])
+            self.levels.append(np.zeros(level_shape, dtype=dtype))
+
+    @property
+    def image(self):
+        return self.levels[0]
+
+    def paste(self, tile_img, x, y):
+        """Paste tile_img into the mosaic with its upper left corner at
+        pixel position (x, y) and update the pyramid levels. Return the
+        updated region (x, y, width, height) at full resolution."""
+        height, width = self.levels[0].shape[:2]
+        tile_img = np.asarray(tile_img)
+        x1 = min(x + tile_img.shape[1], width)
+        y1 = min(y + tile_img.shape[0], height)
+        if x1 <= x or y1 <= y:
+            return None
+        self.levels[0][y:y1, x:x1] = tile_img[:y1 - y, :x1 - x]
+        rect = x, y, x1 - x, y1 - y
+        region = x, y, x1, y1
+        for level in range(1, len(self.levels)):
+            region = self._update_level(level, region)
+        return rect
+
+    def _update_level(self, level, region):
+        """Recompute the region of the specified level covering region
+        (x0, y0, x1, y1) of the previous level by area averaging."""
+        factor = self.pyramid_downsample
+        prev_level = self.levels[level - 1]
+        target = self.levels[level]
+        x0, y0, x1, y1 = region
+        # Region in target level coordinates (rounded outwards)
+        tx0, ty0 = x0 // factor, y0 // factor
+        tx1, ty1 = -(-x1 // factor), -(-y1 // factor)
+        block = prev_level[ty0 * factor:ty1 * factor, tx0 * factor:tx1 * factor]
+        # Pad incomplete blocks at the image border by edge replication
+        pad_y = (ty1 - ty0) * factor - block.shape[0]
+        pad_x = (tx1 - tx0) * factor - block.shape[1]
+        if pad_y or pad_x:
+            pad_width = [(0, pad_y), (0, pad_x)] + [(0, 0)] * (block.ndim - 2)
+            block = np.pad(block, pad_width, mode='edge')
+        block = block.reshape((ty1 - ty0, factor, tx1 - tx0, factor)
+                              + block.shape[2:])
+        mean = block.mean(axis=(1, 3))
+        if np.issubdtype(target.dtype, np.integer):
+            mean = np.round(mean)
+        target[ty0:ty1, tx0:tx1] = mean.astype(target.dtype)
+        return tx0, ty0, tx1, ty1
+
+    def level_region(self, level, rect):
+        """Return the part of the specified level covering rect
+        (x, y, width, height at full resolution) and its position as
+        (x, y, image)."""
+        factor = self.pyramid_downsample ** level
+        x, y, width, height = rect
+        x0, y0 = x // factor, y // factor
+        x1, y1 = -(-(x + width) // factor), -(-(y + height) // factor)
+        return x0, y0, self.levels[level][y0:y1, x0:x1]
+
+    def write(self, path, metadata=None, compression=None):
+        """Write the complete mosaic as a pyramidal image file, compressed
+        with compression (see image_io.imwrite())."""
+        imwrite(path, self.levels[0], metadata=metadata,
+                compression=compression,
+                pyramid_downsample=self.pyramid_downsample,
+                pyramid=self.levels[1:])
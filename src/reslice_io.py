@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+
+# ==============================================================================
+#   This source file is part of SBEMimage (github.com/SBEMimage)
+#   (c) 2018-2020 Friedrich Miescher Institute for Biomedical Research, Basel,
+#   and the SBEMimage developers.
+#   This software is licensed under the terms of the MIT License.
+#   See LICENSE.txt in the project root folder.
+# ==============================================================================
+
+"""This module provides an append-only store for reslice images.
+
+A reslice store is a binary file with a fixed-size header (magic string,
+NumPy dtype, row width, row count) followed by the rows of the reslice
+image. Adding a line writes only the new row and updates the row count in
+the header, so the cost per slice does not depend on the number of slices
+already acquired. Rows beyond the row count (left behind if the program
+stopped between writing a row and updating the header) are ignored and
+overwritten by the next append.
+
+Reslice images written as image files by previous versions are migrated
+to the store when the store is first used.
+"""
+
+import os
+import struct
+import threading
+import numpy as np
+
+from constants import RESLICE_FORMAT, LEGACY_RESLICE_FORMATS
+from image_io import imread
+
+
+RESLICE_MAGIC = b'SBEMRSL1'
+# Header: magic, dtype string (for example '|u1', '<u2'), row width, row count
+HEADER_FORMAT = '<8s8sIQ'
+HEADER_SIZE = 32
+
+_migration_lock = threading.Lock()
+
+
+def read_header(file):
+    file.seek(0)
+    magic, dtype, width, rows = struct.unpack(
+        HEADER_FORMAT, file.read(struct.calcsize(HEADER_FORMAT)))
+    if magic != RESLICE_MAGIC:
+        raise ValueError('Not a reslice store')
+    return np.dtype(dtype.rstrip(b'\0').decode()), width, rows
+
+
+def write_header(file, dtype, width, rows):
+    file.seek(0)
+    header = struct.pack(HEADER_FORMAT, RESLICE_MAGIC,
+                         np.dtype(dtype).str.encode(), width, rows)
+    file.write(header.ljust(HEADER_SIZE, b'\0'))
+
+
+def legacy_reslice_path(path):
+    """Return the path of a reslice image written by a previous version for
+    the store at path, or None if there is none."""
+    base_path = path[:-len(RESLICE_FORMAT)]
+    for ext in LEGACY_RESLICE_FORMATS:
+        if os.path.isfile(base_path + ext):
+            return base_path + ext
+    return None
+
+
+def create_reslice(path, rows):
+    """Create a new store at path containing rows (2D array)."""
+    rows = np.ascontiguousarray(rows)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as file:
+        write_header(file, rows.dtype, rows.shape[1], rows.shape[0])
+        file.write(rows.tobytes())
+    os.replace(tmp_path, path)
+
+
+def migrate_reslice(path):
+    """Convert the legacy reslice image for path (if any) into a store.
+    Return True if the store exists afterwards."""
+    with _migration_lock:
+        if os.path.isfile(path):
+            return True
+        legacy_path = legacy_reslice_path(path)
+        if legacy_path is None:
+            return False
+        image = np.asarray(imread(legacy_path, render=False))
+        if image.ndim > 2:
+            image = image[..., 0]
+        create_reslice(path, image)
+        return True
+
+
+def reslice_shape(path):
+    """Return the shape (rows, width) of the reslice at path, or None if no
+    reslice exists."""
+    if not migrate_reslice(path):
+        return None
+    with open(path, 'rb') as file:
+        _, width, rows = read_header(file)
+    return rows, width
+
+
+def append_reslice(path, line):
+    """Append line (array with shape (width,) or (n, width)) to the reslice
+    store at path. The store is created if necessary."""
+    line = np.asarray(line)
+    line = line.reshape(-1, line.shape[-1])
+    if not migrate_reslice(path):
+        create_reslice(path, line)
+        return
+    with open(path, 'r+b') as file:
+        dtype, width, rows = read_header(file)
+        if width != line.shape[1]:
+            raise ValueError(f'Reslice line width {line.shape[1]} does not '
+                             f'match reslice width {width}')
+        if line.dtype != dtype:
+            new_dtype = np.result_type(dtype, line.dtype)
+            if new_dtype != dtype:
+                # Bit depth changed during the acquisition: convert the store
+                # once (same behaviour as concatenating the images)
+                file.seek(HEADER_SIZE)
+                existing_rows = np.fromfile(
+                    file, dtype=dtype, count=rows * width).reshape(rows, width)
+                file.close()
+                create_reslice(
+                    path,
+                    np.concatenate((existing_rows, line)).astype(new_dtype))
+                return
+            line = line.astype(dtype)
+        file.seek(HEADER_SIZE + rows * width * dtype.itemsize)
+        file.write(np.ascontiguousarray(line).tobytes())
+        file.flush()
+        write_header(file, dtype, width, rows + line.shape[0])
+
+
+def read_reslice(path, max_rows=None):
+    """Return the reslice at path as a 2D array, or None if no reslice
+    exists. If max_rows is specified, only the last max_rows rows are read.
+    """
+    if not migrate_reslice(path):
+        return None
+    with open(path, 'rb') as file:
+        dtype, width, rows = read_header(file)
+        first_row = 0
+        if max_rows is not None:
+            first_row = max(rows - max_rows, 0)
+        file.seek(HEADER_SIZE + first_row * width * dtype.itemsize)
+        count = (rows - first_row) * width
+        data = np.fromfile(file, dtype=dtype, count=count)
+    return data.reshape(-1, width)
@@ -12,11 +12,13 @@
 that are actually required in SBEMimage have been implemented."""
 
 import json
+import os
 from collections import deque
 from typing import List
 
 import utils
 from constants import Error
+from image_io import is_compressible
 
 
 class SEM:
@@ -101,6 +103,12 @@ class SEM:
         # Bit depth selector (0: 8 bit [default]; 1: 16 bit). Selects the
         # image bit depth to be used for acquisition.
         self.bit_depth_selector = 0
+        # Compression codec of the saved frames (see
+        # image_io.COMPRESSION_CODECS), set with set_compression()
+        self.compression = None
+        # (codec, file extension) for which a warning has been logged that
+        # the codec cannot be applied (see frame_compression())
+        self.compression_warnings = set()
         # The cycle time is total duration to acquire a full frame.
         # self.current_cycle_time will be set (in seconds) the first time when
         # self.apply_frame_settings() is called.
@@ -534,13 +542,40 @@ class SEM:
         """Set the bit depth selector."""
         self.bit_depth_selector = bit_depth_selector
 
-    def acquire_frame(self, save_path_filename, extra_delay=0):
+    def set_compression(self, compression):
+        """Set the compression codec used to save acquired frames (see
+        frame_compression())."""
+        self.compression = compression
+
+    def frame_compression(self, save_path_filename):
+        """Return the compression codec for the frame saved as
+        save_path_filename. Only TIFF and OME-Zarr frames are compressed;
+        for other formats, None is returned and a warning is logged (once
+        per codec and format) if a codec is set."""
+        if is_compressible(save_path_filename):
+            return self.compression
+        if self.compression not in (None, 'none'):
+            ext = os.path.splitext(save_path_filename)[1].lower()
+            if (self.compression, ext) not in self.compression_warnings:
+                self.compression_warnings.add((self.compression, ext))
+                utils.log_warning(
+                    'SEM', f'Compression {self.compression} cannot be '
+                           f'applied to {ext} files, frames are saved '
+                           f'uncompressed.')
+        return None
+
+    def acquire_frame(self, save_path_filename, stage=None, extra_delay=0,
+                      return_image=False):
         """Acquire a full frame and save it to save_path_filename.
         All imaging parameters must be applied BEFORE calling this function.
         To avoid grabbing the image before it is acquired completely, an
         additional waiting period after the cycle time (extra_delay, in seconds)
         may be necessary. The delay specified in syscfg (self.DEFAULT_DELAY)
-        is added by default for cycle times > 0.5 s."""
+        is added by default for cycle times > 0.5 s.
+        Return True if successful. If return_image is True, return a tuple
+        (success, image) instead, where image is the acquired frame as a
+        NumPy array, or None if the image is not available in memory (the
+        caller must then load it from save_path_filename)."""
         raise NotImplementedError
 
     def acquire_frame_lm(self, save_path_filename, stage=None, extra_delay=0):
@@ -292,7 +292,8 @@ class SEM_Mock(SEM):
 
         return self._generate_uniform_noise_image(width, height, bitsize)
 
-    def acquire_frame(self, save_path_filename, stage=None, extra_delay=0):
+    def acquire_frame(self, save_path_filename, stage=None, extra_delay=0,
+                      return_image=False):
         width = self.STORE_RES[self.frame_size_selector][0]
         height = self.STORE_RES[self.frame_size_selector][1]
         bitsize = (self.bit_depth_selector + 1) * 8
@@ -308,7 +309,10 @@ class SEM_Mock(SEM):
             mock_image = self._generate_uniform_noise_image(width, height, bitsize)
 
         sleep(self.current_cycle_time + self.additional_cycle_time)
-        imwrite(save_path_filename, mock_image, metadata=self.get_grab_metadata(stage), npyramid_add=DEFAULT_PYRAMID_LEVELS)
+        imwrite(save_path_filename, mock_image, metadata=self.get_grab_metadata(stage), npyramid_add=DEFAULT_PYRAMID_LEVELS,
+                compression=self.frame_compression(save_path_filename))
+        if return_image:
+            return True, mock_image
         return True
 
     def save_frame(self, save_path_filename, stage=None):
@@ -299,7 +299,8 @@ class SEM_Phenom(SEM):
                 f'sem.set_em_mode: command failed ({e})')
             return False
 
-    def acquire_frame(self, save_path_filename, stage=None, extra_delay=0):
+    def acquire_frame(self, save_path_filename, stage=None, extra_delay=0,
+                      return_image=False):
         """Acquire a full frame and save it to save_path_filename.
         All imaging parameters must be applied BEFORE calling this function.
         To avoid grabbing the image before stage movement has stabilised, an
@@ -331,12 +332,17 @@ class SEM_Phenom(SEM):
 
             acq = self.sem_api.SemAcquireImageEx(scan_params)
             image = np.asarray(acq.image)
-            imwrite(save_path_filename, image, metadata=self.get_grab_metadata(stage), npyramid_add=DEFAULT_PYRAMID_LEVELS)
+            imwrite(save_path_filename, image, metadata=self.get_grab_metadata(stage), npyramid_add=DEFAULT_PYRAMID_LEVELS,
+                    compression=self.frame_compression(save_path_filename))
+            if return_image:
+                return True, image
             return True
         except Exception as e:
             self.error_state = Error.grab_image
             self.error_info = f'sem.acquire_frame: command failed ({e})'
             utils.log_error('SEM', self.error_info)
+            if return_image:
+                return False, None
             return False
 
     def acquire_frame_lm(self, save_path_filename, stage=None, extra_delay=0):
@@ -359,7 +365,8 @@ class SEM_Phenom(SEM):
             if acq.image.encoding == ppi.PixelType.RGB:
                 # API returns multi-type array; convert to simple type
                 data = np.asarray(data.tolist(), dtype=np.uint8)
-            imwrite(save_path_filename, data, metadata=self.get_grab_metadata(stage))
+            imwrite(save_path_filename, data, metadata=self.get_grab_metadata(stage),
+                    compression=self.frame_compression(save_path_filename))
             return True
         except Exception as e:
             self.error_state = Error.grab_image
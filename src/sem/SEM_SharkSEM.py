@@ -11,6 +11,7 @@
 """This module provides the implementation of the TESCAN SharkSEM API."""
 
 import time
+import numpy as np
 from PIL import Image
 from typing import Optional, List
 import re
@@ -20,6 +21,8 @@ try:
 except:
     pass
 
+import constants
+from image_io import imwrite, is_compressible
 from sem.SEM import SEM
 
 
@@ -202,7 +205,8 @@ class SEM_SharkSEM(SEM):
         """Save the frame currently displayed in SmartSEM."""
         self.acquire_frame(save_path_filename, stage=stage)
 
-    def acquire_frame(self, save_path_filename, stage=None, extra_delay=0):
+    def acquire_frame(self, save_path_filename, stage=None, extra_delay=0,
+                      return_image=False):
         """Acquire a full frame and save it to save_path_filename.
         All imaging parameters must be applied BEFORE calling this function.
         To avoid grabbing the image before it is acquired completely, an
@@ -223,13 +227,13 @@ class SEM_SharkSEM(SEM):
         if matchName:
             detector_index = matchName.group(1)
         else:
-            return False
+            return (False, None) if return_image else False
         patternIndex: re.Pattern = re.compile('det\.' + detector_index + '\.detector=(\d+)')
         matchIndex = re.search(patternIndex, detectors)
         if matchIndex:
             detector = int(matchIndex.group(1))
         else:
-            return False
+            return (False, None) if return_image else False
 
         # Scan
         self.sem_api.ScStopScan()
@@ -278,15 +282,23 @@ class SEM_SharkSEM(SEM):
         self.sem_api.ScStopScan()
 
         # TODO: avoid redundant image conversions (to string)
-        # TODO: *** use generic image_io.imwrite() instead, using self.get_grab_metadata(stage)
 
         # create and save the images (only here the 'Image' library is required)
         if bpp == 8:
             img = Image.frombuffer("L", (width, height), img_str[0], "raw", "L", 0, 1)          # 8-bit grayscale
         else:
             img = Image.frombuffer("I;16", (width, height), img_str[0], "raw", "I;16", 0, 1)    # 16-bit grayscale
-        img.save(save_path_filename)
+        image = np.asarray(img)
+        compression = self.frame_compression(save_path_filename)
+        if is_compressible(save_path_filename):
+            # TIFF and OME-Zarr with metadata, pyramid and compression
+            imwrite(save_path_filename, image, metadata=self.get_grab_metadata(stage),
+                    npyramid_add=constants.DEFAULT_PYRAMID_LEVELS, compression=compression)
+        else:
+            img.save(save_path_filename)
 
+        if return_image:
+            return True, image
         return True
 
     def get_chamber_pressure(self):
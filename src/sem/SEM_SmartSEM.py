@@ -26,7 +26,7 @@ except:
 from dialog.AboutBox import AboutBox
 import constants
 from constants import Error
-from image_io import imread, imwrite
+from image_io import imread, imwrite, is_compressible
 from sem.SEM import SEM
 import utils
 
@@ -457,7 +457,8 @@ class SEM_SmartSEM(SEM):
         sleep(0.5)  # how long of a delay is necessary?
         return ret_val1 == 0 and ret_val2 == 0
 
-    def acquire_frame(self, save_path_filename, stage=None, extra_delay=0):
+    def acquire_frame(self, save_path_filename, stage=None, extra_delay=0,
+                      return_image=False):
         """Acquire a full frame and save it to save_path_filename.
         All imaging parameters must be applied BEFORE calling this function.
         To avoid grabbing the image before it is acquired completely, an
@@ -468,7 +469,7 @@ class SEM_SmartSEM(SEM):
         if self.simulation_mode:
             self.error_state = Error.grab_image
             self.error_info = f'sem.save_frame: simulation mode'
-            return False
+            return (False, None) if return_image else False
 
         self.sem_execute('CMD_UNFREEZE_ALL')
 
@@ -492,19 +493,24 @@ class SEM_SmartSEM(SEM):
             sleep(0.1)
             self.additional_cycle_time += 0.1
 
-        return self.save_frame(save_path_filename, stage=stage)
+        return self.save_frame(save_path_filename, stage=stage,
+                               return_image=return_image)
 
-    def save_frame(self, save_path_filename, stage=None):
-        """Save the frame currently displayed in SmartSEM."""
+    def save_frame(self, save_path_filename, stage=None, return_image=False):
+        """Save the frame currently displayed in SmartSEM. If return_image is
+        True, return (success, image). The image is only available in
+        memory if it was rewritten with metadata and compression (TIFF and
+        OME-Zarr), otherwise it is None."""
 
         if self.simulation_mode:
             self.error_state = Error.grab_image
             self.error_info = f'sem.save_frame: simulation mode'
-            return False
+            return (False, None) if return_image else False
 
-        # for (ome).tif write to temp file, then rewrite with metadata
-        ext = os.path.splitext(save_path_filename)[1].lower()
-        rewrite_file = ext in ['.tif', '.tiff']
+        # for (ome).tif and OME-Zarr write to temp file, then rewrite with
+        # metadata and compression
+        rewrite_file = is_compressible(save_path_filename)
+        compression = self.frame_compression(save_path_filename)
         if rewrite_file:
             grab_filename = os.path.join(os.path.dirname(save_path_filename), 'grab' + constants.TEMP_IMAGE_FORMAT)
         else:
@@ -512,16 +518,20 @@ class SEM_SmartSEM(SEM):
         utils.validate_output_path(grab_filename, is_file=True)
         ret_val = self.sem_api.Grab(0, 0, 1024, 768, 0, grab_filename)
         if ret_val == 0:
+            image = None
             if rewrite_file:
                 image = imread(grab_filename)
-                imwrite(save_path_filename, image, metadata=self.get_grab_metadata(stage), npyramid_add=constants.DEFAULT_PYRAMID_LEVELS)
+                imwrite(save_path_filename, image, metadata=self.get_grab_metadata(stage),
+                        npyramid_add=constants.DEFAULT_PYRAMID_LEVELS, compression=compression)
                 os.remove(grab_filename)
+            if return_image:
+                return True, image
             return True
         else:
             self.error_state = Error.grab_image
             self.error_info = (
                 f'sem.save_frame: command failed (ret_val: {ret_val})')
-            return False
+            return (False, None) if return_image else False
 
     def get_wd(self):
         """Return current working distance in metres."""
@@ -0,0 +1,315 @@
+# -*- coding: utf-8 -*-
+
+# ==============================================================================
+#   This source file is part of SBEMimage (github.com/SBEMimage)
+#   (c) 2018-2020 Friedrich Miescher Institute for Biomedical Research, Basel,
+#   and the SBEMimage developers.
+#   This software is licensed under the terms of the MIT License.
+#   See LICENSE.txt in the project root folder.
+# ==============================================================================
+
+"""This module optimises the order in which the active tiles of all grids
+are acquired in a slice to minimise the total duration of the stage moves.
+
+Move durations are calculated with the stage model used for the estimates
+(Stage.stage_move_duration(): separate X and Y motor speeds plus the wait
+interval after each move). The tiles of each grid are ordered with a nearest
+neighbour route and the snake pattern (Grid.sort_tile_acq_order()) as start
+solutions, which are improved with 2-opt and Or-opt moves until no further
+improvement is found or the time budget is used up. The tiles of a grid are
+always acquired together because the acquisition settings are applied per
+grid, but the grids are visited in the order (and direction) that minimises
+the moves between them. The result is never slower than the snake pattern.
+"""
+
+import numpy as np
+
+from time import perf_counter
+
+
+# Minimum improvement (in s) for a 2-opt/Or-opt move to be applied
+MIN_IMPROVEMENT = 1e-9
+# Maximum segment length for Or-opt moves
+OR_OPT_MAX_SEGMENT = 3
+
+
+def move_durations(from_sx_sy, to_sx_sy, motor_speed_x, motor_speed_y,
+                   wait_interval):
+    """Return the matrix of stage move durations (in s) from each position
+    in from_sx_sy (N x 2) to each position in to_sx_sy (M x 2). Vectorised
+    version of stage_move_duration()."""
+    from_sx_sy = np.asarray(from_sx_sy, dtype=float).reshape(-1, 2)
+    to_sx_sy = np.asarray(to_sx_sy, dtype=float).reshape(-1, 2)
+    diff = np.abs(from_sx_sy[:, np.newaxis, :] - to_sx_sy[np.newaxis, :, :])
+    return (np.maximum(diff[..., 0] / motor_speed_x,
+                       diff[..., 1] / motor_speed_y)
+            + wait_interval)
+
+
+def path_duration(path, durations):
+    """Return the total duration of path (array of node indices) in the
+    matrix durations."""
+    path = np.asarray(path)
+    return float(durations[path[:-1], path[1:]].sum())
+
+
+def augmented_durations(durations, start_durations):
+    """Add a virtual node 0 to the duration matrix: moving from node 0 to
+    node i takes start_durations[i - 1], returning to node 0 takes no time.
+    An open route then corresponds to a closed path starting and ending at
+    node 0."""
+    n = len(durations)
+    augmented = np.zeros((n + 1, n + 1))
+    augmented[1:, 1:] = durations
+    augmented[0, 1:] = start_durations
+    return augmented
+
+
+def nearest_neighbour_order(durations, start_durations):
+    """Return a route visiting all nodes, always moving to the nearest node
+    that has not been visited yet."""
+    n = len(durations)
+    visited = np.zeros(n, dtype=bool)
+    order = []
+    current_durations = np.asarray(start_durations, dtype=float)
+    for _ in range(n):
+        candidates = np.where(visited, np.inf, current_durations)
+        node = int(np.argmin(candidates))
+        order.append(node)
+        visited[node] = True
+        current_durations = durations[node]
+    return order
+
+
+def two_opt_pass(path, augmented, deadline):
+    """Apply improving 2-opt moves (reversal of the segment path[i..j]) in
+    a single pass over path. Return True if path was improved."""
+    n = len(path) - 2
+    improved = False
+    for i in range(1, n):
+        if perf_counter() > deadline:
+            break
+        a, b = path[i - 1], path[i]
+        j = np.arange(i + 1, n + 1)
+        c, d = path[j], path[j + 1]
+        delta = (augmented[a, c] + augmented[b, d]
+                 - augmented[a, b] - augmented[c, d])
+        best = int(np.argmin(delta))
+        if delta[best] < -MIN_IMPROVEMENT:
+            j = j[best]
+            path[i:j + 1] = path[i:j + 1][::-1]
+            improved = True
+    return improved
+
+
+def or_opt_pass(path, augmented, deadline):
+    """Apply improving Or-opt moves (a segment of up to OR_OPT_MAX_SEGMENT
+    nodes is moved to another position in path, optionally reversed) in a
+    single pass. Return path (possibly a new array) and True if it was
+    improved."""
+    improved = False
+    for length in range(1, OR_OPT_MAX_SEGMENT + 1):
+        n = len(path) - 2
+        i = 1
+        while i <= n - length + 1:
+            if perf_counter() > deadline:
+                return path, improved
+            a, s0 = path[i - 1], path[i]
+            s1, e = path[i + length - 1], path[i + length]
+            removal_gain = (augmented[a, s0] + augmented[s1, e]
+                            - augmented[a, e])
+            # Insert between path[k] and path[k + 1], excluding the edges
+            # adjacent to the segment
+            k = np.concatenate((np.arange(0, i - 1),
+                                np.arange(i + length, n + 1)))
+            if len(k) == 0:
+                i += 1
+                continue
+            u, v = path[k], path[k + 1]
+            forward = augmented[u, s0] + augmented[s1, v] - augmented[u, v]
+            reverse = augmented[u, s1] + augmented[s0, v] - augmented[u, v]
+            best_forward, best_reverse = (int(np.argmin(forward)),
+                                          int(np.argmin(reverse)))
+            if forward[best_forward] <= reverse[best_reverse]:
+                best, insertion_cost, reverse_segment = (
+                    best_forward, forward[best_forward], False)
+            else:
+                best, insertion_cost, reverse_segment = (
+                    best_reverse, reverse[best_reverse], True)
+            if insertion_cost - removal_gain < -MIN_IMPROVEMENT:
+                segment = path[i:i + length]
+                if reverse_segment:
+                    segment = segment[::-1]
+                rest = np.concatenate((path[:i], path[i + length:]))
+                k = k[best]
+                position = k + 1 if k < i else k + 1 - length
+                path = np.concatenate(
+                    (rest[:position], segment, rest[position:]))
+                improved = True
+            else:
+                i += 1
+    return path, improved
+
+
+def improve_order(order, durations, start_durations, deadline):
+    """Improve the route order with 2-opt and Or-opt moves until no
+    improving move is found or the deadline (perf_counter()) is reached.
+    The returned route is never slower than order."""
+    augmented = augmented_durations(durations, start_durations)
+    path = np.concatenate(([0], np.asarray(order, dtype=int) + 1, [0]))
+    improved = True
+    while improved and perf_counter() < deadline:
+        improved = two_opt_pass(path, augmented, deadline)
+        path, or_opt_improved = or_opt_pass(path, augmented, deadline)
+        improved = improved or or_opt_improved
+    return list(path[1:-1] - 1)
+
+
+def optimise_order(durations, start_durations, deadline):
+    """Return the best route through all nodes (open path, starting with
+    the move durations start_durations) found before the deadline. The
+    nodes are expected in snake order, which is used as one of the start
+    solutions."""
+    n = len(durations)
+    if n <= 2:
+        order = list(range(n))
+        if n == 2 and start_durations[1] < start_durations[0]:
+            order.reverse()
+        return order
+    augmented = augmented_durations(durations, start_durations)
+    candidates = []
+    remaining = deadline - perf_counter()
+    for start_order, candidate_deadline in (
+            (list(range(n)), perf_counter() + remaining / 2),
+            (nearest_neighbour_order(durations, start_durations), deadline)):
+        order = improve_order(start_order, durations, start_durations,
+                              candidate_deadline)
+        path = np.concatenate(([0], np.asarray(order) + 1, [0]))
+        candidates.append((path_duration(path, augmented), order))
+    return min(candidates, key=lambda candidate: candidate[0])[1]
+
+
+def optimise_grid_order(tile_sx_sy, groups, duration_function, deadline):
+    """Return the order of the tiles of one grid (indices into tile_sx_sy)
+    that minimises the moves within the grid. The tiles in each group
+    (lists of indices) are acquired before the tiles of the next group."""
+    order = []
+    for group in groups:
+        if not group:
+            continue
+        points = tile_sx_sy[group]
+        durations = duration_function(points, points)
+        if order:
+            start_durations = duration_function(
+                tile_sx_sy[order[-1]], points)[0]
+        else:
+            # The start position depends on the grid order: free start
+            start_durations = np.zeros(len(group))
+        group_order = optimise_order(durations, start_durations, deadline)
+        order.extend(group[i] for i in group_order)
+    return order
+
+
+def route_duration(start_sx_sy, route, duration_function):
+    """Return the total duration of the stage moves for route (list of
+    (key, tile_sx_sy) with the tile positions in acquisition order),
+    starting from start_sx_sy."""
+    points = [np.asarray(start_sx_sy, dtype=float).reshape(1, 2)]
+    points.extend(np.asarray(tile_sx_sy, dtype=float).reshape(-1, 2)
+                  for _, tile_sx_sy in route)
+    points = np.concatenate(points)
+    if len(points) < 2:
+        return 0
+    return float(np.sum([duration_function(points[i], points[i + 1])[0, 0]
+                         for i in range(len(points) - 1)]))
+
+
+def plan_route(grids, start_sx_sy, duration_function, time_budget=0.5,
+               keep_grid_order=False):
+    """Plan the acquisition order of the tiles in grids, starting at stage
+    position start_sx_sy.
+
+    Args:
+        grids (list): (key, tiles, tile_sx_sy, first_tiles) for each grid
+            to be acquired. tiles: tile indices in snake order; tile_sx_sy:
+            stage positions of these tiles (N x 2); first_tiles: tiles that
+            must be acquired before the other tiles of the grid (for example
+            autofocus reference tiles).
+        start_sx_sy: Stage position before the first move.
+        duration_function: Function returning the matrix of move durations
+            between two arrays of stage positions (see move_durations()).
+        time_budget (float): Maximum duration (in s) of the optimisation.
+        keep_grid_order (bool): Visit the grids in the given order.
+
+    Returns:
+        route (list): (key, ordered tiles) for each grid in acquisition order
+        route_duration (float): Total duration (in s) of the stage moves
+        snake_duration (float): Total duration (in s) of the stage moves
+            when the grids are acquired in the given order using the snake
+            pattern (with first_tiles first)
+    """
+    start_time = perf_counter()
+    total_tiles = sum(len(tiles) for _, tiles, _, _ in grids)
+
+    # Tile order within each grid
+    snake_route = []
+    grid_routes = []
+    for key, tiles, tile_sx_sy, first_tiles in grids:
+        tile_sx_sy = np.asarray(tile_sx_sy, dtype=float).reshape(-1, 2)
+        first = [i for i, t in enumerate(tiles) if t in first_tiles]
+        others = [i for i, t in enumerate(tiles) if t not in first_tiles]
+        snake_order = first + others
+        snake_route.append((key, [tiles[i] for i in snake_order],
+                            tile_sx_sy[snake_order]))
+        if total_tiles > 0:
+            deadline = (perf_counter() + (start_time + time_budget
+                        - perf_counter()) * len(tiles) / total_tiles)
+        else:
+            deadline = perf_counter()
+        total_tiles -= len(tiles)
+        order = optimise_grid_order(tile_sx_sy, [first, others],
+                                    duration_function, deadline)
+        # Without precedence constraints, the grid can be acquired in
+        # reverse order
+        reversible = not first or not others
+        grid_routes.append((key, [tiles[i] for i in order],
+                            tile_sx_sy[order], reversible))
+
+    # Order of the grids: always move to the nearest grid entry point
+    position = np.asarray(start_sx_sy, dtype=float)
+    remaining = list(range(len(grid_routes)))
+    optimised_route = []
+    while remaining:
+        candidates = remaining[:1] if keep_grid_order else remaining
+        best = None
+        for index in candidates:
+            key, tiles, tile_sx_sy, reversible = grid_routes[index]
+            if not tiles:
+                best = (0, index, False)
+                break
+            directions = [False, True] if reversible else [False]
+            for reverse in directions:
+                entry = tile_sx_sy[-1] if reverse else tile_sx_sy[0]
+                duration = duration_function(position, entry)[0, 0]
+                if best is None or duration < best[0]:
+                    best = (duration, index, reverse)
+        _, index, reverse = best
+        key, tiles, tile_sx_sy, _ = grid_routes[index]
+        if reverse:
+            tiles, tile_sx_sy = tiles[::-1], tile_sx_sy[::-1]
+        optimised_route.append((key, list(tiles), tile_sx_sy))
+        if len(tiles) > 0:
+            position = tile_sx_sy[-1]
+        remaining.remove(index)
+
+    snake_duration = route_duration(
+        start_sx_sy, [(key, sx_sy) for key, _, sx_sy in snake_route],
+        duration_function)
+    optimised_duration = route_duration(
+        start_sx_sy, [(key, sx_sy) for key, _, sx_sy in optimised_route],
+        duration_function)
+    if optimised_duration <= snake_duration:
+        route = [(key, tiles) for key, tiles, _ in optimised_route]
+        return route, optimised_duration, snake_duration
+    route = [(key, tiles) for key, tiles, _ in snake_route]
+    return route, snake_duration, snake_duration
@@ -20,14 +20,14 @@ import numpy as np
 
 from configparser import ConfigParser
 from time import sleep
-from queue import Queue
+from queue import Queue, Empty
 from logging import StreamHandler
 from logging.handlers import RotatingFileHandler
 
 from skimage.measure import ransac
 from skimage.transform import ProjectiveTransform
 
-from qtpy.QtCore import QObject, Signal, QSize
+from qtpy.QtCore import QObject, Signal, QSize, QTimer
 from qtpy.QtGui import QIcon, QPixmap, QImage, QTransform
 from scipy.ndimage import maximum_filter
 from serial.tools import list_ports
@@ -52,7 +52,11 @@ class Trigger(QObject):
     queue, and queue.get() reads the cmd and empties the queue.
     """
     signal = Signal()
-    queue = Queue()
+
+    def __init__(self):
+        super().__init__()
+        # Each trigger has its own queue
+        self.queue = Queue()
 
     def transmit(self, cmd, *args, **kwargs):
         """Transmit a single command."""
@@ -60,6 +64,98 @@ class Trigger(QObject):
         self.queue.put(cmd)
         self.signal.emit()
 
+    def receive_all(self):
+        """Read and return all commands currently in the queue."""
+        cmds = []
+        while True:
+            try:
+                cmds.append(self.queue.get_nowait())
+            except Empty:
+                return cmds
+
+
+# Commands that only refresh the GUI from the current state. If a command
+# is sent repeatedly, only its last occurrence is processed.
+IDEMPOTENT_COMMANDS = ('DRAW VP', 'DRAW VP NO LABELS', 'UPDATE PROGRESS',
+                       'UPDATE XY', 'UPDATE XY FT', 'UPDATE Z',
+                       'SHOW CURRENT SETTINGS', 'MIRROR STATUS',
+                       'ACQ STATS')
+# An earlier 'DRAW VP NO LABELS' is redundant if 'DRAW VP' follows
+SUPERSEDED_COMMANDS = {'DRAW VP NO LABELS': 'DRAW VP'}
+# Commands that change the state of the Viewport and require a redraw
+REDRAW_COMMANDS = ('ACQ IND OV', 'ACQ IND TILE')
+# Command containing several log lines: args = (list of lines,)
+LOG_LINES = 'LOG LINES'
+
+
+def is_log_line(cmd):
+    """Messages without arguments that are not upper-case command names are
+    shown in the log."""
+    msg = cmd['msg']
+    return not cmd['args'] and not cmd['kwargs'] and msg != msg.upper()
+
+
+def coalesce_commands(cmds):
+    """Merge the commands cmds (received within one frame interval) before
+    processing them in the GUI. All other commands are kept in their
+    original order:
+    - Only the last occurrence of each idempotent command is kept.
+    - Commands in REDRAW_COMMANDS are followed by a 'DRAW VP'.
+    - Consecutive log lines are merged into a single LOG_LINES command.
+    """
+    expanded = []
+    for cmd in cmds:
+        expanded.append(cmd)
+        if cmd['msg'] in REDRAW_COMMANDS:
+            expanded.append({'msg': 'DRAW VP', 'args': (), 'kwargs': {}})
+    kept = []
+    seen = set()
+    for cmd in reversed(expanded):
+        msg = cmd['msg']
+        if msg in IDEMPOTENT_COMMANDS:
+            if msg in seen or SUPERSEDED_COMMANDS.get(msg) in seen:
+                continue
+            seen.add(msg)
+        kept.append(cmd)
+    coalesced = []
+    for cmd in reversed(kept):
+        if is_log_line(cmd):
+            if coalesced and coalesced[-1]['msg'] == LOG_LINES:
+                coalesced[-1]['args'][0].append(cmd['msg'])
+            else:
+                coalesced.append(
+                    {'msg': LOG_LINES, 'args': ([cmd['msg']],), 'kwargs': {}})
+        else:
+            coalesced.append(cmd)
+    return coalesced
+
+
+class CommandCoalescer(QObject):
+    """Collect the commands sent through trigger for one frame interval
+    (in ms), merge them with coalesce_commands(), and call
+    process_command(cmd) for each merged command. Use this instead of
+    processing each command when the signal is received if many GUI updates
+    are sent in quick succession (for example, from the acquisition thread).
+    """
+
+    def __init__(self, trigger, process_command, interval=GUI_FRAME_INTERVAL):
+        super().__init__()
+        self.trigger = trigger
+        self.process_command = process_command
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(interval)
+        self.timer.timeout.connect(self.process_commands)
+        self.trigger.signal.connect(self.schedule)
+
+    def schedule(self):
+        if not self.timer.isActive():
+            self.timer.start()
+
+    def process_commands(self):
+        for cmd in coalesce_commands(self.trigger.receive_all()):
+            self.process_command(cmd)
+
 
 class QtTextHandler(StreamHandler):
     def __init__(self):
@@ -103,14 +199,14 @@ logger: logging.Logger
 qt_text_handler = QtTextHandler()
 
 
-def logging_init(*message):
+def logging_init(*message, filename=LOG_FILENAME):
     global logger
-    validate_output_path(LOG_FILENAME, is_file=True)
+    validate_output_path(filename, is_file=True)
     logger = logging.getLogger("SBEMimage")
     logger.setLevel(logging.INFO)   # important: anything below this will be filtered irrespective of handler level
     # logging_add_handler(StreamHandler(), level=logging.ERROR)   # filter messages to console log handler
     logging_add_handler(RotatingFileHandler(
-        LOG_FILENAME, maxBytes=LOG_MAX_FILESIZE, backupCount=LOG_MAX_FILECOUNT, encoding='utf-8'))
+        filename, maxBytes=LOG_MAX_FILESIZE, backupCount=LOG_MAX_FILECOUNT, encoding='utf-8'))
     logging_add_handler(qt_text_handler, format=LOG_FORMAT_SCREEN)
 
     # logger.propagate = False
@@ -312,8 +408,9 @@ def ov_debris_save_path(base_dir, stack_name, ov_index, slice_index, sweep_index
         + '_' + str(sweep_index) + TEMP_IMAGE_FORMAT)
 
 def ov_reslice_save_path(base_dir, ov_index):
-    filename = get_ov_filename('r', ov_index)
-    return os.path.join(base_dir, 'workspace', 'reslices', filename)
+    filename = get_ov_filename('r', ov_index)[:-len(OV_IMAGE_FORMAT)]
+    return os.path.join(base_dir, 'workspace', 'reslices',
+                        filename + RESLICE_FORMAT)
 
 def get_tile_basepath(stack_name, grid_index, array_index=None, roi_index=None, tile_index=None, slice_index=None):
     grid_string = 'g' + str(grid_index).zfill(GRID_DIGITS)
@@ -361,8 +458,9 @@ def tile_preview_save_path(base_dir, grid_index, array_index=None, roi_index=Non
     return os.path.join(base_dir, 'workspace', filename)
 
 def tile_reslice_save_path(base_dir, grid_index, array_index=None, roi_index=None, tile_index=None):
-    filename = get_tile_filename('r', grid_index, array_index, roi_index, tile_index)
-    return os.path.join(base_dir, 'workspace', 'reslices', filename)
+    filename = get_tile_filename('r', grid_index, array_index, roi_index, tile_index)[:-len(GRIDTILE_IMAGE_FORMAT)]
+    return os.path.join(base_dir, 'workspace', 'reslices',
+                        filename + RESLICE_FORMAT)
 
 def tile_id(grid_index, tile_index, slice_index):
     return (str(grid_index).zfill(GRID_DIGITS)
@@ -522,7 +620,9 @@ def get_image_file_title(filepath):
     return title
 
 
-def image_to_QPixmap(image):
+def image_to_QImage(image):
+    """Convert image to a QImage that owns its data. Unlike QPixmaps,
+    QImages can be created outside the GUI thread."""
     image = np.require(uint8_image(image), np.uint8, 'C')
     height, width = image.shape[:2]
     nchannels = image.shape[2] if image.ndim > 2 else 1
@@ -531,7 +631,11 @@ def image_to_QPixmap(image):
         channel_format = QImage.Format_Grayscale8
     else:
         channel_format = QImage.Format_RGB888
-    return QPixmap(QImage(image, width, height, bytes_per_line, channel_format))
+    return QImage(image, width, height, bytes_per_line, channel_format).copy()
+
+
+def image_to_QPixmap(image):
+    return QPixmap(image_to_QImage(image))
 
 
 def grayscale_image(image):
@@ -612,6 +716,14 @@ def resize_image(image, new_size):
     return cv2.resize(image, new_size)
 
 
+def downsample_image(image, new_size):
+    """Reduce image to new_size (width, height) by averaging the pixels in
+    each target area. uint8/uint16 images are averaged by OpenCV without
+    conversion to float."""
+    return cv2.resize(image, tuple(int(value) for value in new_size),
+                      interpolation=cv2.INTER_AREA)
+
+
 def resize_image_max_pool(image, new_size):
     if not isinstance(new_size, (tuple, list, np.ndarray)):
         # use single value for width; apply aspect ratio
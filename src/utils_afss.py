@@ -1,6 +1,9 @@
 import cv2
 import numpy as np
 import os
+import scipy.fft
+import threading
+from collections import OrderedDict
 from typing import Tuple, List
 
 from scipy.ndimage import interpolation
@@ -106,6 +109,113 @@ def compute_shifts_cv2(files: List[str]):
     return shift
 
 
+def padded_shape(shape: Tuple[int, ...]) -> Tuple[int, int]:
+    # As in cv2.phaseCorrelate, images are zero-padded to a size for which the FFT is fast
+    return tuple(scipy.fft.next_fast_len(n, real=True) for n in shape[:2])
+
+
+def image_spectrum(img: np.ndarray, workers: int = 1) -> np.ndarray:
+    """Forward FFT of img for phase correlation."""
+    return scipy.fft.rfft2(np.asarray(img, dtype=np.float32), s=padded_shape(img.shape), workers=workers)
+
+
+def phase_correlate(ref_spectrum: np.ndarray, cur_spectrum: np.ndarray,
+                    shape: Tuple[int, int], workers: int = 1) -> np.ndarray:
+    """
+    Computes the translation vector between two AFSS images from their spectra
+    (see image_spectrum). The vector (y, x) has the same convention as
+    compute_shifts_cv2: shifting the current image by it aligns it with the reference.
+    Args:
+        ref_spectrum, cur_spectrum: spectra of the reference and the current image
+        shape: padded image shape used for both spectra
+    """
+    cross_power = ref_spectrum * np.conj(cur_spectrum)
+    cross_power /= np.maximum(np.abs(cross_power), np.finfo(np.float32).tiny)
+    corr = scipy.fft.irfft2(cross_power, s=shape, workers=workers)
+    # Positions in the correlation shifted so that zero shift is in the centre
+    # (as after fftShift in cv2.phaseCorrelate)
+    corr = scipy.fft.fftshift(corr)
+    peak = np.unravel_index(np.argmax(corr), shape)
+    # As in cv2.phaseCorrelate, the shift is the weighted centroid of the 5x5
+    # neighbourhood of the peak (clipped at the borders), rounded as in fix_vec
+    window = tuple(np.arange(max(p - 2, 0), min(p + 3, n)) for p, n in zip(peak, shape))
+    weights = corr[np.ix_(*window)]
+    total = weights.sum()
+    if total != 0:
+        centroid = [(weights.sum(axis=1) * window[0]).sum() / total,
+                    (weights.sum(axis=0) * window[1]).sum() / total]
+    else:
+        centroid = peak
+    vec = np.round([c - n / 2 for c, n in zip(centroid, shape)])
+    return np.reshape(vec.astype(float), [1, 2])
+
+
+class SeriesCache:
+    """
+    In-memory ring cache of AFSS series images, filled when the tiles are grabbed.
+    For each ref. tile, the last max_frames images are kept (keyed by file path), so
+    that the series does not have to be read from disk again. The spectrum of the
+    newest image of each tile is kept as the reference for the next pair shift.
+    """
+
+    def __init__(self, max_frames: int = 3):
+        self.max_frames = max_frames
+        self.lock = threading.Lock()
+        # {tile_key: OrderedDict({path: image})}
+        self.images = {}
+        # {tile_key: (path, spectrum)}
+        self.spectra = {}
+
+    def add(self, tile_key: str, path: str, img: np.ndarray) -> None:
+        with self.lock:
+            frames = self.images.setdefault(tile_key, OrderedDict())
+            frames[path] = img
+            frames.move_to_end(path)
+            while len(frames) > max(self.max_frames, 2):
+                old_path, _ = frames.popitem(last=False)
+                if self.spectra.get(tile_key, (None,))[0] == old_path:
+                    del self.spectra[tile_key]
+
+    def get(self, tile_key: str, path: str) -> np.ndarray:
+        """Returns the cached image, or reads it from disk if not cached."""
+        with self.lock:
+            img = self.images.get(tile_key, {}).get(path)
+        if img is None:
+            img = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+        return img
+
+    def get_collection(self, tile_key: str, paths: List[str]) -> np.ndarray:
+        """Returns a new array with the images of paths stacked along the first axis."""
+        return np.stack([self.get(tile_key, path) for path in paths])
+
+    def spectrum(self, tile_key: str, path: str, workers: int = 1) -> np.ndarray:
+        """Returns the spectrum of an image. Only the spectrum of the last requested
+        image of each tile is kept."""
+        with self.lock:
+            cached = self.spectra.get(tile_key)
+        if cached is not None and cached[0] == path:
+            return cached[1]
+        spectrum = image_spectrum(self.get(tile_key, path), workers)
+        with self.lock:
+            self.spectra[tile_key] = (path, spectrum)
+        return spectrum
+
+    def pair_shift(self, tile_key: str, ref_path: str, cur_path: str,
+                   workers: int = 1) -> np.ndarray:
+        """Computes the shift between two consecutive images of a tile. The spectrum of
+        the reference image is usually cached from the previous pair, so each pair
+        costs one forward transform."""
+        ref_spectrum = self.spectrum(tile_key, ref_path, workers)
+        cur_spectrum = self.spectrum(tile_key, cur_path, workers)
+        shape = padded_shape(self.get(tile_key, cur_path).shape)
+        return phase_correlate(ref_spectrum, cur_spectrum, shape, workers)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.images = {}
+            self.spectra = {}
+
+
 def crop_image_collection(image_collection: np.ndarray, cumm_shifts: np.ndarray) -> np.ndarray:
     sX, sY = np.asarray(cumm_shifts)[:, 1], np.asarray(cumm_shifts)[:, 0]
     sx = np.array(np.round([abs(np.max(sX)), abs(np.min(sX))]), dtype=int)
@@ -114,9 +224,15 @@ def crop_image_collection(image_collection: np.ndarray, cumm_shifts: np.ndarray)
     return crop(image_collection, crop_vals)
 
 
-def shift_collection(ic: np.ndarray, cumm_shifts: np.ndarray) -> np.ndarray:
+def shift_collection(ic: np.ndarray, cumm_shifts: np.ndarray, subpixel: bool = False) -> np.ndarray:
     for i, im in enumerate(ic[1:]):
-        ic[i+1] = interpolation.shift(im, cumm_shifts[i])
+        shift = np.asarray(cumm_shifts[i])
+        if not subpixel and np.array_equal(shift, np.round(shift)):
+            # Integer shifts: roll the image, the wrapped-around borders are
+            # removed by crop_image_collection()
+            ic[i+1] = np.roll(im, tuple(shift.astype(int)), axis=(0, 1))
+        else:
+            ic[i+1] = interpolation.shift(im, shift)
     return ic
 
 
@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+
+# ==============================================================================
+#   This source file is part of SBEMimage (github.com/SBEMimage)
+#   (c) 2018-2020 Friedrich Miescher Institute for Biomedical Research, Basel,
+#   and the SBEMimage developers.
+#   This software is licensed under the terms of the MIT License.
+#   See LICENSE.txt in the project root folder.
+# ==============================================================================
+
+"""This module provides the render cache of the Viewport.
+
+Each image shown in the Viewport (overviews, stub overviews, imported images)
+is kept as a pyramid of downsampled QPixmaps (magnification levels 1, 2, 4, 8,
+16). Each level is split into tiles, which are scaled to the current zoom
+factor when they first become visible and kept in a memory-bounded LRU cache.
+Panning and redrawing the Viewport therefore reuse the scaled tiles, and only
+the tiles of images that are zoomed or changed have to be scaled again.
+
+Images are identified by a key (for example ('ov', 0)) and a version (for
+example the file path of the image and QPixmap.cacheKey()). When the version
+of an image changes, only the pyramid and the tiles of this image are
+discarded.
+
+The pyramid levels computed by the cache (downsampled from the previous
+level) count towards the memory budget; levels provided by the caller are
+owned by the caller. When the last scaled tile of an image is evicted, its
+pyramid is released as well, so images that are no longer shown (deleted or
+replaced overviews, imported images) are not kept in memory by the cache.
+"""
+
+from collections import OrderedDict
+from math import ceil, floor, log2
+
+from qtpy.QtCore import Qt, QPointF
+
+import constants
+
+
+MAG_LEVELS = (1, 2, 4, 8, 16)
+
+
+class RenderCache:
+
+    def __init__(self, max_bytes=constants.VP_RENDER_CACHE_SIZE,
+                 tile_size=constants.VP_RENDER_TILE_SIZE):
+        self.max_bytes = max_bytes
+        self.tile_size = tile_size
+        # {key: version}
+        self.versions = {}
+        # {key: {mag: QPixmap}}
+        self.pyramids = {}
+        # {key: memory used by the computed pyramid levels}
+        self.pyramid_nbytes = {}
+        # {(key, mag, scale, src_tile, tx, ty): (QPixmap, (ox, oy), nbytes)}
+        self.tiles = OrderedDict()
+        # {key: number of scaled tiles in self.tiles}
+        self.tile_counts = {}
+        # Memory used by the computed pyramid levels and the scaled tiles
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def mag_level(resize_ratio):
+        """Return the magnification level (power of two) closest to the
+        inverse of resize_ratio."""
+        if resize_ratio <= 0:
+            return MAG_LEVELS[-1]
+        mag = 2 ** -round(log2(resize_ratio))
+        return int(min(max(mag, MAG_LEVELS[0]), MAG_LEVELS[-1]))
+
+    @staticmethod
+    def pixmap_nbytes(pixmap):
+        if pixmap is None:
+            return 0
+        return pixmap.width() * pixmap.height() * max(pixmap.depth(), 8) // 8
+
+    def invalidate(self, key):
+        """Discard the pyramid and all scaled tiles of the image key."""
+        self._release_pyramid(key)
+        for tile_key in [k for k in self.tiles if k[0] == key]:
+            self.nbytes -= self.tiles.pop(tile_key)[2]
+        self.tile_counts.pop(key, None)
+
+    def clear(self):
+        self.versions.clear()
+        self.pyramids.clear()
+        self.pyramid_nbytes.clear()
+        self.tiles.clear()
+        self.tile_counts.clear()
+        self.nbytes = 0
+
+    def _release_pyramid(self, key):
+        self.versions.pop(key, None)
+        self.pyramids.pop(key, None)
+        self.nbytes -= self.pyramid_nbytes.pop(key, 0)
+
+    def _evict(self, keep):
+        """Release least recently used tiles, and the pyramids of images
+        without tiles, until the memory budget is met. The pyramid of the
+        image keep (currently drawn) is not released."""
+        while self.nbytes > self.max_bytes and len(self.tiles) > 1:
+            tile_key, (_, _, nbytes) = self.tiles.popitem(last=False)
+            self.nbytes -= nbytes
+            key = tile_key[0]
+            self.tile_counts[key] -= 1
+            if not self.tile_counts[key]:
+                del self.tile_counts[key]
+                if key != keep:
+                    self._release_pyramid(key)
+        if self.nbytes > self.max_bytes:
+            # Pyramids of images that were drawn without visible tiles
+            for key in [k for k in self.pyramids
+                        if k not in self.tile_counts and k != keep]:
+                self._release_pyramid(key)
+
+    def cached_level(self, key, version, mag=1):
+        """Return the pyramid level mag of image key if it is cached for
+        this version, otherwise None."""
+        if self.versions.get(key) != version:
+            return None
+        return self.pyramids.get(key, {}).get(mag)
+
+    def level(self, key, version, source, mag):
+        """Return the pyramid level mag of image key. source(mag) must return
+        the QPixmap of this level, or None if the level must be computed
+        from the previous level."""
+        if self.versions.get(key) != version:
+            self.invalidate(key)
+            self.versions[key] = version
+        pyramid = self.pyramids.setdefault(key, {})
+        if mag not in pyramid:
+            pixmap = source(mag)
+            if pixmap is None and mag > 1:
+                prev_level = self.level(key, version, source, mag // 2)
+                if prev_level is not None:
+                    pixmap = prev_level.scaled(
+                        max(prev_level.width() // 2, 1),
+                        max(prev_level.height() // 2, 1),
+                        Qt.IgnoreAspectRatio, Qt.SmoothTransformation)
+                    nbytes = self.pixmap_nbytes(pixmap)
+                    self.pyramid_nbytes[key] = (
+                        self.pyramid_nbytes.get(key, 0) + nbytes)
+                    self.nbytes += nbytes
+                    self._evict(keep=key)
+            pyramid[mag] = pixmap
+        return pyramid[mag]
+
+    def draw(self, painter, key, version, source, vx, vy, resize_ratio,
+             vp_width, vp_height, mag=None):
+        """Draw the visible part of image key with its upper left corner at
+        (vx, vy) and scaled by resize_ratio (full resolution image pixels to
+        Viewport pixels). If mag is not specified, the pyramid level closest
+        to the zoom factor is used. Return True if anything was drawn."""
+        if mag is None:
+            mag = self.mag_level(resize_ratio)
+        level = self.level(key, version, source, mag)
+        if level is None or level.isNull():
+            return False
+        scale = resize_ratio * mag
+        width, height = level.width(), level.height()
+        # Visible area in pixel coordinates of the pyramid level
+        x0 = max(0, floor(-vx / scale))
+        y0 = max(0, floor(-vy / scale))
+        x1 = min(width, ceil((vp_width - vx) / scale))
+        y1 = min(height, ceil((vp_height - vy) / scale))
+        if x0 >= x1 or y0 >= y1:
+            return False
+        # Tile size in level pixels so that the scaled tiles are at most
+        # about tile_size Viewport pixels wide
+        src_tile = max(16, int(self.tile_size / max(scale, 1)))
+        for ty in range(y0 // src_tile, (y1 - 1) // src_tile + 1):
+            for tx in range(x0 // src_tile, (x1 - 1) // src_tile + 1):
+                tile = self._tile(key, level, mag, scale, src_tile, tx, ty)
+                if tile is not None:
+                    pixmap, (ox, oy) = tile
+                    painter.drawPixmap(QPointF(vx + ox, vy + oy), pixmap)
+        return True
+
+    def _tile(self, key, level, mag, scale, src_tile, tx, ty):
+        """Return the scaled tile (tx, ty) of the pyramid level and its offset
+        relative to the upper left corner of the image in Viewport pixels."""
+        tile_key = (key, mag, round(scale, 9), src_tile, tx, ty)
+        entry = self.tiles.get(tile_key)
+        if entry is not None:
+            self.tiles.move_to_end(tile_key)
+            self.hits += 1
+            return entry[0], entry[1]
+        self.misses += 1
+        sx0, sy0 = tx * src_tile, ty * src_tile
+        sx1 = min(sx0 + src_tile, level.width())
+        sy1 = min(sy0 + src_tile, level.height())
+        # Round tile borders (not sizes) to keep adjacent tiles seamless
+        ox, oy = round(sx0 * scale), round(sy0 * scale)
+        dw, dh = round(sx1 * scale) - ox, round(sy1 * scale) - oy
+        if dw <= 0 or dh <= 0:
+            return None
+        pixmap = level.copy(sx0, sy0, sx1 - sx0, sy1 - sy0).scaled(
+            dw, dh, Qt.IgnoreAspectRatio, Qt.FastTransformation)
+        nbytes = self.pixmap_nbytes(pixmap)
+        self.tiles[tile_key] = (pixmap, (ox, oy), nbytes)
+        self.tile_counts[key] = self.tile_counts.get(key, 0) + 1
+        self.nbytes += nbytes
+        self._evict(keep=key)
+        return pixmap, (ox, oy)
@@ -0,0 +1,289 @@
+"""Headless end-to-end benchmark of the stack acquisition.
+
+Acquisition.run_acquisition() is run for a number of slices with the mock SEM
+and the mock microtome, without GUI. The configuration is built from the mock
+configuration in tests/resources, completed with config_template.process_cfg().
+Grids, tile size and options (mirror drive, heuristic autofocus, debris
+detection, reslices) can be selected. The main methods of the acquisition are
+timed, and a JSON report with per-phase timings and throughput is written,
+which can be compared between versions to detect regressions.
+
+Usage (from the repository root):
+
+    PYTHONPATH=src python tests/acq_benchmark.py --slices 5 --grids 2 \
+        --grid-size 4 4 --tile-size 0 --mirror -o report.json
+"""
+
+import argparse
+import functools
+import json
+import os
+import platform
+import sys
+import tempfile
+from collections import defaultdict
+from time import perf_counter
+
+import numpy as np
+
+import constants
+from config_template import process_cfg
+from test_utils import StubTrigger, init_acquisition, init_log, init_read_configs
+
+
+TEST_CONFIG_FILE = 'mock.ini'
+TEST_SYSCONFIG_FILE = 'mock.cfg'
+
+# Replies to the questions the acquisition asks the user
+USER_REPLIES = {
+    'ASK DEBRIS FIRST OV': 0,         # Image is fine
+    'ASK DEBRIS CONFIRMATION': 1,     # No debris, continue
+}
+
+# Timed methods: (component of Acquisition, method name, phase)
+PHASES = [
+    (None, 'acquire_all_overviews', 'overviews'),
+    (None, 'acquire_all_grids', 'grids'),
+    (None, 'do_cut', 'cut'),
+    (None, 'process_heuristic_af_queue', 'heuristic_af'),
+    (None, 'register_accepted_tile', 'register'),
+    (None, 'mirror_files', 'mirror'),
+    (None, 'save_viewport_screenshot', 'screenshot'),
+    ('stage', 'move_to_xy', 'stage_move'),
+    ('microtome', 'move_stage_to_z', 'stage_move_z'),
+    ('sem', 'apply_frame_settings', 'frame_settings'),
+    ('sem', 'acquire_frame', 'grab'),
+    ('img_inspector', 'process_tile', 'inspect'),
+    ('img_inspector', 'save_tile_stats', 'save_stats'),
+    ('img_inspector', 'save_tile_reslice', 'reslice'),
+    ('img_inspector', 'detect_debris', 'debris_detection'),
+]
+
+
+class BenchmarkTrigger(StubTrigger):
+    """Stub trigger that answers the questions of the acquisition, creates
+    the Viewport screenshots and records when slices are completed."""
+    def __init__(self):
+        super().__init__()
+        self.acq = None
+        self.progress_times = []
+
+    def transmit(self, cmd, *args, **kwargs):
+        super().transmit(cmd, *args, **kwargs)
+        if cmd == 'UPDATE PROGRESS':
+            self.progress_times.append(perf_counter())
+        elif cmd == 'GRAB VP SCREENSHOT':
+            open(args[0], 'wb').close()
+        elif cmd in USER_REPLIES:
+            self.acq.user_reply = USER_REPLIES[cmd]
+
+
+class PhaseTimer:
+    """Record the durations of methods replaced by timed wrappers. The
+    wrappers may be called from several threads."""
+    def __init__(self):
+        self.durations = defaultdict(list)
+
+    def wrap(self, obj, method_name, phase):
+        method = getattr(obj, method_name)
+        durations = self.durations[phase]
+
+        @functools.wraps(method)
+        def timed(*args, **kwargs):
+            start = perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                durations.append(perf_counter() - start)
+
+        setattr(obj, method_name, timed)
+
+    def summary(self):
+        summary = {}
+        for phase, durations in self.durations.items():
+            if not durations:
+                continue
+            values = np.array(durations)
+            summary[phase] = {
+                'count': len(values),
+                'total_s': round(float(values.sum()), 6),
+                'mean_s': round(float(values.mean()), 6),
+                'p50_s': round(float(np.percentile(values, 50)), 6),
+                'p95_s': round(float(np.percentile(values, 95)), 6),
+                'max_s': round(float(values.max()), 6),
+            }
+        return summary
+
+
+def build_config(base_dir, number_slices, number_grids, grid_size,
+                 tile_size_selector, mirror_dir, heuristic_af,
+                 debris_detection, take_overviews, pipelined, cut_duration):
+    config, sysconfig = init_read_configs(TEST_CONFIG_FILE, TEST_SYSCONFIG_FILE)
+    success, exceptions, _, _, config, sysconfig = process_cfg(config, sysconfig)
+    assert success, exceptions
+    acq = config['acq']
+    acq['base_dir'] = base_dir
+    acq['mock_prev_acq_dir'] = base_dir
+    acq['mock_type'] = 'Uniform noise'
+    acq['number_slices'] = str(number_slices)
+    acq['slice_counter'] = '0'
+    acq['paused'] = 'False'
+    acq['interrupted'] = 'False'
+    acq['take_overviews'] = str(take_overviews)
+    acq['use_debris_detection'] = str(debris_detection)
+    acq['ask_user'] = 'False'
+    acq['use_autofocus'] = str(heuristic_af)
+    acq['pipelined_tile_acq'] = str(pipelined)
+    config['autofocus']['method'] = '1'   # Heuristic autofocus
+    config['autofocus']['ref_tiles'] = json.dumps(
+        [f'{grid_index}.0' for grid_index in range(number_grids)])
+    config['sys']['use_mirror_drive'] = str(mirror_dir is not None)
+    if mirror_dir is not None:
+        config['sys']['mirror_drive'] = mirror_dir
+    sysconfig['knife']['full_cut_duration'] = str(cut_duration)
+
+    grids = config['grids']
+    grids['number_grids'] = str(number_grids)
+    rows, cols = grid_size
+    for key, value in [
+            ('grid_active', 1),
+            ('origin_sx_sy', [200.0, 250.0]),
+            ('sw_sh', [0, 0]),
+            ('rotation', 0),
+            ('size', [rows, cols]),
+            ('overlap', 200),
+            ('row_shift', 0),
+            ('active_tiles', list(range(rows * cols))),
+            ('tile_size', json.loads(
+                sysconfig['sem']['store_res'])[tile_size_selector]),
+            ('tile_size_selector', tile_size_selector),
+            ('pixel_size', 10.0),
+            ('dwell_time', 0.01),
+            ('dwell_time_selector', 0),
+            ('bit_depth_selector', 0),
+            ('display_colour', 0),
+            ('wd_stig_xy', [0, 0, 0]),
+            ('acq_interval', 1),
+            ('acq_interval_offset', 0),
+            ('use_wd_gradient', 0),
+            ('wd_gradient_ref_tiles', [-1, -1, -1]),
+            ('wd_gradient_params', [0, 0, 0]),
+            ('array_index', None),
+            ('roi_index', None)]:
+        values = [value] * number_grids
+        if key == 'origin_sx_sy':
+            # Grids next to each other
+            values = [[200.0 + i * cols * 50.0, 250.0]
+                      for i in range(number_grids)]
+        grids[key] = json.dumps(values)
+    grids['wd_stig_params'] = '{}'
+    return config, sysconfig
+
+
+def run_benchmark(base_dir, number_slices=3, number_grids=1, grid_size=(3, 3),
+                  tile_size_selector=0, mirror=False, heuristic_af=False,
+                  debris_detection=False, reslices=True, take_overviews=True,
+                  pipelined=False, cut_duration=0.0):
+    """Run the acquisition of number_slices slices in base_dir and return
+    the report as a dict."""
+    settings = {
+        'number_slices': number_slices, 'number_grids': number_grids,
+        'grid_size': list(grid_size), 'tile_size_selector': tile_size_selector,
+        'mirror': mirror, 'heuristic_af': heuristic_af,
+        'debris_detection': debris_detection, 'reslices': reslices,
+        'take_overviews': take_overviews, 'pipelined': pipelined,
+        'cut_duration': cut_duration}
+    init_log()
+    base_dir = os.path.abspath(base_dir)
+    stack_dir = os.path.join(base_dir, 'stack')
+    mirror_dir = os.path.join(base_dir, 'mirror') if mirror else None
+    os.makedirs(stack_dir, exist_ok=True)
+    config, sysconfig = build_config(
+        stack_dir, number_slices, number_grids, grid_size,
+        tile_size_selector, mirror_dir, heuristic_af, debris_detection,
+        take_overviews, pipelined, cut_duration)
+
+    trigger = BenchmarkTrigger()
+    acq = init_acquisition(config, sysconfig, trigger)
+    trigger.acq = acq
+    timer = PhaseTimer()
+    for component, method_name, phase in PHASES:
+        obj = acq if component is None else getattr(acq, component)
+        timer.wrap(obj, method_name, phase)
+    if not reslices:
+        no_reslice = lambda *args, **kwargs: (True, '')
+        acq.img_inspector.save_tile_reslice = no_reslice
+        acq.img_inspector.save_ov_reslice = no_reslice
+
+    np.random.seed(0)
+    start_time = perf_counter()
+    acq.run_acquisition()
+    wall_time = perf_counter() - start_time
+
+    with open(acq.imagelist_filename) as file:
+        number_tiles = sum(1 for line in file if line.strip())
+    slice_times = np.diff(trigger.progress_times).tolist()
+    phases = timer.summary()
+    grids_time = phases.get('grids', {}).get('total_s', 0)
+    scan_time = acq.sem.current_cycle_time + acq.sem.additional_cycle_time
+    return {
+        'version': constants.VERSION,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'settings': settings,
+        'completed': bool(acq.stack_completed),
+        'error_state': str(acq.error_state),
+        'slices_acquired': acq.slice_counter,
+        'tiles_acquired': number_tiles,
+        'wall_time_s': round(wall_time, 6),
+        'slices_per_hour': round(3600 * acq.slice_counter / wall_time, 3),
+        'tiles_per_hour': round(3600 * number_tiles / wall_time, 3),
+        # Time per tile in the grid acquisition not spent scanning
+        'per_tile_overhead_s': (
+            round(grids_time / number_tiles - scan_time, 6)
+            if number_tiles else None),
+        'slice_durations_s': [round(t, 6) for t in slice_times],
+        'phases': phases,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--slices', type=int, default=3)
+    parser.add_argument('--grids', type=int, default=1)
+    parser.add_argument('--grid-size', type=int, nargs=2, default=[3, 3],
+                        metavar=('ROWS', 'COLS'))
+    parser.add_argument('--tile-size', type=int, default=0,
+                        help='frame size selector (see store_res in mock.cfg)')
+    parser.add_argument('--mirror', action='store_true')
+    parser.add_argument('--heuristic-af', action='store_true')
+    parser.add_argument('--debris', action='store_true')
+    parser.add_argument('--no-reslices', action='store_true')
+    parser.add_argument('--no-overviews', action='store_true')
+    parser.add_argument('--pipelined', action='store_true')
+    parser.add_argument('--cut-duration', type=float, default=0.0)
+    parser.add_argument('--base-dir', help='directory for the acquired '
+                        'images (default: temporary directory)')
+    parser.add_argument('-o', '--output', help='JSON report file '
+                        '(default: stdout)')
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        report = run_benchmark(
+            args.base_dir or tmp_dir, number_slices=args.slices,
+            number_grids=args.grids, grid_size=args.grid_size,
+            tile_size_selector=args.tile_size, mirror=args.mirror,
+            heuristic_af=args.heuristic_af, debris_detection=args.debris,
+            reslices=not args.no_reslices,
+            take_overviews=not args.no_overviews, pipelined=args.pipelined,
+            cut_duration=args.cut_duration)
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
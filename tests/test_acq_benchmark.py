@@ -0,0 +1,39 @@
+import json
+import sys
+
+import pytest
+from qtpy.QtWidgets import QApplication
+
+import acq_benchmark
+
+
+app = QApplication.instance() or QApplication(sys.argv)   # Required for QPixmap
+
+
+@pytest.mark.parametrize('mirror, reslices', [(False, True), (True, False)])
+def test_acq_benchmark(tmp_path, mirror, reslices):
+    report = acq_benchmark.run_benchmark(
+        str(tmp_path), number_slices=2, number_grids=2, grid_size=(2, 2),
+        mirror=mirror, reslices=reslices)
+    print(json.dumps(report, indent=2))
+    assert report['completed']
+    assert report['slices_acquired'] == 2
+    assert report['tiles_acquired'] == 2 * 2 * 4
+    assert len(report['slice_durations_s']) == 2
+    assert report['slices_per_hour'] > 0
+    phases = report['phases']
+    assert phases['grab']['count'] == 2 * 2 * 4 + phases['overviews']['count']
+    assert phases['cut']['count'] == 2
+    assert ('mirror' in phases) == mirror
+    assert ('reslice' in phases) == reslices
+    # Report can be serialised and compared between versions
+    json.dumps(report)
+
+
+def test_acq_benchmark_command_line(tmp_path):
+    report_file = tmp_path / 'report.json'
+    acq_benchmark.main(['--slices', '1', '--grid-size', '2', '1', '--no-overviews',
+                        '--base-dir', str(tmp_path / 'acq'), '-o', str(report_file)])
+    report = json.loads(report_file.read_text())
+    assert report['settings']['grid_size'] == [2, 1]
+    assert report['tiles_acquired'] == 2
@@ -0,0 +1,264 @@
+import os
+import sys
+from collections import Counter
+from time import perf_counter
+
+import numpy as np
+import pytest
+from qtpy.QtWidgets import QApplication
+
+import acq_benchmark
+import acq_estimate
+import tile_route
+from test_utils import init_acquisition, init_log
+from Tracer import Tracer
+
+
+app = QApplication.instance() or QApplication(sys.argv)   # Required for QPixmap
+
+
+def set_up_acq(base_dir, number_slices=21, number_grids=3,
+               intervals=(1, 2, 2), offsets=(0, 1, 0)):
+    init_log()
+    stack_dir = os.path.join(base_dir, 'stack')
+    os.makedirs(stack_dir, exist_ok=True)
+    config, sysconfig = acq_benchmark.build_config(
+        stack_dir, number_slices, number_grids, (4, 4), 0, None,
+        heuristic_af=False, debris_detection=False, take_overviews=True,
+        pipelined=False, cut_duration=0.0)
+    trigger = acq_benchmark.BenchmarkTrigger()
+    acq = init_acquisition(config, sysconfig, trigger)
+    trigger.acq = acq
+    for grid, interval, offset in zip(acq.gm, intervals, offsets):
+        grid.acq_interval = interval
+        grid.acq_interval_offset = offset
+    return acq
+
+
+# Previous implementation (all slices up to the largest offset and interval
+# calculated one by one, then extrapolated)
+
+def previous_estimates(acq, N):
+    overhead_per_frame = 1.0
+    if acq.use_mirror_drive:
+        overhead_per_frame += 0.5
+    max_offset_slice_number = max(
+        acq.gm.max_acq_interval_offset(), acq.ovm.max_acq_interval_offset())
+    max_interval_slice_number = max(
+        acq.gm.max_acq_interval(), acq.ovm.max_acq_interval())
+
+    def calculate_for_slice_range(from_slice, to_slice):
+        imaging_time = 0
+        stage_move_time = 0
+        time_saved = 0
+        amount_of_data = 0
+        x0, y0 = acq.ovm[0].centre_sx_sy
+        for slice_counter in range(from_slice, to_slice):
+            if acq.take_overviews:
+                for ov_index in range(acq.ovm.number_ov):
+                    if (acq.ovm[ov_index].slice_active(slice_counter)
+                            and acq.ovm[ov_index].active):
+                        x1, y1 = acq.ovm[ov_index].centre_sx_sy
+                        stage_move_time += (
+                            acq.stage.stage_move_duration(x0, y0, x1, y1))
+                        x0, y0 = x1, y1
+                        imaging_time += acq.ovm[ov_index].tile_cycle_time()
+                        imaging_time += overhead_per_frame
+                        amount_of_data += (acq.ovm[ov_index].width_p()
+                                           * acq.ovm[ov_index].height_p())
+            route, route_duration, snake_duration = (
+                acq.plan_tile_route(slice_counter, (x0, y0)))
+            stage_move_time += route_duration
+            time_saved += snake_duration - route_duration
+            if route:
+                last_grid_index, last_tiles = route[-1]
+                x0, y0 = acq.gm[last_grid_index][last_tiles[-1]].sx_sy
+            for grid_index, grid in enumerate(acq.gm):
+                if grid.slice_active(slice_counter) and grid.active:
+                    number_active_tiles = grid.number_active_tiles()
+                    imaging_time += ((grid.tile_cycle_time()
+                                      + overhead_per_frame)
+                                     * number_active_tiles)
+                    amount_of_data += (grid.tile_width_p()
+                                       * grid.tile_height_p()
+                                       * number_active_tiles)
+            if acq.take_overviews:
+                x1, y1 = acq.ovm[0].centre_sx_sy
+                stage_move_time += (
+                    acq.stage.stage_move_duration(x0, y0, x1, y1))
+                x0, y0 = x1, y1
+        return imaging_time, stage_move_time, time_saved, amount_of_data
+
+    if N <= max_offset_slice_number + max_interval_slice_number:
+        part_0 = calculate_for_slice_range(0, N)
+        part_1 = 0, 0, 0, 0
+    else:
+        part_0 = calculate_for_slice_range(0, max_offset_slice_number)
+        part_1 = calculate_for_slice_range(
+            max_offset_slice_number,
+            max_offset_slice_number + max_interval_slice_number)
+        factor = ((N - max_offset_slice_number) / max_interval_slice_number)
+        part_1 = [value * factor for value in part_1]
+    imaging_time, stage_move_time, time_saved, amount_of_data = [
+        a + b for a, b in zip(part_0, part_1)]
+    return imaging_time, stage_move_time, amount_of_data / 1e9, time_saved
+
+
+def brute_force_patterns(intervals, offsets, active, from_slice, to_slice):
+    patterns = Counter()
+    for slice_counter in range(from_slice, to_slice):
+        patterns[tuple(
+            bool(is_active and slice_counter >= offset
+                 and (slice_counter - offset) % interval == 0)
+            for interval, offset, is_active
+            in zip(intervals, offsets, active))] += 1
+    return patterns
+
+
+@pytest.mark.parametrize('from_slice, to_slice', [(0, 1), (0, 100), (7, 53),
+                                                  (40, 40), (3, 1000)])
+def test_slice_patterns(from_slice, to_slice):
+    rng = np.random.default_rng(from_slice)
+    for _ in range(20):
+        number_items = rng.integers(1, 6)
+        intervals = rng.integers(1, 8, number_items)
+        offsets = rng.integers(0, 12, number_items)
+        active = rng.random(number_items) < 0.8
+        expected = brute_force_patterns(intervals, offsets, active,
+                                        from_slice, to_slice)
+        patterns, counts, first_slices = acq_estimate.slice_patterns(
+            intervals, offsets, active, from_slice, to_slice)
+        assert {tuple(pattern): count
+                for pattern, count in zip(patterns.tolist(), counts)} == expected
+        for pattern, slice_counter in zip(patterns.tolist(), first_slices):
+            assert brute_force_patterns(intervals, offsets, active,
+                                        slice_counter, slice_counter + 1) \
+                   == {tuple(pattern): 1}
+        counts = acq_estimate.active_counts(intervals, offsets,
+                                            from_slice, to_slice)
+        assert counts.tolist() == [
+            sum(slice_counter >= offset and (slice_counter - offset) % interval == 0
+                for slice_counter in range(from_slice, to_slice))
+            for interval, offset in zip(intervals, offsets)]
+
+
+def synthetic_trace(rng, number_slices, overhead_per_frame=0.8,
+                    move_scale=1.3, cut_time=12.0, noise=0.03):
+    """Slices with 100 or 150 frames (every other slice with an additional
+    grid) and measured durations generated with the given parameters."""
+    frames = np.where(np.arange(number_slices) % 2, 150, 100)
+    scan_time = frames * 2.5
+    move_time = frames * 0.4
+    measured_moves = move_scale * move_time * rng.normal(1, noise, number_slices)
+    measured_cut = cut_time * rng.normal(1, noise, number_slices)
+    duration = (scan_time + measured_moves + measured_cut
+                + overhead_per_frame * frames * rng.normal(1, noise, number_slices))
+    return (duration, measured_moves, measured_cut), scan_time, move_time, frames
+
+
+def test_timing_model_calibration():
+    rng = np.random.default_rng(0)
+    model = acq_estimate.TimingModel(overhead_per_frame=1.0, cut_time=30)
+    assert model.bounds([100], [10]) is None
+    measured, scan_time, move_time, frames = synthetic_trace(rng, 1)
+    assert not model.calibrate(measured, scan_time, move_time, frames)
+    measured, scan_time, move_time, frames = synthetic_trace(rng, 20)
+    assert model.calibrate(measured, scan_time, move_time, frames)
+    assert model.overhead_per_frame == pytest.approx(0.8, rel=0.05)
+    assert model.move_scale == pytest.approx(1.3, rel=0.02)
+    assert model.cut_time == pytest.approx(12.0, rel=0.05)
+    assert 0 < model.relative_sd < 0.05
+
+    # The true remaining time lies within the bounds in about 95% of the
+    # simulated acquisitions
+    inside = 0
+    number_runs = 200
+    for _ in range(number_runs):
+        measured, scan_time, move_time, frames = synthetic_trace(rng, 20)
+        model = acq_estimate.TimingModel(overhead_per_frame=1.0, cut_time=30)
+        model.calibrate(measured, scan_time, move_time, frames)
+        remaining, scan_time, move_time, frames = synthetic_trace(rng, 50)
+        durations = model.slice_durations(scan_time, move_time, frames)
+        low, high = model.bounds(durations, np.ones(len(durations)))
+        assert low < durations.sum() < high
+        inside += low <= remaining[0].sum() <= high
+    print(f'Remaining time within bounds in {inside} of {number_runs} runs')
+    assert inside >= 0.85 * number_runs
+
+
+def test_estimates_match_previous_implementation(tmp_path):
+    number_slices = 21
+    acq = set_up_acq(str(tmp_path), number_slices)
+    # Plans the tile routes, as the acquisition does
+    imaging_time, stage_move_time, amount_of_data, time_saved = (
+        previous_estimates(acq, number_slices))
+    estimates = acq.calculate_estimates()
+    (min_dose, max_dose, total_area, total_z, total_data,
+     total_imaging, total_stage_moves, total_cutting,
+     date_estimate, remaining_time, remaining_time_range,
+     stage_move_time_saved) = estimates
+    assert total_imaging == pytest.approx(imaging_time)
+    assert total_stage_moves == pytest.approx(stage_move_time)
+    assert total_data == pytest.approx(amount_of_data)
+    assert stage_move_time_saved == pytest.approx(time_saved)
+    assert total_cutting == number_slices * acq.microtome.full_cut_duration
+    assert abs(remaining_time - (total_imaging + total_stage_moves
+                                 + total_cutting)) <= 1
+    # No measured durations yet
+    assert remaining_time_range is None
+
+
+def test_estimates_do_not_plan_routes(tmp_path, monkeypatch):
+    acq = set_up_acq(str(tmp_path), number_slices=21)
+
+    def plan_route(*args, **kwargs):
+        raise AssertionError('Route planned for the estimates')
+
+    monkeypatch.setattr(tile_route, 'plan_route', plan_route)
+    # No routes planned yet: snake order
+    estimates = acq.calculate_estimates()
+    assert estimates[-1] == 0
+    monkeypatch.undo()
+    x0, y0 = acq.ovm[0].centre_sx_sy
+    route, route_duration, snake_duration = acq.plan_tile_route(0, (x0, y0))
+    assert acq.plan_tile_route(0, (x0, y0), plan=False)[1] == route_duration
+    # Other start position: not planned, snake order
+    _, duration, snake_duration = acq.plan_tile_route(0, (x0 + 1, y0),
+                                                      plan=False)
+    assert duration == snake_duration
+
+
+def test_estimates_calibrated_with_measured_durations(tmp_path):
+    acq = set_up_acq(str(tmp_path), number_slices=4)
+    acq.run_acquisition()
+    assert acq.slice_counter == 4
+    # Stack extended
+    acq.number_slices = 40
+    estimates = acq.calculate_estimates()
+    remaining_time, remaining_time_range = estimates[9:11]
+    assert remaining_time_range is not None
+    low, high = remaining_time_range
+    assert low <= remaining_time <= high
+    # The mock acquisition has less overhead than the default estimate
+    # of 1 s per frame
+    acq.tracer = Tracer()
+    default_remaining_time, default_range = acq.calculate_estimates()[9:11]
+    assert default_range is None
+    assert remaining_time < default_remaining_time
+
+
+def test_estimates_benchmark(tmp_path):
+    # Grids acquired in long intervals with large offsets
+    acq = set_up_acq(str(tmp_path), number_slices=5000,
+                     intervals=(1, 40, 60), offsets=(0, 100, 250))
+    start_time = perf_counter()
+    previous = previous_estimates(acq, 5000)
+    duration_previous = perf_counter() - start_time
+    start_time = perf_counter()
+    estimates = acq.calculate_estimates()
+    duration_new = perf_counter() - start_time
+    print(f'Estimates for 5000 slices: previous implementation '
+          f'{duration_previous * 1e3:.0f} ms, new {duration_new * 1e3:.0f} ms')
+    assert duration_new < duration_previous
+    # Data volume does not depend on the extrapolation
+    assert estimates[4] == pytest.approx(previous[2], rel=0.01)
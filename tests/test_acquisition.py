@@ -0,0 +1,246 @@
+import os
+from collections import Counter
+import sys
+import numpy as np
+import pytest
+from qtpy.QtWidgets import QApplication
+
+from test_utils import *
+from constants import Error
+
+
+TEST_CONFIG_FILE = 'mock.ini'
+TEST_SYSCONFIG_FILE = 'mock.cfg'
+ACTIVE_TILES = [0, 1, 2, 3, 7, 6, 5, 4]
+
+app = QApplication.instance() or QApplication(sys.argv)   # Required for QPixmap
+
+
+def set_up_acq(base_dir):
+    init_log()
+    config, sysconfig = init_read_configs(TEST_CONFIG_FILE, TEST_SYSCONFIG_FILE)
+    os.makedirs(base_dir, exist_ok=True)
+    config['acq']['base_dir'] = base_dir
+    config['acq']['mock_prev_acq_dir'] = base_dir
+    config['acq']['mock_type'] = 'Uniform noise'
+    config['grids']['tile_size_selector'] = '[0]'
+    config['grids']['active_tiles'] = str([ACTIVE_TILES])
+    acq = init_acquisition(config, sysconfig)
+    acq.pause_state = None
+    acq.set_up_acq_subdirectories()
+    acq.set_up_acq_logs()
+    acq.set_up_afss_masks()
+    acq.init_acquisition()
+    return acq
+
+
+def read_log_messages(acq):
+    """Return main log entries without timestamps and duration statistics."""
+    with open(acq.main_log_filename) as f:
+        return sorted(line[19:].strip() for line in f
+                      if ' avg. ' not in line)
+
+
+def read_imagelist(acq):
+    with open(acq.imagelist_filename) as f:
+        return f.read().splitlines()
+
+
+def fail_tile(acq, failing_tile):
+    """Let the image inspector report failed range tests for failing_tile."""
+    process_tile = acq.img_inspector.process_tile
+    acq.monitor_images = True
+
+    def process_tile_with_failure(filename, grid_index, tile_index, *args):
+        result = list(process_tile(filename, grid_index, tile_index, *args))
+        if tile_index == failing_tile:
+            result[4] = False   # range_test_passed
+        return tuple(result)
+
+    acq.img_inspector.process_tile = process_tile_with_failure
+
+
+def fail_metadata(acq, failing_tile):
+    """Let the metadata server reject the metadata of failing_tile."""
+    failing_id = utils.tile_id(0, failing_tile, acq.slice_counter)
+    acq.send_metadata = True
+
+    def send_tile_metadata(project_name, stack_name, tile_metadata):
+        if tile_metadata['tileid'] == failing_id:
+            return 100, 'Rejected'
+        return 200, None
+
+    acq.notifications.send_tile_metadata = send_tile_metadata
+
+
+def run_grid(base_dir, pipelined, failing_tile=None):
+    acq = set_up_acq(base_dir)
+    acq.pipelined_tile_acq = pipelined
+    np.random.seed(0)   # Identical mock images in both modes
+    if failing_tile is not None:
+        fail_tile(acq, failing_tile)
+    acq.acquire_grid(0)
+    return acq
+
+
+@pytest.mark.parametrize('failing_tile', [None, 3, ACTIVE_TILES[-1]])
+def test_pipelined_tile_acq(tmp_path, failing_tile):
+    serial = run_grid(str(tmp_path / 'serial' / 'stack'), False, failing_tile)
+    pipelined = run_grid(str(tmp_path / 'pipelined' / 'stack'), True,
+                         failing_tile)
+
+    assert read_imagelist(pipelined) == read_imagelist(serial)
+    serial_log = Counter(read_log_messages(serial))
+    pipelined_log = Counter(read_log_messages(pipelined))
+    assert not serial_log - pipelined_log
+    assert pipelined.pause_state == serial.pause_state
+    assert pipelined.error_state == serial.error_state
+    assert pipelined.tiles_acquired == serial.tiles_acquired
+    assert pipelined.grids_acquired == serial.grids_acquired
+    assert pipelined.acq_interrupted_at == serial.acq_interrupted_at
+    # Only tiles in the imagelist (and the failed tile) are kept on disk
+    for acq in (serial, pipelined):
+        tile_files = [file_name for dir_path, _, file_names
+                      in os.walk(os.path.join(acq.base_dir, 'tiles'))
+                      if 'rejected' not in dir_path
+                      for file_name in file_names]
+        assert len(tile_files) == (len(read_imagelist(acq))
+                                   + (failing_tile is not None))
+
+    if failing_tile is None or failing_tile == ACTIVE_TILES[-1]:
+        # No tile acquired ahead of the failed tile
+        assert pipelined_log == serial_log
+    else:
+        # Moving to, acquiring and discarding the tile after the failed tile
+        next_tile = ACTIVE_TILES[ACTIVE_TILES.index(failing_tile) + 1]
+        extra_log = list((pipelined_log - serial_log).elements())
+        assert len(extra_log) == 3
+        assert any(f'Tile 0.{next_tile} discarded' in msg for msg in extra_log)
+
+    if failing_tile is None:
+        assert pipelined.pause_state is None
+        assert pipelined.grids_acquired == [0]
+    else:
+        assert pipelined.pause_state == 1
+        assert pipelined.error_state == Error.tile_image_range
+        assert pipelined.acq_interrupted_at == [0, failing_tile]
+        failed_index = ACTIVE_TILES.index(failing_tile)
+        assert pipelined.tiles_acquired == ACTIVE_TILES[:failed_index]
+
+
+@pytest.mark.parametrize('pipelined', [False, True])
+def test_registration_error(tmp_path, pipelined):
+    acq = set_up_acq(str(tmp_path / 'stack'))
+    acq.pipelined_tile_acq = pipelined
+    fail_metadata(acq, 3)
+    grabbed = []
+    grab_tile = acq.grab_tile
+
+    def grab_tile_recorded(grid_index, tile_index, *args):
+        grabbed.append(tile_index)
+        return grab_tile(grid_index, tile_index, *args)
+
+    acq.grab_tile = grab_tile_recorded
+    acq.acquire_grid(0)
+    # Paused after registering the tile, before the tile after next is grabbed
+    failed_index = ACTIVE_TILES.index(3)
+    assert acq.pause_state == 1
+    assert acq.error_state == Error.metadata_server
+    assert acq.acq_interrupted_at == [0, 3]
+    assert acq.tiles_acquired == ACTIVE_TILES[:failed_index + 1]
+    assert grabbed == ACTIVE_TILES[:failed_index + 1 + pipelined]
+    # The frame of the next tile (pipelined) is discarded
+    tile_files = [file_name for _, _, file_names
+                  in os.walk(os.path.join(acq.base_dir, 'tiles'))
+                  for file_name in file_names]
+    assert len(tile_files) == len(read_imagelist(acq)) == failed_index + 1
+
+
+def test_pipelined_tile_acq_user_pause(tmp_path):
+    acq = set_up_acq(str(tmp_path / 'stack'))
+    acq.pipelined_tile_acq = True
+    grab_tile = acq.grab_tile
+
+    def grab_tile_with_pause(grid_index, tile_index, *args):
+        result = grab_tile(grid_index, tile_index, *args)
+        if tile_index == 2:
+            acq.pause_acquisition(1)
+        return result
+
+    acq.grab_tile = grab_tile_with_pause
+    acq.acquire_grid(0)
+    # Tile acquired before the pause request is completed, then acquisition stops
+    assert acq.pause_state == 1
+    assert acq.error_state == Error.none
+    assert acq.tiles_acquired == [0, 1, 2]
+    assert acq.acq_interrupted_at == [0, 2]
+    assert len(read_imagelist(acq)) == 3
+
+
+def test_mirror_backlog_pause(tmp_path):
+    from test_mirror_queue import ThrottledMirrorQueue
+    acq = set_up_acq(str(tmp_path / 'stack'))
+    acq.use_mirror_drive = True
+    acq.mirror_backlog_limit = 3
+    # Mirror drive copying less than one tile per tile acquisition
+    acq.mirror_queue = ThrottledMirrorQueue(
+        acq.base_dir, str(tmp_path / 'mirror' / 'stack'),
+        os.path.join(acq.base_dir, 'meta', 'mirror_queue.txt'),
+        number_workers=1, bytes_per_s=2e6)
+    acq.acquire_grid(0)
+    # Paused when the backlog exceeded the limit, not on the first slow copy
+    assert acq.pause_state == 1
+    assert acq.error_state == Error.mirror_drive
+    assert 3 <= len(acq.tiles_acquired) < len(ACTIVE_TILES)
+    acq.stop_mirror_queue()
+    for line in read_imagelist(acq):
+        assert os.path.isfile(os.path.join(tmp_path, 'mirror', 'stack',
+                                           line.split(';')[0]))
+
+
+def test_run_acquisition_with_mirror_drive(tmp_path):
+    from acq_benchmark import BenchmarkTrigger, build_config
+    init_log()
+    base_dir = str(tmp_path / 'stack')
+    mirror_drive = str(tmp_path / 'mirror')
+    os.makedirs(base_dir)
+    config, sysconfig = build_config(
+        base_dir, number_slices=1, number_grids=1, grid_size=(2, 2),
+        tile_size_selector=0, mirror_dir=mirror_drive, heuristic_af=False,
+        debris_detection=False, take_overviews=True, pipelined=False,
+        cut_duration=0.0)
+    trigger = BenchmarkTrigger()
+    acq = init_acquisition(config, sysconfig, trigger)
+    trigger.acq = acq
+    assert acq.use_mirror_drive
+    acq.run_acquisition()
+    assert acq.stack_completed
+    assert acq.error_state == Error.none
+    # Queue stopped after the run, every tile copied to the mirror drive
+    assert acq.mirror_queue is None
+    tiles = read_imagelist(acq)
+    assert len(tiles) == 4
+    for line in tiles:
+        assert os.path.isfile(os.path.join(acq.mirror_drive_dir,
+                                           line.split(';')[0]))
+    # The imagelist is copied through the queue after each tile
+    mirror_imagelist = os.path.join(acq.mirror_drive,
+                                    acq.imagelist_filename[2:])
+    with open(mirror_imagelist) as f:
+        assert f.read().splitlines() == tiles
+
+
+def test_tile_route(tmp_path):
+    acq = set_up_acq(str(tmp_path / 'stack'))
+    route, route_duration, snake_duration = acq.plan_tile_route(0, (0, 0))
+    assert [grid_index for grid_index, _ in route] == [0]
+    assert sorted(route[0][1]) == sorted(ACTIVE_TILES)
+    assert route_duration <= snake_duration
+    estimates = acq.calculate_estimates()
+    assert estimates[-1] >= 0
+    # The planned order is used for the acquisition
+    acq.tile_route = dict(route)
+    acq.acquire_grid(0)
+    tile_ids = [line.split(';')[0] for line in read_imagelist(acq)]
+    assert len(tile_ids) == len(ACTIVE_TILES)
+    assert [int(tile_id.split('_t')[1][:4]) for tile_id in tile_ids] == route[0][1]
@@ -0,0 +1,219 @@
+import os
+import sys
+from time import perf_counter
+
+import numpy as np
+import pytest
+import tifffile
+from qtpy.QtWidgets import QApplication
+from scipy.ndimage import gaussian_filter
+from scipy.ndimage import shift as ndimage_shift
+
+import Autofocus
+import utils_afss
+from constants import FOCUS
+from test_utils import *
+
+
+TEST_CONFIG_FILE = 'mock.ini'
+TEST_SYSCONFIG_FILE = 'mock.cfg'
+NUMBER_TILES = 20
+AFSS_ROUNDS = 3
+FIRST_SLICE = 10
+WD = 5e-3
+
+app = QApplication.instance() or QApplication(sys.argv)
+
+
+def set_up_acq(base_dir):
+    init_log()
+    config, sysconfig = init_read_configs(TEST_CONFIG_FILE, TEST_SYSCONFIG_FILE)
+    os.makedirs(base_dir, exist_ok=True)
+    config['acq']['base_dir'] = base_dir
+    config['grids']['size'] = '[[5, 4]]'   # 20 tiles
+    acq = init_acquisition(config, sysconfig)
+    acq.pause_state = None
+    acq.set_up_acq_subdirectories()
+    acq.set_up_acq_logs()
+    acq.set_up_afss_masks()
+    acq.init_acquisition()
+    return acq
+
+
+def synthetic_series(base_dir, number_tiles=NUMBER_TILES, rounds=AFSS_ROUNDS,
+                     shape=(768, 1024), max_drift=12):
+    """Focus series of number_tiles tiles with random integer drift between
+    the slices. Return the file paths and images {tile_key: [...]}."""
+    rng = np.random.default_rng(0)
+    paths, images = {}, {}
+    for t in range(number_tiles):
+        tile_key = f'0.{t}'
+        scene = gaussian_filter(
+            rng.random((shape[0] + 4 * max_drift, shape[1] + 4 * max_drift)), 2)
+        offset = np.array([2 * max_drift, 2 * max_drift])
+        for r in range(rounds):
+            if r > 0:
+                offset += rng.integers(-max_drift, max_drift + 1, 2)
+            img = scene[offset[0]:offset[0] + shape[0],
+                        offset[1]:offset[1] + shape[1]]
+            # Best focus in the middle of the series
+            img = gaussian_filter(img, 1 + abs(r - rounds // 2))
+            img = ((img - img.min()) / (img.max() - img.min()) * 255).astype(np.uint8)
+            path = os.path.join(base_dir, f'g0_t{t}_s{FIRST_SLICE + r}.tif')
+            tifffile.imwrite(path, img)
+            paths.setdefault(tile_key, []).append(path)
+            images.setdefault(tile_key, []).append(img)
+    return paths, images
+
+
+def add_round(af, paths, images, r, use_cache=True):
+    """Add the tiles of round r to the series (as in Acquisition after the
+    tile has been grabbed)."""
+    for tile_key in paths:
+        img = images[tile_key][r]
+        entry = {FIRST_SLICE + r: [[WD + (r - 1) * af.afss_wd_delta, 0], (0, 0),
+                                   0, paths[tile_key][r], np.std(img)]}
+        af.afss_wd_stig_corr.setdefault(tile_key, {}).update(entry)
+        if use_cache:
+            af.afss_cache_tile(tile_key, paths[tile_key][r], img)
+
+
+# Previous implementation (series read from disk, spline shift, one tile after another)
+
+def previous_compute_pair_shifts(af):
+    for key, tile_dict in af.afss_wd_stig_corr.items():
+        slice_nrs = sorted(tile_dict.keys())[-2:]
+        fns = [tile_dict[slice_nr][3] for slice_nr in slice_nrs]
+        shift_vec = utils_afss.compute_shifts_cv2(fns)
+        af.afss_wd_stig_corr[key][max(slice_nrs)].append(shift_vec)
+
+
+def previous_process_afss_collections(af):
+    for tile_key in af.afss_wd_stig_corr:
+        fns, shifts = [], []
+        for i, slice_nr in enumerate(af.afss_wd_stig_corr[tile_key]):
+            fns.append(af.afss_wd_stig_corr[tile_key][slice_nr][3])
+            if i != 0:
+                shifts.append(af.afss_wd_stig_corr[tile_key][slice_nr][5][0])
+        cumm_shifts = np.cumsum(shifts, axis=0)
+        ic = utils_afss.load_image_collection(fns)
+        ic = utils_afss.shift_collection(ic, cumm_shifts, subpixel=True)
+        ic = utils_afss.crop_image_collection(ic, cumm_shifts)
+        coll_sharpness = utils_afss.get_collection_sharpness(ic, metric='edges')
+        for i, slice_nr in enumerate(af.afss_wd_stig_corr[tile_key]):
+            af.afss_wd_stig_corr[tile_key][slice_nr][2] = coll_sharpness[i]
+
+
+def run_series(af, paths, images, previous=False, use_cache=True):
+    af.reset_afss_corrections()
+    for r in range(AFSS_ROUNDS):
+        add_round(af, paths, images, r, use_cache=use_cache and not previous)
+        if r > 0:
+            if previous:
+                previous_compute_pair_shifts(af)
+            else:
+                af.afss_compute_pair_shifts()
+    if previous:
+        previous_process_afss_collections(af)
+    else:
+        af.process_afss_collections()
+    return {tile_key: [entry[2:] for entry in tile_dict.values()]
+            for tile_key, tile_dict in af.afss_wd_stig_corr.items()}
+
+
+@pytest.mark.parametrize('cached', [True, False])
+def test_afss_series_unchanged(tmp_path, cached):
+    acq = set_up_acq(str(tmp_path))
+    af = acq.autofocus
+    paths, images = synthetic_series(str(tmp_path), number_tiles=4)
+    expected = run_series(af, paths, images, previous=True)
+    # Images not in memory are read from disk
+    results = run_series(af, paths, images, use_cache=cached)
+    for tile_key, entries in expected.items():
+        for entry, expected_entry in zip(results[tile_key], entries):
+            # Sharpness, path, stddev and shift vector (not for first slice)
+            assert len(entry) == len(expected_entry)
+            np.testing.assert_allclose(entry[0], expected_entry[0], rtol=1e-6)
+            assert entry[1] == expected_entry[1]
+            if len(entry) > 3:
+                np.testing.assert_array_equal(entry[3], expected_entry[3])
+
+
+def test_roll_shift_equals_spline_shift():
+    rng = np.random.default_rng(1)
+    ic = (rng.random((3, 64, 80)) * 255).astype(np.uint8)
+    cumm_shifts = np.array([[3., -5.], [-2., 7.]])
+    spline = utils_afss.crop_image_collection(
+        utils_afss.shift_collection(ic.copy(), cumm_shifts, subpixel=True), cumm_shifts)
+    rolled = utils_afss.crop_image_collection(
+        utils_afss.shift_collection(ic.copy(), cumm_shifts), cumm_shifts)
+    np.testing.assert_array_equal(rolled, spline)
+
+
+
+def test_phase_correlate_equals_cv2(tmp_path):
+    rng = np.random.default_rng(2)
+    scene = gaussian_filter(rng.random((300, 340)), 2)
+    ref = scene[20:276, 20:320]
+    paths = [str(tmp_path / 'ref.tif'), str(tmp_path / 'cur.tif')]
+    # Subpixel shifts, the peak is spread over neighbouring pixels
+    for shift in [(0.5, -0.5), (3.4, 7.6), (-11.5, 2.5), (6, -9)]:
+        cur = ndimage_shift(scene, shift)[20:276, 20:320]
+        for path, img in zip(paths, [ref, cur]):
+            tifffile.imwrite(path, (img * 255).astype(np.uint8))
+        imgs = [utils_afss.imread_cv2(path) for path in paths]
+        spectra = [utils_afss.image_spectrum(img) for img in imgs]
+        np.testing.assert_array_equal(
+            utils_afss.phase_correlate(*spectra, utils_afss.padded_shape(ref.shape)),
+            utils_afss.compute_shifts_cv2(paths))
+
+def test_series_cache_ring():
+    cache = utils_afss.SeriesCache(max_frames=3)
+    for i in range(5):
+        cache.add('0.0', f'img{i}.tif', np.full((8, 8), i, dtype=np.uint8))
+    assert list(cache.images['0.0']) == ['img2.tif', 'img3.tif', 'img4.tif']
+    cache.pair_shift('0.0', 'img3.tif', 'img4.tif')
+    assert cache.spectra['0.0'][0] == 'img4.tif'
+    cache.clear()
+    assert not cache.images and not cache.spectra
+
+
+def test_afss_benchmark(tmp_path, monkeypatch):
+    # Fit plots are not part of the benchmark
+    monkeypatch.setattr(Autofocus, 'has_matplotlib', False)
+    acq = set_up_acq(str(tmp_path))
+    af = acq.autofocus
+    af.afss_drift_corrected = True
+    af.afss_mode = FOCUS
+    af.afss_data['afss_rounds'] = AFSS_ROUNDS
+    paths, images = synthetic_series(str(tmp_path))
+    durations = {}
+    for name in ['previous', 'in-memory']:
+        if name == 'previous':
+            monkeypatch.setattr(af, 'afss_compute_pair_shifts',
+                                lambda: previous_compute_pair_shifts(af))
+            monkeypatch.setattr(af, 'process_afss_collections',
+                                lambda: previous_process_afss_collections(af))
+        else:
+            monkeypatch.undo()
+            monkeypatch.setattr(Autofocus, 'has_matplotlib', False)
+        af.reset_afss_corrections()
+        af.afss_wd_stig_orig = {tile_key: [[WD, 0], np.array([0., 0.])]
+                                for tile_key in paths}
+        durations[name] = 0
+        for r in range(AFSS_ROUNDS):
+            acq.slice_counter = FIRST_SLICE + r
+            add_round(af, paths, images, r, use_cache=(name != 'previous'))
+            acq.afss_compute_drifts = r > 0
+            acq.do_afss_corrections = (r == AFSS_ROUNDS - 1)
+            start_time = perf_counter()
+            acq.process_afss_autofocus()
+            durations[name] += perf_counter() - start_time
+        # Series completed, processed and passed (the results are cleared)
+        assert not af.afss_wd_stig_corr
+        assert acq.afss_fail_counter[FOCUS] == -1
+        af.afss_mode = FOCUS
+    print(f'AFSS, {NUMBER_TILES} tiles, {AFSS_ROUNDS} rounds: previous implementation '
+          f'{durations["previous"] * 1e3:.0f} ms, '
+          f'in-memory {durations["in-memory"] * 1e3:.0f} ms')
+    assert durations['in-memory'] < durations['previous']
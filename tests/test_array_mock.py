@@ -14,7 +14,7 @@ class TestArrayMock:
     TEST_CONFIG_FILE = 'array.ini'
     TEST_SYSCONFIG_FILE = 'mock.cfg'
 
-    qapp = QApplication(sys.argv)   # required Qt operations. Exclude when using pytest-qt
+    qapp = QApplication.instance() or QApplication(sys.argv)   # required Qt operations. Exclude when using pytest-qt
 
     @pytest.fixture
     def sem(self):
@@ -0,0 +1,106 @@
+import json
+import sys
+
+import numpy as np
+import pytest
+from qtpy.QtWidgets import QApplication
+
+import codec_calibration
+from constants import DEFAULT_COMPRESSION
+from image_io import COMPRESSION_CODECS, available_codecs
+from test_utils import init_read_configs
+
+
+app = QApplication.instance() or QApplication(sys.argv)   # Required for QPixmap
+
+
+def sample_frame(width, height, dtype=np.uint8):
+    """Smooth gradient with a fine texture, similar to an EM frame.
+    Deterministic and compressible."""
+    y, x = np.mgrid[0:height, 0:width]
+    image = 0.3 + 0.2 * np.sin(x / 50) * np.cos(y / 70)
+    image += 0.02 * np.sin(x * 1.7 + y * 2.3)
+    return (np.clip(image, 0, 1) * np.iinfo(dtype).max).astype(dtype)
+
+
+def test_calibrate():
+    _, sysconfig = init_read_configs('mock.ini', 'mock.cfg')
+    width, height = json.loads(sysconfig['sem']['store_res'])[0]
+    frame = sample_frame(width, height)
+    results = codec_calibration.calibrate(frame, repeats=1)
+    assert list(results) == available_codecs()
+    for codec, result in results.items():
+        print(f'{codec}: {result["mb_per_s"]:.0f} MB/s, ratio {result["ratio"]:.2f}, '
+              f'{result["encode_time"] * 1e3:.1f} ms')
+        assert result['encode_time'] > 0
+        assert result['mb_per_s'] > 0
+    # Uncompressed: only the TIFF structure is added
+    assert 0.95 < results['none']['ratio'] <= 1
+    assert results['deflate_1']['ratio'] > 1.2
+
+    # No time limit: best ratio
+    best = max(results, key=lambda codec: results[codec]['ratio'])
+    assert codec_calibration.recommend(results, tile_cycle_time=1e6) == best
+    # Every codec too slow
+    assert codec_calibration.recommend(results, tile_cycle_time=0) == DEFAULT_COMPRESSION
+
+
+def test_recommend():
+    results = {
+        'none': {'encode_time': 0.01, 'mb_per_s': 1600, 'ratio': 1.0},
+        'deflate_1': {'encode_time': 0.1, 'mb_per_s': 160, 'ratio': 1.8},
+        'zstd': {'encode_time': 0.05, 'mb_per_s': 320, 'ratio': 1.8},
+        'deflate_9': {'encode_time': 0.8, 'mb_per_s': 20, 'ratio': 2.0},
+    }
+    # Limit: fraction 0.25 of the cycle time
+    assert codec_calibration.recommend(results, 4.0) == 'deflate_9'
+    # Same ratio: the faster codec
+    assert codec_calibration.recommend(results, 1.0) == 'zstd'
+    assert codec_calibration.recommend(results, 0.1) == 'none'
+    assert codec_calibration.recommend(results, 1.0, fraction=0.001) == DEFAULT_COMPRESSION
+
+
+def test_checked_codec():
+    assert codec_calibration.checked_codec(' Deflate_6 ', 'tile_compression') == ('deflate_6', None)
+    codec, warning = codec_calibration.checked_codec('gzip', 'tile_compression')
+    assert codec == DEFAULT_COMPRESSION
+    assert 'tile_compression = gzip' in warning
+    for codec in COMPRESSION_CODECS:
+        checked, warning = codec_calibration.checked_codec(codec, 'ov_compression')
+        if codec in available_codecs():
+            assert (checked, warning) == (codec, None)
+        else:
+            assert checked == DEFAULT_COMPRESSION
+            assert 'not available' in warning
+
+
+def test_calibration_in_background(tmp_path):
+    from test_acquisition import set_up_acq
+    acq = set_up_acq(str(tmp_path / 'stack'))
+    assert not acq.calibrate_codecs   # Off by default
+    acq.calibrate_codecs = True
+    started = []
+    start_compression_calibration = acq.start_compression_calibration
+
+    def start_counted(*args):
+        started.append(args)
+        start_compression_calibration(*args)
+
+    acq.start_compression_calibration = start_counted
+    acq.acquire_grid(0)
+    # Once per session
+    assert len(started) == 1
+    acq.compression_calibration_thread.join(timeout=300)
+    assert list(acq.compression_calibration) == available_codecs()
+
+
+@pytest.mark.parametrize('dtype', [np.uint8, np.uint16])
+def test_measure_codec(dtype):
+    frame = sample_frame(512, 384, dtype)
+    encode_time, size = codec_calibration.measure_codec(frame, 'none', npyramid_add=0,
+                                                        repeats=2)
+    assert encode_time > 0
+    assert frame.nbytes <= size < frame.nbytes + 4096
+    _, compressed_size = codec_calibration.measure_codec(frame, 'deflate_6', npyramid_add=0,
+                                                         repeats=1)
+    assert compressed_size < size
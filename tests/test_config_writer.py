@@ -0,0 +1,165 @@
+import io
+import os
+import sys
+from configparser import ConfigParser
+from time import perf_counter
+
+import numpy as np
+from qtpy.QtWidgets import QApplication
+
+import utils
+from config_template import process_cfg
+from ConfigWriter import ConfigWriter
+from GridManager import GridManager
+from test_load_config import config, sysconfig
+from test_preview_manager import create_project, previous_load_previews
+
+
+app = QApplication.instance() or QApplication(sys.argv)   # Required for QImage
+
+
+def save_settings(gm, writer, cfg_path):
+    """Save settings as MainControls.save_config_to_disk() does."""
+    gm.save_to_cfg()
+    writer.write_images(gm.previews.take_unsaved())
+    writer.write_config(cfg_path, gm.cfg)
+    assert writer.flush(timeout=30)
+
+
+def preview_mtimes(base_dir):
+    workspace = os.path.join(base_dir, 'workspace')
+    return {name: os.stat(os.path.join(workspace, name)).st_mtime_ns
+            for name in os.listdir(workspace)}
+
+
+# Previous implementation (all previews in memory and the config file
+# written on every save)
+
+def previous_save_settings(gm, cfg_path):
+    gm.save_to_cfg()
+    base_dir = gm.cfg['acq']['base_dir']
+    for grid_index in range(gm.number_grids):
+        grid = gm[grid_index]
+        for tile_index in range(grid.number_tiles):
+            preview_path = utils.tile_preview_save_path(
+                base_dir, grid_index, grid.array_index, grid.roi_index, tile_index)
+            img = grid[tile_index].preview_img
+            if img is not None:
+                img.save(preview_path)
+    with open(cfg_path, 'w') as f:
+        gm.cfg.write(f)
+
+
+def test_config_round_trip(tmp_path):
+    cfg_path = str(tmp_path / 'test.ini')
+    writer = ConfigWriter()
+    assert writer.write_config(cfg_path, config)
+    assert writer.flush(timeout=10)
+    # Same text as ConfigParser.write()
+    expected = io.StringIO()
+    config.write(expected)
+    with open(cfg_path) as file:
+        assert file.read() == expected.getvalue()
+    # Load as in test_load_config
+    loaded = ConfigParser()
+    with open(cfg_path, 'r') as file:
+        loaded.read_file(file)
+    assert {s: dict(loaded[s]) for s in loaded.sections()} == \
+           {s: dict(config[s]) for s in config.sections()}
+    success, exceptions, _, _, _, _ = process_cfg(loaded, sysconfig)
+    assert success
+    # Unchanged configuration is not written again
+    assert not writer.write_config(cfg_path, config)
+    writer.close()
+    assert writer.files_written == 1
+
+
+def test_atomic_write(tmp_path):
+    cfg_path = str(tmp_path / 'test.ini')
+    with open(cfg_path, 'w') as file:
+        file.write('[previous]\n')
+
+    class FailingConfigWriter(ConfigWriter):
+        def write(self, path, data):
+            with open(path + '.tmp', 'w') as file:
+                file.write(data[:100])
+            raise OSError('Disk full')
+
+    writer = FailingConfigWriter()
+    writer.write_config(cfg_path, config)
+    writer.flush(timeout=10)
+    with open(cfg_path) as file:
+        assert file.read() == '[previous]\n'
+    assert writer.last_error is not None
+    # Errors are retrieved on the calling thread
+    assert writer.take_errors() == [f'Could not save {cfg_path}: Disk full']
+    assert writer.take_errors() == []
+    # Failed file is written again at the next save
+    assert cfg_path not in writer.submitted
+    writer.close()
+
+
+def test_unchanged_project_writes_no_previews(tmp_path):
+    base_dir = str(tmp_path / 'stack')
+    cfg, cs, sem = create_project(base_dir, number_grids=2)
+    cfg_path = str(tmp_path / 'project.ini')
+    gm = GridManager(cfg, sem, cs)
+    # Viewport shows all tiles of grid 0
+    gm.previews.request(list(gm[0]), list(gm[0]))
+    assert gm.previews.wait_until_loaded(timeout=60)
+    writer = ConfigWriter()
+    save_settings(gm, writer, cfg_path)
+    mtimes = preview_mtimes(base_dir)
+    files_written = writer.files_written
+    for _ in range(5):
+        save_settings(gm, writer, cfg_path)
+    # Neither previews nor the config file were written again
+    assert writer.files_written == files_written
+    assert preview_mtimes(base_dir) == mtimes
+
+    # New preview of tile 1.5 and changed WD: one preview and the config
+    gm.set_tile_preview(1, 5, utils.image_to_QImage(np.zeros((48, 64), dtype=np.uint8)))
+    gm[1][5].wd = 5e-3
+    save_settings(gm, writer, cfg_path)
+    assert writer.files_written == files_written + 2
+    changed = [name for name, mtime in preview_mtimes(base_dir).items()
+               if mtimes.get(name) != mtime]
+    assert changed == [os.path.basename(
+        utils.tile_preview_save_path(base_dir, 1, tile_index=5))]
+    loaded = ConfigParser()
+    loaded.read(cfg_path)
+    assert '"1.5": [0.005' in loaded['grids']['wd_stig_params']
+    writer.close()
+    gm.previews.close()
+
+
+def test_save_benchmark(tmp_path):
+    base_dir = str(tmp_path / 'stack')
+    cfg, cs, sem = create_project(base_dir, number_grids=4)
+    cfg_path = str(tmp_path / 'project.ini')
+    number_saves = 5
+
+    gm = GridManager(cfg, sem, cs)
+    previous_load_previews(gm)
+    start_time = perf_counter()
+    for _ in range(number_saves):
+        previous_save_settings(gm, cfg_path)
+    duration_previous = perf_counter() - start_time
+    gm.previews.close()
+
+    gm = GridManager(cfg, sem, cs)
+    writer = ConfigWriter()
+    start_time = perf_counter()
+    for _ in range(number_saves):
+        # Time spent on the calling (GUI) thread
+        gm.save_to_cfg()
+        writer.write_images(gm.previews.take_unsaved())
+        writer.write_config(cfg_path, gm.cfg)
+    duration_new = perf_counter() - start_time
+    writer.close()
+    gm.previews.close()
+
+    print(f'{number_saves} saves of {gm.number_grids} grids x 400 tiles: '
+          f'previous implementation {duration_previous * 1e3:.0f} ms, '
+          f'background writer {duration_new * 1e3:.0f} ms')
+    assert duration_new < duration_previous
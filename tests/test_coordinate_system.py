@@ -10,6 +10,8 @@
 
 """Tests for CoordinateSystem.py."""
 
+from time import perf_counter
+
 import pytest
 import numpy as np
 # Use the default configuration for all tests
@@ -29,3 +31,50 @@ def test_convert_coordinates(cs):
     assert np.all(cs.convert_d_to_s(cs.convert_s_to_d([0, 0])) == 0)
     assert cs.convert_s_to_d(cs.convert_d_to_s([-100, 100])) == pytest.approx([-100, 100])
 
+
+def random_points(n, seed=0):
+    rng = np.random.default_rng(seed)
+    return rng.uniform(-5000, 5000, (n, 2))
+
+def test_batch_conversions_equal_scalar(cs):
+    cs.vp_centre_dx_dy = [120.0, -80.0]
+    cs.vp_scale = 2.5
+    points = random_points(50)
+    d_to_s = np.array([cs.convert_d_to_s(p) for p in points])
+    s_to_d = np.array([cs.convert_s_to_d(p) for p in points])
+    d_to_v = np.array([cs.convert_d_to_v(p) for p in points])
+    s_to_v = np.array([cs.convert_d_to_v(cs.convert_s_to_d(p)) for p in points])
+    np.testing.assert_allclose(cs.convert_d_to_s_batch(points), d_to_s,
+                               rtol=1e-12, atol=1e-9)
+    np.testing.assert_allclose(cs.convert_s_to_d_batch(points), s_to_d,
+                               rtol=1e-12, atol=1e-9)
+    np.testing.assert_allclose(cs.convert_d_to_v_batch(points), d_to_v,
+                               rtol=1e-12, atol=1e-9)
+    np.testing.assert_allclose(cs.convert_s_to_v_batch(points), s_to_v,
+                               rtol=1e-12, atol=1e-9)
+    # Single points and empty input
+    assert cs.convert_d_to_s_batch([1, 2]).shape == (1, 2)
+    assert cs.convert_s_to_v_batch([]).shape == (0, 2)
+
+def test_batch_matrices_follow_calibration(cs):
+    points = random_points(10)
+    cs.stage_calibration = [1.1, 0.9, 0.05, 0.02]
+    cs.apply_stage_calibration()
+    expected = np.array([cs.convert_s_to_d(p) for p in points])
+    np.testing.assert_allclose(cs.convert_s_to_d_batch(points), expected,
+                               rtol=1e-12, atol=1e-9)
+    np.testing.assert_allclose(cs.get_s_to_d_transform()[:2, :2] @ points[0],
+                               expected[0], rtol=1e-12, atol=1e-9)
+
+def test_batch_conversion_benchmark(cs):
+    points = random_points(100000)
+    start_time = perf_counter()
+    for p in points:
+        cs.convert_d_to_v(cs.convert_s_to_d(p))
+    scalar_duration = perf_counter() - start_time
+    start_time = perf_counter()
+    cs.convert_s_to_v_batch(points)
+    batch_duration = perf_counter() - start_time
+    print(f'10^5 points s -> v: scalar {scalar_duration * 1e3:.0f} ms, '
+          f'batch {batch_duration * 1e3:.1f} ms')
+    assert batch_duration < scalar_duration
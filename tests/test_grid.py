@@ -0,0 +1,148 @@
+from math import radians, cos, sin
+from time import perf_counter
+
+import numpy as np
+import pytest
+
+from CoordinateSystem import CoordinateSystem
+from Grid import Grid
+from sem.SEM import SEM
+from test_load_config import config, sysconfig
+
+
+@pytest.fixture
+def cs():
+    return CoordinateSystem(config, sysconfig)
+
+
+@pytest.fixture
+def sem():
+    return SEM(config, sysconfig)
+
+
+def make_grid(cs, sem, size=(5, 5), rotation=30, active_tiles=None):
+    return Grid(cs, sem, origin_sx_sy=(100.0, -50.0), size=list(size),
+                rotation=rotation, overlap=200, row_shift=100,
+                active_tiles=active_tiles, frame_size=[4096, 3072],
+                frame_size_selector=-1, pixel_size=10.0,
+                dwell_time=0.8, dwell_time_selector=0)
+
+
+# Previous implementation (one tile after another)
+
+def reference_tile_positions(grid):
+    rows, cols = grid.size
+    width_p, height_p = grid.frame_size[0], grid.frame_size[1]
+    theta = radians(grid.rotation)
+    px_py, dx_dy, sx_sy = [], [], []
+    for y_pos in range(rows):
+        for x_pos in range(cols):
+            x_coord = x_pos * (width_p - grid.overlap) + grid.row_shift * (y_pos % 2)
+            y_coord = y_pos * (height_p - grid.overlap)
+            px_py.append([x_coord, y_coord])
+            if theta != 0:
+                x_coord, y_coord = (x_coord * cos(theta) - y_coord * sin(theta),
+                                    x_coord * sin(theta) + y_coord * cos(theta))
+            dx_dy.append([x_coord * grid.pixel_size / 1000,
+                          y_coord * grid.pixel_size / 1000])
+            sx_sy.append(grid.cs.convert_d_to_s(dx_dy[-1]) + grid.origin_sx_sy)
+    return np.array(px_py), np.array(dx_dy), np.array(sx_sy)
+
+
+def reference_tile_bounding_box(grid, tile_index):
+    grid_origin_dx, grid_origin_dy = grid.origin_dx_dy
+    tile_dx, tile_dy = grid[tile_index].dx_dy
+    tile_width_d = grid.tile_width_d()
+    tile_height_d = grid.tile_height_d()
+    top_left_dx = grid_origin_dx + tile_dx - tile_width_d/2
+    top_left_dy = grid_origin_dy + tile_dy - tile_height_d/2
+    points_x = [top_left_dx, top_left_dx + tile_width_d,
+                top_left_dx, top_left_dx + tile_width_d]
+    points_y = [top_left_dy, top_left_dy,
+                top_left_dy + tile_height_d, top_left_dy + tile_height_d]
+    theta = radians(grid.rotation)
+    pivot_dx = top_left_dx + tile_width_d/2
+    pivot_dy = top_left_dy + tile_height_d/2
+    for i in range(4):
+        x, y = points_x[i] - pivot_dx, points_y[i] - pivot_dy
+        points_x[i] = x * cos(theta) - y * sin(theta) + pivot_dx
+        points_y[i] = x * sin(theta) + y * cos(theta) + pivot_dy
+    return min(points_x), max(points_x), min(points_y), max(points_y)
+
+
+def test_tile_positions(cs, sem):
+    grid = make_grid(cs, sem, size=(4, 6))
+    px_py, dx_dy, sx_sy = reference_tile_positions(grid)
+    np.testing.assert_array_equal(grid.tile_data.px_py, px_py)
+    np.testing.assert_array_equal(grid.tile_data.dx_dy, dx_dy)
+    np.testing.assert_allclose(grid.tile_data.sx_sy, sx_sy, rtol=1e-12, atol=1e-9)
+    # Tile objects are views of the grid arrays
+    np.testing.assert_array_equal(grid[7].sx_sy, grid.tile_data.sx_sy[7])
+    for tile_index in [0, 7, 23]:
+        np.testing.assert_allclose(grid.tile_bounding_box(tile_index),
+                                   reference_tile_bounding_box(grid, tile_index),
+                                   rtol=1e-12)
+
+
+def test_tile_views(cs, sem):
+    grid = make_grid(cs, sem, active_tiles=[0, 5, 6, 24])
+    assert grid.active_tiles == [0, 6, 5, 24]   # snake order
+    assert grid[6].tile_active and not grid[7].tile_active
+    grid[3].wd = 5e-3
+    grid[3].stig_xy = [0.5, -0.25]
+    grid[8].wd = 7e-3
+    assert grid.tile_data.wd[3] == 5e-3
+    assert grid[3].stig_xy == [0.5, -0.25]
+    assert grid.average_wd() == pytest.approx(6e-3)
+    assert grid.average_stig_xy() == pytest.approx((0.25, -0.125))
+    grid[8].autofocus_active = True
+    assert grid.autofocus_ref_tiles() == [8]
+    assert grid.average_wd_of_autofocus_ref_tiles() == pytest.approx(7e-3)
+    # Returned positions are copies
+    sx_sy = grid[3].sx_sy
+    sx_sy += 1000
+    assert not np.array_equal(grid[3].sx_sy, sx_sy)
+
+
+def test_resize_preserves_tiles(cs, sem):
+    grid = make_grid(cs, sem, size=(3, 3), active_tiles=[1, 4, 8])
+    grid[4].wd = 5e-3
+    grid[4].preview_img = 'preview'
+    grid.size = [4, 2]
+    # Tile 4 (row 1, col 1) is now tile 3, tile 8 (row 2, col 2) was removed
+    assert grid.active_tiles == [1, 3]
+    assert grid[3].wd == 5e-3
+    assert grid[3].preview_img == 'preview'
+    assert grid[3].index == 3 and grid[3].arrays is grid.tile_data
+    px_py, _, _ = reference_tile_positions(grid)
+    np.testing.assert_array_equal(grid.tile_data.px_py, px_py)
+
+
+def test_activate_tiles_from_mask(cs, sem):
+    grid = make_grid(cs, sem, size=(3, 4))
+    mask = np.zeros((3, 4), dtype=bool)
+    mask[1, :2] = True
+    mask[2, 3] = True
+    grid.activate_tiles_from_mask(mask)
+    assert grid.active_tiles == [5, 4, 11]
+    with pytest.raises(ValueError):
+        grid.activate_tiles_from_mask(np.ones(5, dtype=bool))
+
+
+def test_grid_benchmark(cs, sem):
+    start_time = perf_counter()
+    grid = make_grid(cs, sem, size=(200, 200))
+    rng = np.random.default_rng(0)
+    grid.activate_tiles_from_mask(rng.random((200, 200)) < 0.5)
+    grid.active_tiles = rng.choice(40000, 20000, replace=False).tolist()
+    for tile_index in range(0, 40000, 4000):
+        grid.toggle_active_tile(tile_index)
+    grid.rotation = 15
+    grid.set_wd_for_all_tiles(5e-3)
+    grid.average_wd()
+    grid.tile_bounding_boxes()
+    grid.size = [150, 250]
+    duration = perf_counter() - start_time
+    print(f'Grid 200 x 200: build and edit {duration * 1e3:.0f} ms')
+    assert grid.number_tiles == 150 * 250
+    assert duration < 10
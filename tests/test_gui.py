@@ -37,7 +37,7 @@ class TestGuiMock:
     def init(self):
         init_log()
         if self.qtbot is None:
-            self.qapp = QApplication(sys.argv)  # Required to run Qt
+            self.qapp = QApplication.instance() or QApplication(sys.argv)  # Required to run Qt
         config, sysconfig = init_read_configs(self.TEST_CONFIG_FILE, self.TEST_SYSCONFIG_FILE)
         # Set base path to temp path
         base_dir = str(self.tmp_path)
@@ -0,0 +1,160 @@
+from math import sqrt, exp, sin, cos
+from time import perf_counter
+
+import numpy as np
+import pytest
+from scipy.signal import fftconvolve
+
+from Autofocus import Autofocus
+from CoordinateSystem import CoordinateSystem
+from GridManager import GridManager
+from image_io import imwrite
+from test_utils import init_read_configs, init_sem
+
+
+TEST_CONFIG_FILE = 'mock.ini'
+TEST_SYSCONFIG_FILE = 'mock.cfg'
+
+
+def init_autofocus():
+    config, sysconfig = init_read_configs(TEST_CONFIG_FILE, TEST_SYSCONFIG_FILE)
+    sem = init_sem(TEST_CONFIG_FILE, TEST_SYSCONFIG_FILE)
+    cs = CoordinateSystem(config, sysconfig)
+    gm = GridManager(config, sem, cs)
+    return Autofocus(config, sem, gm)
+
+
+# Previous implementation (loops over mask pixels, one FFT per tile)
+
+def reference_masks(width=64):
+    α, β, γ, δ, ε = 6, 0.5, 3, 0.5, 9
+    masks = np.empty((6, width, width))
+    for i in range(width):
+        for j in range(width):
+            x, y = i - width/2, j - width/2
+            r = sqrt(x**2 + y**2)
+            if r == 0:
+                r = 1
+            sinφ = x/r
+            cosφ = y/r
+            exp_astig = exp(-r**2/α) - exp(-r**2/β)
+            masks[:, i, j] = (exp(-r**2/γ) - exp(-r**2/δ),
+                              exp(-r**2/ε) - exp(-r**2/γ),
+                              sinφ**2 * exp_astig,
+                              cosφ**2 * exp_astig,
+                              0.5 * (sinφ + cosφ)**2 * exp_astig,
+                              0.5 * (sinφ - cosφ)**2 * exp_astig)
+    return masks
+
+
+def reference_multiply_with_mask(autocorr, mask):
+    numerator_sum = 0
+    norm = 0
+    for i in range(64):
+        for j in range(64):
+            numerator_sum += autocorr[i, j] * mask[i, j]
+            norm += mask[i, j]
+    return numerator_sum / norm
+
+
+def reference_estimators(img, masks):
+    mean = int(np.mean(img))
+    img = img.astype(np.int16)
+    img -= mean
+    norm = np.sum(img ** 2)
+    autocorr = fftconvolve(img, img[::-1, ::-1]) / norm
+    height, width = autocorr.shape[0], autocorr.shape[1]
+    autocorr = autocorr[int(height/2 - 32):int(height/2 + 32),
+                        int(width/2 - 32):int(width/2 + 32)]
+    fi, fo, apx, amx, apy, amy = [reference_multiply_with_mask(autocorr, mask)
+                                  for mask in masks]
+    return (fi - fo) / (fi + fo), (apx - amx) / (apx + amx), (apy - amy) / (apy + amy)
+
+
+def blurred_image(seed, blur):
+    """Random structure blurred anisotropically (simulated defocus and
+    astigmatism), 8-bit tile of 1024 x 1024 pixels."""
+    rng = np.random.default_rng(seed)
+    img = rng.random((1024, 1024))
+    spectrum = np.fft.rfft2(img)
+    fy = np.fft.fftfreq(1024)[:, np.newaxis]
+    fx = np.fft.rfftfreq(1024)[np.newaxis, :]
+    spectrum *= np.exp(-(blur[0] * fx**2 + blur[1] * fy**2) * 200)
+    img = np.fft.irfft2(spectrum, s=img.shape)
+    img = (img - img.min()) / (img.max() - img.min()) * 255
+    return img.astype(np.uint8)
+
+
+def test_masks():
+    autofocus = init_autofocus()
+    masks = reference_masks()
+    for mask, reference in zip((autofocus.fi_mask, autofocus.fo_mask,
+                                autofocus.apx_mask, autofocus.amx_mask,
+                                autofocus.apy_mask, autofocus.amy_mask), masks):
+        np.testing.assert_allclose(mask, reference, rtol=1e-12, atol=1e-15)
+
+
+@pytest.mark.parametrize('background', [False, True])
+def test_heuristic_deltas(background):
+    autofocus = init_autofocus()
+    masks = reference_masks()
+    tile_keys = [f'0.{t}' for t in range(4)]
+    reference_est = {}
+    # Two slices with different blur (as with alternating WD/stig deltas)
+    for slice_counter, blur in enumerate([(20, 10), (10, 20)]):
+        for t, tile_key in enumerate(tile_keys):
+            tile_img = blurred_image(t, blur)
+            autofocus.prepare_tile_for_heuristic_af(tile_img, tile_key)
+            reference_est.setdefault(tile_key, []).append(
+                reference_estimators(autofocus.img[tile_key], masks))
+        if background:
+            autofocus.submit_heuristic_af_batch(tile_keys)
+        for tile_key in tile_keys:
+            autofocus.process_image_for_heuristic_af(tile_key)
+    assert not autofocus.heuristic_pending
+    for tile_key in tile_keys:
+        np.testing.assert_allclose(
+            np.transpose([autofocus.foc_est[tile_key],
+                          autofocus.astgx_est[tile_key],
+                          autofocus.astgy_est[tile_key]]),
+            reference_est[tile_key], rtol=1e-9)
+        wd_corr, sx_corr, sy_corr, _ = autofocus.get_heuristic_corrections(tile_key)
+        # Corrections as computed from the reference estimators
+        (f0, x0, y0), (f1, x1, y1) = reference_est[tile_key]
+        calibration = autofocus.heuristic_calibration
+        a1, a2 = calibration[1] * (x0 - x1), calibration[2] * (y0 - y1)
+        angle, scale = autofocus.rot_angle, autofocus.scale_factor
+        np.testing.assert_allclose(
+            [wd_corr, sx_corr, sy_corr],
+            [calibration[0] * (f0 - f1),
+             (a1 * cos(angle) - a2 * sin(angle)) * scale,
+             (a1 * sin(angle) + a2 * cos(angle)) * scale],
+            rtol=1e-6, atol=1e-12)
+
+
+def test_heuristic_benchmark():
+    autofocus = init_autofocus()
+    masks = reference_masks()
+    images = [blurred_image(t, (10, 10))[256:768, 256:768] for t in range(8)]
+    start_time = perf_counter()
+    for img in images:
+        reference_estimators(img, masks)
+    reference_duration = perf_counter() - start_time
+    start_time = perf_counter()
+    autofocus.heuristic_estimators(images)
+    duration = perf_counter() - start_time
+    print(f'Heuristic AF, 8 tiles: previous implementation '
+          f'{reference_duration * 1e3:.0f} ms, batched {duration * 1e3:.0f} ms')
+    assert duration < reference_duration
+
+
+def test_prepare_tile_from_file(tmp_path):
+    autofocus = init_autofocus()
+    tile_img = np.random.randint(0, 255, size=(1537, 2048), dtype=np.uint8)
+    filename = str(tmp_path / 'tile.ome.tif')
+    imwrite(filename, tile_img, tile_size=(256, 256))
+    autofocus.prepare_tile_for_heuristic_af(tile_img, '0.0')
+    # Only the central area is read from the file
+    autofocus.prepare_tile_for_heuristic_af(None, '0.1', filename)
+    assert autofocus.img['0.0'].shape == (512, 512)
+    np.testing.assert_array_equal(autofocus.img['0.1'], autofocus.img['0.0'])
@@ -0,0 +1,434 @@
+import json
+import os
+import sys
+from time import perf_counter
+
+import numpy as np
+import pytest
+import tifffile
+from qtpy.QtWidgets import QApplication
+
+import image_io
+import ImageInspector
+import ImportedImage
+from image_io import imread, imread_metadata, imwrite, open_zarr_level, remove_image, copy_image
+from image_io import clear_metadata_cache, imread_region, parse_metadata
+from constants import DEFAULT_PYRAMID_LEVELS
+from test_utils import init_read_configs
+from utils import resize_image
+
+
+app = QApplication.instance() or QApplication(sys.argv)   # Required for QPixmap
+
+
+METADATA = {'pixel_size': [(10, 'nm'), (10, 'nm')],
+            'position': [(1234.5, -678.9, 0.05)],
+            'rotation': 12.5}
+
+
+def write_tiff_and_zarr(tmp_path, image, metadata, **kwargs):
+    tiff_path = str(tmp_path / 'image.ome.tif')
+    zarr_path = str(tmp_path / 'image.ome.zarr')
+    imwrite(tiff_path, image, metadata, **kwargs)
+    imwrite(zarr_path, image, metadata, **kwargs)
+    return tiff_path, zarr_path
+
+
+@pytest.mark.parametrize('compression', [None, 'zlib', 'zstd'])
+def test_zarr_round_trip(tmp_path, compression):
+    image = np.random.randint(0, 65535, size=(700, 500), dtype=np.uint16)
+    tiff_path, zarr_path = write_tiff_and_zarr(
+        tmp_path, image, METADATA, tile_size=(256, 256), compression=compression, npyramid_add=3)
+
+    np.testing.assert_array_equal(imread(zarr_path, render=False), image)
+    tiff_metadata = imread_metadata(tiff_path)
+    zarr_metadata = imread_metadata(zarr_path)
+    for key in ['dimension_order', 'size', 'sizes']:
+        assert zarr_metadata[key] == tiff_metadata[key]
+    np.testing.assert_allclose(zarr_metadata['pixel_size'], tiff_metadata['pixel_size'])
+    np.testing.assert_allclose(zarr_metadata['position'], tiff_metadata['position'])
+    assert zarr_metadata['rotation'] == tiff_metadata['rotation']
+    for level in range(4):
+        np.testing.assert_array_equal(imread(zarr_path, level=level, render=False),
+                                      imread(tiff_path, level=level, render=False))
+
+
+def test_zarr_region(tmp_path):
+    image = np.random.randint(0, 255, size=(1000, 800), dtype=np.uint8)
+    zarr_path = str(tmp_path / 'image.ome.zarr')
+    imwrite(zarr_path, image, METADATA, tile_size=(128, 128), npyramid_add=1)
+    # Region is read without loading the full image
+    np.testing.assert_array_equal(open_zarr_level(zarr_path)[300:400, 50:700],
+                                  image[300:400, 50:700])
+    assert open_zarr_level(zarr_path, 1).shape == (500, 400)
+
+
+def test_zarr_channels(tmp_path):
+    rgb_image = np.random.randint(0, 255, size=(300, 400, 3), dtype=np.uint8)
+    tiff_path, zarr_path = write_tiff_and_zarr(tmp_path, rgb_image, METADATA)
+    np.testing.assert_array_equal(imread(zarr_path, render=False), rgb_image)
+    np.testing.assert_array_equal(imread(zarr_path), imread(tiff_path))
+
+    channels = [{'label': 'SE', 'color': [1, 0, 0, 1]}, {'label': 'BSE', 'color': [0, 1, 0, 1]}]
+    image = np.random.randint(0, 255, size=(300, 400, 2), dtype=np.uint8)
+    zarr_path = str(tmp_path / 'channels.ome.zarr')
+    imwrite(zarr_path, image, dict(METADATA, channels=channels))
+    metadata = imread_metadata(zarr_path)
+    assert [channel['label'] for channel in metadata['channels']] == ['SE', 'BSE']
+    np.testing.assert_allclose(metadata['channels'][0]['color'], channels[0]['color'])
+    np.testing.assert_array_equal(imread(zarr_path, render=False), image)
+    np.testing.assert_array_equal(imread(zarr_path, channeli=1, render=False), image[..., 1])
+
+
+def test_copy_remove_zarr(tmp_path):
+    image = np.random.randint(0, 255, size=(200, 200), dtype=np.uint8)
+    zarr_path = str(tmp_path / 'image.ome.zarr')
+    copy_path = str(tmp_path / 'copy' / 'image.ome.zarr')
+    imwrite(zarr_path, image)
+    os.makedirs(os.path.dirname(copy_path))
+    copy_image(zarr_path, copy_path)
+    np.testing.assert_array_equal(imread(copy_path, render=False), image)
+    remove_image(zarr_path)
+    assert not os.path.exists(zarr_path)
+
+
+# Previous implementation (metadata read without cache, then the file opened
+# again for the pixels)
+
+def previous_imread(path, level=None, source_pixel_size_um=None, target_pixel_size_um=None,
+                    channeli=None, render=True, memmap=False):
+    metadata = parse_metadata(path)
+    dimension_order = metadata.get('dimension_order', -1)
+    c_index = dimension_order.index('c') if 'c' in dimension_order else None
+    size = metadata['size']
+    source_pixel_size = source_pixel_size_um or metadata.get('pixel_size')
+    scale_by_pixel_size = (target_pixel_size_um is not None and source_pixel_size is not None)
+    if scale_by_pixel_size:
+        target_size = (np.divide(source_pixel_size, target_pixel_size_um) * size).astype(int)
+        for level1, size1 in enumerate(metadata['sizes']):
+            if np.all(size1 > target_size):
+                level = level1
+    image = tifffile.imread(path, level=level)
+    if c_index is not None and c_index < len(dimension_order) - 1:
+        image = np.moveaxis(image, c_index, -1)
+        if channeli is not None:
+            image = image[..., channeli]
+    if scale_by_pixel_size and not np.all(target_size == size):
+        image = resize_image(image, target_size)
+    if render:
+        image = image_io.render_image(image, metadata.get('channels', []))
+    return image
+
+
+def previous_imread_metadata(path):
+    return parse_metadata(path)
+
+
+@pytest.mark.parametrize('compression', [None, 'zlib'])
+def test_tiff_single_open(tmp_path, monkeypatch, compression):
+    image = np.random.randint(0, 65535, size=(700, 500), dtype=np.uint16)
+    path = str(tmp_path / 'image.ome.tif')
+    imwrite(path, image, METADATA, tile_size=(256, 256), compression=compression, npyramid_add=2)
+    clear_metadata_cache()
+    opened = []
+
+    class CountingTiffFile(tifffile.TiffFile):
+        def __init__(self, *args, **kwargs):
+            opened.append(args[0])
+            super().__init__(*args, **kwargs)
+
+    monkeypatch.setattr(image_io.tifffile, 'TiffFile', CountingTiffFile)
+    for level in range(3):
+        np.testing.assert_array_equal(imread(path, level=level, render=False),
+                                      previous_imread(path, level=level, render=False))
+    assert imread_metadata(path) == parse_metadata(path)
+    opened.clear()
+    imread(path, render=False)
+    assert len(opened) == 1
+    # Cached metadata: no need to open the file
+    imread_metadata(path)
+    assert len(opened) == 1
+
+    # Pyramid level selected by pixel size
+    np.testing.assert_array_equal(
+        imread(path, source_pixel_size_um=[0.01, 0.01], target_pixel_size_um=[0.03, 0.03]),
+        previous_imread(path, source_pixel_size_um=[0.01, 0.01], target_pixel_size_um=[0.03, 0.03]))
+
+    # Memory-mapped only if not compressed, not tiled and large enough
+    monkeypatch.setattr(image_io, 'MEMMAP_MIN_SIZE', image.nbytes)
+    image2 = imread(path, render=False, memmap=True)
+    np.testing.assert_array_equal(image2, image)
+    assert not isinstance(image2, np.memmap)
+    path = str(tmp_path / 'strips.ome.tif')
+    imwrite(path, image, METADATA, compression=compression)
+    image2 = imread(path, render=False, memmap=True)
+    np.testing.assert_array_equal(image2, image)
+    assert isinstance(image2, np.memmap) == (compression is None)
+    monkeypatch.setattr(image_io, 'MEMMAP_MIN_SIZE', image.nbytes + 1)
+    assert not isinstance(imread(path, render=False, memmap=True), np.memmap)
+
+
+def test_metadata_cache(tmp_path):
+    path = str(tmp_path / 'image.ome.tif')
+    imwrite(path, np.zeros((100, 200), dtype=np.uint8), METADATA)
+    metadata = imread_metadata(path)
+    assert metadata['size'] == (200, 100)
+    # The cached metadata cannot be changed by the caller
+    metadata['size'] = None
+    assert imread_metadata(path)['size'] == (200, 100)
+    # Overwritten file (different size)
+    imwrite(path, np.zeros((300, 400), dtype=np.uint8), dict(METADATA, rotation=45))
+    metadata = imread_metadata(path)
+    assert metadata['size'] == (400, 300)
+    assert metadata['rotation'] == 45
+
+
+def test_read_benchmark(tmp_path, monkeypatch):
+    """Compare the read latency of imported images and inspected tiles with
+    the previous implementation. The timings are printed; only the results
+    are compared (wall-clock comparisons are not reliable in the unit
+    tests)."""
+    imported_path = str(tmp_path / 'imported.ome.tif')
+    imwrite(imported_path, np.random.randint(0, 255, size=(4096, 4096), dtype=np.uint8),
+            METADATA, tile_size=(512, 512), npyramid_add=3)
+    tile_path = str(tmp_path / 'tile.ome.tif')
+    imwrite(tile_path, np.random.randint(0, 255, size=(1536, 2048), dtype=np.uint8), METADATA)
+    config, _ = init_read_configs('mock.ini', 'mock.cfg')
+    img_inspector = ImageInspector.ImageInspector(config, None, None)
+    number_reads = 20
+
+    def time_reads():
+        start_time = perf_counter()
+        for _ in range(number_reads):
+            imported_image = ImportedImage.ImportedImage(
+                imported_path, '', [0, 0], 0, False, None, 10, True, 0)
+        imported_duration = (perf_counter() - start_time) / number_reads
+        start_time = perf_counter()
+        for _ in range(number_reads):
+            result = img_inspector.load_and_inspect(tile_path)
+        inspect_duration = (perf_counter() - start_time) / number_reads
+        assert imported_image.size == [4096, 4096]
+        assert not result[4]
+        return imported_duration, inspect_duration, result
+
+    new_imported, new_inspect, new_result = time_reads()
+    with monkeypatch.context() as patch:
+        patch.setattr(ImportedImage, 'imread', previous_imread)
+        patch.setattr(ImportedImage, 'imread_metadata', previous_imread_metadata)
+        patch.setattr(ImageInspector, 'imread', previous_imread)
+        previous_imported, previous_inspect, previous_result = time_reads()
+    print(f'ImportedImage.load_image: previous {previous_imported * 1e3:.1f} ms, '
+          f'new {new_imported * 1e3:.1f} ms')
+    print(f'ImageInspector.load_and_inspect: previous {previous_inspect * 1e3:.1f} ms, '
+          f'new {new_inspect * 1e3:.1f} ms')
+    np.testing.assert_array_equal(new_result[0], previous_result[0])
+    assert new_result[1:] == previous_result[1:]
+
+
+REGIONS = [(0, 0, 64, 64), (100, 37, 300, 211), (250, 255, 2, 2),
+           (650, 400, 200, 200), (0, 0, 700, 500), (699, 499, 1, 1)]
+
+
+@pytest.mark.parametrize('tile_size', [(128, 128), (64, 256), None])
+@pytest.mark.parametrize('compression', [None, 'zlib', 'zstd'])
+@pytest.mark.parametrize('shape, dtype', [((700, 500), np.uint16), ((700, 500, 3), np.uint8),
+                                          ((700, 500, 2), np.uint8)])
+def test_region_equals_full_read(tmp_path, tile_size, compression, shape, dtype):
+    """Regions of tiled (tile_size) and striped (no tile_size) files, and of
+    OME-Zarr images, are the same as slices of the full image."""
+    image = np.random.randint(0, np.iinfo(dtype).max, size=shape, dtype=dtype)
+    paths = write_tiff_and_zarr(tmp_path, image, METADATA, tile_size=tile_size,
+                                compression=compression, npyramid_add=2)
+    for path in paths:
+        for level in range(3):
+            full_image = imread(path, level=level, render=False)
+            for y0, x0, h, w in REGIONS:
+                region = imread_region(path, level, y0, x0, h, w)
+                np.testing.assert_array_equal(region, full_image[y0:y0 + h, x0:x0 + w])
+        if shape[-1] == 3:
+            # Rendered as imread() (no normalisation for RGB images)
+            np.testing.assert_array_equal(imread_region(path, 0, 10, 20, 30, 40, render=True),
+                                          imread(path)[10:40, 20:60])
+
+
+
+@pytest.mark.parametrize('shape, nplanes', [((70, 50), 1), ((70, 50, 3), 1), ((70, 50, 2), 2)])
+def test_ome_plane_metadata(tmp_path, shape, nplanes):
+    path = str(tmp_path / 'image.ome.tif')
+    imwrite(path, np.zeros(shape, dtype=np.uint8), METADATA)
+    with tifffile.TiffFile(path) as tiff:
+        planes = tifffile.xml2dict(tiff.ome_metadata)['OME']['Image']['Pixels']['Plane']
+    if not isinstance(planes, list):
+        planes = [planes]
+    # One position per plane (channel)
+    assert len(planes) == nplanes
+    for plane in planes:
+        assert (plane['PositionX'], plane['PositionY']) == (1234.5, -678.9)
+
+def test_region_small_strips(tmp_path):
+    image = np.random.randint(0, 255, size=(300, 200), dtype=np.uint8)
+    path = str(tmp_path / 'strips.tif')
+    with tifffile.TiffWriter(path) as writer:
+        writer.write(image, rowsperstrip=7, compression='zlib')
+    for y0, x0, h, w in [(0, 0, 1, 1), (5, 3, 9, 100), (293, 0, 7, 200), (0, 0, 300, 200)]:
+        np.testing.assert_array_equal(imread_region(path, 0, y0, x0, h, w),
+                                      image[y0:y0 + h, x0:x0 + w])
+
+
+def test_region_level_selection(tmp_path):
+    image = np.random.randint(0, 255, size=(1024, 768), dtype=np.uint8)
+    path = str(tmp_path / 'image.ome.tif')
+    imwrite(path, image, METADATA, tile_size=(128, 128), npyramid_add=3)
+    # Full-resolution region, read from the level selected for 40 nm pixels
+    # (level 1 is the smallest level larger than the target size)
+    region = imread_region(path, None, 400, 200, 200, 100, target_pixel_size_um=[0.04, 0.04])
+    np.testing.assert_array_equal(region, imread(path, level=1, render=False)[200:300, 100:150])
+    # No pixel sizes: full resolution
+    np.testing.assert_array_equal(imread_region(path, None, 400, 200, 200, 100),
+                                  image[400:600, 200:300])
+
+
+def test_region_benchmark(tmp_path):
+    image = np.random.randint(0, 255, size=(6144, 8192), dtype=np.uint8)
+    path = str(tmp_path / 'tile.ome.tif')
+    imwrite(path, image, METADATA, tile_size=(512, 512), compression='zlib')
+    start_time = perf_counter()
+    full_image = imread(path, render=False)
+    crop = full_image[2816:3328, 3840:4352]
+    duration_full = perf_counter() - start_time
+    start_time = perf_counter()
+    region = imread_region(path, 0, 2816, 3840, 512, 512)
+    duration_region = perf_counter() - start_time
+    print(f'512 x 512 crop of 8192 x 6144 tile: full read {duration_full * 1e3:.1f} ms, '
+          f'region {duration_region * 1e3:.1f} ms')
+    np.testing.assert_array_equal(region, crop)
+    assert duration_region < duration_full
+
+
+# Previous implementation (each level resized from the full image, tiles
+# compressed in the calling thread)
+
+def previous_imwrite(path, data, tile_size=None, compression=None, npyramid_add=0,
+                     pyramid_downsample=2):
+    size = np.flip(data.shape[:2])
+    with tifffile.TiffWriter(path) as writer:
+        writer.write(data, subifds=npyramid_add, tile=tile_size, compression=compression,
+                     maxworkers=1)
+        new_size = size
+        for i in range(npyramid_add):
+            new_size = new_size / pyramid_downsample
+            resized_data = resize_image(data, np.round(new_size).astype(int))
+            writer.write(resized_data, subfiletype=1, tile=tile_size, compression=compression,
+                         maxworkers=1)
+
+
+@pytest.mark.parametrize('shape, dtype', [((1000, 1500), np.uint8), ((999, 1501), np.uint16),
+                                          ((600, 800, 3), np.uint8)])
+def test_pyramid_area_average(tmp_path, shape, dtype):
+    image = np.random.randint(0, np.iinfo(dtype).max, size=shape, dtype=dtype)
+    for path in write_tiff_and_zarr(tmp_path, image, METADATA, tile_size=(256, 256),
+                                    compression='zlib', npyramid_add=4):
+        previous_level = image
+        for level in range(1, 5):
+            level_image = imread(path, level=level, render=False)
+            assert level_image.dtype == dtype
+            height, width = level_image.shape[:2]
+            assert (width, height) == tuple(np.round(np.flip(shape[:2]) / 2 ** level).astype(int))
+            if previous_level.shape[0] % 2 == 0 and previous_level.shape[1] % 2 == 0:
+                # Blocks of 2 x 2 pixels of the previous level averaged
+                blocks = previous_level.reshape((height, 2, width, 2) + shape[2:])
+                np.testing.assert_allclose(level_image, blocks.mean(axis=(1, 3)), atol=1)
+            previous_level = level_image
+
+
+def test_imwrite_benchmark(tmp_path):
+    """Regression benchmark: write pyramidal tiles of all store resolutions,
+    with and without compression. The timings are printed, not compared
+    (wall-clock comparisons are not reliable in the unit tests)."""
+    _, sysconfig = init_read_configs('mock.ini', 'mock.cfg')
+    store_res = json.loads(sysconfig['sem']['store_res'])
+    for compression in [None, 'zlib']:
+        duration_previous = duration_new = 0
+        for width, height in store_res:
+            image = np.random.randint(0, 64, size=(height, width), dtype=np.uint8)
+            path = str(tmp_path / 'tile.tif')
+            start_time = perf_counter()
+            previous_imwrite(path, image, tile_size=(512, 512), compression=compression,
+                             npyramid_add=DEFAULT_PYRAMID_LEVELS)
+            duration = perf_counter() - start_time
+            duration_previous += duration
+            start_time = perf_counter()
+            imwrite(path, image, tile_size=(512, 512), compression=compression,
+                    npyramid_add=DEFAULT_PYRAMID_LEVELS)
+            new_duration = perf_counter() - start_time
+            duration_new += new_duration
+            print(f'{width}x{height}, compression {compression}: previous {duration * 1e3:.1f} ms, '
+                  f'new {new_duration * 1e3:.1f} ms')
+            np.testing.assert_array_equal(imread(path, render=False), image)
+        print(f'All store resolutions, compression {compression}: '
+              f'previous {duration_previous * 1e3:.1f} ms, new {duration_new * 1e3:.1f} ms')
+
+
+def test_compression_workers(monkeypatch):
+    monkeypatch.setattr(image_io, 'COMPRESSION_WORKERS', 4)
+    large = np.zeros((2048, 2048), dtype=np.uint8)
+    small = np.zeros((1024, 1024), dtype=np.uint8)
+    assert image_io.compression_workers(large, 'zlib') == 4
+    # Uncompressed and small images: no thread pool
+    assert image_io.compression_workers(large, None) == 1
+    assert image_io.compression_workers(small, 'zlib') == 1
+
+
+@pytest.mark.parametrize('codec', list(image_io.COMPRESSION_CODECS))
+@pytest.mark.parametrize('shape, dtype', [((700, 500), np.uint8), ((700, 500), np.uint16),
+                                          ((300, 400, 3), np.uint8)])
+def test_codec_round_trip(tmp_path, codec, shape, dtype):
+    if not image_io.codec_available(codec):
+        pytest.skip(f'{codec} not available in the installed imagecodecs')
+    rng = np.random.default_rng(0)
+    # Smooth image with noise (compressible)
+    image = (np.linspace(0, 0.5, shape[0] * shape[1]).reshape(shape[:2])
+             * np.iinfo(dtype).max).astype(dtype)
+    if len(shape) > 2:
+        image = np.repeat(image[..., np.newaxis], shape[2], axis=2)
+    image += rng.integers(0, 8, shape, dtype=dtype)
+    path = str(tmp_path / 'image.ome.tif')
+    imwrite(path, image, METADATA, tile_size=(256, 256), compression=codec,
+            npyramid_add=DEFAULT_PYRAMID_LEVELS)
+    # Lossless at all levels
+    np.testing.assert_array_equal(imread(path, render=False), image)
+    with tifffile.TiffFile(path) as tiff:
+        compression, _ = image_io.COMPRESSION_CODECS[codec]
+        expected = {None: 'NONE', 'lzw': 'LZW', 'zlib': 'ADOBE_DEFLATE',
+                    'zstd': 'ZSTD', 'jpegxl': 'JPEGXL'}[compression]
+        assert tiff.pages[0].compression.name == expected
+        levels = tiff.series[0].levels
+        assert len(levels) == DEFAULT_PYRAMID_LEVELS + 1
+        for level in levels[1:]:
+            assert level.keyframe.compression == tiff.pages[0].compression
+    assert imread_metadata(path)['rotation'] == METADATA['rotation']
+    # Striped (no tile size)
+    imwrite(path, image, compression=codec)
+    np.testing.assert_array_equal(imread(path, render=False), image)
+    # OME-Zarr
+    zarr_path = str(tmp_path / 'image.ome.zarr')
+    imwrite(zarr_path, image, compression=codec, npyramid_add=2)
+    np.testing.assert_array_equal(imread(zarr_path, render=False), image)
+    compressors = open_zarr_level(zarr_path).compressors
+    expected = {None: None, 'lzw': 'imagecodecs_lzw', 'zlib': 'zlib',
+                'zstd': 'zstd', 'jpegxl': 'imagecodecs_jpegxl'}[compression]
+    assert [c.codec_id for c in compressors] == ([expected] if expected else [])
+
+
+def test_compression_arguments():
+    assert image_io.tiff_compression(None) == (None, None)
+    assert image_io.tiff_compression('none') == (None, None)
+    assert image_io.tiff_compression('Deflate_9') == ('zlib', {'level': 9})
+    assert image_io.tiff_compression(('zstd', 5)) == ('zstd', {'level': 5})
+    assert image_io.tiff_compression('lzma') == ('lzma', None)
+    assert not image_io.codec_available('unknown')
+    # zlib is always available
+    available = image_io.available_codecs()
+    assert {'none', 'deflate_1', 'deflate_6', 'deflate_9'} <= set(available)
+    assert available == [codec for codec in image_io.COMPRESSION_CODECS
+                         if codec in available]
@@ -0,0 +1,206 @@
+import glob
+import os
+import signal
+import subprocess
+import sys
+import threading
+from time import perf_counter, sleep
+
+import numpy as np
+import pytest
+
+from image_io import imread, imwrite
+from ImageWriter import ImageWriter, remove_temp_files
+
+
+def make_image(index, shape=(256, 256)):
+    return np.random.default_rng(index).integers(
+        0, 255, shape, dtype=np.uint8)
+
+
+def test_write_and_wait(tmp_path):
+    writer = ImageWriter()
+    paths = [str(tmp_path / f'tile_{index}.tif') for index in range(10)]
+    futures = [writer.write(path, make_image(index))
+               for index, path in enumerate(paths)]
+    assert writer.wait(paths, timeout=30)
+    for index, (path, future) in enumerate(zip(paths, futures)):
+        assert future.result(timeout=0) == os.path.abspath(path)
+        assert np.array_equal(imread(path, render=False), make_image(index))
+    assert writer.files_written == 10
+    assert writer.backlog == 0
+    assert writer.future(paths[0]) is None
+    assert not glob.glob(str(tmp_path / '*.tmp.*'))
+    assert writer.close()
+    with pytest.raises(RuntimeError):
+        writer.write(paths[0], make_image(0))
+
+
+def test_replace_pending(tmp_path):
+    # No workers: the files stay pending
+    writer = ImageWriter(number_workers=0)
+    path = str(tmp_path / 'ov.tif')
+    first = writer.write(path, make_image(0))
+    second = writer.write(path, make_image(1))
+    assert writer.backlog == 1
+    assert writer.memory_in_use == make_image(1).nbytes
+    assert not writer.wait([path], timeout=0.1)
+    # Start a worker
+    worker = threading.Thread(target=writer.run, daemon=True)
+    worker.start()
+    writer.workers.append(worker)
+    assert writer.flush(timeout=30)
+    # Only the latest image is written, both futures are completed
+    assert first.result(timeout=0) == second.result(timeout=0)
+    assert np.array_equal(imread(path, render=False), make_image(1))
+    assert writer.files_written == 1
+    writer.close()
+
+
+def test_back_pressure(tmp_path):
+    image = make_image(0)
+    # Room for two images
+    writer = ImageWriter(memory_budget=2 * image.nbytes, number_workers=0)
+    writer.write(str(tmp_path / '0.tif'), image)
+    writer.write(str(tmp_path / '1.tif'), image)
+    blocked = threading.Event()
+    done = threading.Event()
+
+    def write_third():
+        blocked.set()
+        writer.write(str(tmp_path / '2.tif'), image)
+        done.set()
+
+    threading.Thread(target=write_third, daemon=True).start()
+    blocked.wait()
+    sleep(0.2)
+    assert not done.is_set()
+    worker = threading.Thread(target=writer.run, daemon=True)
+    worker.start()
+    writer.workers.append(worker)
+    assert done.wait(timeout=30)
+    assert writer.flush(timeout=30)
+    assert writer.memory_in_use == 0
+    assert writer.files_written == 3
+    writer.close()
+
+
+def test_when_written_and_errors(tmp_path):
+    writer = ImageWriter()
+    paths = [str(tmp_path / f'{index}.tif') for index in range(3)]
+    written = []
+    called = threading.Event()
+
+    def callback(file_list):
+        written.extend(file_list)
+        called.set()
+
+    for index, path in enumerate(paths):
+        writer.write(path, make_image(index))
+    writer.when_written(paths, callback)
+    assert called.wait(timeout=30)
+    assert written == paths
+    assert all(os.path.isfile(path) for path in paths)
+    # Nothing pending: called immediately
+    written.clear()
+    writer.when_written(paths, callback)
+    assert written == paths
+
+    # Parent directory cannot be created (a file with the same name exists)
+    with open(tmp_path / 'blocked', 'w'):
+        pass
+    failing = str(tmp_path / 'blocked' / 'tile.tif')
+    future = writer.write(failing, make_image(0))
+    with pytest.raises(Exception):
+        future.result(timeout=30)
+    assert 'blocked' in writer.last_error
+    # Raised for the failed file, the callback is called for the others
+    written.clear()
+    called.clear()
+    with pytest.raises(Exception):
+        writer.when_written([failing] + paths, callback)
+    assert written == paths
+    # The error is raised once
+    writer.when_written([failing], callback)
+    assert writer.flush(timeout=30)
+
+    # Raised on flush and close
+    future = writer.write(failing, make_image(0))
+    with pytest.raises(Exception):
+        writer.flush(timeout=30)
+    assert writer.flush(timeout=30)
+    writer.write(failing, make_image(0))
+    with pytest.raises(Exception):
+        writer.close()
+    assert not any(worker.is_alive() for worker in writer.workers)
+
+
+def test_remove_temp_files(tmp_path):
+    imwrite(str(tmp_path / 'tile.tmp.tif'), make_image(0))
+    imwrite(str(tmp_path / 'tile.tif'), make_image(0))
+    assert remove_temp_files(str(tmp_path)) == 1
+    assert os.listdir(str(tmp_path)) == ['tile.tif']
+
+
+KILL_SCRIPT = """
+import sys
+import numpy as np
+from ImageWriter import ImageWriter
+
+writer = ImageWriter(memory_budget=16 * 1024 ** 2)
+index = 0
+while True:
+    image = np.random.default_rng(index % 20).integers(
+        0, 255, (1024, 1024), dtype=np.uint8)
+    writer.write(f'{sys.argv[1]}/tile_{index % 20}.tif', image)
+    index += 1
+"""
+
+
+@pytest.mark.skipif(sys.platform == 'win32', reason='requires SIGKILL')
+def test_kill_during_writes(tmp_path):
+    repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=os.path.join(repo_dir, 'src'))
+    process = subprocess.Popen(
+        [sys.executable, '-c', KILL_SCRIPT, str(tmp_path)], env=env)
+    try:
+        start_time = perf_counter()
+        while (len(glob.glob(str(tmp_path / 'tile_*[0-9].tif'))) < 10
+               and perf_counter() - start_time < 60):
+            assert process.poll() is None
+            sleep(0.01)
+        # Files are overwritten in a loop, so the kill happens mid-write
+        sleep(0.3)
+    finally:
+        process.send_signal(signal.SIGKILL)
+        process.wait()
+    remove_temp_files(str(tmp_path))
+    assert not glob.glob(str(tmp_path / '*.tmp.*'))
+    paths = glob.glob(str(tmp_path / 'tile_*.tif'))
+    assert len(paths) >= 10
+    # Every file under its final name is complete
+    for path in paths:
+        index = int(os.path.basename(path)[5:-4])
+        expected = np.random.default_rng(index).integers(
+            0, 255, (1024, 1024), dtype=np.uint8)
+        assert np.array_equal(imread(path, render=False), expected)
+
+
+def test_write_behind_benchmark(tmp_path):
+    number_images = 20
+    images = [make_image(index, (1024, 1024)) for index in range(number_images)]
+    # Previous implementation: each image written on the acquisition thread
+    start_time = perf_counter()
+    for index, image in enumerate(images):
+        imwrite(str(tmp_path / f'previous_{index}.tif'), image)
+    duration_previous = perf_counter() - start_time
+    writer = ImageWriter()
+    start_time = perf_counter()
+    for index, image in enumerate(images):
+        writer.write(str(tmp_path / f'new_{index}.tif'), image)
+    duration_new = perf_counter() - start_time
+    assert writer.close()
+    print(f'Time on acquisition thread for {number_images} images: previous '
+          f'implementation {duration_previous * 1e3:.0f} ms, '
+          f'new {duration_new * 1e3:.0f} ms')
+    assert duration_new < duration_previous
@@ -0,0 +1,107 @@
+from multiprocessing import Pool
+from time import perf_counter
+
+import numpy as np
+import pytest
+from mapfost import mtfLib
+
+import autofocus_mapfost
+from autofocus_mapfost import (RunAutoFoc, est_aberr_proc,
+                               get_crop_refs_from_scan_size,
+                               process_ims_and_est_aberr)
+
+
+MAPFOST_PARAMS = {'num_aperture': 0.004, 'stig_rot_deg': 0,
+                  'stig_scale': [1., 1.], 'crop_size': [384, 384],
+                  'pix_size_um': 0.05}
+TEST_DEFOCUS = [-4, 4]
+
+
+def defocused_images(aberration, edge_len=768, seed=0):
+    """Pair of synthetic test images with the aberration [defocus, astig_x,
+    astig_y] (in µm) plus the test defoci."""
+    rng = np.random.default_rng(seed)
+    structure = rng.random((edge_len, edge_len))
+    spectrum = np.fft.fftshift(np.fft.fft2(structure))
+    kspace_xy = mtfLib.get_kspace_xy(edge_len, MAPFOST_PARAMS['pix_size_um'])
+    images = []
+    for test_defocus in TEST_DEFOCUS:
+        mtf = mtfLib.getMTF(kspace_xy, aberration[0] + test_defocus,
+                            aberration[1], aberration[2],
+                            MAPFOST_PARAMS['num_aperture'])
+        img = np.real(np.fft.ifft2(np.fft.ifftshift(spectrum * mtf)))
+        img = (img - img.mean()) / img.std() * 30 + 128
+        img += rng.normal(0, 2, img.shape)
+        images.append(np.clip(img, 0, 255).astype(np.uint8))
+    return images
+
+
+def previous_process_ims_and_est_aberr(aberr_perturbations, test_imarrs,
+                                       mapfost_params):
+    """Previous implementation: new pool for each call, images pickled for
+    each patch."""
+    result_procs = []
+
+    def proc_res(ret_val):
+        if ret_val[0] and ret_val[2].success:
+            result_procs.append([True, ret_val[2].x])
+
+    crop_refs = get_crop_refs_from_scan_size(test_imarrs[0].shape,
+                                             mapfost_params['crop_size'])
+    p = Pool(len(crop_refs))
+    _ = [p.apply_async(est_aberr_proc,
+                       args=[test_imarrs, aberr_perturbations,
+                             crop_refs[i][::-1], mapfost_params],
+                       callback=proc_res)
+         for i in range(len(crop_refs))]
+    p.close()
+    p.join()
+    if len(result_procs) > 0:
+        return np.mean(np.array(result_procs, dtype=object)[:, 1], axis=0)
+    return None
+
+
+@pytest.fixture
+def af():
+    af = RunAutoFoc(None, number_workers=4)
+    yield af
+    af.close()
+
+
+def test_aberrations_unchanged(af):
+    for seed, aberration in enumerate([[1.5, 0, 0], [-1, 0.8, -0.5]]):
+        images = defocused_images(aberration, seed=seed)
+        expected = previous_process_ims_and_est_aberr(
+            TEST_DEFOCUS, images, dict(MAPFOST_PARAMS))
+        # Same pool for all iterations/tiles
+        for _ in range(2):
+            estimated = process_ims_and_est_aberr(
+                TEST_DEFOCUS, images, dict(MAPFOST_PARAMS), af=af)
+            np.testing.assert_allclose(list(estimated), list(expected),
+                                       rtol=1e-9, atol=1e-9)
+    # Without runner (temporary pool)
+    estimated = process_ims_and_est_aberr(TEST_DEFOCUS, images,
+                                          dict(MAPFOST_PARAMS))
+    np.testing.assert_allclose(list(estimated), list(expected),
+                               rtol=1e-9, atol=1e-9)
+    assert af.pool is not None
+    af.close()
+    assert af.pool is None and af.shm is None
+
+
+def test_mapfost_benchmark(af):
+    images = defocused_images([1, 0.5, 0])
+    durations = {'previous': [], 'persistent pool': []}
+    for _ in range(3):
+        start_time = perf_counter()
+        previous_process_ims_and_est_aberr(TEST_DEFOCUS, images,
+                                           dict(MAPFOST_PARAMS))
+        durations['previous'].append(perf_counter() - start_time)
+        start_time = perf_counter()
+        af.estimate_aberrations(TEST_DEFOCUS, images, dict(MAPFOST_PARAMS))
+        durations['persistent pool'].append(perf_counter() - start_time)
+    for name, values in durations.items():
+        print(f'MAPFoSt iteration ({name}): first {values[0] * 1e3:.0f} ms, '
+              f'then {np.mean(values[1:]) * 1e3:.0f} ms')
+    # The pool is started once, later iterations do not pay for it
+    assert np.mean(durations['persistent pool'][1:]) < np.mean(durations['previous'][1:])
@@ -0,0 +1,231 @@
+import json
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import sleep, time
+
+import pytest
+
+from MetadataClient import BATCH_SUFFIX, MetadataClient
+from test_utils import init_log
+
+
+class MetadataServer(ThreadingHTTPServer):
+    """Stand-in for the metadata server that records the received requests.
+    latency: delay (in s) before each response; failures: number of
+    requests (from now on) to be answered with status 503;
+    batch_support: False if batch requests are answered with status 404."""
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), MetadataRequestHandler)
+        self.received = []
+        self.latency = 0
+        self.failures = 0
+        self.batch_support = True
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server_address[1]}'
+
+    def records(self, endpoint):
+        records = []
+        for method, path, data in self.received:
+            if path == endpoint:
+                records.append(data)
+            elif path == endpoint + BATCH_SUFFIX:
+                records.extend(data)
+        return records
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class MetadataRequestHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def respond(self, status, content=b''):
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def handle_request(self):
+        sleep(self.server.latency)
+        with self.server.lock:
+            if self.server.failures > 0:
+                self.server.failures -= 1
+                self.respond(503)
+                return
+        if self.path.endswith(BATCH_SUFFIX) and not self.server.batch_support:
+            self.respond(404)
+            return
+        length = int(self.headers.get('Content-Length', 0))
+        data = json.loads(self.rfile.read(length))
+        with self.server.lock:
+            self.server.received.append((self.command, self.path, data))
+        self.respond(200)
+
+    do_PUT = handle_request
+    do_POST = handle_request
+
+    def do_GET(self):
+        sleep(self.server.latency)
+        self.respond(200, json.dumps({'command': 'PAUSE'}).encode())
+
+
+TILE_ENDPOINT = '/project/test/stack/stack/tile/completed'
+SLICE_ENDPOINT = '/project/test/stack/stack/slice/completed'
+
+
+@pytest.fixture
+def server():
+    init_log()
+    server = MetadataServer()
+    yield server
+    server.stop()
+
+
+def queue_slice(client, slice_counter, number_tiles=20):
+    for tile_index in range(number_tiles):
+        client.queue('POST', TILE_ENDPOINT,
+                     {'tileid': f'0.{tile_index}.{slice_counter}'}, batch=True)
+    client.queue('PUT', SLICE_ENDPOINT, {'completed_slice': slice_counter})
+
+
+def test_batching_with_latency(server, tmp_path):
+    server.latency = 0.2
+    client = MetadataClient(server.url, str(tmp_path / 'outbox'), batch_interval=10)
+    start_time = time()
+    for slice_counter in range(3):
+        queue_slice(client, slice_counter)
+    # Queuing does not wait for the server
+    assert time() - start_time < 0.2 * 3
+    assert client.close(timeout=10)
+
+    tile_ids = [record['tileid'] for record in server.records(TILE_ENDPOINT)]
+    assert tile_ids == [f'0.{t}.{s}' for s in range(3) for t in range(20)]
+    # Tiles of each slice are sent in one request, before the slice is completed
+    assert ([path for _, path, _ in server.received]
+            == [TILE_ENDPOINT + BATCH_SUFFIX, SLICE_ENDPOINT] * 3)
+    assert client.requests_sent == 6
+    assert not os.listdir(tmp_path / 'outbox')
+
+
+def test_batching_not_supported(server, tmp_path):
+    server.batch_support = False
+    client = MetadataClient(server.url, str(tmp_path / 'outbox'), batch_interval=10)
+    queue_slice(client, 0, number_tiles=5)
+    assert client.close(timeout=10)
+    # The rejected batch is sent again as individual requests, nothing is dropped
+    assert not client.batch_supported
+    assert client.rejected_count == 0
+    assert ([path for _, path, _ in server.received]
+            == [TILE_ENDPOINT] * 5 + [SLICE_ENDPOINT])
+    assert not os.listdir(tmp_path / 'outbox')
+
+
+def test_batching_off_by_default(server, tmp_path):
+    client = MetadataClient(server.url, str(tmp_path / 'outbox'))
+    queue_slice(client, 0, number_tiles=3)
+    assert client.close(timeout=10)
+    # Single records are sent to the endpoint unchanged
+    assert ([path for _, path, _ in server.received]
+            == [TILE_ENDPOINT] * 3 + [SLICE_ENDPOINT])
+    assert isinstance(server.received[0][2], dict)
+
+
+def test_batch_interval(server, tmp_path):
+    client = MetadataClient(server.url, str(tmp_path / 'outbox'), batch_interval=0.3)
+    for tile_index in range(5):
+        client.queue('POST', TILE_ENDPOINT, {'tileid': f'0.{tile_index}.0'}, batch=True)
+    sleep(1)
+    # Sent after the batch interval, without flush
+    assert len(server.records(TILE_ENDPOINT)) == 5
+    assert len(server.received) == 1
+    client.close()
+
+
+def test_server_failures(server, tmp_path):
+    server.failures = 3
+    client = MetadataClient(server.url, str(tmp_path / 'outbox'), batch_interval=0,
+                            retry_interval=0.05)
+    queue_slice(client, 0, number_tiles=5)
+    assert client.close(timeout=10)
+    # All records received exactly once and in order despite failures
+    tile_ids = [record['tileid'] for record in server.records(TILE_ENDPOINT)]
+    assert tile_ids == [f'0.{t}.0' for t in range(5)]
+    assert len(server.records(SLICE_ENDPOINT)) == 1
+    assert client.last_error is None
+
+
+def test_outbox_written_outside_lock(server, tmp_path, monkeypatch):
+    client = MetadataClient(server.url, str(tmp_path / 'outbox'))
+    lock_free = []
+
+    def check_lock():
+        if client.condition.acquire(timeout=1):
+            client.condition.release()
+            lock_free.append(True)
+        else:
+            lock_free.append(False)
+
+    fsync = os.fsync
+
+    def checked_fsync(fd):
+        # Called while the record is written to the outbox
+        checker = threading.Thread(target=check_lock)
+        checker.start()
+        checker.join()
+        fsync(fd)
+
+    monkeypatch.setattr(os, 'fsync', checked_fsync)
+    queue_slice(client, 0, number_tiles=3)
+    monkeypatch.setattr(os, 'fsync', fsync)
+    assert lock_free == [True] * 4
+    assert client.close(timeout=10)
+    assert len(server.records(TILE_ENDPOINT)) == 3
+
+
+def test_outbox_replay(server, tmp_path):
+    outbox_dir = str(tmp_path / 'outbox')
+    # Server not reachable (port closed)
+    unreachable_url = server.url
+    server.stop()
+    client = MetadataClient(unreachable_url, outbox_dir, retry_interval=0.05)
+    queue_slice(client, 0)
+    assert not client.close(timeout=0.5)
+    assert client.last_error is not None
+    assert len(os.listdir(outbox_dir)) == 21
+
+    # Restart: records from the previous run are sent first
+    server2 = MetadataServer()
+    try:
+        client = MetadataClient(server2.url, outbox_dir)
+        assert client.pending_count == 21
+        queue_slice(client, 1)
+        assert client.close(timeout=10)
+        tile_ids = [record['tileid'] for record in server2.records(TILE_ENDPOINT)]
+        assert tile_ids == [f'0.{t}.{s}' for s in range(2) for t in range(20)]
+        assert [record['completed_slice']
+                for record in server2.records(SLICE_ENDPOINT)] == [0, 1]
+        assert not os.listdir(outbox_dir)
+    finally:
+        server2.stop()
+
+
+def test_poll_server_message(server, tmp_path):
+    server.latency = 0.2
+    client = MetadataClient(server.url, str(tmp_path / 'outbox'))
+    start_time = time()
+    client.poll('/project/test/stack/stack/signal/read')
+    assert client.pop_server_message() is None
+    assert time() - start_time < 0.1
+    sleep(0.5)
+    status, command, msg, exc_str = client.pop_server_message()
+    assert status == 200
+    assert command == 'PAUSE'
+    client.close()
@@ -0,0 +1,131 @@
+import os
+from time import sleep, time
+
+import numpy as np
+
+from MirrorQueue import MirrorQueue
+from test_utils import init_log
+
+
+class ThrottledMirrorQueue(MirrorQueue):
+    """Mirror queue writing to a slow 'mirror drive' (bytes_per_s)."""
+    def __init__(self, *args, bytes_per_s=2e6, corrupt_writes=0, **kwargs):
+        self.bytes_per_s = bytes_per_s
+        self.corrupt_writes = corrupt_writes
+        super().__init__(*args, **kwargs)
+
+    def write_chunk(self, file, chunk):
+        sleep(len(chunk) / self.bytes_per_s)
+        if self.corrupt_writes > 0:
+            self.corrupt_writes -= 1
+            chunk = bytes(len(chunk))
+        file.write(chunk)
+
+
+def create_files(base_dir, number_files, size=100000):
+    paths = []
+    for i in range(number_files):
+        path = os.path.join(base_dir, 'tiles', 'g0000', f't{i:04}.tif')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as file:
+            file.write(np.random.bytes(size))
+        paths.append(path)
+    return paths
+
+
+def assert_mirrored(paths, base_dir, mirror_dir):
+    for path in paths:
+        mirror_path = os.path.join(mirror_dir, os.path.relpath(path, base_dir))
+        with open(path, 'rb') as file, open(mirror_path, 'rb') as mirror_file:
+            assert file.read() == mirror_file.read()
+
+
+def test_mirror_queue(tmp_path):
+    init_log()
+    base_dir, mirror_dir = str(tmp_path / 'stack'), str(tmp_path / 'mirror')
+    journal = os.path.join(base_dir, 'meta', 'mirror_queue.txt')
+    paths = create_files(base_dir, 20)
+    queue = ThrottledMirrorQueue(base_dir, mirror_dir, journal, number_workers=4)
+    start_time = time()
+    for path in paths:
+        queue.add([path])
+    # Adding files does not wait for the copies (20 x 50 ms with 4 workers)
+    assert time() - start_time < 0.1
+    assert queue.backlog > 0
+    assert queue.wait_until_empty(timeout=10)
+    metrics = queue.metrics()
+    assert metrics['files_copied'] == 20
+    assert metrics['bytes_copied'] == 20 * 100000
+    assert metrics['bandwidth'] > 0
+    assert queue.close()
+    assert_mirrored(paths, base_dir, mirror_dir)
+    assert not [f for _, _, files in os.walk(mirror_dir) for f in files
+                if f.endswith('.part')]
+
+
+def test_mirror_queue_resume(tmp_path):
+    init_log()
+    base_dir, mirror_dir = str(tmp_path / 'stack'), str(tmp_path / 'mirror')
+    journal = os.path.join(base_dir, 'meta', 'mirror_queue.txt')
+    paths = create_files(base_dir, 10)
+    queue = ThrottledMirrorQueue(base_dir, mirror_dir, journal,
+                                 number_workers=1, bytes_per_s=1e6)
+    queue.add(paths)
+    # Stop before all files have been copied
+    assert not queue.close(timeout=0.2)
+    copied = queue.files_copied
+    assert 0 < copied < 10
+
+    # Restart: remaining files are copied, copied files are not copied again
+    queue = MirrorQueue(base_dir, mirror_dir, journal)
+    assert queue.close(timeout=10)
+    assert queue.files_copied == 10 - copied
+    assert_mirrored(paths, base_dir, mirror_dir)
+    queue = MirrorQueue(base_dir, mirror_dir, journal)
+    assert queue.backlog == 0
+    queue.close()
+
+
+def test_mirror_queue_verify(tmp_path):
+    init_log()
+    base_dir, mirror_dir = str(tmp_path / 'stack'), str(tmp_path / 'mirror')
+    journal = os.path.join(base_dir, 'meta', 'mirror_queue.txt')
+    paths = create_files(base_dir, 3)
+    queue = ThrottledMirrorQueue(base_dir, mirror_dir, journal, number_workers=1,
+                                 corrupt_writes=1, retry_interval=0.05)
+    queue.add(paths)
+    assert queue.close(timeout=10)
+    # The corrupted copy was detected and repeated
+    assert queue.last_error is None
+    assert_mirrored(paths, base_dir, mirror_dir)
+
+
+def test_mirror_queue_retry_backoff(tmp_path):
+    init_log()
+    base_dir, mirror_dir = str(tmp_path / 'stack'), str(tmp_path / 'mirror')
+    journal = os.path.join(base_dir, 'meta', 'mirror_queue.txt')
+    paths = create_files(base_dir, 4, size=1000)
+    attempts = []
+
+    class FailingMirrorQueue(MirrorQueue):
+        def copy_file(self, path, hasher):
+            if path == paths[0]:
+                attempts.append(time())
+                raise IOError('Mirror drive not available')
+            return super().copy_file(path, hasher)
+
+    queue = FailingMirrorQueue(base_dir, mirror_dir, journal, number_workers=2,
+                               retry_interval=1)
+    queue.add(paths[:1])
+    sleep(0.1)
+    # Adding files and other workers do not retry the failed copy early
+    for path in paths[1:]:
+        queue.add([path])
+        sleep(0.05)
+    assert queue.wait_until_empty(timeout=0.2) is False
+    assert len(attempts) == 1
+    assert_mirrored(paths[1:], base_dir, mirror_dir)
+    sleep(1)
+    assert len(attempts) == 2
+    assert not queue.close(timeout=0)
+    assert queue.last_error == 'Mirror drive not available'
@@ -0,0 +1,125 @@
+import sys
+import threading
+import numpy as np
+from time import perf_counter
+from qtpy.QtGui import QImage
+from qtpy.QtWidgets import QApplication
+
+from CoordinateSystem import CoordinateSystem
+from image_io import imread, imwrite
+from mosaic_io import MosaicWriter
+from StubOverview import StubOverview
+from test_utils import init_sem, init_read_configs
+
+
+TEST_CONFIG_FILE = 'mock.ini'
+TEST_SYSCONFIG_FILE = 'mock.cfg'
+
+app = QApplication.instance() or QApplication(sys.argv)   # Required for QPixmap
+
+
+def init_stub_ov(grid_size):
+    config, sysconfig = init_read_configs(TEST_CONFIG_FILE, TEST_SYSCONFIG_FILE)
+    sem = init_sem(TEST_CONFIG_FILE, TEST_SYSCONFIG_FILE)
+    cs = CoordinateSystem(config, sysconfig)
+    return StubOverview(cs, sem, [0, 0], grid_size, 32, 0, 372.0, 0, '')
+
+
+def tile_positions(stub_ovm):
+    number_cols = stub_ovm.size[1]
+    tile_width, tile_height = stub_ovm.tile_width_p(), stub_ovm.tile_height_p()
+    for tile_index in range(stub_ovm.number_tiles):
+        x = tile_index % number_cols
+        y = tile_index // number_cols
+        yield x * (tile_width - stub_ovm.overlap), y * (tile_height - stub_ovm.overlap)
+
+
+def qpixmap_to_array(pixmap):
+    qimage = pixmap.toImage().convertToFormat(QImage.Format_Grayscale8)
+    ptr = qimage.constBits()
+    ptr.setsize(qimage.sizeInBytes())
+    return np.array(ptr).reshape(qimage.height(), qimage.bytesPerLine())[:, :qimage.width()]
+
+
+def test_mosaic_levels(tmp_path):
+    shape = (1000, 1500)
+    mosaic = MosaicWriter(shape)
+    for _ in range(20):
+        tile = np.random.randint(0, 255, size=(300, 400), dtype=np.uint8)
+        x, y = np.random.randint(-50, 1400), np.random.randint(-50, 900)
+        mosaic.paste(tile[max(-y, 0):, max(-x, 0):], max(x, 0), max(y, 0))
+    # Incrementally updated levels are identical to levels computed at once
+    reference = MosaicWriter(shape)
+    assert reference.paste(mosaic.image, 0, 0) == (0, 0, 1500, 1000)
+    for level, reference_level in zip(mosaic.levels, reference.levels):
+        np.testing.assert_array_equal(level, reference_level)
+    assert [level.shape for level in mosaic.levels] == [
+        (1000, 1500), (500, 750), (250, 375), (125, 188), (63, 94)]
+
+    path = str(tmp_path / 'mosaic.ome.tif')
+    mosaic.write(path, metadata={'pixel_size': [0.372] * 2})
+    np.testing.assert_array_equal(imread(path, render=False), mosaic.image)
+    # The levels kept up to date in the mosaic are written as they are
+    for level in range(1, len(mosaic.levels)):
+        np.testing.assert_array_equal(imread(path, level=level, render=False),
+                                      mosaic.levels[level])
+    # Compressed stub overview
+    compressed_path = str(tmp_path / 'mosaic_deflate.ome.tif')
+    mosaic.write(compressed_path, compression='deflate_6')
+    np.testing.assert_array_equal(imread(compressed_path, level=2, render=False),
+                                  mosaic.levels[2])
+
+
+def test_stub_ov_preview_update():
+    stub_ovm = init_stub_ov([3, 3])
+    mosaic = MosaicWriter((stub_ovm.height_p(), stub_ovm.width_p()))
+    stub_ovm.show_mosaic(mosaic)
+
+    def acquire():
+        for x, y in tile_positions(stub_ovm):
+            tile = np.random.randint(0, 255, size=(stub_ovm.tile_height_p(), stub_ovm.tile_width_p()),
+                                     dtype=np.uint8)
+            stub_ovm.update_mosaic_region(mosaic, mosaic.paste(tile, x, y))
+
+    # The preview is updated in the acquisition thread (QImages only), while
+    # the Viewport converts it to QPixmaps in the GUI thread
+    thread = threading.Thread(target=acquire)
+    thread.start()
+    while thread.is_alive():
+        stub_ovm.image(1)
+    thread.join()
+    # Only updating the dirty regions gives the same preview as reloading all
+    for level, mag in enumerate([1, 2, 4, 8, 16]):
+        np.testing.assert_array_equal(qpixmap_to_array(stub_ovm.image(mag)),
+                                      mosaic.levels[level])
+
+
+def test_stub_ov_benchmark(tmp_path):
+    """Compare the time per tile for updating the stub OV preview with the
+    MosaicWriter and with rewriting and reloading the full image (previous
+    implementation), using SEM_Mock tiles for grids up to 10x10 tiles."""
+    sem = init_sem(TEST_CONFIG_FILE, TEST_SYSCONFIG_FILE)
+    sem.set_frame_size(0)
+    _, tile = sem.acquire_frame(str(tmp_path / 'tile.ome.tif'), return_image=True)
+    durations = {}
+    for grid_size in ([2, 2], [5, 5], [10, 10]):
+        stub_ovm = init_stub_ov(grid_size)
+        mosaic = MosaicWriter((stub_ovm.height_p(), stub_ovm.width_p()))
+        stub_ovm.show_mosaic(mosaic)
+        start_time = perf_counter()
+        for x, y in tile_positions(stub_ovm):
+            stub_ovm.update_mosaic_region(mosaic, mosaic.paste(tile, x, y))
+        duration = (perf_counter() - start_time) / stub_ovm.number_tiles
+
+        # Previous implementation: write and reload full image for one tile
+        temp_save_path = str(tmp_path / 'temp_stub_ov.tif')
+        start_time = perf_counter()
+        imwrite(temp_save_path, mosaic.image, npyramid_add=4)
+        stub_ovm.vp_file_path = temp_save_path
+        full_duration = perf_counter() - start_time
+        durations[grid_size[0]] = duration
+        print(f'{grid_size[0]}x{grid_size[1]} tiles: '
+              f'incremental {duration * 1e3:.1f} ms per tile, '
+              f'full rewrite {full_duration * 1e3:.1f} ms per tile')
+    # Time per tile does not depend on the number of tiles (linear scaling)
+    assert durations[10] < 3 * durations[2]
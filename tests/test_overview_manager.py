@@ -15,7 +15,7 @@ import pytest
 
 # QApplication needed because QPixmap is used in Overview.py
 from qtpy.QtWidgets import QApplication
-app = QApplication(sys.argv)
+app = QApplication.instance() or QApplication(sys.argv)
 
 # Use the default configuration for all tests
 from test_load_config import config, sysconfig
@@ -0,0 +1,223 @@
+import os
+import shutil
+import sys
+import threading
+from configparser import ConfigParser
+from time import perf_counter
+
+import numpy as np
+import psutil
+from qtpy.QtWidgets import QApplication
+
+import constants
+import utils
+from CoordinateSystem import CoordinateSystem
+from GridManager import GridManager
+from image_io import imread, imwrite
+from PreviewManager import PreviewManager
+from sem.SEM import SEM
+from test_load_config import config, sysconfig
+
+
+app = QApplication.instance() or QApplication(sys.argv)   # Required for QImage
+
+# The previous implementation keeps every preview in memory (about 0.8 MB
+# per tile), so the project is limited to 4000 tiles
+NUMBER_GRIDS, GRID_SIZE = 10, (20, 20)
+
+
+def preview_file(path, shape=(384, 512), seed=0):
+    rng = np.random.default_rng(seed)
+    imwrite(path, rng.integers(0, 256, shape, dtype=np.uint8))
+
+
+def default_tiles(number_tiles):
+    cs = CoordinateSystem(config, sysconfig)
+    return list(GridManager(config, SEM(config, sysconfig), cs)[0])[:number_tiles]
+
+
+def create_project(base_dir, number_grids=NUMBER_GRIDS):
+    """Create a configuration with number_grids grids of 400 active tiles,
+    a preview and an (empty) tile file for each tile."""
+    cfg = ConfigParser()
+    cfg.read_dict(config)
+    cfg['acq']['base_dir'] = base_dir
+    cfg['acq']['slice_counter'] = '0'
+    cs = CoordinateSystem(cfg, sysconfig)
+    sem = SEM(cfg, sysconfig)
+    gm = GridManager(cfg, sem, cs)
+    gm[0].size = list(GRID_SIZE)
+    for _ in range(number_grids - 1):
+        gm.add_new_grid(size=list(GRID_SIZE))
+    stack_name = os.path.basename(base_dir)
+    source_preview = os.path.join(base_dir, 'preview' + constants.GRIDTILE_IMAGE_FORMAT)
+    os.makedirs(os.path.join(base_dir, 'workspace'), exist_ok=True)
+    preview_file(source_preview)
+    for grid_index in range(number_grids):
+        gm[grid_index].activate_all_tiles()
+        for tile_index in range(gm[grid_index].number_tiles):
+            shutil.copyfile(source_preview, utils.tile_preview_save_path(
+                base_dir, grid_index, tile_index=tile_index))
+            tile_path = os.path.join(base_dir, utils.tile_relative_save_path(
+                stack_name, grid_index, tile_index=tile_index, slice_index=0))
+            os.makedirs(os.path.dirname(tile_path), exist_ok=True)
+            open(tile_path, 'wb').close()
+    gm.save_to_cfg()
+    return cfg, cs, sem
+
+
+# Previous implementation (all previews loaded when the project is opened)
+
+def previous_load_previews(gm):
+    base_dir = gm.cfg['acq']['base_dir']
+    for grid_index in range(gm.number_grids):
+        grid = gm[grid_index]
+        for tile_index in grid.active_tiles:
+            preview_path = utils.tile_preview_save_path(
+                base_dir, grid_index, grid.array_index, grid.roi_index, tile_index)
+            if os.path.isfile(preview_path):
+                grid[tile_index].preview_img = utils.image_to_QPixmap(imread(preview_path))
+
+
+class PeakRSS:
+    """Sample the resident set size in a background thread."""
+    def __init__(self):
+        self.process = psutil.Process()
+        self.start = self.peak = self.process.memory_info().rss
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while self.running:
+            self.peak = max(self.peak, self.process.memory_info().rss)
+            threading.Event().wait(0.005)
+
+    def stop(self):
+        self.running = False
+        self.thread.join()
+        self.peak = max(self.peak, self.process.memory_info().rss)
+        return (self.peak - self.start) / 1024 ** 2
+
+
+def test_previews_loaded_on_request(tmp_path):
+    paths = [str(tmp_path / f'preview{i}.tif') for i in range(6)]
+    for i, path in enumerate(paths):
+        preview_file(path, shape=(64, 64), seed=i)
+    tiles = default_tiles(6)
+    loaded = []
+    # Budget for 4 previews
+    previews = PreviewManager(max_bytes=4 * 64 * 64, on_loaded=lambda: loaded.append(1))
+    for tile, path in zip(tiles, paths):
+        previews.register(tile, path)
+    assert all(tile.preview_img is None for tile in tiles)
+    previews.request(tiles[:3], tiles[:3])
+    assert previews.wait_until_loaded(timeout=10)
+    assert loaded
+    assert (tiles[1].preview_img.width(), tiles[1].preview_img.height()) == (64, 64)
+    assert previews.number_loaded == 3
+    # Tiles 0-2 scrolled out of view: least recently used previews are evicted
+    previews.request(tiles[3:], tiles[3:])
+    assert previews.wait_until_loaded(timeout=10)
+    assert previews.nbytes <= previews.max_bytes
+    assert all(tile.preview_img is not None for tile in tiles[3:])
+    assert sum(tile.preview_img is None for tile in tiles[:3]) == 2
+    # Clearing the preview releases it
+    previews.register(tiles[4], '')
+    assert tiles[4].preview_img is None and tiles[4] not in previews.loaded
+    previews.close()
+
+
+def test_unsaved_previews_saved_on_eviction(tmp_path):
+    tiles = default_tiles(3)
+    previews = PreviewManager(max_bytes=2 * 64 * 64)
+    new_paths = [str(tmp_path / f'new{i}.png') for i in range(3)]
+    for i, (tile, path) in enumerate(zip(tiles, new_paths)):
+        image = np.full((64, 64), 50 * i, dtype=np.uint8)
+        previews.set_preview(tile, utils.image_to_QImage(image), path)
+    # Preview of tile 0 was released from memory and saved by the loader
+    assert tiles[0].preview_img is None
+    assert previews.wait_until_loaded(timeout=10)
+    assert os.path.isfile(new_paths[0]) and not os.path.isfile(new_paths[1])
+    assert tiles[0].preview_src == new_paths[0]
+    assert [path for path, _ in previews.take_unsaved()] == new_paths[1:]
+    assert not previews.unsaved
+    # Reloaded from the saved file
+    previews.request(tiles[:1], tiles[:1])
+    assert previews.wait_until_loaded(timeout=10)
+    assert tiles[0].preview_img is not None
+    previews.close()
+
+
+def test_released_previews_saved_outside_lock(tmp_path):
+    tiles = default_tiles(2)
+    previews = PreviewManager(max_bytes=64 * 64)
+    saving = threading.Event()
+    proceed = threading.Event()
+    released = []
+
+    class SlowImage:
+        """QImage stand-in whose save() blocks until released."""
+        def __init__(self, image):
+            self.image = image
+
+        def height(self):
+            return self.image.height()
+
+        def bytesPerLine(self):
+            return self.image.bytesPerLine()
+
+        def save(self, path):
+            saving.set()
+            assert proceed.wait(timeout=10)
+            released.append(path)
+            return self.image.save(path)
+
+    image = utils.image_to_QImage(np.zeros((64, 64), dtype=np.uint8))
+    path = str(tmp_path / 'slow.png')
+    previews.set_preview(tiles[0], SlowImage(image), path)
+    # Evicts tile 0, which is saved by the loader thread
+    previews.set_preview(tiles[1], image, str(tmp_path / 'new.png'))
+    assert saving.wait(timeout=10)
+    # The lock is free while the preview is saved
+    previews.request(tiles[1:], [])
+    assert previews.take_unsaved()[0][0] == str(tmp_path / 'new.png')
+    proceed.set()
+    assert previews.wait_until_loaded(timeout=10)
+    assert released == [path] and os.path.isfile(path)
+    previews.close()
+
+
+def test_preview_startup_benchmark(tmp_path):
+    cfg, cs, sem = create_project(str(tmp_path / 'stack'))
+    number_tiles = NUMBER_GRIDS * GRID_SIZE[0] * GRID_SIZE[1]
+
+    rss = PeakRSS()
+    start_time = perf_counter()
+    gm = GridManager(cfg, sem, cs)
+    duration_new = perf_counter() - start_time
+    rss_new = rss.stop()
+    registered = sum(bool(tile.preview_src)
+                     for grid_index in range(gm.number_grids) for tile in gm[grid_index])
+    assert registered == number_tiles
+    # Viewport showing one grid: only its previews are loaded
+    visible = list(gm[0])
+    gm.previews.request(visible, visible)
+    assert gm.previews.wait_until_loaded(timeout=60)
+    assert gm.previews.number_loaded == len(visible)
+    gm.previews.close()
+    del gm, visible
+
+    rss = PeakRSS()
+    start_time = perf_counter()
+    gm = GridManager(cfg, sem, cs)
+    previous_load_previews(gm)
+    duration_previous = perf_counter() - start_time
+    rss_previous = rss.stop()
+
+    print(f'{NUMBER_GRIDS} grids x {GRID_SIZE[0] * GRID_SIZE[1]} tiles: '
+          f'previous implementation {duration_previous:.2f} s, '
+          f'peak RSS +{rss_previous:.0f} MB; '
+          f'lazy previews {duration_new:.2f} s, peak RSS +{rss_new:.0f} MB')
+    assert duration_new < duration_previous
+    assert rss_new < rss_previous
@@ -0,0 +1,55 @@
+import os
+import numpy as np
+
+from image_io import imwrite
+from reslice_io import append_reslice, read_reslice, reslice_shape, HEADER_SIZE
+import utils
+
+
+def test_append_read(tmp_path):
+    path = str(tmp_path / 'r_g0000_t0000.reslice')
+    assert read_reslice(path) is None
+    lines = np.random.randint(0, 255, size=(20, 400), dtype=np.uint8)
+    for line in lines:
+        append_reslice(path, line[np.newaxis, :])
+        # Only the new line is added to the file
+        assert os.path.getsize(path) == HEADER_SIZE + reslice_shape(path)[0] * 400
+    assert reslice_shape(path) == (20, 400)
+    np.testing.assert_array_equal(read_reslice(path), lines)
+    np.testing.assert_array_equal(read_reslice(path, 5), lines[-5:])
+    np.testing.assert_array_equal(read_reslice(path, 500), lines)
+
+
+def test_bit_depth_change(tmp_path):
+    path = str(tmp_path / 'r_ov000.reslice')
+    append_reslice(path, np.full((1, 400), 200, dtype=np.uint8))
+    append_reslice(path, np.full((1, 400), 1000, dtype=np.uint16))
+    append_reslice(path, np.full((1, 400), 100, dtype=np.uint8))
+    reslice = read_reslice(path)
+    assert reslice.dtype == np.uint16
+    np.testing.assert_array_equal(reslice[:, 0], [200, 1000, 100])
+
+
+def test_migrate_legacy_reslice(tmp_path):
+    path = utils.tile_reslice_save_path(str(tmp_path), 0, tile_index=3)
+    os.makedirs(os.path.dirname(path))
+    legacy_path = path[:-len('.reslice')] + '.ome.tif'
+    legacy_img = np.random.randint(0, 255, size=(30, 400), dtype=np.uint8)
+    imwrite(legacy_path, legacy_img)
+
+    np.testing.assert_array_equal(read_reslice(path, 10), legacy_img[-10:])
+    new_line = np.zeros((1, 400), dtype=np.uint8)
+    append_reslice(path, new_line)
+    np.testing.assert_array_equal(read_reslice(path),
+                                  np.concatenate((legacy_img, new_line)))
+
+
+def test_incomplete_append(tmp_path):
+    path = str(tmp_path / 'r_ov000.reslice')
+    append_reslice(path, np.ones((2, 400), dtype=np.uint8))
+    # Row written without updating the header (interrupted append)
+    with open(path, 'ab') as file:
+        file.write(np.full(400, 9, dtype=np.uint8).tobytes())
+    assert reslice_shape(path) == (2, 400)
+    append_reslice(path, np.full((1, 400), 5, dtype=np.uint8))
+    np.testing.assert_array_equal(read_reslice(path)[:, 0], [1, 1, 5])
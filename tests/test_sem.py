@@ -3,10 +3,12 @@
 
 import numpy as np
 import pytest
+from time import perf_counter
 
 from image_io import *
+from ImageInspector import ImageInspector
 from Stage import Stage
-from test_utils import init_sem
+from test_utils import init_sem, init_read_configs
 
 
 class TestSem:
@@ -92,6 +94,55 @@ class TestSem:
         else:
             pytest.fail('Acquisition failed')
 
+    def test_acq_return_image(self, sem, tmp_path):
+        output_filename = str(tmp_path / 'test.ome.tif')
+        success, image = sem.acquire_frame(output_filename, return_image=True)
+        assert success
+        assert isinstance(image, np.ndarray)
+        np.testing.assert_array_equal(image, imread(output_filename))
+
+    def test_acq_return_image_benchmark(self, sem, tmp_path):
+        """Compare the inspection of frames read back from disk with frames
+        kept in memory, for each store resolution."""
+        config, _ = init_read_configs(self.TEST_CONFIG_FILE, self.TEST_SYSCONFIG_FILE)
+        img_inspector = ImageInspector(config, None, None)
+        frame_size_selector = sem.get_frame_size_selector()
+        for selector, store_res in enumerate(sem.STORE_RES):
+            sem.set_frame_size(selector)
+            output_filename = str(tmp_path / f'test{selector}.ome.tif')
+            _, image = sem.acquire_frame(output_filename, return_image=True)
+
+            start_time = perf_counter()
+            disk_result = img_inspector.load_and_inspect(output_filename)
+            disk_duration = perf_counter() - start_time
+            start_time = perf_counter()
+            memory_result = img_inspector.load_and_inspect(output_filename, image)
+            memory_duration = perf_counter() - start_time
+
+            np.testing.assert_array_equal(memory_result[0], disk_result[0])
+            assert memory_result[1:] == disk_result[1:]
+            print(f'{store_res[0]}x{store_res[1]}: '
+                  f'from disk {disk_duration * 1e3:.1f} ms, '
+                  f'in memory {memory_duration * 1e3:.1f} ms, '
+                  f'saved {(disk_duration - memory_duration) * 1e3:.1f} ms per tile')
+        sem.set_frame_size(frame_size_selector)
+
+    def test_inspect_16bit_in_memory(self, sem, tmp_path):
+        """16-bit frames inspected in memory give the same (8-bit) results
+        as frames read back from disk."""
+        config, _ = init_read_configs(self.TEST_CONFIG_FILE, self.TEST_SYSCONFIG_FILE)
+        img_inspector = ImageInspector(config, None, None)
+        sem.set_bit_depth(1)
+        output_filename = str(tmp_path / 'test16.ome.tif')
+        _, image = sem.acquire_frame(output_filename, return_image=True)
+        assert image.dtype == np.uint16
+        disk_result = img_inspector.load_and_inspect(output_filename)
+        memory_result = img_inspector.load_and_inspect(output_filename, image)
+        assert memory_result[0].dtype == np.uint8
+        np.testing.assert_array_equal(memory_result[0], disk_result[0])
+        assert memory_result[1:] == disk_result[1:]
+        assert memory_result[1] < 256
+
 
 if __name__ == '__main__':
     from pathlib import Path
@@ -105,3 +156,5 @@ if __name__ == '__main__':
     test.test_beam(test_sem)
     test.test_acq_settings(test_sem)
     test.test_acq(test_sem, temp_path)
+    test.test_acq_return_image(test_sem, temp_path)
+    test.test_acq_return_image_benchmark(test_sem, temp_path)
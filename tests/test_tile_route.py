@@ -0,0 +1,117 @@
+from functools import partial
+from time import perf_counter
+
+import numpy as np
+import pytest
+
+from tile_route import move_durations, plan_route, route_duration
+
+
+# Stage model: X motor faster than Y motor, 0.5 s wait interval after each move
+duration_function = partial(move_durations, motor_speed_x=60, motor_speed_y=40,
+                            wait_interval=0.5)
+
+
+def synthetic_grid(rows, cols, origin, tile_size=40, active_fraction=1.0,
+                   rng=None):
+    """Return the active tiles in snake order and the stage positions of all
+    tiles for a grid of rows x cols tiles."""
+    active = np.ones(rows * cols, dtype=bool)
+    if rng is not None:
+        active = rng.random(rows * cols) < active_fraction
+    tiles = []
+    for row in range(rows):
+        cols_in_row = range(cols) if row % 2 == 0 else range(cols - 1, -1, -1)
+        tiles.extend(row * cols + col for col in cols_in_row
+                     if active[row * cols + col])
+    sx_sy = np.array([[origin[0] + (t % cols) * tile_size,
+                       origin[1] + (t // cols) * tile_size]
+                      for t in range(rows * cols)], dtype=float)
+    return tiles, sx_sy
+
+
+def assert_valid_route(route, grids):
+    assert [key for key, _ in route] != []
+    assert sorted(key for key, _ in route) == sorted(key for key, *_ in grids)
+    tiles_by_key = {key: tiles for key, tiles, *_ in grids}
+    for key, tiles in route:
+        # No tile dropped or duplicated
+        assert len(tiles) == len(set(tiles))
+        assert sorted(tiles) == sorted(tiles_by_key[key])
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_route_never_worse_than_snake(seed):
+    rng = np.random.default_rng(seed)
+    grids = []
+    for grid_index in range(3):
+        rows, cols = rng.integers(2, 12, size=2)
+        origin = rng.uniform(-1000, 1000, size=2)
+        tiles, sx_sy = synthetic_grid(rows, cols, origin, active_fraction=0.6,
+                                      rng=rng)
+        grids.append((grid_index, tiles, sx_sy[tiles], []))
+    start_sx_sy = (0, 0)
+    route, duration, snake_duration = plan_route(
+        grids, start_sx_sy, duration_function, time_budget=0.5)
+    assert_valid_route(route, grids)
+    assert duration <= snake_duration + 1e-9
+
+    # Returned durations correspond to the stage model
+    positions = {key: sx_sy for key, tiles, sx_sy, _ in grids}
+    snake_positions = [(key, sx_sy) for key, _, sx_sy, _ in grids]
+    assert snake_duration == pytest.approx(
+        route_duration(start_sx_sy, snake_positions, duration_function))
+    route_positions = []
+    for key, tiles in route:
+        grid_tiles = grids[key][1]
+        route_positions.append(
+            (key, positions[key][[grid_tiles.index(t) for t in tiles]]))
+    assert duration == pytest.approx(
+        route_duration(start_sx_sy, route_positions, duration_function))
+
+
+def test_sparse_grid_saving():
+    # Checkerboard pattern of active tiles: snake pattern makes long diagonal
+    # moves; an optimised route is clearly faster.
+    tiles, sx_sy = synthetic_grid(10, 10, (0, 0))
+    tiles = [t for t in tiles if (t // 10 + t % 10) % 2 == 0 or t % 10 > 7]
+    grids = [(0, tiles, sx_sy[tiles], [])]
+    route, duration, snake_duration = plan_route(
+        grids, (0, 0), duration_function, time_budget=1)
+    assert_valid_route(route, grids)
+    assert duration < snake_duration
+
+
+def test_grid_order_and_precedence():
+    # Grid 0 far away from the start, grid 1 close: grid 1 is visited first
+    tiles_0, sx_sy_0 = synthetic_grid(4, 4, (2000, 2000))
+    tiles_1, sx_sy_1 = synthetic_grid(4, 4, (0, 0))
+    first_tiles = [15, 5]   # for example autofocus reference tiles
+    grids = [(0, tiles_0, sx_sy_0[tiles_0], first_tiles),
+             (1, tiles_1, sx_sy_1[tiles_1], [])]
+    route, duration, snake_duration = plan_route(
+        grids, (0, 0), duration_function, time_budget=0.5)
+    assert_valid_route(route, grids)
+    assert [key for key, _ in route] == [1, 0]
+    assert sorted(route[1][1][:2]) == sorted(first_tiles)
+    assert duration < snake_duration
+
+    # Fixed grid order
+    route, _, _ = plan_route(grids, (0, 0), duration_function,
+                             time_budget=0.5, keep_grid_order=True)
+    assert [key for key, _ in route] == [0, 1]
+
+
+def test_time_budget():
+    tiles, sx_sy = synthetic_grid(40, 40, (0, 0), active_fraction=0.5,
+                                  rng=np.random.default_rng(0))
+    grids = [(0, tiles, sx_sy[tiles], [])]
+    start_time = perf_counter()
+    route, duration, snake_duration = plan_route(
+        grids, (0, 0), duration_function, time_budget=0.3)
+    # Optimisation stops after the time budget (plus one improvement step)
+    assert perf_counter() - start_time < 1.5
+    assert_valid_route(route, grids)
+    assert duration <= snake_duration
+    print(f'{len(tiles)} tiles: stage moves {duration:.0f} s '
+          f'(snake pattern: {snake_duration:.0f} s)')
@@ -0,0 +1,168 @@
+import csv
+import glob
+import os
+import sys
+import threading
+from time import perf_counter, sleep
+
+import pytest
+from qtpy.QtWidgets import QApplication
+
+import acq_benchmark
+from Tracer import CSV_HEADER, UNTRACED, Tracer
+
+
+app = QApplication.instance() or QApplication(sys.argv)   # Required for QPixmap
+
+
+def read_trace(file_name):
+    with open(file_name) as file:
+        assert file.readline() == CSV_HEADER
+        file.seek(0)
+        return list(csv.DictReader(file))
+
+
+def test_span_overhead():
+    tracer = Tracer()
+    number_spans = 100000
+    start_time = perf_counter()
+    for _ in range(number_spans):
+        pass
+    duration_loop = perf_counter() - start_time
+    start_time = perf_counter()
+    for _ in range(number_spans):
+        with tracer.span('grab'):
+            pass
+    duration_spans = perf_counter() - start_time
+    overhead = (duration_spans - duration_loop) / number_spans
+    print(f'Span overhead: {overhead * 1e6:.2f} µs')
+    assert len(tracer.buffer) == number_spans
+    assert overhead < 50e-6
+    # Flushing is done once per slice and must not be slower per span
+    start_time = perf_counter()
+    tracer.flush(0)
+    flush_duration = (perf_counter() - start_time) / number_spans
+    print(f'Flush: {flush_duration * 1e6:.2f} µs per span')
+    assert flush_duration < 50e-6
+
+
+def test_trace_file(tmp_path):
+    tracer = Tracer()
+    file_name = str(tmp_path / 'trace.csv')
+    tracer.open(file_name)
+    with tracer.span('stage_move') as span:
+        sleep(0.01)
+    assert span.duration >= 0.01
+    # Spans recorded in a worker thread
+    def inspect():
+        with tracer.span('inspect'):
+            pass
+    worker = threading.Thread(target=inspect)
+    worker.start()
+    worker.join()
+    with pytest.raises(RuntimeError):
+        with tracer.span('grab'):
+            raise RuntimeError
+    assert tracer.flush(0) == (True, '')
+    with tracer.span('cut'):
+        pass
+    assert tracer.flush(1) == (True, '')
+    tracer.close()
+
+    rows = read_trace(file_name)
+    assert [(row['slice'], row['phase'], row['thread']) for row in rows] == [
+        ('0', 'stage_move', '0'), ('0', 'inspect', '1'), ('0', 'grab', '0'),
+        ('1', 'cut', '0')]
+    assert float(rows[0]['duration_s']) >= 0.01
+    starts = [float(row['start_s']) for row in rows]
+    assert starts == sorted(starts)
+    assert not tracer.buffer
+
+
+def test_summary_and_idle_sources():
+    # Buffer for at most 3 slices
+    tracer = Tracer(summary_slices=3)
+    tracer.open(os.devnull)
+    for slice_counter in range(5):
+        for _ in range(10):
+            with tracer.span('stage_move'):
+                sleep(0.002)
+            with tracer.span('grab'):
+                sleep(0.005)
+        with tracer.span('cut'):
+            sleep(0.06)
+        # Not traced
+        sleep(0.02)
+        tracer.flush(slice_counter)
+    tracer.close()
+
+    assert len(tracer.slice_durations()) == 3
+    summary = tracer.summary()
+    assert set(summary) == {'stage_move', 'grab', 'cut'}
+    assert summary['grab']['count'] == 30
+    assert summary['cut']['count'] == 3
+    grab = summary['grab']
+    assert 0.005 <= grab['p50'] <= grab['p90'] <= grab['p99'] <= grab['max']
+    assert summary['grab']['per_slice'] == pytest.approx(
+        10 * summary['grab']['mean'])
+
+    idle_sources = tracer.idle_sources()
+    phases = [phase for phase, _, _ in idle_sources]
+    # The scanning phase is not idle time
+    assert 'grab' not in phases
+    assert set(phases) == {'stage_move', 'cut', UNTRACED}
+    assert phases[0] == 'cut'
+    per_slice = dict((phase, value) for phase, value, _ in idle_sources)
+    assert per_slice['cut'] >= 0.06
+    assert per_slice[UNTRACED] >= 0.02
+    fractions = [fraction for _, _, fraction in idle_sources]
+    assert 0 < sum(fractions) < 1
+    assert tracer.idle_sources(number_sources=1) == idle_sources[:1]
+
+
+def test_nested_spans(tmp_path):
+    tracer = Tracer()
+    file_name = str(tmp_path / 'trace.csv')
+    tracer.open(file_name)
+    tracer.start_slice()
+    with tracer.span('inspect'):
+        sleep(0.02)
+        with tracer.span('save'):
+            sleep(0.05)
+    with tracer.span('grab'):
+        sleep(0.02)
+    tracer.flush(0)
+    tracer.close()
+
+    rows = read_trace(file_name)
+    assert [(row['phase'], row['parent']) for row in rows] == [
+        ('save', 'inspect'), ('inspect', ''), ('grab', '')]
+    # The time of the nested span is counted once
+    summary = tracer.summary()
+    assert summary['save']['per_slice'] >= 0.05
+    assert 0.02 <= summary['inspect']['per_slice'] < 0.05
+    (_, duration, totals), = tracer.slice_totals()
+    assert sum(totals.values()) <= duration
+    per_slice = dict((phase, value)
+                     for phase, value, _ in tracer.idle_sources())
+    assert per_slice['inspect'] < 0.05
+    assert per_slice[UNTRACED] < 0.02
+
+
+def test_acquisition_trace(tmp_path):
+    report = acq_benchmark.run_benchmark(
+        str(tmp_path), number_slices=2, number_grids=1, grid_size=(2, 2))
+    assert report['completed']
+    trace_files = glob.glob(
+        os.path.join(str(tmp_path), 'stack', 'meta', 'stats', 'trace_*.csv'))
+    assert len(trace_files) == 1
+    rows = read_trace(trace_files[0])
+    phases = {}
+    for row in rows:
+        phases.setdefault(row['phase'], []).append(int(row['slice']))
+    # Spans are saved for the slice that was acquired before the cut
+    assert sorted(set(phases['cut'])) == [0, 1]
+    assert phases['grab'].count(0) >= 4
+    for phase in ['stage_move', 'frame_settings', 'inspect', 'save',
+                  'register', 'notification']:
+        assert phase in phases
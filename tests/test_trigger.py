@@ -0,0 +1,79 @@
+import sys
+import threading
+from time import perf_counter
+
+from qtpy.QtWidgets import QApplication
+
+import utils
+
+
+app = QApplication.instance() or QApplication(sys.argv)   # Required for QTimer
+
+
+def cmd(msg, *args):
+    return {'msg': msg, 'args': args, 'kwargs': {}}
+
+
+def test_coalesce_commands():
+    cmds = [cmd('DRAW VP'), cmd('2024-01-01 | CTRL  : line 1'),
+            cmd('2024-01-01 | CTRL  : line 2'), cmd('ACQ IND TILE', 0, 3),
+            cmd('DRAW VP NO LABELS'), cmd('UPDATE XY'), cmd('SAVE CFG'),
+            cmd('2024-01-01 | CTRL  : line 3'), cmd('MIRROR STATUS', {'n': 1}),
+            cmd('DRAW VP'), cmd('UPDATE XY'), cmd('MIRROR STATUS', {'n': 2}),
+            cmd('ACQ IND TILE', 0, 3)]
+    coalesced = utils.coalesce_commands(cmds)
+    assert [c['msg'] for c in coalesced] == [
+        utils.LOG_LINES, 'ACQ IND TILE', 'SAVE CFG', utils.LOG_LINES,
+        'UPDATE XY', 'MIRROR STATUS', 'ACQ IND TILE', 'DRAW VP']
+    assert coalesced[0]['args'][0] == ['2024-01-01 | CTRL  : line 1',
+                                       '2024-01-01 | CTRL  : line 2']
+    # Last arguments are kept
+    assert coalesced[5]['args'] == ({'n': 2},)
+    # Full redraw makes earlier redraws without labels redundant
+    assert utils.coalesce_commands(
+        [cmd('DRAW VP NO LABELS'), cmd('DRAW VP')]) == [cmd('DRAW VP')]
+    assert len(utils.coalesce_commands(
+        [cmd('DRAW VP'), cmd('DRAW VP NO LABELS')])) == 2
+
+
+def test_trigger_queues_are_separate():
+    trigger1, trigger2 = utils.Trigger(), utils.Trigger()
+    trigger1.transmit('DRAW VP')
+    assert trigger2.receive_all() == []
+    assert trigger1.receive_all() == [cmd('DRAW VP')]
+
+
+def test_coalescer_counts_repaints():
+    trigger = utils.Trigger()
+    processed = []
+    coalescer = utils.CommandCoalescer(trigger, processed.append, interval=20)
+
+    # Fast tile loop: 10,000 commands sent from the acquisition thread
+    def send_commands():
+        for i in range(2500):
+            trigger.transmit('UPDATE XY')
+            trigger.transmit(f'2024-01-01 | CTRL  : Tile {i} acquired.')
+            trigger.transmit('SAVE CFG', i)
+            trigger.transmit('DRAW VP')
+
+    thread = threading.Thread(target=send_commands)
+    start_time = perf_counter()
+    thread.start()
+    while thread.is_alive() or not trigger.queue.empty() or coalescer.timer.isActive():
+        app.processEvents()
+        assert perf_counter() - start_time < 30
+    thread.join()
+    repaints = sum(c['msg'] == 'DRAW VP' for c in processed)
+    log_appends = sum(c['msg'] == utils.LOG_LINES for c in processed)
+    log_lines = [line for c in processed if c['msg'] == utils.LOG_LINES
+                 for line in c['args'][0]]
+    state_cmds = [c['args'][0] for c in processed if c['msg'] == 'SAVE CFG']
+    print(f'10,000 commands: {repaints} repaints, {log_appends} log updates, '
+          f'{len(processed)} commands processed')
+    assert 1 <= repaints < 2500
+    # All state changes and log lines in their original order
+    assert state_cmds == list(range(2500))
+    assert log_lines == [f'2024-01-01 | CTRL  : Tile {i} acquired.'
+                         for i in range(2500)]
+    # Last command is the final redraw
+    assert processed[-1]['msg'] == 'DRAW VP'
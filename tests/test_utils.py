@@ -1,3 +1,6 @@
+import os
+import tempfile
+
 import numpy as np
 
 from CoordinateSystem import CoordinateSystem
@@ -8,9 +11,13 @@ import utils
 _sem = None
 _microtome = None
 
+# Outside the repository, which has its own log directory
+TEST_LOG_FILENAME = os.path.join(tempfile.gettempdir(), 'SBEMimage_tests',
+                                 'SBEMimage.log')
+
 
 def init_log():
-    utils.logging_init('TEST', 'Testing')
+    utils.logging_init('TEST', 'Testing', filename=TEST_LOG_FILENAME)
 
 
 def init_read_configs(config_filename, test_config_filename):
@@ -87,3 +94,44 @@ def create_image(filename, shape=(1000, 1000), bitsize=8):
     image = np.random.randint(0, max_val, size=shape, dtype=dtype)
     imwrite(filename, image)
     return image
+
+
+class StubTrigger:
+    """Replacement for utils.Trigger that records the transmitted commands
+    instead of sending them to the GUI."""
+    def __init__(self):
+        self.commands = []
+
+    def transmit(self, cmd, *args, **kwargs):
+        self.commands.append((cmd, args))
+
+
+def init_acquisition(config, sysconfig, trigger=None):
+    """Set up an Acquisition instance with all its components (no GUI)."""
+    from sem.SEM_Mock import SEM_Mock
+    from microtome.Microtome_Mock import Microtome_Mock
+    from Stage import Stage
+    from OverviewManager import OverviewManager
+    from GridManager import GridManager
+    from ImageInspector import ImageInspector
+    from Autofocus import Autofocus
+    from Notifications import Notifications
+    from TCPRemote import TCPRemote
+    from Acquisition import Acquisition
+
+    if trigger is None:
+        trigger = StubTrigger()
+    cs = CoordinateSystem(config, sysconfig)
+    sem = SEM_Mock(config, sysconfig)
+    sem.cs = cs
+    microtome = Microtome_Mock(config, sysconfig)
+    stage = Stage(sem, microtome, True)
+    ovm = OverviewManager(config, sem, cs)
+    gm = GridManager(config, sem, cs)
+    img_inspector = ImageInspector(config, ovm, gm)
+    autofocus = Autofocus(config, sem, gm)
+    notifications = Notifications(config, sysconfig, trigger)
+    tcp_remote = TCPRemote(config)
+    return Acquisition(config, sysconfig, sem, microtome, stage, ovm, gm, cs,
+                       img_inspector, autofocus, notifications, tcp_remote,
+                       trigger)
@@ -0,0 +1,167 @@
+import sys
+import numpy as np
+from time import perf_counter
+from qtpy.QtCore import Qt, QPointF, QRect
+from qtpy.QtGui import QImage, QPainter, QPixmap
+from qtpy.QtWidgets import QApplication
+
+from vp_render_cache import RenderCache
+
+
+app = QApplication.instance() or QApplication(sys.argv)   # Required for QPixmap
+
+VP_WIDTH, VP_HEIGHT = 1000, 800
+
+
+def random_pixmap(width, height, seed=0):
+    rng = np.random.default_rng(seed)
+    image = np.ascontiguousarray(
+        rng.integers(0, 256, (height, width), dtype=np.uint8))
+    qimage = QImage(image.data, width, height, width, QImage.Format_Grayscale8)
+    return QPixmap.fromImage(qimage.copy())
+
+
+def qpixmap_to_array(pixmap):
+    qimage = pixmap.toImage().convertToFormat(QImage.Format_Grayscale8)
+    ptr = qimage.constBits()
+    ptr.setsize(qimage.sizeInBytes())
+    return np.array(ptr).reshape(qimage.height(), qimage.bytesPerLine())[:, :qimage.width()]
+
+
+# Previous implementation (crop and scale the full image on every draw)
+
+def previous_draw(painter, image, vx, vy, resize_ratio):
+    width, height = image.width(), image.height()
+    if (vx > VP_WIDTH or vx + width * resize_ratio < 0
+            or vy > VP_HEIGHT or vy + height * resize_ratio < 0):
+        return
+    crop_x, crop_y = max(int(-vx / resize_ratio), 0), max(int(-vy / resize_ratio), 0)
+    crop_area = QRect(crop_x, crop_y,
+                      int((VP_WIDTH - max(vx, 0)) / resize_ratio + 1),
+                      int((VP_HEIGHT - max(vy, 0)) / resize_ratio + 1))
+    cropped_img = image.copy(crop_area)
+    cropped_resized_img = cropped_img.scaledToWidth(
+        int(cropped_img.width() * resize_ratio))
+    painter.drawPixmap(QPointF(max(vx, 0), max(vy, 0)), cropped_resized_img)
+
+
+def new_canvas():
+    canvas = QPixmap(VP_WIDTH, VP_HEIGHT)
+    canvas.fill(Qt.black)
+    return canvas
+
+
+def test_tiles_equal_full_image():
+    image = random_pixmap(1100, 900)
+    cache = RenderCache(tile_size=128)
+    expected, result = new_canvas(), new_canvas()
+    painter = QPainter(expected)
+    painter.drawPixmap(QPointF(-50, 20), image)
+    painter.end()
+    painter = QPainter(result)
+    drawn = cache.draw(painter, 'ov', 'v1', lambda mag: image if mag == 1 else None,
+                       -50, 20, 1.0, VP_WIDTH, VP_HEIGHT)
+    painter.end()
+    assert drawn
+    np.testing.assert_array_equal(qpixmap_to_array(result), qpixmap_to_array(expected))
+    # Only the visible tiles were scaled
+    assert cache.misses == 9 * 7
+    assert not cache.draw(QPainter(), 'ov', 'v1', None, 2000, 0, 1.0,
+                          VP_WIDTH, VP_HEIGHT)
+
+
+def test_pyramid_and_invalidation():
+    images = {('ov', i): random_pixmap(512, 384, seed=i) for i in range(3)}
+    cache = RenderCache()
+    canvas = new_canvas()
+    painter = QPainter(canvas)
+    for key, image in images.items():
+        cache.draw(painter, key, 'v1', lambda mag, image=image: image if mag == 1 else None,
+                   0, 0, 0.25, VP_WIDTH, VP_HEIGHT)
+    assert cache.mag_level(0.25) == 4
+    assert cache.pyramids[('ov', 0)][4].width() == 128
+    hits = cache.hits
+    # Redraw is served from the cache
+    cache.draw(painter, ('ov', 1), 'v1', None, 10, 10, 0.25, VP_WIDTH, VP_HEIGHT)
+    assert cache.hits > hits
+    # New version of OV 1 only discards the tiles of OV 1
+    number_tiles = len(cache.tiles)
+    new_image = random_pixmap(512, 384, seed=10)
+    cache.draw(painter, ('ov', 1), 'v2', lambda mag: new_image if mag == 1 else None,
+               0, 0, 0.25, VP_WIDTH, VP_HEIGHT)
+    painter.end()
+    assert len(cache.tiles) == number_tiles
+    assert cache.cached_level(('ov', 1), 'v2') is new_image
+    assert cache.cached_level(('ov', 1), 'v1') is None
+    assert cache.cached_level(('ov', 0), 'v1') is images[('ov', 0)]
+
+
+def test_memory_bound():
+    image = random_pixmap(2048, 2048)
+    cache = RenderCache(max_bytes=2 * 256 * 256 * 4, tile_size=256)
+    canvas = new_canvas()
+    painter = QPainter(canvas)
+    for vx in range(0, -1000, -100):
+        cache.draw(painter, 'stub', 'v1', lambda mag: image if mag == 1 else None,
+                   vx, 0, 1.0, VP_WIDTH, VP_HEIGHT)
+    assert cache.nbytes <= cache.max_bytes
+    assert cache.nbytes == (sum(entry[2] for entry in cache.tiles.values())
+                            + sum(cache.pyramid_nbytes.values()))
+    # Images no longer drawn are released with their last tile, including
+    # the computed pyramid levels (zoomed out: level 2)
+    for index in range(3):
+        other = random_pixmap(2048, 2048, seed=index + 1)
+        cache.draw(painter, ('ov', index), 'v1', lambda mag: other if mag == 1 else None,
+                   0, 0, 0.5, VP_WIDTH, VP_HEIGHT)
+    painter.end()
+    assert cache.pyramid_nbytes[('ov', 2)] == RenderCache.pixmap_nbytes(
+        cache.pyramids[('ov', 2)][2])
+    assert list(cache.pyramids) == [('ov', 2)]
+    assert set(cache.tile_counts) == {('ov', 2)}
+    assert cache.cached_level('stub', 'v1') is None
+    assert cache.nbytes == (sum(entry[2] for entry in cache.tiles.values())
+                            + sum(cache.pyramid_nbytes.values()))
+    cache.invalidate(('ov', 2))
+    assert cache.nbytes == 0 and not cache.tiles
+
+
+def test_render_cache_benchmark():
+    # Stub OV with pyramid levels and 20 OVs on a 5 x 4 raster
+    stub_levels = {mag: random_pixmap(8192 // mag, 8192 // mag, seed=mag)
+                   for mag in [1, 2, 4, 8, 16]}
+    ovs = [(random_pixmap(2048, 1536, seed=20 + i), (i % 5) * 1500, (i // 5) * 1500)
+           for i in range(20)]
+    # Pan across the stub and zoom in and out, returning to previous views
+    views = []
+    for scale in [0.08, 0.11, 0.16, 0.11, 0.08]:
+        for pan_x in range(0, 600, 100):
+            views.append((scale, pan_x, pan_x // 2))
+    durations = {}
+    for name in ['previous', 'cached']:
+        cache = RenderCache()
+        canvas = new_canvas()
+        start_time = perf_counter()
+        for scale, pan_x, pan_y in views:
+            canvas.fill(Qt.black)
+            painter = QPainter(canvas)
+            stub_mag = cache.mag_level(scale)
+            vx, vy = -pan_x, -pan_y
+            if name == 'previous':
+                previous_draw(painter, stub_levels[stub_mag], vx, vy, scale * stub_mag)
+            else:
+                cache.draw(painter, 'stub', 'v1', stub_levels.get, vx, vy, scale,
+                           VP_WIDTH, VP_HEIGHT, mag=stub_mag)
+            for i, (image, x, y) in enumerate(ovs):
+                ov_vx, ov_vy = vx + x * scale, vy + y * scale
+                if name == 'previous':
+                    previous_draw(painter, image, ov_vx, ov_vy, scale)
+                else:
+                    cache.draw(painter, ('ov', i), 'v1',
+                               lambda mag, image=image: image if mag == 1 else None,
+                               ov_vx, ov_vy, scale, VP_WIDTH, VP_HEIGHT)
+            painter.end()
+        durations[name] = perf_counter() - start_time
+    print(f'Stub OV + 20 OVs, {len(views)} views: previous implementation '
+          f'{durations["previous"] * 1e3:.0f} ms, '
+          f'render cache {durations["cached"] * 1e3:.0f} ms')
+    assert durations['cached'] < durations['previous']